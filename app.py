@@ -9,8 +9,8 @@ import streamlit as st
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-import tempfile
 import os
+import importlib.util
 import zipfile
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
@@ -19,19 +19,19 @@ import matplotlib.patches as mpatches
 from matplotlib.colors import LinearSegmentedColormap
 from mpl_toolkits.mplot3d import Axes3D
 import io
-from shapely.geometry import Polygon, LineString, Point
-from shapely.geometry import mapping
-import math
+from shapely.geometry import Polygon, MultiPolygon
 import warnings
 import xml.etree.ElementTree as ET
 import json
+import hashlib
+import time
+import uuid
 from io import BytesIO
 from docx import Document
 from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_TABLE_ALIGNMENT
 import geojson
-import requests
 import contextily as ctx
 # ===== IMPORTACIÓN DE MÓDULOS IA (GEMINI) =====
 from modules.ia_integration import (
@@ -40,6 +40,40 @@ from modules.ia_integration import (
     generar_analisis_riesgo_hidrico,
     generar_recomendaciones_integradas
 )
+from modules.geometria import preparar_geometria, TOLERANCIA_SIMPLIFICACION_M
+# ===== PARÁMETROS DE CULTIVOS Y ETAPAS DE ANÁLISIS (IMPORTABLES DESDE WORKERS) =====
+from modules.cultivos import (
+    CULTIVOS, VARIEDADES_CULTIVOS, PARAMETROS_CULTIVOS, ICONOS_CULTIVOS
+)
+from modules.analisis import validar_y_corregir_crs, calcular_superficie, columnas_float64
+from modules.lotes import (
+    MAX_PROCESOS_LOTES,
+    nombrar_lotes,
+    agrupar_lotes_por_cercania,
+    envolvente_grupo,
+    preparar_tareas,
+    recortar_grilla_dem,
+    recortar_datos_satelitales,
+    ejecutar_lotes_en_paralelo,
+    resumen_establecimiento
+)
+from modules.registro_lotes import RegistroLotes
+from modules.agronomia import CRITERIOS_RANKING, PRECIOS_FERTILIZANTE, ranking_cultivos
+from modules.dosis_optima import MODELOS_RESPUESTA, optimizar_dosis_n
+from modules.incertidumbre import simular_rendimientos
+from modules.escenarios import evaluar_escenarios, precios_por_multiplicador, multiplicador_equilibrio_fertilizante
+from modules.texturas import COLORES_TEXTURA
+from modules.ingesta import FORMATOS_VECTORIALES, es_formato_vectorial, leer_vectorial
+from modules.etapas import CacheEtapas
+from modules.eventos import Reportador, destino_logging, fijar_reportador, usar_reportador
+from modules.datos_externos import (
+    PROYECTO_GEE, inicializar_gee, obtener_datos_satelitales
+)
+from modules.topografia import obtener_grilla_dem
+from modules.clima_power import obtener_clima_lotes
+from modules.pipeline import ETAPAS_ANALISIS, ejecutar_analisis_completo
+from modules.corridas import AlmacenCorridas, comparar_corridas
+from modules.trabajos import MAX_TRABAJOS_HOST, ColaTrabajos, PENDIENTE, TERMINADO, FALLIDO, CANCELADO
 
 # ===== SOLUCIÓN PARA ERROR libGL.so.1 =====
 # Configurar matplotlib para usar backend no interactivo
@@ -64,15 +98,13 @@ except ImportError:
 
 try:
     import rasterio
-    from rasterio.mask import mask
     RASTERIO_OK = True
 except ImportError:
     st.warning("⚠️ Rasterio no instalado. No se podrá descargar DEM real, se usará DEM sintético.")
 
-try:
-    from skimage import measure
-    SKIMAGE_OK = True
-except ImportError:
+# Las curvas de nivel se extraen en modules/topografia; aquí sólo importa si skimage está instalado
+SKIMAGE_OK = importlib.util.find_spec('skimage') is not None
+if not SKIMAGE_OK:
     st.warning("⚠️ scikit-image no instalado. No se generarán curvas de nivel.")
 
 # Variable que indica si se pueden generar curvas (necesita skimage)
@@ -101,54 +133,37 @@ except ImportError:
 
 warnings.filterwarnings('ignore')
 
-# === INICIALIZACIÓN SEGURA DE GOOGLE EARTH ENGINE (NO MODIFICAR) ===
-def inicializar_gee():
-    """Inicializa GEE con Service Account desde secrets de Streamlit Cloud"""
-    if not GEE_AVAILABLE:
-        return False
-    
-    try:
-        # Intentar con Service Account desde secrets (Streamlit Cloud)
-        gee_secret = os.environ.get('GEE_SERVICE_ACCOUNT')
-        if gee_secret:
-            try:
-                credentials_info = json.loads(gee_secret.strip())
-                credentials = ee.ServiceAccountCredentials(
-                    credentials_info['client_email'],
-                    key_data=json.dumps(credentials_info)
-                )
-                ee.Initialize(credentials, project='ee-mawucano25')
-                st.session_state.gee_authenticated = True
-                st.session_state.gee_project = 'ee-mawucano25'
-                print("✅ GEE inicializado con Service Account")
-                return True
-            except Exception as e:
-                print(f"⚠️ Error con Service Account: {str(e)}")
-        
-        # Fallback: autenticación local (desarrollo en tu Linux)
-        try:
-            ee.Initialize(project='ee-mawucano25')
-            st.session_state.gee_authenticated = True
-            st.session_state.gee_project = 'ee-mawucano25'
-            print("✅ GEE inicializado localmente")
-            return True
-        except Exception as e:
-            print(f"⚠️ Error inicialización local: {str(e)}")
-            
-        st.session_state.gee_authenticated = False
-        return False
-        
-    except Exception as e:
-        st.session_state.gee_authenticated = False
-        print(f"❌ Error crítico GEE: {str(e)}")
-        return False
+# ===== EVENTOS DEL CÓMPUTO EN LA INTERFAZ =====
+def reportador_streamlit(texto_barra=None):
+    """
+    Reportador que dibuja los eventos de los módulos de cómputo: los mensajes
+    como st.info/success/warning/error y, si se pasa `texto_barra`, el avance
+    como barra de progreso. Los eventos también quedan en el log del servidor.
+    """
+    mostrar = {'info': st.info, 'exito': st.success, 'advertencia': st.warning, 'error': st.error}
+    barra = st.progress(0.0, text=texto_barra) if texto_barra else None
+
+    def destino(evento):
+        if evento['fraccion'] is not None:
+            if barra is None:
+                return
+            etapa = f"{evento['etapa']}: " if evento['etapa'] else ''
+            barra.progress(evento['fraccion'], text=f"{etapa}{evento['mensaje']} · {evento['transcurrido']:.1f} s")
+        elif evento['nivel'] in mostrar:
+            mostrar[evento['nivel']](evento['mensaje'])
+
+    return Reportador(destino, destino_logging())
+
+# Por defecto, los mensajes de los módulos se muestran en la página de esta ejecución del script
+fijar_reportador(reportador_streamlit())
 
 # Ejecutar inicialización al inicio (ANTES de cualquier uso de ee.*)
 if 'gee_authenticated' not in st.session_state:
     st.session_state.gee_authenticated = False
     st.session_state.gee_project = ''
-    if GEE_AVAILABLE:
-        inicializar_gee()
+    if GEE_AVAILABLE and inicializar_gee():
+        st.session_state.gee_authenticated = True
+        st.session_state.gee_project = PROYECTO_GEE
 
 # ===== FUNCIONES YOLO PARA DETECCIÓN DE PLAGAS/ENFERMEDADES (VERSIÓN PIL - SIN OpenCV) =====
 def cargar_modelo_yolo(modelo_path='yolo_plagas.pt'):
@@ -972,324 +987,6 @@ def crear_boton_descarga_tiff(buffer_png, gdf, nombre_archivo, texto_boton="📥
 
 # ===== FUNCIONES DE CURVAS DE NIVEL (MODIFICADAS) =====
 
-def obtener_dem_opentopography(gdf, api_key=None):
-    """
-    Descarga DEM SRTM 1 arc-seg (30m) desde OpenTopography.
-    Retorna (dem_array, meta, transform) o (None, None, None) si falla.
-    Requiere rasterio.
-    """
-    if not RASTERIO_OK:
-        st.warning("⚠️ Rasterio no instalado. No se puede descargar DEM real.")
-        return None, None, None
-
-    # 1. Obtener API Key (prioridad: argumento > variable entorno > secret)
-    if api_key is None:
-        api_key = os.environ.get("OPENTOPOGRAPHY_API_KEY", None)
-    if not api_key:
-        st.warning("⚠️ No se encontró API Key de OpenTopography. Se usará DEM sintético.")
-        st.info("📌 Obtén una API Key gratuita en: https://opentopography.org/")
-        return None, None, None
-
-    try:
-        # 2. Obtener bounding box y validar que esté dentro de la cobertura SRTM (latitudes entre -60 y 60)
-        bounds = gdf.total_bounds
-        west, south, east, north = bounds
-
-        # Verificar límites
-        if south < -60 or north > 60:
-            st.warning("⚠️ El área está fuera de la cobertura de SRTM (latitudes > 60° o < -60°). Usando DEM sintético.")
-            return None, None, None
-
-        lon_span = east - west
-        lat_span = north - south
-        west = max(west - 0.05 * lon_span, -180)
-        east = min(east + 0.05 * lon_span, 180)
-        south = max(south - 0.05 * lat_span, -60)
-        north = min(north + 0.05 * lat_span, 60)
-
-        params = {
-            "demtype": "SRTMGL1",
-            "south": south,
-            "north": north,
-            "west": west,
-            "east": east,
-            "outputFormat": "GTiff",
-            "API_Key": api_key
-        }
-
-        url = "https://portal.opentopography.org/API/globaldem"
-        
-        with st.spinner("🛰️ Descargando DEM desde OpenTopography..."):
-            response = requests.get(url, params=params, timeout=60)
-            
-        if response.status_code == 403:
-            st.error("❌ API Key inválida o no autorizada.")
-            return None, None, None
-        elif response.status_code == 404:
-            st.error("❌ No se encontraron datos SRTM para esta área.")
-            return None, None, None
-        elif response.status_code != 200:
-            st.error(f"❌ Error en OpenTopography: HTTP {response.status_code}")
-            return None, None, None
-
-        dem_bytes = BytesIO(response.content)
-        with rasterio.open(dem_bytes) as src:
-            geom = [mapping(gdf.unary_union)]
-            out_image, out_transform = mask(src, geom, crop=True, nodata=-32768, all_touched=True)
-            out_meta = src.meta.copy()
-            out_meta.update({
-                "driver": "GTiff",
-                "height": out_image.shape[1],
-                "width": out_image.shape[2],
-                "transform": out_transform,
-                "nodata": -32768
-            })
-
-        dem_array = out_image.squeeze()
-        dem_array = np.ma.masked_where(dem_array <= -32768, dem_array)
-        
-        if dem_array.mask.all() if isinstance(dem_array, np.ma.MaskedArray) else np.all(dem_array <= -32768):
-            st.warning("⚠️ El DEM descargado no contiene datos válidos dentro del polígono.")
-            return None, None, None
-
-        st.success("✅ DEM SRTM 30m descargado y recortado exitosamente.")
-        return dem_array, out_meta, out_transform
-
-    except requests.exceptions.Timeout:
-        st.error("❌ Tiempo de espera agotado al conectar con OpenTopography.")
-        return None, None, None
-    except Exception as e:
-        st.error(f"❌ Error inesperado al obtener DEM: {str(e)[:200]}")
-        return None, None, None
-
-def obtener_dem_opentopodata_api(gdf, dataset="srtm30m"):
-    """
-    Obtiene DEM desde la API pública Open Topo Data.
-    Datasets disponibles: srtm30m, srtm90m, aster30m, eudem25m, etc.
-    Límite gratuito: 1000 consultas/día, 100 puntos/consulta.
-    Retorna (dem_array, meta, transform) compatible con el resto del código.
-    """
-    if not RASTERIO_OK:
-        st.warning("⚠️ Rasterio no instalado. No se puede procesar DEM desde Open Topo Data.")
-        return None, None, None
-
-    try:
-        bounds = gdf.total_bounds
-        minx, miny, maxx, maxy = bounds
-
-        # Definir resolución aproximada para grilla (máximo 50x50 para cumplir límite de 100 puntos)
-        nx = 50
-        ny = 50
-        x_vals = np.linspace(minx, maxx, nx)
-        y_vals = np.linspace(miny, maxy, ny)
-
-        # Construir lista de ubicaciones (lat,lon) para la API
-        locations = []
-        for y in y_vals:
-            for x in x_vals:
-                locations.append(f"{y:.6f},{x:.6f}")
-
-        # Dividir en lotes de 100 (límite de la API)
-        batch_size = 100
-        all_elevations = []
-        for i in range(0, len(locations), batch_size):
-            batch = locations[i:i+batch_size]
-            loc_str = "|".join(batch)
-            url = f"https://api.opentopodata.org/v1/{dataset}"
-            params = {"locations": loc_str, "interpolation": "cubic"}
-
-            with st.spinner(f"📡 Consultando lote {i//batch_size + 1} de Open Topo Data..."):
-                resp = requests.get(url, params=params, timeout=30)
-
-            if resp.status_code != 200:
-                st.error(f"Error en API Open Topo Data: HTTP {resp.status_code}")
-                return None, None, None
-
-            data = resp.json()
-            if data.get('status') != 'OK':
-                st.error(f"Error en respuesta: {data.get('error', 'desconocido')}")
-                return None, None, None
-
-            elevations = [r['elevation'] for r in data['results']]
-            all_elevations.extend(elevations)
-
-        # Reconstruir grilla
-        Z = np.array(all_elevations).reshape(ny, nx)
-        X, Y = np.meshgrid(x_vals, y_vals)
-
-        # Crear una transformación aproximada (para compatibilidad con código que espera transform)
-        # La transform de rasterio: (res_x, 0, minx, 0, -res_y, maxy) si se usa from_origin
-        # Pero aquí podemos usar None y luego tratar como DEM sintético
-        # Para simplificar, devolvemos None en transform y construiremos X,Y,Z en dem_data
-        # Creamos un array enmascarado con NaN fuera del polígono
-        points = np.vstack([X.ravel(), Y.ravel()]).T
-        mask = gdf.geometry.unary_union.contains([Point(p) for p in points])
-        mask = mask.reshape(X.shape)
-        Z_masked = Z.copy().astype(float)
-        Z_masked[~mask] = np.nan
-        dem_array = np.ma.masked_invalid(Z_masked)
-
-        # Meta información básica
-        meta = {
-            'driver': 'GTiff',
-            'height': ny,
-            'width': nx,
-            'count': 1,
-            'crs': CRS.from_epsg(4326),
-            'transform': None  # No tenemos transform real, lo manejaremos aparte
-        }
-
-        st.success(f"✅ DEM obtenido de Open Topo Data ({dataset}) - {nx}x{ny} puntos")
-        return dem_array, meta, None  # transform = None
-
-    except Exception as e:
-        st.error(f"❌ Error obteniendo DEM de Open Topo Data: {str(e)}")
-        return None, None, None
-
-def generar_curvas_nivel_reales(dem_array, transform, intervalo=10, polygon=None):
-    """
-    Genera curvas de nivel a partir de un DEM real (array) y su transform.
-    Opcionalmente filtra curvas que intersecten el polígono de la parcela.
-    Requiere scikit-image.
-    """
-    if dem_array is None or not SKIMAGE_OK:
-        return []
-
-    # Enmascarar nodata
-    if isinstance(dem_array, np.ma.MaskedArray):
-        valid_mask = ~dem_array.mask
-        data = dem_array.data.astype(float)
-        data[~valid_mask] = np.nan
-    else:
-        data = dem_array.astype(float)
-        valid_mask = data > -32768
-        data[~valid_mask] = np.nan
-
-    if not np.any(valid_mask):
-        st.warning("⚠️ El DEM no contiene datos válidos para generar curvas.")
-        return []
-
-    vmin = np.nanmin(data)
-    vmax = np.nanmax(data)
-    if np.isnan(vmin) or np.isnan(vmax):
-        return []
-
-    niveles = np.arange(np.floor(vmin / intervalo) * intervalo,
-                        np.ceil(vmax / intervalo) * intervalo + intervalo,
-                        intervalo)
-
-    # Si el rango es muy pequeño, usar un intervalo más fino
-    if vmax - vmin < intervalo * 2 and len(niveles) < 3:
-        intervalo_ajustado = (vmax - vmin) / 5
-        niveles = np.arange(vmin, vmax + intervalo_ajustado, intervalo_ajustado)
-        st.info(f"ℹ️ Terreno muy plano: se usó intervalo de {intervalo_ajustado:.1f} m en lugar de {intervalo} m")
-
-    # Rellenar con un valor muy negativo para que find_contours no se salga
-    data_filled = np.where(valid_mask, data, -9999)
-
-    contours = []
-    for nivel in niveles:
-        try:
-            for contour in measure.find_contours(data_filled, nivel):
-                coords = []
-                valid_contour = True
-                for row, col in contour:
-                    r, c = int(round(row)), int(round(col))
-                    # Verificar que el punto esté dentro del array y sea válido
-                    if not (0 <= r < data.shape[0] and 0 <= c < data.shape[1]) or not valid_mask[r, c]:
-                        valid_contour = False
-                        break
-                    x, y = transform * (col, row)
-                    coords.append((x, y))
-                if valid_contour and len(coords) >= 3:
-                    line = LineString(coords)
-                    # Filtrar líneas muy cortas y opcionalmente por polígono
-                    if line.length > 0.01:
-                        if polygon is None or line.intersects(polygon):
-                            contours.append((line, nivel))
-        except Exception:
-            continue
-    if contours:
-        st.info(f"✅ Generadas {len(contours)} curvas de nivel (intervalo {intervalo} m)")
-    else:
-        st.warning("⚠️ No se generaron curvas de nivel. El terreno puede ser muy plano o el DEM no tiene variación.")
-    return contours
-
-def generar_curvas_nivel_simuladas(gdf, intervalo=10):
-    """
-    Genera curvas de nivel sintéticas cuando no hay DEM real.
-    También puede usarse para datos provenientes de Open Topo Data (X,Y,Z ya definidos).
-    Requiere scikit-image.
-    """
-    if not SKIMAGE_OK:
-        return []
-    from scipy.ndimage import gaussian_filter
-    bounds = gdf.total_bounds
-    minx, miny, maxx, maxy = bounds
-    n = 200  # Mayor resolución para más detalle
-    x = np.linspace(minx, maxx, n)
-    y = np.linspace(miny, maxy, n)
-    X, Y = np.meshgrid(x, y)
-
-    # Semilla reproducible basada en la ubicación
-    seed = int((minx + miny) * 1e6) % (2**32)
-    rng = np.random.RandomState(seed)
-
-    # Generar relieve con varias ondas
-    Z = rng.randn(n, n) * 30
-    Z = gaussian_filter(Z, sigma=8)
-    # Añadir gradiente y colinas
-    Z = 50 + Z + 0.01 * (X - minx) * 111000 + 0.005 * (Y - miny) * 111000
-    for _ in range(5):
-        cx = rng.uniform(minx, maxx)
-        cy = rng.uniform(miny, maxy)
-        r = rng.uniform(0.001, 0.008)
-        h = rng.uniform(30, 100)
-        Z += h * np.exp(-((X-cx)**2 + (Y-cy)**2) / (2*r**2))
-
-    # Enmascarar fuera del polígono
-    points = np.vstack([X.ravel(), Y.ravel()]).T
-    mask = gdf.geometry.unary_union.contains([Point(p) for p in points])
-    mask = mask.reshape(X.shape)
-    Z[~mask] = np.nan
-
-    # Rellenar NaN con valor muy bajo para find_contours
-    Z_filled = np.where(np.isnan(Z), -9999, Z)
-
-    vmin = np.nanmin(Z)
-    vmax = np.nanmax(Z)
-    if np.isnan(vmin) or np.isnan(vmax):
-        return []
-
-    niveles = np.arange(vmin, vmax + intervalo, intervalo)
-    if len(niveles) < 2:
-        return []
-
-    contours = []
-    polygon = gdf.geometry.unary_union
-    for nivel in niveles:
-        try:
-            for contour in measure.find_contours(Z_filled, nivel):
-                coords = []
-                for row, col in contour:
-                    r, c = int(round(row)), int(round(col))
-                    if r < 0 or r >= n or c < 0 or c >= n or np.isnan(Z[r, c]):
-                        continue
-                    lon = minx + (c / n) * (maxx - minx)
-                    lat = miny + (r / n) * (maxy - miny)
-                    coords.append((lon, lat))
-                if len(coords) >= 3:
-                    line = LineString(coords)
-                    if line.length > 0.01 and line.intersects(polygon):
-                        contours.append((line, nivel))
-        except Exception:
-            continue
-    if contours:
-        st.info(f"✅ Generadas {len(contours)} curvas de nivel sintéticas (intervalo {intervalo} m)")
-    else:
-        st.warning("⚠️ No se generaron curvas de nivel sintéticas.")
-    return contours
-
 def mapa_curvas_coloreadas(gdf_original, curvas_con_elevacion):
     """
     Crea un mapa Folium interactivo con las curvas de nivel coloreadas por elevación.
@@ -1355,48 +1052,11 @@ def mapa_curvas_coloreadas(gdf_original, curvas_con_elevacion):
     Fullscreen().add_to(m)
     return m
 
-def generar_dem_sintetico_fallback(gdf, resolucion=10.0):
-    """
-    Función de respaldo para obtener X, Y, Z cuando no hay DEM real.
-    No requiere rasterio ni skimage.
-    """
-    bounds = gdf.total_bounds
-    minx, miny, maxx, maxy = bounds
-
-    num_cells_x = int((maxx - minx) * 111000 / resolucion)
-    num_cells_y = int((maxy - miny) * 111000 / resolucion)
-    num_cells_x = max(50, min(num_cells_x, 200))
-    num_cells_y = max(50, min(num_cells_y, 200))
-
-    x = np.linspace(minx, maxx, num_cells_x)
-    y = np.linspace(miny, maxy, num_cells_y)
-    X, Y = np.meshgrid(x, y)
-
-    centroid = gdf.geometry.unary_union.centroid
-    seed_value = int(centroid.x * 10000 + centroid.y * 10000) % (2**32)
-    rng = np.random.RandomState(seed_value)
-
-    elevacion_base = rng.uniform(100, 300)
-    slope_x = rng.uniform(-0.001, 0.001)
-    slope_y = rng.uniform(-0.001, 0.001)
-
-    Z = elevacion_base + slope_x * (X - minx) + slope_y * (Y - miny)
-    n_hills = rng.randint(3, 7)
-    for _ in range(n_hills):
-        cx = rng.uniform(minx, maxx)
-        cy = rng.uniform(miny, maxy)
-        r = rng.uniform(0.001, 0.005)
-        h = rng.uniform(20, 80)
-        Z += h * np.exp(-((X-cx)**2 + (Y-cy)**2) / (2*r**2))
-
-    # enmascarar fuera de la parcela
-    points = np.vstack([X.flatten(), Y.flatten()]).T
-    mask = gdf.geometry.unary_union.contains([Point(p) for p in points])
-    mask = mask.reshape(X.shape)
-    Z[~mask] = np.nan
-
-    return X, Y, Z, bounds
-
+# ===== REGISTRO DE LOTES (PERSISTENTE, COMPARTIDO POR TODAS LAS SESIONES) =====
+@st.cache_resource
+def obtener_registro_lotes():
+    """Registro de lotes con índice STRtree, cargado una vez por proceso."""
+    return RegistroLotes()
 
 # ===== INICIALIZACIÓN DE VARIABLES DE SESIÓN =====
 if 'reporte_completo' not in st.session_state:
@@ -1755,431 +1415,6 @@ SATELITES_DISPONIBLES = {
     }
 }
 
-# ===== CONFIGURACIÓN VARIEDADES CULTIVOS (ACTUALIZADO CON AVENA) =====
-VARIEDADES_CULTIVOS = {
-    'TRIGO': [
-        'ACA 303', 'ACA 315', 'Baguette Premium 11', 'Baguette Premium 13',
-        'Biointa 1005', 'Biointa 2004', 'Klein Don Enrique', 'Klein Guerrero',
-        'Buck Meteoro', 'Buck Poncho', 'SY 110', 'SY 200'
-    ],
-    'MAIZ': [
-        'DK 72-10', 'DK 73-20', 'Pioneer 30F53', 'Pioneer 30F35',
-        'Syngenta AG 6800', 'Syngenta AG 8088', 'Dow 2A610', 'Dow 2B710',
-        'Nidera 8710', 'Nidera 8800', 'Morgan 360', 'Morgan 390'
-    ],
-    'SORGO': [
-        'Advanta AS 5405', 'Advanta AS 5505', 'Pioneer 84G62', 'Pioneer 85G96',
-        'DEKALB 53-67', 'DEKALB 55-00', 'MACER S-10', 'MACER S-15',
-        'Sorgocer 105', 'Sorgocer 110', 'Río IV 100', 'Río IV 110'
-    ],
-    'SOJA': [
-        'DM 53i52', 'DM 58i62', 'Nidera 49X', 'Nidera 52X',
-        'Don Mario 49X', 'Don Mario 52X', 'SYNGENTA 4.9i', 'SYNGENTA 5.2i',
-        'Biosoys 4.9', 'Biosoys 5.2', 'ACA 49', 'ACA 52'
-    ],
-    'GIRASOL': [
-        'ACA 884', 'ACA 887', 'Nidera 7120', 'Nidera 7150',
-        'Syngenta 390', 'Syngenta 410', 'Pioneer 64A15', 'Pioneer 65A25',
-        'Advanta G 100', 'Advanta G 110', 'Biosun 400', 'Biosun 420'
-    ],
-    'MANI': [
-        'ASEM 400', 'ASEM 500', 'Granoleico', 'Guasu',
-        'Florman INTA', 'Elena', 'Colorado Irradiado', 'Overo Colorado',
-        'Runner 886', 'Runner 890', 'Tegua', 'Virginia 98R'
-    ],
-    'VID': [
-        'Malbec', 'Cabernet Sauvignon', 'Merlot', 'Syrah', 'Chardonnay',
-        'Torrontés', 'Bonarda', 'Tempranillo', 'Sangiovese', 'Pinot Noir',
-        'Chenin', 'Sauvignon Blanc', 'Viognier', 'Carménère', 'Petit Verdot'
-    ],
-    'OLIVO': [
-        'Arbequina', 'Picual', 'Manzanilla', 'Hojiblanca', 'Cornicabra',
-        'Empeltre', 'Frantoio', 'Leccino', 'Coratina', 'Picholine',
-        'Kalamata', 'Mission', 'Ascolano', 'Barnea', 'Arbosana'
-    ],
-    'ALMENDRO': [
-        'Non Pareil', 'Carmel', 'Butte', 'Padre', 'Mission',
-        'Fritz', 'Monterey', 'Price', 'Aldrich', 'Wood Colony',
-        'Peerless', 'Thompson', 'Livingston', 'Sonora', 'Winters'
-    ],
-    'BANANO': [
-        'Cavendish', 'Gros Michel', 'Plátano', 'Manzano', 'Rojo',
-        'Morado', 'Baby Banana', 'Blue Java', 'Goldfinger', 'Pisang Awak',
-        'Mysore', 'Saba', 'Lakatan', 'Señorita', 'Dwarf Cavendish'
-    ],
-    'CAFE': [
-        'Arabica', 'Robusta', 'Liberica', 'Excelsa', 'Typica',
-        'Bourbon', 'Caturra', 'Catuai', 'Mundo Novo', 'Maragogipe',
-        'Geisha', 'Pacamara', 'SL-28', 'SL-34', 'Kona'
-    ],
-    'CACAO': [
-        'Forastero', 'Criollo', 'Trinitario', 'Nacional', 'Amelonado',
-        'Contamana', 'Marañón', 'Porcelana', 'Chuao', 'Carenero',
-        'Ocumare', 'Cundeamor', 'ICS-95', 'UF-613', 'TSH-565'
-    ],
-    'PALMA_ACEITERA': [
-        'Tenera', 'Dura', 'Pisifera', 'DxP', 'Yangambi',
-        'AVROS', 'La Mé', 'Ekona', 'Calabar', 'NIFOR',
-        'MARDI', 'CIRAD', 'ASD Costa Rica', 'Dami', 'Socfindo'
-    ],
-    'AVENA': [
-        'Cristal INTA', 'Milagros INTA', 'Bonaerense INTA', 'Calén',
-        'Laura', 'Carlota', 'Küller', 'Pampeana',
-        'Estanzuela 109', 'Estanzuela 208', 'Tacuarí', 'Poli'
-    ]
-}
-
-# ===== CONFIGURACIÓN PARÁMETROS CULTIVOS (ACTUALIZADO CON AVENA) =====
-PARAMETROS_CULTIVOS = {
-    'TRIGO': {
-        'NITROGENO': {'min': 100, 'max': 180},
-        'FOSFORO': {'min': 40, 'max': 80},
-        'POTASIO': {'min': 90, 'max': 150},
-        'MATERIA_ORGANICA_OPTIMA': 3.5,
-        'HUMEDAD_OPTIMA': 0.28,
-        'NDVI_OPTIMO': 0.75,
-        'NDRE_OPTIMO': 0.40,
-        'RENDIMIENTO_OPTIMO': 4500,
-        'COSTO_FERTILIZACION': 350,
-        'PRECIO_VENTA': 0.25,
-        'VARIEDADES': VARIEDADES_CULTIVOS['TRIGO'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
-    },
-    'MAIZ': {
-        'NITROGENO': {'min': 150, 'max': 250},
-        'FOSFORO': {'min': 50, 'max': 90},
-        'POTASIO': {'min': 120, 'max': 200},
-        'MATERIA_ORGANICA_OPTIMA': 3.8,
-        'HUMEDAD_OPTIMA': 0.32,
-        'NDVI_OPTIMO': 0.80,
-        'NDRE_OPTIMO': 0.45,
-        'RENDIMIENTO_OPTIMO': 8500,
-        'COSTO_FERTILIZACION': 550,
-        'PRECIO_VENTA': 0.20,
-        'VARIEDADES': VARIEDADES_CULTIVOS['MAIZ'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste', 'Cuyo']
-    },
-    'SORGO': {
-        'NITROGENO': {'min': 80, 'max': 140},
-        'FOSFORO': {'min': 35, 'max': 65},
-        'POTASIO': {'min': 100, 'max': 180},
-        'MATERIA_ORGANICA_OPTIMA': 3.0,
-        'HUMEDAD_OPTIMA': 0.25,
-        'NDVI_OPTIMO': 0.70,
-        'NDRE_OPTIMO': 0.35,
-        'RENDIMIENTO_OPTIMO': 5000,
-        'COSTO_FERTILIZACION': 300,
-        'PRECIO_VENTA': 0.18,
-        'VARIEDADES': VARIEDADES_CULTIVOS['SORGO'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
-    },
-    'SOJA': {
-        'NITROGENO': {'min': 20, 'max': 40},
-        'FOSFORO': {'min': 45, 'max': 85},
-        'POTASIO': {'min': 140, 'max': 220},
-        'MATERIA_ORGANICA_OPTIMA': 3.5,
-        'HUMEDAD_OPTIMA': 0.30,
-        'NDVI_OPTIMO': 0.78,
-        'NDRE_OPTIMO': 0.42,
-        'RENDIMIENTO_OPTIMO': 3200,
-        'COSTO_FERTILIZACION': 400,
-        'PRECIO_VENTA': 0.45,
-        'VARIEDADES': VARIEDADES_CULTIVOS['SOJA'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
-    },
-    'GIRASOL': {
-        'NITROGENO': {'min': 70, 'max': 120},
-        'FOSFORO': {'min': 40, 'max': 75},
-        'POTASIO': {'min': 110, 'max': 190},
-        'MATERIA_ORGANICA_OPTIMA': 3.2,
-        'HUMEDAD_OPTIMA': 0.26,
-        'NDVI_OPTIMO': 0.72,
-        'NDRE_OPTIMO': 0.38,
-        'RENDIMIENTO_OPTIMO': 2800,
-        'COSTO_FERTILIZACION': 320,
-        'PRECIO_VENTA': 0.35,
-        'VARIEDADES': VARIEDADES_CULTIVOS['GIRASOL'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
-    },
-    'MANI': {
-        'NITROGENO': {'min': 15, 'max': 30},
-        'FOSFORO': {'min': 50, 'max': 90},
-        'POTASIO': {'min': 80, 'max': 140},
-        'MATERIA_ORGANICA_OPTIMA': 2.8,
-        'HUMEDAD_OPTIMA': 0.22,
-        'NDVI_OPTIMO': 0.68,
-        'NDRE_OPTIMO': 0.32,
-        'RENDIMIENTO_OPTIMO': 3800,
-        'COSTO_FERTILIZACION': 380,
-        'PRECIO_VENTA': 0.60,
-        'VARIEDADES': VARIEDADES_CULTIVOS['MANI'],
-        'ZONAS_ARGENTINA': ['Córdoba', 'San Luis', 'La Pampa']
-    },
-    'VID': {
-        'NITROGENO': {'min': 60, 'max': 120},
-        'FOSFORO': {'min': 30, 'max': 70},
-        'POTASIO': {'min': 150, 'max': 250},
-        'MATERIA_ORGANICA_OPTIMA': 2.5,
-        'HUMEDAD_OPTIMA': 0.35,
-        'NDVI_OPTIMO': 0.65,
-        'NDRE_OPTIMO': 0.35,
-        'RENDIMIENTO_OPTIMO': 15000,
-        'COSTO_FERTILIZACION': 800,
-        'PRECIO_VENTA': 0.80,
-        'VARIEDADES': VARIEDADES_CULTIVOS['VID'],
-        'ZONAS_ARGENTINA': ['Mendoza', 'San Juan', 'La Rioja', 'Salta']
-    },
-    'OLIVO': {
-        'NITROGENO': {'min': 40, 'max': 100},
-        'FOSFORO': {'min': 20, 'max': 50},
-        'POTASIO': {'min': 100, 'max': 200},
-        'MATERIA_ORGANICA_OPTIMA': 2.0,
-        'HUMEDAD_OPTIMA': 0.25,
-        'NDVI_OPTIMO': 0.60,
-        'NDRE_OPTIMO': 0.30,
-        'RENDIMIENTO_OPTIMO': 8000,
-        'COSTO_FERTILIZACION': 600,
-        'PRECIO_VENTA': 1.20,
-        'VARIEDADES': VARIEDADES_CULTIVOS['OLIVO'],
-        'ZONAS_ARGENTINA': ['La Rioja', 'Catamarca', 'San Juan', 'Mendoza']
-    },
-    'ALMENDRO': {
-        'NITROGENO': {'min': 80, 'max': 160},
-        'FOSFORO': {'min': 40, 'max': 80},
-        'POTASIO': {'min': 120, 'max': 200},
-        'MATERIA_ORGANICA_OPTIMA': 2.2,
-        'HUMEDAD_OPTIMA': 0.30,
-        'NDVI_OPTIMO': 0.62,
-        'NDRE_OPTIMO': 0.32,
-        'RENDIMIENTO_OPTIMO': 3000,
-        'COSTO_FERTILIZACION': 700,
-        'PRECIO_VENTA': 4.50,
-        'VARIEDADES': VARIEDADES_CULTIVOS['ALMENDRO'],
-        'ZONAS_ARGENTINA': ['Río Negro', 'Neuquén', 'Mendoza', 'San Juan']
-    },
-    'BANANO': {
-        'NITROGENO': {'min': 200, 'max': 350},
-        'FOSFORO': {'min': 60, 'max': 120},
-        'POTASIO': {'min': 300, 'max': 500},
-        'MATERIA_ORGANICA_OPTIMA': 4.0,
-        'HUMEDAD_OPTIMA': 0.45,
-        'NDVI_OPTIMO': 0.78,
-        'NDRE_OPTIMO': 0.40,
-        'RENDIMIENTO_OPTIMO': 40000,
-        'COSTO_FERTILIZACION': 1200,
-        'PRECIO_VENTA': 0.30,
-        'VARIEDADES': VARIEDADES_CULTIVOS['BANANO'],
-        'ZONAS_ARGENTINA': ['Formosa', 'Misiones', 'Corrientes']
-    },
-    'CAFE': {
-        'NITROGENO': {'min': 100, 'max': 200},
-        'FOSFORO': {'min': 40, 'max': 80},
-        'POTASIO': {'min': 150, 'max': 250},
-        'MATERIA_ORGANICA_OPTIMA': 3.5,
-        'HUMEDAD_OPTIMA': 0.40,
-        'NDVI_OPTIMO': 0.70,
-        'NDRE_OPTIMO': 0.38,
-        'RENDIMIENTO_OPTIMO': 2000,
-        'COSTO_FERTILIZACION': 900,
-        'PRECIO_VENTA': 3.50,
-        'VARIEDADES': VARIEDADES_CULTIVOS['CAFE'],
-        'ZONAS_ARGENTINA': ['Misiones', 'Corrientes', 'Jujuy']
-    },
-    'CACAO': {
-        'NITROGENO': {'min': 80, 'max': 150},
-        'FOSFORO': {'min': 30, 'max': 60},
-        'POTASIO': {'min': 120, 'max': 200},
-        'MATERIA_ORGANICA_OPTIMA': 4.0,
-        'HUMEDAD_OPTIMA': 0.50,
-        'NDVI_OPTIMO': 0.72,
-        'NDRE_OPTIMO': 0.38,
-        'RENDIMIENTO_OPTIMO': 1500,
-        'COSTO_FERTILIZACION': 850,
-        'PRECIO_VENTA': 5.00,
-        'VARIEDADES': VARIEDADES_CULTIVOS['CACAO'],
-        'ZONAS_ARGENTINA': ['Misiones', 'Corrientes', 'Formosa']
-    },
-    'PALMA_ACEITERA': {
-        'NITROGENO': {'min': 150, 'max': 250},
-        'FOSFORO': {'min': 50, 'max': 100},
-        'POTASIO': {'min': 200, 'max': 350},
-        'MATERIA_ORGANICA_OPTIMA': 3.8,
-        'HUMEDAD_OPTIMA': 0.55,
-        'NDVI_OPTIMO': 0.75,
-        'NDRE_OPTIMO': 0.42,
-        'RENDIMIENTO_OPTIMO': 20000,
-        'COSTO_FERTILIZACION': 1100,
-        'PRECIO_VENTA': 0.40,
-        'VARIEDADES': VARIEDADES_CULTIVOS['PALMA_ACEITERA'],
-        'ZONAS_ARGENTINA': ['Formosa', 'Chaco', 'Misiones']
-    },
-    'AVENA': {
-        'NITROGENO': {'min': 90, 'max': 150},
-        'FOSFORO': {'min': 35, 'max': 70},
-        'POTASIO': {'min': 80, 'max': 140},
-        'MATERIA_ORGANICA_OPTIMA': 3.2,
-        'HUMEDAD_OPTIMA': 0.30,
-        'NDVI_OPTIMO': 0.72,
-        'NDRE_OPTIMO': 0.38,
-        'RENDIMIENTO_OPTIMO': 4500,
-        'COSTO_FERTILIZACION': 320,
-        'PRECIO_VENTA': 0.22,
-        'VARIEDADES': VARIEDADES_CULTIVOS['AVENA'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Sur de Santa Fe', 'Sudeste de Buenos Aires']
-    }
-}
-
-# ===== CONFIGURACIÓN TEXTURA SUELO ÓPTIMA (ACTUALIZADO CON AVENA) =====
-TEXTURA_SUELO_OPTIMA = {
-    'TRIGO': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 35,
-        'limo_optima': 40,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.35,
-        'porosidad_optima': 0.48
-    },
-    'MAIZ': {
-        'textura_optima': 'Franco',
-        'arena_optima': 45,
-        'limo_optima': 35,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.30,
-        'porosidad_optima': 0.50
-    },
-    'SORGO': {
-        'textura_optima': 'Franco-arenoso',
-        'arena_optima': 55,
-        'limo_optima': 30,
-        'arcilla_optima': 15,
-        'densidad_aparente_optima': 1.40,
-        'porosidad_optima': 0.45
-    },
-    'SOJA': {
-        'textura_optima': 'Franco',
-        'arena_optima': 40,
-        'limo_optima': 40,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.25,
-        'porosidad_optima': 0.52
-    },
-    'GIRASOL': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 30,
-        'limo_optima': 45,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.32,
-        'porosidad_optima': 0.49
-    },
-    'MANI': {
-        'textura_optima': 'Franco-arenoso',
-        'arena_optima': 60,
-        'limo_optima': 25,
-        'arcilla_optima': 15,
-        'densidad_aparente_optima': 1.38,
-        'porosidad_optima': 0.46
-    },
-    'VID': {
-        'textura_optima': 'Franco-arenoso',
-        'arena_optima': 50,
-        'limo_optima': 30,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.40,
-        'porosidad_optima': 0.50
-    },
-    'OLIVO': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 40,
-        'limo_optima': 35,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.35,
-        'porosidad_optima': 0.48
-    },
-    'ALMENDRO': {
-        'textura_optima': 'Franco',
-        'arena_optima': 45,
-        'limo_optima': 35,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.38,
-        'porosidad_optima': 0.47
-    },
-    'BANANO': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 35,
-        'limo_optima': 40,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.20,
-        'porosidad_optima': 0.55
-    },
-    'CAFE': {
-        'textura_optima': 'Franco',
-        'arena_optima': 40,
-        'limo_optima': 40,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.25,
-        'porosidad_optima': 0.52
-    },
-    'CACAO': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 30,
-        'limo_optima': 45,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.15,
-        'porosidad_optima': 0.56
-    },
-    'PALMA_ACEITERA': {
-        'textura_optima': 'Franco',
-        'arena_optima': 45,
-        'limo_optima': 35,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.30,
-        'porosidad_optima': 0.51
-    },
-    'AVENA': {
-        'textura_optima': 'Franco-arenoso',
-        'arena_optima': 50,
-        'limo_optima': 30,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.38,
-        'porosidad_optima': 0.47
-    }
-}
-
-# ===== ICONOS Y COLORES PARA CULTIVOS (ACTUALIZADO CON AVENA) =====
-ICONOS_CULTIVOS = {
-    'TRIGO': '🌾',
-    'MAIZ': '🌽',
-    'SORGO': '🌾',
-    'SOJA': '🫘',
-    'GIRASOL': '🌻',
-    'MANI': '🥜',
-    'VID': '🍇',
-    'OLIVO': '🫒',
-    'ALMENDRO': '🌰',
-    'BANANO': '🍌',
-    'CAFE': '☕',
-    'CACAO': '🍫',
-    'PALMA_ACEITERA': '🌴',
-    'AVENA': '🌾'
-}
-
-COLORES_CULTIVOS = {
-    'TRIGO': '#FFD700',
-    'MAIZ': '#F4A460',
-    'SORGO': '#8B4513',
-    'SOJA': '#228B22',
-    'GIRASOL': '#FFD700',
-    'MANI': '#D2691E',
-    'VID': '#8B0000',
-    'OLIVO': '#808000',
-    'ALMENDRO': '#D2B48C',
-    'BANANO': '#FFD700',
-    'CAFE': '#8B4513',
-    'CACAO': '#4A2C2A',
-    'PALMA_ACEITERA': '#32CD32',
-    'AVENA': '#DAA520'
-}
-
 PALETAS_GEE = {
     'FERTILIDAD': ['#d73027', '#f46d43', '#fdae61', '#fee08b', '#d9ef8b', '#a6d96a', '#66bd63', '#1a9850', '#006837'],
     'NITROGENO': ['#00ff00', '#80ff00', '#ffff00', '#ff8000', '#ff0000'],
@@ -2232,13 +1467,12 @@ def mostrar_info_cultivo(cultivo):
 with st.sidebar:
     st.markdown('<div class="sidebar-title">⚙️ CONFIGURACIÓN</div>', unsafe_allow_html=True)
     
-    CULTIVOS_TOTALES = [
-        "TRIGO", "MAIZ", "SORGO", "SOJA", "GIRASOL", "MANI",
-        "VID", "OLIVO", "ALMENDRO", "BANANO", "CACAO", "CAFE", "PALMA_ACEITERA",
-        "AVENA"
-    ]
+    CULTIVOS_TOTALES = list(CULTIVOS)
     
-    cultivo = st.selectbox("Cultivo:", CULTIVOS_TOTALES)
+    # Al abrir una corrida guardada se selecciona su cultivo (antes de crear el widget)
+    if 'cultivo_pendiente' in st.session_state:
+        st.session_state.cultivo_sidebar = st.session_state.pop('cultivo_pendiente')
+    cultivo = st.selectbox("Cultivo:", CULTIVOS_TOTALES, key='cultivo_sidebar')
     
     mostrar_info_cultivo(cultivo)
 
@@ -2290,6 +1524,12 @@ with st.sidebar:
 
     st.subheader("🎯 División de Parcela")
     n_divisiones = st.slider("Número de zonas de manejo:", min_value=16, max_value=48, value=32)
+    prescripcion_pixel = st.checkbox("Prescripción por píxel (dosis variable)", value=False,
+                                     help="Evalúa fertilidad, NPK y rendimiento en cada píxel y genera un GeoTIFF "
+                                          "de prescripción; las tablas por zona pasan a ser promedios de los píxeles")
+    resolucion_prescripcion = st.select_slider("Resolución de la prescripción (metros):", options=[10, 15, 20, 25, 30],
+                                               value=10, disabled=not prescripcion_pixel)
+    resolucion_prescripcion = float(resolucion_prescripcion) if prescripcion_pixel else None
 
     st.subheader("🏔️ Configuración Curvas de Nivel")
     intervalo_curvas = st.slider("Intervalo entre curvas (metros):", 1.0, 20.0, 5.0, 1.0)
@@ -2297,151 +1537,202 @@ with st.sidebar:
 
     # No hay selector de proveedor, solo Gemini
 
-    st.subheader("📤 Subir Parcela")
-    uploaded_file = st.file_uploader("Subir archivo de tu parcela", type=['zip', 'kml', 'kmz'],
-                                     help="Formatos aceptados: Shapefile (.zip), KML (.kml), KMZ (.kmz)")
+    st.subheader("📦 Modo Multi-Lote")
+    modo_lotes = st.checkbox("Analizar cada polígono como un lote", value=False,
+                             help="Conserva cada entidad del archivo como lote propio y genera un resumen del establecimiento")
+    max_procesos_lotes = st.slider("Procesos en paralelo:", 1, max(1, os.cpu_count() or 1),
+                                   min(MAX_PROCESOS_LOTES, max(1, os.cpu_count() or 1)),
+                                   disabled=not modo_lotes)
+
+    st.subheader("🗂️ Registro de Lotes")
+    registro_lotes = obtener_registro_lotes()
+    st.caption(f"{len(registro_lotes)} lote(s) registrados")
+    with st.expander("📍 Buscar lote por coordenada"):
+        lat_busqueda = st.number_input("Latitud:", -90.0, 90.0, 0.0, format="%.6f")
+        lon_busqueda = st.number_input("Longitud:", -180.0, 180.0, 0.0, format="%.6f")
+        if st.button("🔍 Buscar", use_container_width=True):
+            encontrados = registro_lotes.consultar_punto(lon_busqueda, lat_busqueda)
+            if len(encontrados) > 0:
+                st.dataframe(encontrados[['establecimiento', 'nombre_lote', 'area_ha']], hide_index=True)
+            else:
+                st.info("Ningún lote registrado contiene ese punto")
 
-# ===== FUNCIONES AUXILIARES - CORREGIDAS PARA EPSG:4326 =====
-def validar_y_corregir_crs(gdf):
-    if gdf is None or len(gdf) == 0:
-        return gdf
-    try:
-        if gdf.crs is None:
-            gdf = gdf.set_crs('EPSG:4326', inplace=False)
-            st.info("ℹ️ Se asignó EPSG:4326 al archivo (no tenía CRS)")
-        elif str(gdf.crs).upper() != 'EPSG:4326':
-            original_crs = str(gdf.crs)
-            gdf = gdf.to_crs('EPSG:4326')
-            st.info(f"ℹ️ Transformado de {original_crs} a EPSG:4326")
-        return gdf
-    except Exception as e:
-        st.warning(f"⚠️ Error al corregir CRS: {str(e)}")
-        return gdf
+    st.subheader("📤 Subir Parcela")
+    tolerancia_simplificacion = st.slider(
+        "Tolerancia de simplificación (metros):", 0.0, 10.0, TOLERANCIA_SIMPLIFICACION_M, 0.5,
+        help="Reduce vértices preservando la topología. 0 = sin simplificar"
+    )
+    uploaded_file = st.file_uploader("Subir archivo de tu parcela",
+                                     type=['zip', 'kml', 'kmz'] + [e.lstrip('.') for e in FORMATOS_VECTORIALES],
+                                     help="Formatos aceptados: Shapefile (.zip), KML (.kml), KMZ (.kmz), "
+                                          "GeoPackage (.gpkg), GeoJSON (.geojson), FlatGeobuf (.fgb), GeoParquet (.parquet)")
 
-def calcular_superficie(gdf):
-    try:
-        if gdf is None or len(gdf) == 0:
-            return 0.0
-        gdf = validar_y_corregir_crs(gdf)
-        bounds = gdf.total_bounds
-        if bounds[0] < -180 or bounds[2] > 180 or bounds[1] < -90 or bounds[3] > 90:
-            area_grados2 = gdf.geometry.area.sum()
-            area_m2 = area_grados2 * 111000 * 111000
-            return area_m2 / 10000
-        gdf_projected = gdf.to_crs('EPSG:3857')
-        area_m2 = gdf_projected.geometry.area.sum()
-        return area_m2 / 10000
-    except Exception as e:
-        try:
-            return gdf.geometry.area.sum() / 10000
-        except:
-            return 0.0
+# ===== FUNCIONES PARA CARGAR ARCHIVOS =====
+# Extensiones que acompañan a un .shp y que se leen junto con él
+EXTENSIONES_SHAPEFILE = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.qpj')
 
-def dividir_parcela_en_zonas(gdf, n_zonas):
-    if len(gdf) == 0:
-        return gdf
-    gdf = validar_y_corregir_crs(gdf)
-    parcela_principal = gdf.iloc[0].geometry
-    bounds = parcela_principal.bounds
-    minx, miny, maxx, maxy = bounds
-    sub_poligonos = []
-    n_cols = math.ceil(math.sqrt(n_zonas))
-    n_rows = math.ceil(n_zonas / n_cols)
-    width = (maxx - minx) / n_cols
-    height = (maxy - miny) / n_rows
-    for i in range(n_rows):
-        for j in range(n_cols):
-            if len(sub_poligonos) >= n_zonas:
-                break
-            cell_minx = minx + (j * width)
-            cell_maxx = minx + ((j + 1) * width)
-            cell_miny = miny + (i * height)
-            cell_maxy = miny + ((i + 1) * height)
-            cell_poly = Polygon([(cell_minx, cell_miny), (cell_maxx, cell_miny), (cell_maxx, cell_maxy), (cell_minx, cell_maxy)])
-            intersection = parcela_principal.intersection(cell_poly)
-            if not intersection.is_empty and intersection.area > 0:
-                sub_poligonos.append(intersection)
-    if sub_poligonos:
-        nuevo_gdf = gpd.GeoDataFrame({'id_zona': range(1, len(sub_poligonos) + 1), 'geometry': sub_poligonos}, crs='EPSG:4326')
-        return nuevo_gdf
-    else:
-        return gdf
+def _leer_capa_shapefile_zip(zip_file, zip_ref, miembro_shp):
+    """
+    Lee una capa .shp directamente desde el ZIP en memoria (GDAL /vsizip/ sobre /vsimem/),
+    sin extraer a disco. Si la capa está en una subcarpeta, se copian sólo sus
+    miembros a un ZIP en memoria, porque GDAL sólo lista capas en la raíz del ZIP.
+    """
+    base, _ = os.path.splitext(miembro_shp)
+    nombre_capa = os.path.basename(base)
+    if '/' not in miembro_shp:
+        zip_file.seek(0)
+        return gpd.read_file(zip_file, layer=nombre_capa)
+    sub_zip = BytesIO()
+    with zipfile.ZipFile(sub_zip, 'w', zipfile.ZIP_STORED) as destino:
+        for miembro in zip_ref.namelist():
+            raiz, ext = os.path.splitext(miembro)
+            if raiz == base and ext.lower() in EXTENSIONES_SHAPEFILE:
+                destino.writestr(nombre_capa + ext.lower(), zip_ref.read(miembro))
+    sub_zip.seek(0)
+    return gpd.read_file(sub_zip, layer=nombre_capa)
 
-# ===== FUNCIONES PARA CARGAR ARCHIVOS =====
 def cargar_shapefile_desde_zip(zip_file):
+    """
+    Carga todas las capas .shp del ZIP sin extraerlo. Con varias capas, se
+    concatenan (ya en EPSG:4326) y la columna 'capa' indica el origen de cada fila.
+    """
     try:
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                zip_ref.extractall(tmp_dir)
-            shp_files = [f for f in os.listdir(tmp_dir) if f.endswith('.shp')]
-            if shp_files:
-                shp_path = os.path.join(tmp_dir, shp_files[0])
-                gdf = gpd.read_file(shp_path)
-                gdf = validar_y_corregir_crs(gdf)
-                return gdf
-            else:
+        zip_file.seek(0)
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            shp_files = [m for m in zip_ref.namelist()
+                         if m.lower().endswith('.shp') and not os.path.basename(m).startswith('._')]
+            if not shp_files:
                 st.error("❌ No se encontró ningún archivo .shp en el ZIP")
                 return None
+            capas = []
+            for miembro_shp in shp_files:
+                gdf_capa = _leer_capa_shapefile_zip(zip_file, zip_ref, miembro_shp)
+                gdf_capa = validar_y_corregir_crs(gdf_capa)
+                gdf_capa['capa'] = os.path.splitext(os.path.basename(miembro_shp))[0]
+                capas.append(gdf_capa)
+        if len(capas) > 1:
+            st.info(f"ℹ️ El ZIP contiene {len(capas)} capas: {', '.join(c['capa'].iloc[0] for c in capas if len(c))}")
+        gdf = gpd.GeoDataFrame(pd.concat(capas, ignore_index=True), geometry='geometry', crs='EPSG:4326')
+        return gdf
     except Exception as e:
         st.error(f"❌ Error cargando shapefile desde ZIP: {str(e)}")
         return None
 
+def _etiqueta_kml(tag):
+    """Nombre local de una etiqueta XML (sin namespace: KML 2.1, 2.2, gx, etc.)."""
+    return tag.rsplit('}', 1)[-1]
+
+def _coordenadas_kml_a_array(texto):
+    """Convierte el texto de <coordinates> ('lon,lat[,alt] ...') a un array (n, 2) de float."""
+    if not texto:
+        return np.empty((0, 2))
+    texto = texto.strip()
+    if not texto:
+        return np.empty((0, 2))
+    dimension = texto.split(None, 1)[0].count(',') + 1
+    valores = texto.replace(',', ' ').split()
+    try:
+        if dimension >= 2 and len(valores) % dimension == 0:
+            return np.array(valores, dtype=float).reshape(-1, dimension)[:, :2]
+    except ValueError:
+        pass
+    # Formato irregular (dimensiones mezcladas o espacios tras comas): tupla por tupla
+    puntos = []
+    for tupla in texto.split():
+        partes = tupla.split(',')
+        if len(partes) >= 2:
+            try:
+                puntos.append((float(partes[0]), float(partes[1])))
+            except ValueError:
+                continue
+    return np.array(puntos, dtype=float).reshape(-1, 2)
+
 def parsear_kml_manual(contenido_kml):
+    """
+    Parser KML en streaming (iterparse) de una sola pasada.
+    Acepta texto, bytes o un archivo abierto. Cada Placemark produce una fila con
+    su geometría (Polygon o MultiPolygon, con anillos interiores/huecos) y sus
+    atributos (name, description, ExtendedData). Los elementos ya procesados se
+    descartan, así la memoria no crece con el tamaño del archivo.
+    """
     try:
-        root = ET.fromstring(contenido_kml)
-        namespaces = {'kml': 'http://www.opengis.net/kml/2.2'}
-        polygons = []
-        for polygon_elem in root.findall('.//kml:Polygon', namespaces):
-            coords_elem = polygon_elem.find('.//kml:coordinates', namespaces)
-            if coords_elem is not None and coords_elem.text:
-                coord_text = coords_elem.text.strip()
-                coord_list = []
-                for coord_pair in coord_text.split():
-                    parts = coord_pair.split(',')
-                    if len(parts) >= 2:
-                        lon = float(parts[0])
-                        lat = float(parts[1])
-                        coord_list.append((lon, lat))
-                if len(coord_list) >= 3:
-                    polygons.append(Polygon(coord_list))
-        if not polygons:
-            for multi_geom in root.findall('.//kml:MultiGeometry', namespaces):
-                for polygon_elem in multi_geom.findall('.//kml:Polygon', namespaces):
-                    coords_elem = polygon_elem.find('.//kml:coordinates', namespaces)
-                    if coords_elem is not None and coords_elem.text:
-                        coord_text = coords_elem.text.strip()
-                        coord_list = []
-                        for coord_pair in coord_text.split():
-                            parts = coord_pair.split(',')
-                            if len(parts) >= 2:
-                                lon = float(parts[0])
-                                lat = float(parts[1])
-                                coord_list.append((lon, lat))
-                        if len(coord_list) >= 3:
-                            polygons.append(Polygon(coord_list))
-        if polygons:
-            gdf = gpd.GeoDataFrame({'geometry': polygons}, crs='EPSG:4326')
-            return gdf
+        if isinstance(contenido_kml, str):
+            fuente = BytesIO(contenido_kml.encode('utf-8'))
+        elif isinstance(contenido_kml, (bytes, bytearray)):
+            fuente = BytesIO(contenido_kml)
         else:
-            for placemark in root.findall('.//kml:Placemark', namespaces):
-                for elem_name in ['Polygon', 'LineString', 'Point', 'LinearRing']:
-                    elem = placemark.find(f'.//kml:{elem_name}', namespaces)
-                    if elem is not None:
-                        coords_elem = elem.find('.//kml:coordinates', namespaces)
-                        if coords_elem is not None and coords_elem.text:
-                            coord_text = coords_elem.text.strip()
-                            coord_list = []
-                            for coord_pair in coord_text.split():
-                                parts = coord_pair.split(',')
-                                if len(parts) >= 2:
-                                    lon = float(parts[0])
-                                    lat = float(parts[1])
-                                    coord_list.append((lon, lat))
-                            if len(coord_list) >= 3:
-                                polygons.append(Polygon(coord_list))
-                            break
-        if polygons:
-            gdf = gpd.GeoDataFrame({'geometry': polygons}, crs='EPSG:4326')
+            fuente = contenido_kml
+
+        filas = []
+        lineas_respaldo = []  # LineString/LinearRing sueltos, sólo si no hay ningún Polygon
+        pila = []
+        placemark = None
+        poligono = None
+        anillo = None
+        nombre_data = None
+
+        for evento, elem in ET.iterparse(fuente, events=('start', 'end')):
+            tag = _etiqueta_kml(elem.tag)
+            if evento == 'start':
+                pila.append(elem)
+                if tag == 'Placemark':
+                    placemark = {'atributos': {}, 'poligonos': []}
+                elif tag == 'Polygon':
+                    poligono = {'exterior': None, 'interiores': []}
+                elif tag == 'outerBoundaryIs':
+                    anillo = 'exterior'
+                elif tag == 'innerBoundaryIs':
+                    anillo = 'interior'
+                elif tag == 'Data':
+                    nombre_data = elem.get('name')
+                continue
+
+            pila.pop()
+            if tag == 'coordinates':
+                coords = _coordenadas_kml_a_array(elem.text)
+                if poligono is not None and len(coords) >= 3:
+                    if anillo == 'interior':
+                        poligono['interiores'].append(coords)
+                    elif poligono['exterior'] is None:
+                        poligono['exterior'] = coords
+                elif poligono is None and len(coords) >= 3:
+                    lineas_respaldo.append((coords, placemark['atributos'].copy() if placemark else {}))
+            elif tag in ('outerBoundaryIs', 'innerBoundaryIs'):
+                anillo = None
+            elif tag == 'Polygon':
+                if poligono['exterior'] is not None:
+                    geom = Polygon(poligono['exterior'], poligono['interiores'])
+                    if placemark is not None:
+                        placemark['poligonos'].append(geom)
+                    else:
+                        filas.append({'geometry': geom})
+                poligono = None
+            elif placemark is not None and tag in ('name', 'description') and pila and _etiqueta_kml(pila[-1].tag) == 'Placemark':
+                if elem.text and elem.text.strip():
+                    placemark['atributos'][tag] = elem.text.strip()
+            elif placemark is not None and tag == 'SimpleData' and elem.get('name'):
+                placemark['atributos'][elem.get('name')] = (elem.text or '').strip()
+            elif placemark is not None and tag == 'value' and nombre_data:
+                placemark['atributos'][nombre_data] = (elem.text or '').strip()
+            elif tag == 'Data':
+                nombre_data = None
+            elif tag == 'Placemark':
+                poligonos = placemark['poligonos']
+                if poligonos:
+                    geom = poligonos[0] if len(poligonos) == 1 else MultiPolygon(poligonos)
+                    filas.append({**placemark['atributos'], 'geometry': geom})
+                placemark = None
+
+            # Liberar el elemento terminado (y sus hijos) para acotar la memoria
+            if tag in ('Placemark', 'Polygon', 'coordinates') or placemark is None:
+                elem.clear()
+                if pila and tag == 'Placemark':
+                    pila[-1].remove(elem)
+
+        if not filas and lineas_respaldo:
+            filas = [{**atributos, 'geometry': Polygon(coords)} for coords, atributos in lineas_respaldo]
+        if filas:
+            gdf = gpd.GeoDataFrame(filas, geometry='geometry', crs='EPSG:4326')
             return gdf
         return None
     except Exception as e:
@@ -2449,33 +1740,36 @@ def parsear_kml_manual(contenido_kml):
         return None
 
 def cargar_kml(kml_file):
+    """KML o KMZ. El KMZ se lee miembro a miembro desde memoria, sin extraerlo a disco."""
     try:
         if kml_file.name.endswith('.kmz'):
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                with zipfile.ZipFile(kml_file, 'r') as zip_ref:
-                    zip_ref.extractall(tmp_dir)
-                kml_files = [f for f in os.listdir(tmp_dir) if f.endswith('.kml')]
-                if kml_files:
-                    kml_path = os.path.join(tmp_dir, kml_files[0])
-                    with open(kml_path, 'r', encoding='utf-8') as f:
-                        contenido = f.read()
-                    gdf = parsear_kml_manual(contenido)
-                    if gdf is not None:
-                        return gdf
-                    else:
-                        try:
-                            gdf = gpd.read_file(kml_path)
-                            gdf = validar_y_corregir_crs(gdf)
-                            return gdf
-                        except:
-                            st.error("❌ No se pudo cargar el archivo KML/KMZ")
-                            return None
-                else:
+            kml_file.seek(0)
+            with zipfile.ZipFile(kml_file, 'r') as zip_ref:
+                kml_files = [m for m in zip_ref.namelist() if m.lower().endswith('.kml')]
+                if not kml_files:
                     st.error("❌ No se encontró ningún archivo .kml en el KMZ")
                     return None
+                # doc.kml es el documento principal; el resto se agrega como capas adicionales
+                kml_files.sort(key=lambda m: (os.path.basename(m).lower() != 'doc.kml', m))
+                capas = []
+                for miembro in kml_files:
+                    with zip_ref.open(miembro) as f:
+                        gdf_capa = parsear_kml_manual(f)
+                    if gdf_capa is None:
+                        try:
+                            with zip_ref.open(miembro) as f:
+                                gdf_capa = validar_y_corregir_crs(gpd.read_file(BytesIO(f.read())))
+                        except Exception:
+                            continue
+                    gdf_capa['capa'] = os.path.splitext(os.path.basename(miembro))[0]
+                    capas.append(gdf_capa)
+            if not capas:
+                st.error("❌ No se pudo cargar el archivo KML/KMZ")
+                return None
+            return gpd.GeoDataFrame(pd.concat(capas, ignore_index=True), geometry='geometry', crs='EPSG:4326')
         else:
-            contenido = kml_file.read().decode('utf-8')
-            gdf = parsear_kml_manual(contenido)
+            kml_file.seek(0)
+            gdf = parsear_kml_manual(kml_file)
             if gdf is not None:
                 return gdf
             else:
@@ -2487,27 +1781,65 @@ def cargar_kml(kml_file):
         st.error(f"❌ Error cargando archivo KML/KMZ: {str(e)}")
         return None
 
-def cargar_archivo_parcela(uploaded_file):
+def cargar_archivo_vectorial(archivo):
+    """
+    GeoPackage, GeoJSON, FlatGeobuf o GeoParquet por la vía rápida Arrow (pyogrio).
+    Si un GeoPackage tiene varias capas, se concatenan con la columna 'capa'.
+    """
+    try:
+        gdf, capas = leer_vectorial(archivo)
+        if len(capas) > 1:
+            partes = [validar_y_corregir_crs(gdf).assign(capa=capas[0])]
+            for capa in capas[1:]:
+                gdf_capa, _ = leer_vectorial(archivo, capa=capa)
+                partes.append(validar_y_corregir_crs(gdf_capa).assign(capa=capa))
+            st.info(f"ℹ️ El archivo contiene {len(capas)} capas: {', '.join(capas)}")
+            return gpd.GeoDataFrame(pd.concat(partes, ignore_index=True), geometry='geometry', crs='EPSG:4326')
+        return validar_y_corregir_crs(gdf)
+    except Exception as e:
+        st.error(f"❌ Error cargando archivo vectorial: {str(e)}")
+        return None
+
+def cargar_archivo_parcela(uploaded_file, tolerancia_m=TOLERANCIA_SIMPLIFICACION_M, por_lotes=False):
+    """
+    Carga la parcela. Por defecto une todos los polígonos en una sola geometría;
+    con por_lotes=True conserva cada entidad (y sus atributos) como un lote.
+    """
     try:
         if uploaded_file.name.endswith('.zip'):
             gdf = cargar_shapefile_desde_zip(uploaded_file)
         elif uploaded_file.name.endswith(('.kml', '.kmz')):
             gdf = cargar_kml(uploaded_file)
+        elif es_formato_vectorial(uploaded_file.name):
+            gdf = cargar_archivo_vectorial(uploaded_file)
         else:
             st.error("❌ Formato de archivo no soportado")
             return None
         
         if gdf is not None:
             gdf = validar_y_corregir_crs(gdf)
-            gdf = gdf.explode(ignore_index=True)
+            if not por_lotes:
+                gdf = gdf.explode(ignore_index=True)
             gdf = gdf[gdf.geometry.geom_type.isin(['Polygon', 'MultiPolygon'])]
             if len(gdf) == 0:
                 st.error("❌ No se encontraron polígonos en el archivo")
                 return None
+            n_poligonos = len(gdf)
+            gdf, stats_geom = preparar_geometria(gdf, tolerancia_m=tolerancia_m, unir=not por_lotes)
+            if len(gdf) == 0:
+                st.error("❌ La geometría no es válida tras la reparación")
+                return None
+            st.info(f"✂️ Vértices: {stats_geom['vertices_antes']:,} → {stats_geom['vertices_despues']:,} "
+                    f"(tolerancia {tolerancia_m} m, {stats_geom['geometrias_reparadas']} reparada(s), "
+                    f"{stats_geom['astillas_eliminadas']} astilla(s) eliminada(s))")
+            if por_lotes:
+                gdf_lotes = nombrar_lotes(gdf)
+                st.info(f"✅ Se cargaron {len(gdf_lotes)} lote(s) independientes.")
+                return gdf_lotes
             geometria_unida = gdf.unary_union
             gdf_unido = gpd.GeoDataFrame([{'geometry': geometria_unida}], crs='EPSG:4326')
             gdf_unido = validar_y_corregir_crs(gdf_unido)
-            st.info(f"✅ Se unieron {len(gdf)} polígono(s) en una sola geometría.")
+            st.info(f"✅ Se unieron {n_poligonos} polígono(s) en una sola geometría.")
             gdf_unido['id_zona'] = 1
             return gdf_unido
         return gdf
@@ -2517,897 +1849,257 @@ def cargar_archivo_parcela(uploaded_file):
         st.error(f"Detalle: {traceback.format_exc()}")
         return None
 
-# ===== FUNCIONES PARA DATOS SATELITALES =====
-def descargar_datos_landsat8(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
-    try:
-        datos_simulados = {
-            'indice': indice,
-            'valor_promedio': 0.65 + np.random.normal(0, 0.1),
-            'fuente': 'Landsat-8',
-            'fecha': datetime.now().strftime('%Y-%m-%d'),
-            'id_escena': f"LC08_{np.random.randint(1000000, 9999999)}",
-            'cobertura_nubes': f"{np.random.randint(0, 15)}%",
-            'resolucion': '30m'
-        }
-        return datos_simulados
-    except Exception as e:
-        st.error(f"❌ Error procesando Landsat 8: {str(e)}")
-        return None
-
-def descargar_datos_sentinel2(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
-    try:
-        datos_simulados = {
-            'indice': indice,
-            'valor_promedio': 0.72 + np.random.normal(0, 0.08),
-            'fuente': 'Sentinel-2',
-            'fecha': datetime.now().strftime('%Y-%m-%d'),
-            'id_escena': f"S2A_{np.random.randint(1000000, 9999999)}",
-            'cobertura_nubes': f"{np.random.randint(0, 10)}%",
-            'resolucion': '10m'
-        }
-        return datos_simulados
-    except Exception as e:
-        st.error(f"❌ Error procesando Sentinel-2: {str(e)}")
-        return None
-
-def generar_datos_simulados(gdf, cultivo, indice='NDVI'):
-    datos_simulados = {
-        'indice': indice,
-        'valor_promedio': PARAMETROS_CULTIVOS[cultivo]['NDVI_OPTIMO'] * 0.8 + np.random.normal(0, 0.1),
-        'fuente': 'Simulación',
-        'fecha': datetime.now().strftime('%Y-%m-%d'),
-        'resolucion': '10m'
-    }
-    return datos_simulados
+# ===== CACHÉ DE CARGA (POR HASH DEL CONTENIDO DEL ARCHIVO) =====
+# Streamlit re-ejecuta todo el script en cada interacción; con estas funciones
+# la ingesta y la vista previa sólo se recalculan cuando cambia el archivo subido.
+def hash_archivo(uploaded_file):
+    """SHA-256 del contenido subido (mismo archivo = misma clave, aunque cambie el nombre)."""
+    if hasattr(uploaded_file, 'getvalue'):
+        return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    uploaded_file.seek(0)
+    digest = hashlib.sha256(uploaded_file.read()).hexdigest()
+    uploaded_file.seek(0)
+    return digest
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def cargar_parcela_por_hash(hash_contenido, nombre_archivo, tolerancia_m, por_lotes, _uploaded_file):
+    """
+    Versión cacheada de cargar_archivo_parcela + calcular_superficie.
+    El archivo (_uploaded_file) no se hashea: la clave es el hash del contenido,
+    el nombre (define el formato), la tolerancia y el modo. Retorna (gdf, area_ha).
+    Los mensajes st.info/st.error de la carga se repiten desde la caché.
+    """
+    gdf = cargar_archivo_parcela(_uploaded_file, tolerancia_m, por_lotes=por_lotes)
+    area = calcular_superficie(gdf) if gdf is not None else 0.0
+    return gdf, area
 
-# ===== FUNCIONES GOOGLE EARTH ENGINE =====
-def obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
-    """Obtener datos reales de Sentinel-2 usando Google Earth Engine con manejo robusto"""
-    if not GEE_AVAILABLE or not st.session_state.gee_authenticated:
-        st.warning("⚠️ GEE no disponible o no autenticado")
-        return None
-    
+@st.cache_data(show_spinner=False, max_entries=32)
+def vista_previa_parcela(hash_contenido, tolerancia_m, por_lotes, titulo, nombre_tiff, cultivo, _gdf, con_tiff=True):
+    """
+    Renderiza una sola vez la vista previa de la parcela/lotes (PNG) y su GeoTIFF.
+    Retorna (png_bytes, tiff_bytes, nombre_tiff); tiff_bytes es None si con_tiff=False.
+    """
+    fig, ax = plt.subplots(figsize=(8, 6))
+    if por_lotes:
+        _gdf.plot(ax=ax, column='id_lote', cmap='tab20', edgecolor='black', alpha=0.7)
+    else:
+        _gdf.plot(ax=ax, color='lightgreen', edgecolor='darkgreen', alpha=0.7)
+    ax.set_title(titulo)
+    ax.set_xlabel("Longitud"); ax.set_ylabel("Latitud"); ax.grid(True, alpha=0.3)
+    buf_vista = io.BytesIO()
+    fig.savefig(buf_vista, format='png', dpi=150, bbox_inches='tight')
+    plt.close(fig)
+    png = buf_vista.getvalue()
+    if not con_tiff:
+        return png, None, None
+    tiff_buffer, tiff_filename = exportar_mapa_tiff(io.BytesIO(png), _gdf, nombre_tiff, cultivo)
+    return png, (tiff_buffer.getvalue() if tiff_buffer else None), tiff_filename
+
+# ===== CACHÉ DE ETAPAS DEL ANÁLISIS COMPLETO =====
+@st.cache_resource
+def obtener_cache_etapas():
+    """Caché de salidas de etapas del proceso, compartida entre sesiones y reruns."""
+    return CacheEtapas()
+
+# ===== CORRIDAS GUARDADAS =====
+@st.cache_resource
+def obtener_almacen_corridas():
+    return AlmacenCorridas()
+
+@st.cache_data(max_entries=8)
+def cargar_corrida(id_corrida):
+    return obtener_almacen_corridas().cargar(id_corrida)
+
+def clave_propietario():
+    """
+    Espacio de corridas de este navegador: la clave viaja en la URL (?espacio=...),
+    así sobrevive a recargas y se puede compartir; se crea al entrar sin ella.
+    """
+    clave = st.query_params.get('espacio')
+    if not clave:
+        clave = uuid.uuid4().hex[:12]
+        st.query_params['espacio'] = clave
+    return clave
+
+def guardar_corrida(resultados, nombre=''):
+    """Persiste la corrida recién calculada; si falla, los resultados siguen en la sesión."""
     try:
-        if gdf is None or len(gdf) == 0:
-            st.error("❌ El área de estudio no es válida")
-            return None
-        
-        bounds = gdf.total_bounds
-        min_lon, min_lat, max_lon, max_lat = bounds
-        
-        if (abs(max_lon - min_lon) < 0.0001 or abs(max_lat - min_lat) < 0.0001):
-            st.warning("⚠️ El área de estudio es muy pequeña. Ampliando bounding box.")
-            min_lon -= 0.001
-            max_lon += 0.001
-            min_lat -= 0.001
-            max_lat += 0.001
-        
-        geometry = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
-        start_date = fecha_inicio.strftime('%Y-%m-%d')
-        end_date = fecha_fin.strftime('%Y-%m-%d')
-        
-        if fecha_inicio > fecha_fin:
-            st.error("❌ La fecha de inicio debe ser anterior a la fecha de fin")
-            start_date, end_date = end_date, start_date
-            st.info("ℹ️ Se intercambiaron las fechas automáticamente")
-        
-        collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-                     .filterBounds(geometry)
-                     .filterDate(start_date, end_date)
-                     .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 60)))
-        
-        collection_size = collection.size().getInfo()
-        
-        if collection_size == 0:
-            st.warning(f"⚠️ No se encontraron imágenes Sentinel-2 para:")
-            st.warning(f"   - Área: [{min_lon:.4f}, {min_lat:.4f}, {max_lon:.4f}, {max_lat:.4f}]")
-            st.warning(f"   - Período: {start_date} a {end_date}")
-            st.info("🔄 Intentando con filtro de nubes más permisivo (<80%)...")
-            collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-                         .filterBounds(geometry)
-                         .filterDate(start_date, end_date)
-                         .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 80)))
-            collection_size = collection.size().getInfo()
-            if collection_size == 0:
-                st.error("❌ No hay imágenes disponibles incluso con filtro permisivo")
-                return None
-            else:
-                st.success(f"✅ Encontradas {collection_size} imágenes con filtro permisivo")
-        
-        image = collection.sort('CLOUDY_PIXEL_PERCENTAGE').first()
-        if image is None:
-            st.error("❌ Error crítico: La imagen seleccionada es nula")
-            return None
-        
-        image_id = image.get('system:index').getInfo()
-        cloud_percent = image.get('CLOUDY_PIXEL_PERCENTAGE').getInfo()
-        image_date = image.get('system:time_start').getInfo()
-        
-        if image_date:
-            image_date_str = datetime.fromtimestamp(image_date / 1000).strftime('%Y-%m-%d')
-            st.info(f"📅 Imagen seleccionada: {image_id} ({image_date_str}) - Nubes: {cloud_percent}%")
-        
-        try:
-            if indice == 'NDVI':
-                ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
-                index_image = ndvi
-            elif indice == 'NDWI':
-                ndwi = image.normalizedDifference(['B3', 'B8']).rename('NDWI')
-                index_image = ndwi
-            elif indice == 'EVI':
-                evi = image.expression(
-                    '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))',
-                    {'NIR': image.select('B8'), 'RED': image.select('B4'), 'BLUE': image.select('B2')}
-                ).rename('EVI')
-                index_image = evi
-            elif indice == 'NDRE':
-                ndre = image.normalizedDifference(['B8', 'B5']).rename('NDRE')
-                index_image = ndre
-            elif indice == 'SAVI':
-                savi = image.expression(
-                    '((NIR - RED) / (NIR + RED + 0.5)) * (1.5)',
-                    {'NIR': image.select('B8'), 'RED': image.select('B4')}
-                ).rename('SAVI')
-                index_image = savi
-            elif indice == 'MSAVI':
-                msavi = image.expression(
-                    '(2 * NIR + 1 - sqrt(pow((2 * NIR + 1), 2) - 8 * (NIR - RED))) / 2',
-                    {'NIR': image.select('B8'), 'RED': image.select('B4')}
-                ).rename('MSAVI')
-                index_image = msavi
-            else:
-                ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
-                index_image = ndvi
-                indice = 'NDVI'
-        except Exception as e:
-            st.error(f"❌ Error calculando índice {indice}: {str(e)}")
-            try:
-                ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
-                index_image = ndvi
-                indice = 'NDVI'
-                st.info("ℹ️ Usando NDVI como índice por defecto")
-            except:
-                st.error("❌ Error crítico: No se pudo calcular ningún índice")
-                return None
-        
-        try:
-            stats = index_image.reduceRegion(
-                reducer=ee.Reducer.mean().combine(
-                    reducer2=ee.Reducer.minMax(),
-                    sharedInputs=True
-                ).combine(
-                    reducer2=ee.Reducer.stdDev(),
-                    sharedInputs=True
-                ),
-                geometry=geometry,
-                scale=10,
-                bestEffort=True,
-                maxPixels=1e9
-            )
-            
-            stats_dict = stats.getInfo()
-            
-            if not stats_dict:
-                st.warning("⚠️ No se pudieron obtener estadísticas de la imagen")
-                valor_promedio = 0.6
-                valor_min = 0.3
-                valor_max = 0.9
-                valor_std = 0.1
-            else:
-                valor_promedio = stats_dict.get(f'{indice}_mean', 0.6)
-                valor_min = stats_dict.get(f'{indice}_min', 0.3)
-                valor_max = stats_dict.get(f'{indice}_max', 0.9)
-                valor_std = stats_dict.get(f'{indice}_stdDev', 0.1)
-                
-        except Exception as e:
-            st.warning(f"⚠️ Error obteniendo estadísticas: {str(e)}")
-            valor_promedio = 0.6 + np.random.normal(0, 0.1)
-            valor_min = max(0.1, valor_promedio - 0.3)
-            valor_max = min(0.95, valor_promedio + 0.3)
-            valor_std = 0.1
-        
-        return {
-            'indice': indice,
-            'valor_promedio': valor_promedio,
-            'valor_min': valor_min,
-            'valor_max': valor_max,
-            'valor_std': valor_std,
-            'fuente': f'Sentinel-2 (Google Earth Engine) - {image_id}' if image_id else 'Sentinel-2 (GEE)',
-            'fecha_descarga': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'fecha_imagen': image_date_str if 'image_date_str' in locals() else 'N/A',
-            'resolucion': '10m',
-            'estado': 'exitosa',
-            'cobertura_nubes': f"{cloud_percent}%" if cloud_percent else 'N/A',
-            'nota': f"Imágenes encontradas: {collection_size}" if collection_size else 'Sin imágenes'
-        }
-        
+        resultados['id_corrida'] = obtener_almacen_corridas().guardar(resultados, nombre, clave_propietario())
+        resultados['nombre_corrida'] = nombre
     except Exception as e:
-        st.error(f"❌ Error obteniendo datos de Google Earth Engine: {str(e)}")
-        st.info("💡 Usando datos simulados como alternativa")
-        return None
+        st.warning(f"⚠️ No se pudo guardar la corrida: {e}")
+    return resultados
 
-def obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, dataset='LANDSAT/LC08/C02/T1_L2', indice='NDVI'):
-    if not GEE_AVAILABLE or not st.session_state.gee_authenticated:
-        return None
-    try:
-        bounds = gdf.total_bounds
-        min_lon, min_lat, max_lon, max_lat = bounds
-        geometry = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
-        start_date = fecha_inicio.strftime('%Y-%m-%d')
-        end_date = fecha_fin.strftime('%Y-%m-%d')
-        
-        if 'LC08' in dataset or 'LANDSAT/LC08' in dataset:
-            red_band = 'SR_B4'
-            nir_band = 'SR_B5'
-            red_edge_band = 'SR_B6'
-            blue_band = 'SR_B2'
-        elif 'LC09' in dataset:
-            red_band = 'SR_B4'
-            nir_band = 'SR_B5'
-            red_edge_band = 'SR_B6'
-            blue_band = 'SR_B2'
-        else:
-            red_band = 'SR_B4'
-            nir_band = 'SR_B5'
-            red_edge_band = 'SR_B6'
-            blue_band = 'SR_B2'
-        
-        collection = (ee.ImageCollection(dataset)
-                     .filterBounds(geometry)
-                     .filterDate(start_date, end_date)
-                     .filter(ee.Filter.lt('CLOUD_COVER', 20)))
-        
-        image = collection.sort('CLOUD_COVER').first()
-        if image is None:
-            st.warning("⚠️ No se encontraron imágenes Landsat para el período y área seleccionados")
-            return None
-        
-        if indice == 'NDVI':
-            ndvi = image.normalizedDifference([nir_band, red_band]).rename('NDVI')
-            index_image = ndvi
-        elif indice == 'NDRE':
-            ndre = image.normalizedDifference([nir_band, red_edge_band]).rename('NDRE')
-            index_image = ndre
-        elif indice == 'NDWI':
-            ndwi = image.normalizedDifference(['SR_B3', nir_band]).rename('NDWI')
-            index_image = ndwi
-        elif indice == 'EVI':
-            evi = image.expression(
-                '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))',
-                {'NIR': image.select(nir_band), 'RED': image.select(red_band), 'BLUE': image.select(blue_band)}
-            ).rename('EVI')
-            index_image = evi
-        elif indice == 'SAVI':
-            savi = image.expression(
-                '((NIR - RED) / (NIR + RED + 0.5)) * (1.5)',
-                {'NIR': image.select(nir_band), 'RED': image.select(red_band)}
-            ).rename('SAVI')
-            index_image = savi
-        elif indice == 'MSAVI':
-            msavi = image.expression(
-                '(2 * NIR + 1 - sqrt(pow((2 * NIR + 1), 2) - 8 * (NIR - RED))) / 2',
-                {'NIR': image.select(nir_band), 'RED': image.select(red_band)}
-            ).rename('MSAVI')
-            index_image = msavi
-        else:
-            ndvi = image.normalizedDifference([nir_band, red_band]).rename('NDVI')
-            index_image = ndvi
-            indice = 'NDVI'
-        
-        stats = index_image.reduceRegion(
-            reducer=ee.Reducer.mean().combine(
-                reducer2=ee.Reducer.minMax(),
-                sharedInputs=True
-            ).combine(
-                reducer2=ee.Reducer.stdDev(),
-                sharedInputs=True
-            ),
-            geometry=geometry,
-            scale=30,
-            bestEffort=True
-        )
-        
-        stats_dict = stats.getInfo()
-        if not stats_dict:
-            st.warning("⚠️ No se pudieron obtener estadísticas de la imagen")
-            return None
-        
-        valor_promedio = stats_dict.get(f'{indice}_mean', 0)
-        valor_min = stats_dict.get(f'{indice}_min', 0)
-        valor_max = stats_dict.get(f'{indice}_max', 0)
-        valor_std = stats_dict.get(f'{indice}_stdDev', 0)
-        
-        fecha_imagen_ee = image.get('system:time_start')
-        fecha_imagen = fecha_imagen_ee.getInfo() if fecha_imagen_ee else None
-        if fecha_imagen:
-            fecha_imagen = datetime.fromtimestamp(fecha_imagen / 1000).strftime('%Y-%m-%d')
-        
-        if 'LC08' in dataset:
-            nombre_satelite = 'Landsat 8'
-        elif 'LC09' in dataset:
-            nombre_satelite = 'Landsat 9'
+def mostrar_corridas_guardadas():
+    almacen = obtener_almacen_corridas()
+    corridas = almacen.listar(clave_propietario())
+    with st.expander(f"📚 Corridas guardadas ({len(corridas)})"):
+        if corridas.empty:
+            st.caption("Cada análisis completo se guarda al terminar; acá se pueden volver a abrir y comparar.")
+            return
+        st.dataframe(corridas[[c for c in ['creada', 'nombre', 'cultivo', 'n_divisiones', 'satelite', 'area_ha',
+                                           'npk_promedio', 'costo_total_usd', 'rendimiento_con_fert_kg_ha']
+                               if c in corridas.columns]].round(2),
+                     use_container_width=True, hide_index=True)
+        etiquetas = {fila.id: f"{fila.creada} · {fila.nombre or 'sin nombre'} · {fila.cultivo}"
+                     for fila in corridas.itertuples()}
+        col1, col2, col3 = st.columns([3, 1, 1])
+        with col1:
+            id_corrida = st.selectbox("Corrida", list(etiquetas), format_func=etiquetas.get, key="corrida_elegida")
+        with col2:
+            if st.button("📂 Abrir", use_container_width=True):
+                st.session_state.resultados_todos = cargar_corrida(id_corrida)
+                st.session_state.analisis_completado = True
+                st.session_state.cultivo_pendiente = st.session_state.resultados_todos['parametros'].get('cultivo')
+                st.rerun()
+        with col3:
+            if st.button("🗑️ Eliminar", use_container_width=True):
+                almacen.eliminar(id_corrida)
+                cargar_corrida.clear()
+                st.rerun()
+
+        comparar = st.multiselect("Comparar dos corridas", list(etiquetas), format_func=etiquetas.get,
+                                  max_selections=2, key="corridas_comparar")
+        if len(comparar) == 2:
+            st.dataframe(comparar_corridas(almacen, *comparar).astype(str), use_container_width=True)
+            for columna, id_comparada in zip(st.columns(2), comparar):
+                gdf_corrida = cargar_corrida(id_comparada)['gdf_completo']
+                with columna:
+                    fig, ax = plt.subplots(figsize=(5, 5))
+                    gdf_corrida.plot(column='fert_npk_actual', cmap='RdYlGn', vmin=0, vmax=1, legend=True,
+                                     edgecolor='black', linewidth=0.3, ax=ax)
+                    ax.set_title(f"Índice NPK · {etiquetas[id_comparada]}", fontsize=9)
+                    ax.set_axis_off()
+                    st.pyplot(fig)
+                    plt.close(fig)
+
+# ===== COLA DE TRABAJOS EN SEGUNDO PLANO =====
+@st.cache_resource
+def obtener_cola_trabajos():
+    """Cola SQLite del host; los workers son procesos hijos de este servidor."""
+    return ColaTrabajos()
+
+@st.fragment(run_every=1.0)
+def panel_trabajo_analisis():
+    """Consulta el avance del análisis encolado por esta sesión y muestra las etapas ya terminadas."""
+    id_trabajo = st.session_state.get('trabajo_analisis')
+    if not id_trabajo:
+        return
+    cola = obtener_cola_trabajos()
+    cola.iniciar_workers()
+    estado = cola.estado(id_trabajo)
+    if estado is None:
+        del st.session_state.trabajo_analisis
+        return
+    if estado['estado'] == TERMINADO:
+        st.session_state.resultados_todos = guardar_corrida(cola.resultado(id_trabajo),
+                                                            st.session_state.pop('nombre_trabajo', ''))
+        st.session_state.analisis_completado = True
+        del st.session_state.trabajo_analisis
+        st.rerun()
+    if estado['estado'] in (FALLIDO, CANCELADO):
+        if estado['estado'] == FALLIDO:
+            st.error(f"❌ Error en el análisis completo: {estado['error']}")
         else:
-            nombre_satelite = 'Landsat'
-        
-        cloud_cover_ee = image.get('CLOUD_COVER')
-        cloud_cover = cloud_cover_ee.getInfo() if cloud_cover_ee else 'N/A'
-        
-        return {
-            'indice': indice,
-            'valor_promedio': valor_promedio,
-            'valor_min': valor_min,
-            'valor_max': valor_max,
-            'valor_std': valor_std,
-            'fuente': f'{nombre_satelite} (Google Earth Engine)',
-            'fecha_descarga': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'fecha_imagen': fecha_imagen,
-            'resolucion': '30m',
-            'estado': 'exitosa',
-            'cobertura_nubes': f"{cloud_cover}%" if cloud_cover != 'N/A' else 'N/A'
-        }
-        
-    except Exception as e:
-        st.error(f"❌ Error obteniendo datos de Landsat desde GEE: {str(e)}")
-        return None
+            st.warning("⏹️ Análisis cancelado")
+        if st.button("Cerrar", key="cerrar_trabajo"):
+            del st.session_state.trabajo_analisis
+            st.rerun()
+        return
 
-def descargar_datos_satelitales_gee(gdf, fecha_inicio, fecha_fin, satelite, indice='NDVI'):
-    if satelite == 'SENTINEL-2_GEE':
-        return obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice)
-    elif satelite == 'LANDSAT-8_GEE':
-        return obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, 'LANDSAT/LC08/C02/T1_L2', indice)
-    elif satelite == 'LANDSAT-9_GEE':
-        return obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, 'LANDSAT/LC09/C02/T1_L2', indice)
+    st.subheader("⚙️ Análisis en curso")
+    if estado['estado'] == PENDIENTE:
+        st.info(f"⏳ En cola (posición {estado['posicion']}); se ejecutan hasta {cola.max_trabajos} análisis a la vez")
     else:
-        return None
+        etapa = f"{estado['etapa']}: " if estado['etapa'] else ''
+        st.progress(estado['fraccion'], text=f"{etapa}{estado['mensaje'] or ''} · {time.time() - estado['iniciado']:.0f} s")
+    for evento in cola.eventos(id_trabajo, ('advertencia', 'error')).itertuples():
+        (st.error if evento.nivel == 'error' else st.warning)(evento.mensaje)
 
-# ===== FUNCIÓN PARA OBTENER DATOS DE NASA POWER =====
-def obtener_datos_nasa_power(gdf, fecha_inicio, fecha_fin):
-    try:
-        centroid = gdf.geometry.unary_union.centroid
-        lat = round(centroid.y, 4)
-        lon = round(centroid.x, 4)
-        start = fecha_inicio.strftime("%Y%m%d")
-        end = fecha_fin.strftime("%Y%m%d")
-        params = {
-            'parameters': 'ALLSKY_SFC_SW_DWN,WS2M,T2M,PRECTOTCORR',
-            'community': 'RE',
-            'longitude': lon,
-            'latitude': lat,
-            'start': start,
-            'end': end,
-            'format': 'JSON'
+    etapas = cola.etapas_completadas(id_trabajo)
+    if len(etapas):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Etapas", f"{len(etapas)}/{estado['total_etapas'] or len(ETAPAS_ANALISIS)}")
+        if 'superficie' in set(etapas['etapa']):
+            col2.metric("Superficie", f"{cola.resultado_parcial(id_trabajo, 'superficie'):.1f} ha")
+        if 'zonas' in set(etapas['etapa']):
+            col3.metric("Zonas", len(cola.resultado_parcial(id_trabajo, 'zonas')))
+        if 'fertilidad' in set(etapas['etapa']):
+            fertilidad = cola.resultado_parcial(id_trabajo, 'fertilidad')
+            st.caption("Fertilidad actual (promedio de las zonas, resultado parcial)")
+            st.dataframe(fertilidad.mean().round(3).to_frame('promedio').T, use_container_width=True)
+    if st.button("⏹️ Cancelar análisis", key="cancelar_trabajo"):
+        cola.cancelar(id_trabajo)
+
+# ===== ANÁLISIS POR LOTES (MULTI-LOTE) =====
+def ejecutar_analisis_lotes(gdf_lotes, cultivo, n_divisiones, satelite, fecha_inicio, fecha_fin,
+                            indice='NDVI', resolucion_dem=10.0, max_procesos=MAX_PROCESOS_LOTES):
+    """
+    Analiza cada polígono como un lote independiente. Las descargas externas
+    (GEE, NASA POWER, DEM) se hacen una sola vez por grupo de lotes cercanos y
+    las etapas agronómicas corren en un pool de procesos acotado.
+    """
+    gdf_lotes = agrupar_lotes_por_cercania(gdf_lotes)
+    n_grupos = gdf_lotes['grupo'].nunique()
+    st.info(f"📦 {len(gdf_lotes)} lote(s) agrupados en {n_grupos} descarga(s) compartida(s)")
+
+    envolventes = {grupo: envolvente_grupo(gdf_grupo) for grupo, gdf_grupo in gdf_lotes.groupby('grupo')}
+    clima_por_grupo = obtener_clima_lotes(
+        {grupo: (env.geometry.unary_union.centroid.y, env.geometry.unary_union.centroid.x)
+         for grupo, env in envolventes.items()},
+        fecha_inicio, fecha_fin
+    )
+    datos_por_grupo = {}
+    for grupo, gdf_env in envolventes.items():
+        datos_por_grupo[grupo] = {
+            'datos_satelitales': obtener_datos_satelitales(gdf_env, cultivo, satelite, fecha_inicio, fecha_fin, indice,
+                                                           con_grilla=True),
+            'df_power': clima_por_grupo[grupo],
+            'dem': obtener_grilla_dem(gdf_env, resolucion_dem)
         }
-        url = "https://power.larc.nasa.gov/api/temporal/daily/point"
-        response = requests.get(url, params=params, timeout=15)
-        data = response.json()
-        if 'properties' not in data or 'parameter' not in data['properties']:
-            return None
-        series = data['properties']['parameter']
-        df_power = pd.DataFrame({
-            'fecha': pd.to_datetime(list(series['ALLSKY_SFC_SW_DWN'].keys())),
-            'radiacion_solar': list(series['ALLSKY_SFC_SW_DWN'].values()),
-            'viento_2m': list(series['WS2M'].values()),
-            'temperatura': list(series['T2M'].values()),
-            'precipitacion': list(series['PRECTOTCORR'].values())
-        })
-        df_power = df_power.replace(-999, np.nan).dropna()
-        if df_power.empty:
-            return None
-        return df_power
-    except Exception as e:
-        return None
-
-# ===== FUNCIONES DE ANÁLISIS COMPLETOS =====
-def analizar_fertilidad_actual(gdf_dividido, cultivo, datos_satelitales):
-    n_poligonos = len(gdf_dividido)
-    resultados = []
-    gdf_centroids = gdf_dividido.copy()
-    gdf_centroids['centroid'] = gdf_dividido.geometry.centroid
-    gdf_centroids['x'] = gdf_centroids.centroid.x
-    gdf_centroids['y'] = gdf_centroids.centroid.y
-    x_coords = gdf_centroids['x'].tolist()
-    y_coords = gdf_centroids['y'].tolist()
-    x_min, x_max = min(x_coords), max(x_coords)
-    y_min, y_max = min(y_coords), max(y_coords)
-    params = PARAMETROS_CULTIVOS[cultivo]
-    valor_base_satelital = datos_satelitales.get('valor_promedio', 0.6) if datos_satelitales else 0.6
-    for idx, row in gdf_centroids.iterrows():
-        x_norm = (row['x'] - x_min) / (x_max - x_min) if x_max != x_min else 0.5
-        y_norm = (row['y'] - y_min) / (y_max - y_min) if y_max != y_min else 0.5
-        patron_espacial = (x_norm * 0.6 + y_norm * 0.4)
-        
-        base_mo = params['MATERIA_ORGANICA_OPTIMA'] * 0.7
-        variabilidad_mo = patron_espacial * (params['MATERIA_ORGANICA_OPTIMA'] * 0.6)
-        materia_organica = base_mo + variabilidad_mo + np.random.normal(0, 0.2)
-        materia_organica = max(0.5, min(8.0, materia_organica))
-        
-        base_humedad = params['HUMEDAD_OPTIMA'] * 0.8
-        variabilidad_humedad = patron_espacial * (params['HUMEDAD_OPTIMA'] * 0.4)
-        humedad_suelo = base_humedad + variabilidad_humedad + np.random.normal(0, 0.05)
-        humedad_suelo = max(0.1, min(0.8, humedad_suelo))
-        
-        ndvi_base = valor_base_satelital * 0.8
-        ndvi_variacion = patron_espacial * (valor_base_satelital * 0.4)
-        ndvi = ndvi_base + ndvi_variacion + np.random.normal(0, 0.06)
-        ndvi = max(0.1, min(0.9, ndvi))
-        
-        ndre_base = params['NDRE_OPTIMO'] * 0.7
-        ndre_variacion = patron_espacial * (params['NDRE_OPTIMO'] * 0.4)
-        ndre = ndre_base + ndre_variacion + np.random.normal(0, 0.04)
-        ndre = max(0.05, min(0.7, ndre))
-        
-        ndwi = 0.2 + np.random.normal(0, 0.08)
-        ndwi = max(0, min(1, ndwi))
-        
-        npk_actual = (ndvi * 0.4) + (ndre * 0.3) + ((materia_organica / 8) * 0.2) + (humedad_suelo * 0.1)
-        npk_actual = max(0, min(1, npk_actual))
-        
-        resultados.append({
-            'materia_organica': round(materia_organica, 2),
-            'humedad_suelo': round(humedad_suelo, 3),
-            'ndvi': round(ndvi, 3),
-            'ndre': round(ndre, 3),
-            'ndwi': round(ndwi, 3),
-            'npk_actual': round(npk_actual, 3)
-        })
-
-    return resultados
-
-def analizar_recomendaciones_npk(indices, cultivo):
-    recomendaciones_n = []
-    recomendaciones_p = []
-    recomendaciones_k = []
-    params = PARAMETROS_CULTIVOS[cultivo]
-
-    for idx in indices:
-        ndre = idx['ndre']
-        materia_organica = idx['materia_organica']
-        humedad_suelo = idx['humedad_suelo']
-        ndvi = idx['ndvi']
-        
-        factor_n = ((1 - ndre) * 0.6 + (1 - ndvi) * 0.4)
-        n_recomendado = (factor_n * (params['NITROGENO']['max'] - params['NITROGENO']['min']) + params['NITROGENO']['min'])
-        n_recomendado = max(params['NITROGENO']['min'] * 0.8, min(params['NITROGENO']['max'] * 1.2, n_recomendado))
-        recomendaciones_n.append(round(n_recomendado, 1))
-        
-        factor_p = ((1 - (materia_organica / 8)) * 0.7 + (1 - humedad_suelo) * 0.3)
-        p_recomendado = (factor_p * (params['FOSFORO']['max'] - params['FOSFORO']['min']) + params['FOSFORO']['min'])
-        p_recomendado = max(params['FOSFORO']['min'] * 0.8, min(params['FOSFORO']['max'] * 1.2, p_recomendado))
-        recomendaciones_p.append(round(p_recomendado, 1))
-        
-        factor_k = ((1 - ndre) * 0.4 + (1 - humedad_suelo) * 0.4 + (1 - (materia_organica / 8)) * 0.2)
-        k_recomendado = (factor_k * (params['POTASIO']['max'] - params['POTASIO']['min']) + params['POTASIO']['min'])
-        k_recomendado = max(params['POTASIO']['min'] * 0.8, min(params['POTASIO']['max'] * 1.2, k_recomendado))
-        recomendaciones_k.append(round(k_recomendado, 1))
-
-    return recomendaciones_n, recomendaciones_p, recomendaciones_k
-
-def analizar_costos(gdf_dividido, cultivo, recomendaciones_n, recomendaciones_p, recomendaciones_k):
-    costos = []
-    params = PARAMETROS_CULTIVOS[cultivo]
-    precio_n = 1.2
-    precio_p = 2.5
-    precio_k = 1.8
-
-    for i in range(len(gdf_dividido)):
-        costo_n = recomendaciones_n[i] * precio_n
-        costo_p = recomendaciones_p[i] * precio_p
-        costo_k = recomendaciones_k[i] * precio_k
-        costo_total = costo_n + costo_p + costo_k + params['COSTO_FERTILIZACION']
-        
-        costos.append({
-            'costo_nitrogeno': round(costo_n, 2),
-            'costo_fosforo': round(costo_p, 2),
-            'costo_potasio': round(costo_k, 2),
-            'costo_total': round(costo_total, 2)
-        })
 
-    return costos
+    tareas = preparar_tareas(gdf_lotes, cultivo, n_divisiones, datos_por_grupo)
+    barra = st.progress(0.0, text="Analizando lotes...")
+    def al_avanzar(completados, total):
+        barra.progress(completados / total, text=f"Analizando lotes... {completados}/{total}")
+    resultados_lotes = ejecutar_lotes_en_paralelo(tareas, max_procesos, al_avanzar)
+    barra.empty()
+
+    fallidos = [r for r in resultados_lotes if not r['exitoso']]
+    for r in fallidos:
+        st.warning(f"⚠️ Lote {r['nombre_lote']}: {r['error']}")
+    return {
+        'exitoso': len(fallidos) < len(resultados_lotes),
+        'gdf_lotes': gdf_lotes,
+        'lotes': resultados_lotes,
+        'datos_por_grupo': datos_por_grupo,
+        'resumen': resumen_establecimiento(resultados_lotes)
+    }
 
-def analizar_proyecciones_cosecha(gdf_dividido, cultivo, indices):
-    proyecciones = []
-    params = PARAMETROS_CULTIVOS[cultivo]
-    for idx in indices:
-        npk_actual = idx['npk_actual']
-        ndvi = idx['ndvi']
-        
-        rendimiento_base = params['RENDIMIENTO_OPTIMO'] * npk_actual * 0.7
-        incremento = (1 - npk_actual) * 0.4 + (1 - ndvi) * 0.2
-        rendimiento_con_fert = rendimiento_base * (1 + incremento)
-        
-        proyecciones.append({
-            'rendimiento_sin_fert': round(rendimiento_base, 0),
-            'rendimiento_con_fert': round(rendimiento_con_fert, 0),
-            'incremento_esperado': round(incremento * 100, 1)
+def resultados_de_lote(resultados_lotes, id_lote):
+    """Arma un dict compatible con `resultados_todos` para ver un lote en las pestañas de detalle."""
+    lote = next(r for r in resultados_lotes['lotes'] if r['id_lote'] == id_lote)
+    compartido = resultados_lotes['datos_por_grupo'].get(lote['grupo'], {})
+    gdf_completo = lote['gdf_completo']
+    dem_data = recortar_grilla_dem(compartido.get('dem'), gdf_completo.total_bounds)
+    if dem_data is not None:
+        dem_data.update({
+            'bounds': [np.nanmin(dem_data['X']), np.nanmin(dem_data['Y']),
+                       np.nanmax(dem_data['X']), np.nanmax(dem_data['Y'])],
+            'curvas_nivel': [], 'elevaciones': [], 'curvas_con_elevacion': []
         })
-
-    return proyecciones
-
-def clasificar_textura_suelo(arena, limo, arcilla):
-    try:
-        total = arena + limo + arcilla
-        if total == 0:
-            return "NO_DETERMINADA"
-        arena_norm = (arena / total) * 100
-        limo_norm = (limo / total) * 100
-        arcilla_norm = (arcilla / total) * 100
-        if arcilla_norm >= 35:
-            return "Franco arcilloso"
-        elif arcilla_norm >= 25 and arcilla_norm <= 35 and arena_norm >= 20 and arena_norm <= 45:
-            return "Franco arcilloso"
-        elif arena_norm >= 55 and arena_norm <= 70 and arcilla_norm >= 10 and arcilla_norm <= 20:
-            return "Franco arenoso"
-        elif arena_norm >= 40 and arena_norm <= 55 and arcilla_norm >= 20 and arcilla_norm <= 30:
-            return "Franco"
-        else:
-            return "Franco"
-    except Exception as e:
-        return "NO_DETERMINADA"
-
-def analizar_textura_suelo(gdf_dividido, cultivo):
-    gdf_dividido = validar_y_corregir_crs(gdf_dividido)
-    params_textura = TEXTURA_SUELO_OPTIMA[cultivo]
-    gdf_dividido['area_ha'] = 0.0
-    gdf_dividido['arena'] = 0.0
-    gdf_dividido['limo'] = 0.0
-    gdf_dividido['arcilla'] = 0.0
-    gdf_dividido['textura_suelo'] = "NO_DETERMINADA"
-
-    for idx, row in gdf_dividido.iterrows():
-        try:
-            area_gdf = gpd.GeoDataFrame({'geometry': [row.geometry]}, crs=gdf_dividido.crs)
-            area_ha = calcular_superficie(area_gdf)
-            if hasattr(area_ha, 'iloc'):
-                area_ha = float(area_ha.iloc[0])
-            elif hasattr(area_ha, '__len__') and len(area_ha) > 0:
-                area_ha = float(area_ha[0])
-            else:
-                area_ha = float(area_ha)
-            
-            centroid = row.geometry.centroid if hasattr(row.geometry, 'centroid') else row.geometry.representative_point()
-            seed_value = abs(hash(f"{centroid.x:.6f}_{centroid.y:.6f}_{cultivo}_textura")) % (2**32)
-            rng = np.random.RandomState(seed_value)
-            
-            lat_norm = (centroid.y + 90) / 180 if centroid.y else 0.5
-            lon_norm = (centroid.x + 180) / 360 if centroid.x else 0.5
-            variabilidad_local = 0.15 + 0.7 * (lat_norm * lon_norm)
-            
-            arena_optima = params_textura['arena_optima']
-            limo_optima = params_textura['limo_optima']
-            arcilla_optima = params_textura['arcilla_optima']
-            
-            arena_val = max(5, min(95, rng.normal(
-                arena_optima * (0.8 + 0.4 * variabilidad_local),
-                arena_optima * 0.15
-            )))
-            limo_val = max(5, min(95, rng.normal(
-                limo_optima * (0.7 + 0.6 * variabilidad_local),
-                limo_optima * 0.2
-            )))
-            arcilla_val = max(5, min(95, rng.normal(
-                arcilla_optima * (0.75 + 0.5 * variabilidad_local),
-                arcilla_optima * 0.15
-            )))
-            
-            total = arena_val + limo_val + arcilla_val
-            arena_pct = (arena_val / total) * 100
-            limo_pct = (limo_val / total) * 100
-            arcilla_pct = (arcilla_val / total) * 100
-            
-            textura = clasificar_textura_suelo(arena_pct, limo_pct, arcilla_pct)
-            
-            gdf_dividido.at[idx, 'area_ha'] = area_ha
-            gdf_dividido.at[idx, 'arena'] = float(arena_pct)
-            gdf_dividido.at[idx, 'limo'] = float(limo_pct)
-            gdf_dividido.at[idx, 'arcilla'] = float(arcilla_pct)
-            gdf_dividido.at[idx, 'textura_suelo'] = textura
-            
-        except Exception as e:
-            gdf_dividido.at[idx, 'area_ha'] = 0.0
-            gdf_dividido.at[idx, 'arena'] = float(params_textura['arena_optima'])
-            gdf_dividido.at[idx, 'limo'] = float(params_textura['limo_optima'])
-            gdf_dividido.at[idx, 'arcilla'] = float(params_textura['arcilla_optima'])
-            gdf_dividido.at[idx, 'textura_suelo'] = params_textura['textura_optima']
-
-    return gdf_dividido
-
-# ===== FUNCIÓN PARA EJECUTAR TODOS LOS ANÁLISIS =====
-def ejecutar_analisis_completo(gdf, cultivo, n_divisiones, satelite, fecha_inicio, fecha_fin,
-                               intervalo_curvas=5.0, resolucion_dem=10.0):
-    resultados = {
-        'exitoso': False,
-        'gdf_dividido': None,
-        'fertilidad_actual': None,
-        'recomendaciones_npk': None,
-        'costos': None,
-        'proyecciones': None,
-        'textura': None,
-        'df_power': None,
-        'area_total': 0,
-        'mapas': {},
-        'dem_data': None,
-        'curvas_nivel': None,
-        'pendientes': None,
-        'datos_satelitales': None
+    return {
+        'exitoso': True,
+        'gdf_dividido': gdf_completo,
+        'gdf_completo': gdf_completo,
+        'area_total': float(gdf_completo['area_ha'].sum()),
+        'datos_satelitales': recortar_datos_satelitales(compartido.get('datos_satelitales'),
+                                                        gdf_completo.geometry.unary_union),
+        'df_power': compartido.get('df_power'),
+        'dem_data': dem_data,
+        'mapas': {}
     }
 
-    try:
-        gdf = validar_y_corregir_crs(gdf)
-        area_total = calcular_superficie(gdf)
-        resultados['area_total'] = area_total
-        
-        datos_satelitales = None
-        if satelite in ['SENTINEL-2_GEE', 'LANDSAT-8_GEE', 'LANDSAT-9_GEE']:
-            datos_satelitales = descargar_datos_satelitales_gee(gdf, fecha_inicio, fecha_fin, satelite, indice_seleccionado)
-            if datos_satelitales is None:
-                st.warning("⚠️ No se pudieron obtener datos de GEE. Usando datos simulados.")
-                datos_satelitales = generar_datos_simulados(gdf, cultivo, indice_seleccionado)
-        elif satelite == "SENTINEL-2":
-            datos_satelitales = descargar_datos_sentinel2(gdf, fecha_inicio, fecha_fin, indice_seleccionado)
-        elif satelite == "LANDSAT-8":
-            datos_satelitales = descargar_datos_landsat8(gdf, fecha_inicio, fecha_fin, indice_seleccionado)
-        else:
-            datos_satelitales = generar_datos_simulados(gdf, cultivo, indice_seleccionado)
-        
-        resultados['datos_satelitales'] = datos_satelitales
-        
-        df_power = obtener_datos_nasa_power(gdf, fecha_inicio, fecha_fin)
-        resultados['df_power'] = df_power
-        
-        gdf_dividido = dividir_parcela_en_zonas(gdf, n_divisiones)
-        resultados['gdf_dividido'] = gdf_dividido
-        
-        areas_ha_list = []
-        for idx, row in gdf_dividido.iterrows():
-            area_gdf = gpd.GeoDataFrame({'geometry': [row.geometry]}, crs=gdf_dividido.crs)
-            area_ha = calcular_superficie(area_gdf)
-            if hasattr(area_ha, 'iloc'):
-                area_ha = float(area_ha.iloc[0])
-            elif hasattr(area_ha, '__len__') and len(area_ha) > 0:
-                area_ha = float(area_ha[0])
-            else:
-                area_ha = float(area_ha)
-            areas_ha_list.append(area_ha)
-        
-        gdf_dividido['area_ha'] = areas_ha_list
-        
-        fertilidad_actual = analizar_fertilidad_actual(gdf_dividido, cultivo, datos_satelitales)
-        resultados['fertilidad_actual'] = fertilidad_actual
-        
-        rec_n, rec_p, rec_k = analizar_recomendaciones_npk(fertilidad_actual, cultivo)
-        resultados['recomendaciones_npk'] = {'N': rec_n, 'P': rec_p, 'K': rec_k}
-        
-        costos = analizar_costos(gdf_dividido, cultivo, rec_n, rec_p, rec_k)
-        resultados['costos'] = costos
-        
-        proyecciones = analizar_proyecciones_cosecha(gdf_dividido, cultivo, fertilidad_actual)
-        resultados['proyecciones'] = proyecciones
-        
-        textura = analizar_textura_suelo(gdf_dividido, cultivo)
-        resultados['textura'] = textura
-
-        # ----- 6. Análisis DEM y curvas de nivel (PRIORIDAD: REAL > OPENTOPODATA > SINTÉTICO) -----
-        try:
-            api_key = os.environ.get("OPENTOPOGRAPHY_API_KEY", None)
-            dem_array, dem_meta, dem_transform = obtener_dem_opentopography(gdf, api_key)
-
-            # Si falla OpenTopography, intentar con Open Topo Data API
-            if dem_array is None:
-                st.info("ℹ️ Intentando con fuente alternativa: Open Topo Data API (srtm30m)")
-                dem_array, dem_meta, dem_transform = obtener_dem_opentopodata_api(gdf, dataset="srtm30m")
-
-            dem_data = {
-                'X': None, 'Y': None, 'Z': None,
-                'bounds': None,
-                'curvas_nivel': [], 'elevaciones': [],
-                'curvas_con_elevacion': [], 'pendientes': None,
-                'fuente': 'No disponible'
-            }
-
-            if dem_array is not None and not (isinstance(dem_array, np.ma.MaskedArray) and dem_array.mask.all()):
-                # Determinar la fuente real
-                if dem_transform is not None:
-                    # Caso OpenTopography (con transform)
-                    st.info("✅ Usando DEM real SRTM 30m (OpenTopography)")
-                    dem_data['fuente'] = 'SRTM 30m'
-
-                    height, width = dem_array.shape
-                    cols = np.arange(width)
-                    rows = np.arange(height)
-                    X_grid, Y_grid = np.meshgrid(cols, rows)
-                    X_geo = dem_transform[2] + dem_transform[0] * X_grid + dem_transform[1] * Y_grid
-                    Y_geo = dem_transform[5] + dem_transform[3] * X_grid + dem_transform[4] * Y_grid
-
-                    # Convertir a float antes de rellenar con NaN
-                    if isinstance(dem_array, np.ma.MaskedArray):
-                        Z = dem_array.astype(float).filled(np.nan)
-                    else:
-                        Z = dem_array.astype(float)
-                        Z[Z <= -32768] = np.nan
-
-                    dem_data.update({
-                        'X': X_geo, 'Y': Y_geo, 'Z': Z,
-                        'bounds': gdf.total_bounds
-                    })
-
-                    if CURVAS_OK:
-                        polygon_union = gdf.geometry.unary_union
-                        curvas_con_elev = generar_curvas_nivel_reales(dem_array, dem_transform, intervalo_curvas, polygon=polygon_union)
-                        if curvas_con_elev:
-                            dem_data['curvas_con_elevacion'] = curvas_con_elev
-                            dem_data['curvas_nivel'] = [line for line, _ in curvas_con_elev]
-                            dem_data['elevaciones'] = [e for _, e in curvas_con_elev]
-                            st.success(f"✅ Generadas {len(curvas_con_elev)} curvas de nivel reales.")
-
-                else:
-                    # Caso Open Topo Data (sin transform, tenemos X, Y, Z en la máscara)
-                    st.info("✅ Usando DEM de Open Topo Data")
-                    dem_data['fuente'] = 'Open Topo Data'
-                    
-                    # Extraer X, Y, Z desde el array enmascarado
-                    # Para Open Topo Data, hemos guardado X, Y en el array? No, necesitamos reconstruirlos.
-                    # Vamos a reconstruir la malla a partir de los bounds y la forma del array.
-                    height, width = dem_array.shape
-                    bounds = gdf.total_bounds
-                    minx, miny, maxx, maxy = bounds
-                    x_vals = np.linspace(minx, maxx, width)
-                    y_vals = np.linspace(miny, maxy, height)
-                    X_geo, Y_geo = np.meshgrid(x_vals, y_vals)
-
-                    if isinstance(dem_array, np.ma.MaskedArray):
-                        Z = dem_array.astype(float).filled(np.nan)
-                    else:
-                        Z = dem_array.astype(float)
-
-                    dem_data.update({
-                        'X': X_geo, 'Y': Y_geo, 'Z': Z,
-                        'bounds': bounds
-                    })
-
-                    if CURVAS_OK:
-                        # Reutilizar la función de curvas sintéticas pero con nuestros datos reales
-                        # Como ya tenemos X,Y,Z podemos usar una función genérica que extraiga contornos
-                        # Por simplicidad, usamos generar_curvas_nivel_simuladas pero adaptada
-                        # Para no duplicar código, podemos modificar generar_curvas_nivel_simuladas para aceptar X,Y,Z opcionales.
-                        # Sin embargo, para mantener el código manejable, usaremos una versión simplificada aquí.
-                        # Llamamos a generar_curvas_nivel_simuladas con el gdf, pero eso generaría un nuevo DEM sintético.
-                        # Mejor implementamos una función auxiliar que extraiga contornos de (X,Y,Z).
-                        curvas_con_elev = extraer_curvas_de_grid(X_geo, Y_geo, Z, intervalo_curvas, gdf.geometry.unary_union)
-                        if curvas_con_elev:
-                            dem_data['curvas_con_elevacion'] = curvas_con_elev
-                            dem_data['curvas_nivel'] = [line for line, _ in curvas_con_elev]
-                            dem_data['elevaciones'] = [e for _, e in curvas_con_elev]
-                            st.success(f"✅ Generadas {len(curvas_con_elev)} curvas de nivel desde Open Topo Data.")
-
-            else:
-                st.info("ℹ️ Usando DEM sintético (fuentes externas no disponibles)")
-                dem_data['fuente'] = 'Sintético'
-                X, Y, Z, bounds = generar_dem_sintetico_fallback(gdf, resolucion_dem)
-                dem_data.update({'X': X, 'Y': Y, 'Z': Z, 'bounds': bounds})
-
-                if CURVAS_OK:
-                    curvas_con_elev = generar_curvas_nivel_simuladas(gdf, intervalo_curvas)
-                    if curvas_con_elev:
-                        dem_data['curvas_con_elevacion'] = curvas_con_elev
-                        dem_data['curvas_nivel'] = [line for line, _ in curvas_con_elev]
-                        dem_data['elevaciones'] = [e for _, e in curvas_con_elev]
-
-            # Calcular pendientes (si hay datos válidos)
-            if dem_data['Z'] is not None and not np.all(np.isnan(dem_data['Z'])):
-                Z_grid = dem_data['Z'].astype(float)
-                mask_valid = ~np.isnan(Z_grid)
-
-                if np.any(mask_valid):
-                    # Obtener resolución espacial en grados
-                    if dem_data['fuente'] == 'SRTM 30m' and dem_transform is not None:
-                        res_x_deg = abs(dem_transform[0])
-                        res_y_deg = abs(dem_transform[4])
-                        lat_media = np.nanmean(dem_data['Y'][mask_valid])
-                        res_x_m = res_x_deg * 111320 * np.cos(np.radians(lat_media))
-                        res_y_m = res_y_deg * 111320
-                    else:
-                        # Para Open Topo Data o sintético, calcular desde la malla
-                        X = dem_data['X']
-                        Y = dem_data['Y']
-                        dx_deg = X[0,1] - X[0,0]
-                        dy_deg = Y[1,0] - Y[0,0]
-                        lat_media = np.nanmean(Y[mask_valid])
-                        res_x_m = abs(dx_deg) * 111320 * np.cos(np.radians(lat_media))
-                        res_y_m = abs(dy_deg) * 111320
-
-                    dy = np.gradient(Z_grid, axis=0) / res_y_m
-                    dx = np.gradient(Z_grid, axis=1) / res_x_m
-                    pendientes = np.sqrt(dx**2 + dy**2) * 100
-                    pendientes[~mask_valid] = np.nan
-                    dem_data['pendientes'] = pendientes
-                else:
-                    dem_data['pendientes'] = None
-
-            resultados['dem_data'] = dem_data
-
-        except Exception as e:
-            st.error(f"❌ Error crítico en análisis DEM: {str(e)[:100]}")
-            resultados['dem_data'] = None
-
-        # ===== COMBINAR TODOS LOS RESULTADOS EN UN SOLO GeoDataFrame =====
-        gdf_completo = gdf_dividido.copy()
-        # Fertilidad
-        for i, f in enumerate(fertilidad_actual):
-            gdf_completo.loc[i, 'fert_npk_actual'] = f['npk_actual']
-            gdf_completo.loc[i, 'fert_ndvi'] = f['ndvi']
-            gdf_completo.loc[i, 'fert_ndre'] = f['ndre']
-            gdf_completo.loc[i, 'fert_ndwi'] = f['ndwi']
-            gdf_completo.loc[i, 'fert_materia_organica'] = f['materia_organica']
-            gdf_completo.loc[i, 'fert_humedad_suelo'] = f['humedad_suelo']
-        # Recomendaciones
-        gdf_completo['rec_N'] = rec_n
-        gdf_completo['rec_P'] = rec_p
-        gdf_completo['rec_K'] = rec_k
-        # Costos
-        for i, c in enumerate(costos):
-            gdf_completo.loc[i, 'costo_costo_nitrogeno'] = c['costo_nitrogeno']
-            gdf_completo.loc[i, 'costo_costo_fosforo'] = c['costo_fosforo']
-            gdf_completo.loc[i, 'costo_costo_potasio'] = c['costo_potasio']
-            gdf_completo.loc[i, 'costo_costo_total'] = c['costo_total']
-        # Proyecciones
-        for i, p in enumerate(proyecciones):
-            gdf_completo.loc[i, 'proy_rendimiento_sin_fert'] = p['rendimiento_sin_fert']
-            gdf_completo.loc[i, 'proy_rendimiento_con_fert'] = p['rendimiento_con_fert']
-            gdf_completo.loc[i, 'proy_incremento_esperado'] = p['incremento_esperado']
-        # Textura (ya está en gdf_dividido, se copia automáticamente)
-        resultados['gdf_completo'] = gdf_completo
-
-        resultados['exitoso'] = True
-        return resultados
-
-    except Exception as e:
-        st.error(f"❌ Error en el análisis completo: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        resultados['exitoso'] = False
-        return resultados
-
-# Función auxiliar para extraer curvas de nivel de una grilla regular (X,Y,Z)
-def extraer_curvas_de_grid(X, Y, Z, intervalo, polygon=None):
-    """
-    Extrae curvas de nivel de una grilla regular definida por X, Y, Z.
-    X, Y son matrices de coordenadas, Z es matriz de elevaciones (con NaN).
-    """
-    if not SKIMAGE_OK:
-        return []
-    from skimage import measure
-
-    Z_filled = np.where(np.isnan(Z), -9999, Z)
-    niveles = np.arange(np.nanmin(Z), np.nanmax(Z) + intervalo, intervalo)
-    if len(niveles) < 2:
-        return []
-
-    ny, nx = Z.shape
-    contours = []
-    for nivel in niveles:
-        try:
-            for contour in measure.find_contours(Z_filled, nivel):
-                coords = []
-                for row, col in contour:
-                    r, c = int(round(row)), int(round(col))
-                    if r < 0 or r >= ny or c < 0 or c >= nx or np.isnan(Z[r, c]):
-                        continue
-                    # Interpolar coordenadas (podría ser más preciso, pero aproximado)
-                    lon = X[r, c]
-                    lat = Y[r, c]
-                    coords.append((lon, lat))
-                if len(coords) >= 3:
-                    line = LineString(coords)
-                    if line.length > 0.01 and (polygon is None or line.intersects(polygon)):
-                        contours.append((line, nivel))
-        except Exception:
-            continue
-    if contours:
-        st.info(f"✅ Generadas {len(contours)} curvas de nivel desde grilla")
-    else:
-        st.warning("⚠️ No se generaron curvas de nivel desde la grilla.")
-    return contours
-
 # ===== FUNCIONES DE VISUALIZACIÓN CON BOTONES DESCARGA =====
 def crear_mapa_fertilidad(gdf_completo, cultivo, satelite):
     try:
@@ -3525,16 +2217,9 @@ def crear_mapa_texturas(gdf_completo, cultivo):
     try:
         gdf_plot = gdf_completo.to_crs(epsg=3857)
         fig, ax = plt.subplots(1, 1, figsize=(12, 8))
-        colores_textura = {
-            'Franco': '#c7eae5',
-            'Franco arcilloso': '#5ab4ac',
-            'Franco arenoso': '#f6e8c3',
-            'NO_DETERMINADA': '#999999'
-        }
-        
         for idx, row in gdf_plot.iterrows():
             textura = row['textura_suelo']
-            color = colores_textura.get(textura, '#999999')
+            color = COLORES_TEXTURA.get(textura, '#999999')
             
             gdf_plot.iloc[[idx]].plot(ax=ax, color=color, edgecolor='black', linewidth=1.5, alpha=0.8)
             
@@ -3557,7 +2242,8 @@ def crear_mapa_texturas(gdf_completo, cultivo):
         
         from matplotlib.patches import Patch
         legend_elements = [Patch(facecolor=color, edgecolor='black', label=textura)
-                           for textura, color in colores_textura.items()]
+                           for textura, color in COLORES_TEXTURA.items()
+                           if textura in set(gdf_completo['textura_suelo'])]
         ax.legend(handles=legend_elements, title='Texturas', loc='upper left', bbox_to_anchor=(1.05, 1))
         
         plt.tight_layout()
@@ -3606,8 +2292,8 @@ def crear_grafico_composicion_textura(arena_prom, limo_prom, arcilla_prom, textu
         ax1.pie(composicion, labels=labels, colors=colors_pie, autopct='%1.1f%%', startangle=90)
         ax1.set_title('Composición Promedio del Suelo')
         
-        ax2.bar(textura_dist.index, textura_dist.values, 
-               color=[PALETAS_GEE['TEXTURA'][i % len(PALETAS_GEE['TEXTURA'])] for i in range(len(textura_dist))])
+        ax2.bar(textura_dist.index, textura_dist.values,
+               color=[COLORES_TEXTURA.get(t, '#999999') for t in textura_dist.index])
         ax2.set_title('Distribución de Texturas')
         ax2.set_xlabel('Textura')
         ax2.set_ylabel('Número de Zonas')
@@ -3688,7 +2374,7 @@ def crear_grafico_proyecciones_rendimiento(zonas, sin_fert, con_fert):
 # ===== FUNCIONES DE EXPORTACIÓN =====
 def exportar_a_geojson(gdf, nombre_base="parcela"):
     try:
-        gdf = validar_y_corregir_crs(gdf)
+        gdf = columnas_float64(validar_y_corregir_crs(gdf))
         geojson_data = gdf.to_json()
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         nombre_archivo = f"{nombre_base}_{timestamp}.geojson"
@@ -3983,7 +2669,25 @@ def generar_reporte_con_ia(resultados, cultivo, satelite, fecha_inicio, fecha_fi
 
         # Análisis de riesgo hídrico
         doc.add_heading('4.2 Análisis de Riesgo de Encharcamiento/Déficit Hídrico', level=2)
-        analisis_agua = generar_analisis_riesgo_hidrico(df_resumen, stats, cultivo)
+        agroclima = resultados.get('agroclima')
+        if agroclima:
+            r_clima = agroclima['resumen']
+            filas_clima = [
+                ('Precipitación del período', f"{r_clima['precipitacion_mm']:.0f} mm"),
+                ('ET0 Penman-Monteith / Hargreaves', f"{r_clima['et0_penman_monteith_mm']:.0f} / {r_clima['et0_hargreaves_mm']:.0f} mm"),
+                ('Balance P - ETc', f"{r_clima['balance_mm']:.0f} mm"),
+                ('Agua útil media (zona de raíces)', f"{r_clima['agua_util_mm']:.0f} mm"),
+                ('Déficit hídrico medio', f"{r_clima['deficit_hidrico_mm']:.0f} mm ({r_clima['dias_estres_hidrico']:.0f} días de estrés)"),
+                (f"Grados día (base {r_clima['temperatura_base']:.0f} °C)", f"{r_clima['gdd']:.0f}"),
+                ('Días con estrés por calor / helada', f"{r_clima['dias_calor']} / {r_clima['dias_helada']}"),
+            ]
+            clima_table = doc.add_table(rows=len(filas_clima), cols=2)
+            clima_table.style = 'Table Grid'
+            for i, (indicador, valor) in enumerate(filas_clima):
+                clima_table.cell(i, 0).text = indicador
+                clima_table.cell(i, 1).text = valor
+            doc.add_paragraph()
+        analisis_agua = generar_analisis_riesgo_hidrico(df_resumen, stats, cultivo, agroclima)
         doc.add_paragraph(analisis_agua)
 
         # ===== 5. ANÁLISIS DE COSTOS Y RETORNO DE INVERSIÓN =====
@@ -4108,13 +2812,76 @@ def generar_reporte_con_ia(resultados, cultivo, satelite, fecha_inicio, fecha_fi
 # ===== INTERFAZ PRINCIPAL =====
 st.title("ANALIZADOR MULTI-CULTIVO SATELITAL")
 
-if uploaded_file:
+if uploaded_file and modo_lotes:
+    hash_subida = hash_archivo(uploaded_file)
+    with st.spinner("Cargando lotes..."):
+        gdf_lotes, area_lotes = cargar_parcela_por_hash(
+            hash_subida, uploaded_file.name, tolerancia_simplificacion, True, uploaded_file
+        )
+    if gdf_lotes is not None:
+        registro_lotes.registrar(gdf_lotes, establecimiento=os.path.splitext(uploaded_file.name)[0])
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write("**📦 LOTES DEL ESTABLECIMIENTO:**")
+            st.write(f"- Lotes: {len(gdf_lotes)}")
+            st.write(f"- Área total: {area_lotes:.1f} ha")
+            st.write(f"- Atributos: {', '.join(c for c in gdf_lotes.columns if c != 'geometry')}")
+            png_vista, _, _ = vista_previa_parcela(
+                hash_subida, tolerancia_simplificacion, True, f"Lotes: {uploaded_file.name}",
+                None, cultivo, gdf_lotes, con_tiff=False
+            )
+            st.image(png_vista, use_container_width=True)
+        with col2:
+            st.write("**🎯 CONFIGURACIÓN**")
+            st.write(f"- Cultivo: {ICONOS_CULTIVOS[cultivo]} {cultivo}")
+            st.write(f"- Zonas por lote: {n_divisiones}")
+            st.write(f"- Satélite: {SATELITES_DISPONIBLES[satelite_seleccionado]['nombre']}")
+            st.write(f"- Período: {fecha_inicio} a {fecha_fin}")
+            st.write(f"- Procesos en paralelo: {max_procesos_lotes}")
+
+        if st.button("🚀 EJECUTAR ANÁLISIS POR LOTES", type="primary", use_container_width=True):
+            with st.spinner("Ejecutando análisis por lotes..."):
+                resultados_lotes = ejecutar_analisis_lotes(
+                    gdf_lotes, cultivo, n_divisiones, satelite_seleccionado,
+                    fecha_inicio, fecha_fin, indice_seleccionado, resolucion_dem, max_procesos_lotes
+                )
+            if resultados_lotes['exitoso']:
+                st.session_state.resultados_lotes = resultados_lotes
+                st.session_state.analisis_completado = False
+                st.success("✅ Análisis por lotes completado")
+            else:
+                st.error("❌ No se pudo analizar ningún lote")
+
+    if st.session_state.get('resultados_lotes'):
+        resultados_lotes = st.session_state.resultados_lotes
+        resumen = resultados_lotes['resumen']
+        st.subheader("🏡 RESUMEN DEL ESTABLECIMIENTO")
+        st.dataframe(resumen, use_container_width=True)
+        st.download_button(
+            label="📥 Descargar Resumen CSV",
+            data=resumen.to_csv(index=False).encode('utf-8'),
+            file_name=f"resumen_lotes_{cultivo}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            mime="text/csv"
+        )
+        lotes_ok = [r for r in resultados_lotes['lotes'] if r['exitoso']]
+        opciones_lote = {f"{r['id_lote']} - {r['nombre_lote']}": r['id_lote'] for r in lotes_ok}
+        lote_sel = st.selectbox("Ver detalle del lote:", list(opciones_lote.keys()))
+        if st.button("🔎 Abrir detalle del lote", use_container_width=True):
+            st.session_state.resultados_todos = resultados_de_lote(resultados_lotes, opciones_lote[lote_sel])
+            st.session_state.analisis_completado = True
+            st.rerun()
+
+elif uploaded_file:
     with st.spinner("Cargando parcela..."):
         try:
-            gdf = cargar_archivo_parcela(uploaded_file)
+            hash_subida = hash_archivo(uploaded_file)
+            gdf, area_total = cargar_parcela_por_hash(
+                hash_subida, uploaded_file.name, tolerancia_simplificacion, False, uploaded_file
+            )
             if gdf is not None:
                 st.success(f"✅ Parcela cargada exitosamente: {len(gdf)} polígono(s)")
-                area_total = calcular_superficie(gdf)
+                nombre_parcela = os.path.splitext(uploaded_file.name)[0]
+                registro_lotes.registrar(gdf.assign(nombre_lote=nombre_parcela), establecimiento=nombre_parcela)
                 col1, col2 = st.columns(2)
                 with col1:
                     st.write("**📊 INFORMACIÓN DE LA PARCELA:**")
@@ -4122,18 +2889,18 @@ if uploaded_file:
                     st.write(f"- Área total: {area_total:.1f} ha")
                     st.write(f"- CRS: {gdf.crs}")
                     st.write(f"- Formato: {uploaded_file.name.split('.')[-1].upper()}")
-                    fig, ax = plt.subplots(figsize=(8, 6))
-                    gdf.plot(ax=ax, color='lightgreen', edgecolor='darkgreen', alpha=0.7)
-                    ax.set_title(f"Parcela: {uploaded_file.name}")
-                    ax.set_xlabel("Longitud"); ax.set_ylabel("Latitud"); ax.grid(True, alpha=0.3)
-                    st.pyplot(fig)
-                    buf_vista = io.BytesIO()
-                    plt.savefig(buf_vista, format='png', dpi=150, bbox_inches='tight')
-                    buf_vista.seek(0)
-                    crear_boton_descarga_tiff(
-                        buf_vista, gdf, f"vista_previa_{cultivo}",
-                        "📥 Descargar Vista Previa TIFF", cultivo
+                    png_vista, tiff_vista, nombre_tiff = vista_previa_parcela(
+                        hash_subida, tolerancia_simplificacion, False, f"Parcela: {uploaded_file.name}",
+                        f"vista_previa_{cultivo}", cultivo, gdf
                     )
+                    st.image(png_vista, use_container_width=True)
+                    if tiff_vista:
+                        st.download_button(
+                            label="📥 Descargar Vista Previa TIFF",
+                            data=tiff_vista,
+                            file_name=nombre_tiff,
+                            mime="image/tiff"
+                        )
                 with col2:
                     st.write("**🎯 CONFIGURACIÓN**")
                     st.write(f"- Cultivo: {ICONOS_CULTIVOS[cultivo]} {cultivo}")
@@ -4149,15 +2916,29 @@ if uploaded_file:
                         else:
                             st.error("❌ GEE no autenticado - usando datos simulados")
                 
-                if st.button("🚀 EJECUTAR ANÁLISIS COMPLETO", type="primary", use_container_width=True):
-                    with st.spinner("Ejecutando análisis completo..."):
+                if st.button("🚀 EJECUTAR ANÁLISIS COMPLETO", type="primary", use_container_width=True,
+                             disabled=bool(st.session_state.get('trabajo_analisis'))):
+                    if MAX_TRABAJOS_HOST > 0:
+                        # En un worker de la cola: la sesión sigue respondiendo y panel_trabajo_analisis muestra el avance
+                        st.session_state.nombre_trabajo = os.path.splitext(uploaded_file.name)[0]
+                        st.session_state.trabajo_analisis = obtener_cola_trabajos().encolar(
+                            gdf=gdf, cultivo=cultivo, n_divisiones=n_divisiones,
+                            satelite=satelite_seleccionado, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin,
+                            intervalo_curvas=intervalo_curvas, resolucion_dem=resolucion_dem,
+                            indice=indice_seleccionado, resolucion_prescripcion=resolucion_prescripcion
+                        )
+                        st.rerun()
+                    with st.spinner("Ejecutando análisis completo..."), \
+                            usar_reportador(reportador_streamlit("Ejecutando análisis completo...")):
                         resultados = ejecutar_analisis_completo(
                             gdf, cultivo, n_divisiones, 
                             satelite_seleccionado, fecha_inicio, fecha_fin,
-                            intervalo_curvas, resolucion_dem
+                            intervalo_curvas, resolucion_dem, indice_seleccionado,
+                            cache=obtener_cache_etapas(), resolucion_prescripcion=resolucion_prescripcion
                         )
                         if resultados['exitoso']:
-                            st.session_state.resultados_todos = resultados
+                            st.session_state.resultados_todos = guardar_corrida(
+                                resultados, os.path.splitext(uploaded_file.name)[0])
                             st.session_state.analisis_completado = True
                             st.success("✅ Análisis completado exitosamente!")
                             st.rerun()
@@ -4170,8 +2951,33 @@ if uploaded_file:
             import traceback
             traceback.print_exc()
 
+mostrar_corridas_guardadas()
+panel_trabajo_analisis()
+
 if st.session_state.analisis_completado and 'resultados_todos' in st.session_state:
     resultados = st.session_state.resultados_todos
+    if resultados.get('id_corrida'):
+        st.caption(f"💾 Corrida guardada {resultados['id_corrida']}"
+                   + (f" · {resultados['nombre_corrida']}" if resultados.get('nombre_corrida') else ''))
+
+    if resultados.get('etapas'):
+        etapas = pd.DataFrame(resultados['etapas'])
+        n_cache = int(etapas['cache'].sum())
+        respaldo = etapas['respaldo'].fillna(False).astype(bool) if 'respaldo' in etapas else False
+        with st.expander(f"⏱️ Etapas del análisis: {n_cache}/{len(etapas)} desde caché, "
+                         f"{etapas['segundos'].sum():.2f} s"):
+            st.dataframe(pd.DataFrame({
+                'Etapa': etapas['etapa'],
+                'Origen': np.select([etapas['cache'], respaldo],
+                                    ['♻️ caché', '⚠️ respaldo (sin caché)'], '⚙️ calculada'),
+                'Tiempo (s)': etapas['segundos'].round(3),
+                'Cálculo original (s)': etapas['segundos_calculo'].round(3),
+            }), use_container_width=True, hide_index=True)
+            st.caption("Cada etapa se memoiza por el hash de sus entradas: al cambiar un parámetro "
+                       "sólo se recalculan las etapas que dependen de él.")
+            if MAX_TRABAJOS_HOST == 0 and st.button("🧹 Vaciar caché de etapas"):
+                obtener_cache_etapas().limpiar()
+                st.rerun()
 
     tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
         "📊 Fertilidad Actual",
@@ -4217,6 +3023,25 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
                               'NDRE', 'Materia Org (%)', 'Humedad']
         st.dataframe(tabla_fert)
 
+        with st.expander("🌱 Ranking de cultivos por zona"):
+            st.caption("Evalúa todos los cultivos sobre la fertilidad medida en cada zona, sin re-ejecutar el análisis.")
+            col_r1, col_r2 = st.columns(2)
+            with col_r1:
+                cultivos_ranking = st.multiselect("Cultivos a comparar:", CULTIVOS_TOTALES, default=CULTIVOS_TOTALES)
+            with col_r2:
+                criterio_ranking = st.selectbox("Ordenar por:", list(CRITERIOS_RANKING),
+                                                format_func=CRITERIOS_RANKING.get)
+            if cultivos_ranking:
+                fertilidad_zonas = resultados['gdf_completo'][
+                    ['fert_ndvi', 'fert_ndre', 'fert_materia_organica', 'fert_humedad_suelo', 'fert_npk_actual']
+                ].rename(columns=lambda c: c[len('fert_'):])
+                ranking = ranking_cultivos(fertilidad_zonas, cultivos_ranking, criterio_ranking, top=3)
+                ranking.insert(0, 'Zona', resultados['gdf_completo']['id_zona'].values)
+                st.dataframe(ranking, use_container_width=True)
+                mejor = ranking['cultivo_1'].value_counts()
+                st.write("**Cultivo mejor posicionado (zonas):** " +
+                         ", ".join(f"{ICONOS_CULTIVOS.get(c, '')} {c}: {n}" for c, n in mejor.items()))
+
     with tab2:
         st.subheader("RECOMENDACIONES NPK")
         col1, col2, col3 = st.columns(3)
@@ -4268,6 +3093,71 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
                              'Fósforo (kg/ha)', 'Potasio (kg/ha)']
         st.dataframe(tabla_npk)
 
+        prescripcion = resultados.get('prescripcion')
+        if prescripcion:
+            st.subheader("🧮 PRESCRIPCIÓN POR PÍXEL")
+            zonas_px = prescripcion['zonas']
+            col_px1, col_px2, col_px3, col_px4 = st.columns(4)
+            with col_px1:
+                st.metric("Resolución", f"{prescripcion['resolucion_m']:.0f} m")
+            with col_px2:
+                st.metric("Píxeles", f"{prescripcion['pixeles']:,}")
+            with col_px3:
+                st.metric("Rango de N", f"{np.nanmin(prescripcion['vista_previa']):.0f}–"
+                                       f"{np.nanmax(prescripcion['vista_previa']):.0f} kg/ha")
+            with col_px4:
+                st.metric("Desvío de N dentro de zonas", f"{zonas_px['rec_N_desvio'].mean():.1f} kg/ha")
+            fig_px, ax_px = plt.subplots(figsize=(8, 6))
+            imagen_px = ax_px.imshow(prescripcion['vista_previa'], cmap='RdYlGn_r', interpolation='nearest')
+            fig_px.colorbar(imagen_px, ax=ax_px, label='Dosis N (kg/ha)')
+            ax_px.set_title(f"Dosis de N por píxel - {cultivo} ({prescripcion['crs']})")
+            ax_px.set_axis_off()
+            st.pyplot(fig_px)
+            plt.close(fig_px)
+            if prescripcion.get('archivo') and os.path.exists(prescripcion['archivo']):
+                with open(prescripcion['archivo'], 'rb') as f_tiff:
+                    st.download_button(
+                        label=f"📥 Descargar prescripción GeoTIFF ({', '.join(prescripcion['bandas'])})",
+                        data=f_tiff.read(),
+                        file_name=f"prescripcion_{cultivo}_{prescripcion['resolucion_m']:.0f}m.tif",
+                        mime="image/tiff"
+                    )
+            else:
+                st.info("ℹ️ El GeoTIFF de prescripción necesita rasterio; las tablas por zona ya usan los píxeles.")
+            tabla_px = zonas_px[['rec_N', 'rec_N_desvio', 'rec_P', 'rec_K', 'pixeles']].copy()
+            tabla_px.insert(0, 'Zona', resultados['gdf_completo']['id_zona'].to_numpy())
+            tabla_px.columns = ['Zona', 'N medio (kg/ha)', 'Desvío N (kg/ha)', 'P medio (kg/ha)',
+                                'K medio (kg/ha)', 'Píxeles']
+            st.dataframe(tabla_px, use_container_width=True, hide_index=True)
+
+        with st.expander("💰 Dosis económica óptima de nitrógeno (EONR)"):
+            st.caption("Curva de respuesta a N por zona calibrada con los rendimientos sin/con fertilizar; "
+                       "la dosis óptima iguala el retorno marginal con la relación de precios N/grano.")
+            col_o1, col_o2, col_o3 = st.columns(3)
+            with col_o1:
+                modelo_respuesta = st.selectbox("Modelo de respuesta:", list(MODELOS_RESPUESTA),
+                                                format_func=MODELOS_RESPUESTA.get)
+            with col_o2:
+                precio_n_opt = st.number_input("Precio N (USD/kg) ", 0.01, 20.0, PRECIOS_FERTILIZANTE['N'], 0.05)
+            with col_o3:
+                precio_grano_opt = st.number_input("Precio grano (USD/kg) ", 0.01, 50.0,
+                                                   float(PARAMETROS_CULTIVOS[cultivo]['PRECIO_VENTA']), 0.01)
+            optimo_n = optimizar_dosis_n(resultados['gdf_completo'], cultivo, modelo_respuesta,
+                                         precio_n_opt, precio_grano_opt)
+            area_zonas = resultados['gdf_completo']['area_ha'].to_numpy(dtype=float)
+            col_o4, col_o5, col_o6 = st.columns(3)
+            with col_o4:
+                st.metric("Dosis óptima promedio", f"{np.average(optimo_n['dosis_n_optima'], weights=area_zonas):.1f} kg/ha",
+                          delta=f"{np.average(optimo_n['dosis_n_optima'] - optimo_n['dosis_n_actual'], weights=area_zonas):.1f} kg/ha")
+            with col_o5:
+                st.metric("Relación de precios N/grano", f"{precio_n_opt / precio_grano_opt:.2f}")
+            with col_o6:
+                st.metric("Ganancia vs. dosis actual", f"{(optimo_n['ganancia'] * area_zonas).sum():,.0f} USD")
+            tabla_optimo = optimo_n.copy()
+            tabla_optimo.columns = ['Zona', 'N actual (kg/ha)', 'N óptimo (kg/ha)', 'Rend. esperado (kg/ha)',
+                                    'Beneficio óptimo (USD/ha)', 'Beneficio actual (USD/ha)', 'Ganancia (USD/ha)']
+            st.dataframe(tabla_optimo, use_container_width=True)
+
     with tab3:
         st.subheader("ANÁLISIS DE COSTOS")
         costo_total = resultados['gdf_completo']['costo_costo_total'].sum()
@@ -4302,6 +3192,69 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
                                 'Costo K (USD)', 'Total (USD)']
         st.dataframe(tabla_costos)
 
+        with st.expander("📈 Escenarios de precios (sensibilidad económica)"):
+            gdf_res = resultados['gdf_completo']
+            precio_venta_base = float(PARAMETROS_CULTIVOS[cultivo]['PRECIO_VENTA'])
+            col_e1, col_e2, col_e3, col_e4 = st.columns(4)
+            with col_e1:
+                precio_n_esc = st.number_input("Precio N (USD/kg)", 0.0, 20.0, PRECIOS_FERTILIZANTE['N'], 0.05)
+            with col_e2:
+                precio_p_esc = st.number_input("Precio P (USD/kg)", 0.0, 20.0, PRECIOS_FERTILIZANTE['P'], 0.05)
+            with col_e3:
+                precio_k_esc = st.number_input("Precio K (USD/kg)", 0.0, 20.0, PRECIOS_FERTILIZANTE['K'], 0.05)
+            with col_e4:
+                precio_grano_esc = st.number_input("Precio grano (USD/kg)", 0.0, 50.0, precio_venta_base, 0.01)
+            col_e5, col_e6 = st.columns(2)
+            with col_e5:
+                variacion_esc = st.slider("Variación de precios (±%)", 10, 90, 50, 5)
+            with col_e6:
+                resolucion_esc = st.slider("Resolución de la grilla", 20, 200, 80, 10)
+
+            precios_ref = {'N': precio_n_esc, 'P': precio_p_esc, 'K': precio_k_esc}
+            # Cantidad impar de puntos: el centro de la grilla es exactamente el escenario base
+            multiplicadores = np.linspace(1 - variacion_esc / 100, 1 + variacion_esc / 100, resolucion_esc + 1)
+            precios_grano = precio_grano_esc * multiplicadores
+            costo_fijo = PARAMETROS_CULTIVOS[cultivo]['COSTO_FERTILIZACION']
+            escenarios = evaluar_escenarios(
+                gdf_res['rec_N'], gdf_res['rec_P'], gdf_res['rec_K'],
+                gdf_res['proy_rendimiento_con_fert'], gdf_res['area_ha'], costo_fijo,
+                precios_por_multiplicador(multiplicadores, precios_ref), precios_grano,
+                rendimiento_sin_fert=gdf_res['proy_rendimiento_sin_fert']
+            )
+            centro = len(multiplicadores) // 2
+            col_m1, col_m2, col_m3 = st.columns(3)
+            with col_m1:
+                st.metric("Margen con precios base", f"{escenarios['margen_ha'][centro, centro]:,.0f} USD/ha")
+            with col_m2:
+                st.metric("Precio de equilibrio del grano", f"{escenarios['equilibrio_grano_ha'][centro]:.3f} USD/kg")
+            with col_m3:
+                positivos = (escenarios['margen_ha'] > 0).mean() * 100
+                st.metric("Escenarios con margen positivo", f"{positivos:.0f}%")
+
+            fig_esc, ax_esc = plt.subplots(figsize=(9, 6))
+            extension = [precios_grano[0], precios_grano[-1], multiplicadores[0] * 100, multiplicadores[-1] * 100]
+            imagen = ax_esc.imshow(escenarios['margen_ha'], origin='lower', aspect='auto', extent=extension, cmap='RdYlGn')
+            ax_esc.contour(precios_grano, multiplicadores * 100, escenarios['margen_ha'], levels=[0],
+                           colors='black', linewidths=2)
+            ax_esc.plot(precio_grano_esc, 100, 'k*', markersize=14)
+            ax_esc.set_xlabel("Precio del grano (USD/kg)")
+            ax_esc.set_ylabel("Precio de fertilizantes (% del base)")
+            ax_esc.set_title(f"Margen del establecimiento (USD/ha) - {cultivo}\nlínea negra = equilibrio")
+            fig_esc.colorbar(imagen, ax=ax_esc, label="USD/ha")
+            st.pyplot(fig_esc)
+            plt.close(fig_esc)
+
+            multiplicador_eq = multiplicador_equilibrio_fertilizante(
+                gdf_res['rec_N'], gdf_res['rec_P'], gdf_res['rec_K'],
+                gdf_res['proy_rendimiento_con_fert'], costo_fijo, precio_grano_esc, precios_ref
+            )
+            st.dataframe(pd.DataFrame({
+                'Zona': gdf_res['id_zona'].values,
+                'Equilibrio grano (USD/kg)': np.round(escenarios['equilibrio_grano_zona'][:, centro], 3),
+                'Equilibrio fertilizar vs. no (USD/kg)': np.round(escenarios['equilibrio_fertilizacion_zona'][:, centro], 3),
+                'Suba máx. fertilizantes (%)': np.round((multiplicador_eq - 1) * 100, 1),
+            }), use_container_width=True)
+
     with tab4:
         st.subheader("TEXTURA DEL SUELO")
         textura_pred = resultados['gdf_completo']['textura_suelo'].mode()[0] if len(resultados['gdf_completo']) > 0 else "N/D"
@@ -4374,6 +3327,83 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
         tabla_proy.columns = ['Zona', 'Área (ha)', 'Sin Fertilización (kg)', 'Con Fertilización (kg)', 'Incremento (%)']
         st.dataframe(tabla_proy)
 
+        agroclima = resultados.get('agroclima')
+        if agroclima:
+            st.subheader("🌦️ BALANCE AGROCLIMÁTICO DEL PERÍODO")
+            r_clima = agroclima['resumen']
+            col_c1, col_c2, col_c3, col_c4 = st.columns(4)
+            with col_c1:
+                st.metric(f"Grados día (base {r_clima['temperatura_base']:.0f} °C)", f"{r_clima['gdd']:,.0f}")
+            with col_c2:
+                st.metric("ET0 Penman-Monteith", f"{r_clima['et0_penman_monteith_mm']:,.0f} mm",
+                          delta=f"Hargreaves {r_clima['et0_hargreaves_mm']:,.0f} mm", delta_color="off")
+            with col_c3:
+                st.metric("Precipitación - ETc", f"{r_clima['balance_mm']:,.0f} mm")
+            with col_c4:
+                st.metric("Días con calor / helada", f"{r_clima['dias_calor']} / {r_clima['dias_helada']}")
+            gdf_res = resultados['gdf_completo']
+            if 'proy_rendimiento_limitado_agua' in gdf_res.columns:
+                rend_agua = float(np.average(gdf_res['proy_rendimiento_limitado_agua'], weights=gdf_res['area_ha']))
+                st.metric("Rendimiento con fertilización limitado por agua", f"{rend_agua:,.0f} kg/ha",
+                          delta=f"ETc real / ETc = {r_clima['factor_hidrico']:.2f}", delta_color="off")
+            elif not r_clima.get('ciclo_completo', True):
+                st.caption(f"ℹ️ La ventana ({r_clima['dias']} días) es más corta que el ciclo del cultivo "
+                           f"({r_clima['dias_ciclo']} días): ETc real / ETc = {r_clima['factor_hidrico']:.2f} "
+                           "describe sólo la ventana y no se estima el rendimiento limitado por agua (FAO-33).")
+            diario = agroclima['diario']
+            fig_clima, (ax_gdd, ax_agua) = plt.subplots(2, 1, figsize=(10, 6), sharex=True)
+            ax_gdd.plot(diario['fecha'], diario['gdd_acumulado'], color='#d95f02')
+            ax_gdd.set_ylabel("Grados día acumulados")
+            ax_gdd.grid(True, alpha=0.3)
+            ax_agua.bar(diario['fecha'], diario['precipitacion'], color='#1f78b4', label='Precipitación (mm)')
+            ax_agua.plot(diario['fecha'], diario['etc'], color='#33a02c', label='ETc (mm)')
+            ax_agua.plot(diario['fecha'], diario['agotamiento_medio'], color='#e31a1c', label='Agotamiento medio (mm)')
+            ax_agua.set_ylabel("mm")
+            ax_agua.legend()
+            ax_agua.grid(True, alpha=0.3)
+            st.pyplot(fig_clima)
+            plt.close(fig_clima)
+            if len(agroclima['anual']) > 1:
+                st.dataframe(agroclima['anual'], use_container_width=True, hide_index=True)
+            tabla_agua = agroclima['zonas'][['agua_util_mm', 'dias_estres_hidrico', 'deficit_hidrico_mm',
+                                             'exceso_hidrico_mm', 'factor_hidrico']].copy()
+            tabla_agua.insert(0, 'Zona', gdf_res['id_zona'].to_numpy())
+            tabla_agua.columns = ['Zona', 'Agua útil (mm)', 'Días con estrés', 'Déficit (mm)',
+                                  'Excedente (mm)', 'ETc real / ETc']
+            st.dataframe(tabla_agua, use_container_width=True, hide_index=True)
+
+        with st.expander("🎲 Bandas de incertidumbre P10/P50/P90 (Monte Carlo)"):
+            st.caption("Muestrea el error satelital, de suelo y climático de la campaña; "
+                       "P10 = rendimiento superado en 9 de cada 10 campañas simuladas.")
+            n_muestras_mc = st.select_slider("Muestras:", options=[1000, 2000, 5000, 10000, 20000], value=5000)
+            gdf_res = resultados['gdf_completo']
+            fertilidad_zonas = gdf_res[['fert_ndvi', 'fert_ndre', 'fert_materia_organica', 'fert_humedad_suelo']] \
+                .rename(columns=lambda c: c[len('fert_'):])
+            simulacion = simular_rendimientos(fertilidad_zonas, gdf_res['area_ha'], cultivo, n_muestras=n_muestras_mc)
+            establecimiento = simulacion['establecimiento']
+            col_mc1, col_mc2, col_mc3 = st.columns(3)
+            for col_mc, (_, fila) in zip((col_mc1, col_mc2, col_mc3), establecimiento.iterrows()):
+                with col_mc:
+                    st.metric(f"Producción {fila['cuantil']} (con fert.)", f"{fila['produccion_con_fert_t']:,.1f} t",
+                              delta=f"{fila['produccion_con_fert_t'] - fila['produccion_sin_fert_t']:,.1f} t vs. sin fert.")
+            fig_mc, ax_mc = plt.subplots(figsize=(9, 4))
+            ax_mc.hist(simulacion['produccion_sin_fert'] / 1000, bins=60, alpha=0.6, color='#d8b365', label='Sin fertilización')
+            ax_mc.hist(simulacion['produccion_con_fert'] / 1000, bins=60, alpha=0.6, color='#5ab4ac', label='Con fertilización')
+            for valor in establecimiento['produccion_con_fert_t']:
+                ax_mc.axvline(valor, color='#01665e', linestyle='--', linewidth=1)
+            ax_mc.set_xlabel("Producción total (t)")
+            ax_mc.set_ylabel("Muestras")
+            ax_mc.legend()
+            ax_mc.grid(True, alpha=0.3)
+            st.pyplot(fig_mc)
+            plt.close(fig_mc)
+            tabla_mc = simulacion['zonas'].copy()
+            tabla_mc.insert(0, 'Zona', gdf_res['id_zona'].values)
+            tabla_mc.columns = ['Zona'] + [
+                f"{'Sin' if 'sin' in c else 'Con'} fert. {c[-3:].upper()} (kg/ha)" for c in tabla_mc.columns[1:]
+            ]
+            st.dataframe(tabla_mc, use_container_width=True)
+
     with tab6:
         st.subheader("🎯 POTENCIAL DE COSECHA")
         col1, col2, col3, col4 = st.columns(4)
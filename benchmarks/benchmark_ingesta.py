@@ -0,0 +1,99 @@
+# benchmarks/benchmark_ingesta.py - Tiempo de ingesta por formato para un archivo de 10k polígonos
+#
+# Uso:  python benchmarks/benchmark_ingesta.py [--poligonos 10000] [--repeticiones 3]
+"""Mide el tiempo de ingesta de un archivo de lotes en cada formato vectorial soportado."""
+import os
+import sys
+import time
+import warnings
+import zipfile
+import argparse
+import tempfile
+
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.ingesta import leer_vectorial, ARROW_DISPONIBLE  # noqa: E402
+
+DRIVERS = {
+    '.gpkg': 'GPKG',
+    '.geojson': 'GeoJSON',
+    '.fgb': 'FlatGeobuf',
+}
+
+
+def generar_lotes(n, semilla=42):
+    """Grilla de n polígonos rectangulares (~1 ha) con atributos típicos de un establecimiento."""
+    rng = np.random.default_rng(semilla)
+    lado = int(np.ceil(np.sqrt(n)))
+    paso = 0.001
+    geometrias = [box(-60 + (i % lado) * paso, -34 + (i // lado) * paso,
+                      -60 + (i % lado + 1) * paso, -34 + (i // lado + 1) * paso) for i in range(n)]
+    return gpd.GeoDataFrame({
+        'nombre': [f"Lote {i + 1}" for i in range(n)],
+        'establecimiento': rng.choice(['La Esperanza', 'San José', 'El Ombú'], n),
+        'cultivo': rng.choice(['TRIGO', 'MAIZ', 'SOJA'], n),
+        'campana': rng.integers(2018, 2026, n),
+        'area_declarada': rng.uniform(5, 120, n).round(2),
+    }, geometry=geometrias, crs='EPSG:4326')
+
+
+def escribir_formatos(gdf, directorio):
+    rutas = {}
+    for extension, driver in DRIVERS.items():
+        ruta = os.path.join(directorio, f"lotes{extension}")
+        gdf.to_file(ruta, driver=driver)
+        rutas[extension] = ruta
+    if ARROW_DISPONIBLE:
+        rutas['.parquet'] = os.path.join(directorio, 'lotes.parquet')
+        gdf.to_parquet(rutas['.parquet'])
+    # Referencia: shapefile comprimido, el único formato que aceptaba la app antes
+    ruta_shp = os.path.join(directorio, 'shp', 'lotes.shp')
+    os.makedirs(os.path.dirname(ruta_shp))
+    gdf.to_file(ruta_shp)
+    rutas['.zip'] = os.path.join(directorio, 'lotes.zip')
+    with zipfile.ZipFile(rutas['.zip'], 'w', zipfile.ZIP_DEFLATED) as z:
+        for archivo in os.listdir(os.path.dirname(ruta_shp)):
+            z.write(os.path.join(os.path.dirname(ruta_shp), archivo), archivo)
+    return rutas
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--poligonos', type=int, default=10000)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')  # truncado de nombres de campo al escribir el shapefile
+
+    gdf = generar_lotes(args.poligonos)
+    with tempfile.TemporaryDirectory() as directorio:
+        rutas = escribir_formatos(gdf, directorio)
+        print(f"{args.poligonos:,} polígonos, {len(gdf.columns) - 1} atributos, mejor de {args.repeticiones}\n")
+        print(f"{'Formato':<12}{'Tamaño (MB)':>12}{'Arrow (s)':>12}{'Sin Arrow (s)':>15}{'Filas':>8}{'Cols':>6}")
+        for extension, ruta in rutas.items():
+            tamano = os.path.getsize(ruta) / 1e6
+            if extension == '.zip':
+                t_arrow = np.nan
+                t_fila, res = medir(lambda: gpd.read_file(ruta, engine='pyogrio'), args.repeticiones)
+            elif extension == '.parquet':
+                t_arrow, (res, _) = medir(lambda: leer_vectorial(ruta), args.repeticiones)
+                t_fila = np.nan
+            else:
+                t_arrow, (res, _) = medir(lambda: leer_vectorial(ruta), args.repeticiones)
+                t_fila, _ = medir(lambda: leer_vectorial(ruta, use_arrow=False), args.repeticiones)
+            print(f"{extension:<12}{tamano:>12.2f}{t_arrow:>12.3f}{t_fila:>15.3f}{len(res):>8}{len(res.columns) - 1:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+# modules/agroclima.py - Indicadores agroclimáticos vectorizados sobre df_power: grados día, ET0, balance hídrico y estrés térmico
+import numpy as np
+import pandas as pd
+
+from .cultivos import CLIMA_CULTIVOS, TEXTURA_SUELO_OPTIMA
+
+# Variables de df_power que necesitan los indicadores
+COLUMNAS_AGROCLIMA = ['fecha', 'radiacion_solar', 'viento_2m', 'temperatura', 'precipitacion',
+                      'temperatura_max', 'temperatura_min', 'humedad_relativa']
+# Constantes FAO-56
+CONSTANTE_SOLAR = 0.0820          # MJ m-2 min-1
+STEFAN_BOLTZMANN = 4.903e-9       # MJ K-4 m-2 día-1
+ALBEDO_REFERENCIA = 0.23
+MJ_A_MM = 0.408                   # equivalente de evaporación de 1 MJ/m²
+KWH_A_MJ = 3.6                    # POWER (comunidad RE) entrega la radiación en kWh/m²/día
+MATERIA_ORGANICA_DEFECTO = 2.5    # % si la zona no trae materia orgánica
+
+
+def campanias(fechas, latitud):
+    """
+    Campaña agrícola de cada día: el año calendario en el hemisferio norte y
+    julio-junio en el sur ('2023/24'), para no cortar los cultivos de verano.
+    """
+    fechas = pd.DatetimeIndex(fechas)
+    if latitud >= 0:
+        return fechas.year.astype(str).to_numpy()
+    inicio = np.where(fechas.month >= 7, fechas.year, fechas.year - 1)
+    return np.array([f"{a}/{(a + 1) % 100:02d}" for a in inicio], dtype=object)
+
+
+def _inicios_grupo(grupos):
+    return np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]])
+
+
+def acumulado_por_grupo(valores, grupos):
+    """Suma acumulada de `valores` (días en el eje 0) que vuelve a cero en cada cambio de grupo."""
+    valores = np.asarray(valores, dtype=float)
+    acumulado = np.cumsum(valores, axis=0)
+    previo = acumulado - valores
+    inicio = np.zeros(len(valores), dtype=np.intp)
+    inicio[_inicios_grupo(grupos)] = _inicios_grupo(grupos)
+    return acumulado - previo[np.maximum.accumulate(inicio)]
+
+
+def radiacion_extraterrestre(latitud, dia_juliano):
+    """Ra diaria (MJ/m²/día) por latitud y día del año (FAO-56, ec. 21)."""
+    phi = np.radians(latitud)
+    dr = 1 + 0.033 * np.cos(2 * np.pi * dia_juliano / 365)
+    delta = 0.409 * np.sin(2 * np.pi * dia_juliano / 365 - 1.39)
+    ws = np.arccos(np.clip(-np.tan(phi) * np.tan(delta), -1.0, 1.0))
+    return (24 * 60 / np.pi) * CONSTANTE_SOLAR * dr * (
+        ws * np.sin(phi) * np.sin(delta) + np.cos(phi) * np.cos(delta) * np.sin(ws))
+
+
+def _presion_vapor(temperatura):
+    return 0.6108 * np.exp(17.27 * temperatura / (temperatura + 237.3))
+
+
+def et0_hargreaves(tmax, tmin, tmedia, ra):
+    """ET0 de Hargreaves-Samani (mm/día): sólo temperatura y radiación extraterrestre."""
+    return np.maximum(0.0023 * (tmedia + 17.8) * np.sqrt(np.maximum(tmax - tmin, 0)) * MJ_A_MM * ra, 0)
+
+
+def et0_penman_monteith(tmax, tmin, tmedia, humedad_relativa, viento_2m, rs, ra, elevacion_m=0.0):
+    """ET0 de Penman-Monteith FAO-56 (mm/día) con radiación global rs y Ra en MJ/m²/día."""
+    presion = 101.3 * ((293 - 0.0065 * elevacion_m) / 293) ** 5.26
+    gamma = 0.000665 * presion
+    es = (_presion_vapor(tmax) + _presion_vapor(tmin)) / 2
+    ea = np.clip(humedad_relativa, 0, 100) / 100 * es
+    pendiente = 4098 * _presion_vapor(tmedia) / (tmedia + 237.3) ** 2
+    rso = (0.75 + 2e-5 * elevacion_m) * ra
+    rns = (1 - ALBEDO_REFERENCIA) * rs
+    rnl = STEFAN_BOLTZMANN * (((tmax + 273.16) ** 4 + (tmin + 273.16) ** 4) / 2) \
+        * (0.34 - 0.14 * np.sqrt(ea)) * (1.35 * np.clip(rs / np.maximum(rso, 1e-9), 0, 1) - 0.35)
+    rn = rns - rnl
+    et0 = (MJ_A_MM * pendiente * rn + gamma * 900 / (tmedia + 273) * viento_2m * (es - ea)) \
+        / (pendiente + gamma * (1 + 0.34 * viento_2m))
+    return np.maximum(et0, 0)
+
+
+def grados_dia(tmax, tmin, temperatura_base):
+    """Grados día de crecimiento (método del promedio) sobre la temperatura base del cultivo."""
+    return np.maximum((tmax + tmin) / 2 - temperatura_base, 0)
+
+
+def agua_util(arena, arcilla, materia_organica=None):
+    """
+    Agua útil (m³/m³ entre capacidad de campo y punto de marchitez) por
+    pedotransferencia de Saxton y Rawls (2006) desde arena y arcilla (%) y
+    materia orgánica (%).
+    """
+    s = np.asarray(arena, dtype=float) / 100
+    c = np.asarray(arcilla, dtype=float) / 100
+    mo = np.clip(np.full(s.shape, MATERIA_ORGANICA_DEFECTO) if materia_organica is None
+                 else np.asarray(materia_organica, dtype=float), 0, 8)
+    t1500 = -0.024 * s + 0.487 * c + 0.006 * mo + 0.005 * s * mo - 0.013 * c * mo + 0.068 * s * c + 0.031
+    t33 = -0.251 * s + 0.195 * c + 0.011 * mo + 0.006 * s * mo - 0.027 * c * mo + 0.452 * s * c + 0.299
+    marchitez = t1500 + (0.14 * t1500 - 0.02)
+    capacidad_campo = t33 + (1.283 * t33 ** 2 - 0.374 * t33 - 0.015)
+    return np.clip(capacidad_campo - marchitez, 0.02, 0.30)
+
+
+def balance_hidrico(precipitacion, etc, agua_util_mm, fraccion_agotamiento):
+    """
+    Balance hídrico diario del perfil de raíces (FAO-56, coeficiente único) para
+    todas las zonas a la vez: agotamiento (días, zonas) en mm, coeficiente de
+    estrés ks, ETc real y excedente que drena o escurre. El perfil arranca a
+    capacidad de campo. La recursión avanza día a día porque el agotamiento
+    está acotado por 0 y el agua útil; cada paso opera sobre todas las zonas.
+    """
+    precipitacion = np.asarray(precipitacion, dtype=float)
+    etc = np.asarray(etc, dtype=float)
+    taw = np.asarray(agua_util_mm, dtype=float)
+    raw = fraccion_agotamiento * taw
+    dias, zonas = len(etc), len(taw)
+    agotamiento = np.empty((dias, zonas))
+    ks = np.empty((dias, zonas))
+    excedente = np.empty((dias, zonas))
+    actual = np.zeros(zonas)
+    for i in range(dias):
+        ks[i] = np.where(actual <= raw, 1.0, np.clip((taw - actual) / np.maximum(taw - raw, 1e-9), 0, 1))
+        nuevo = actual - precipitacion[i] + ks[i] * etc[i]
+        excedente[i] = np.maximum(-nuevo, 0)
+        actual = np.minimum(np.maximum(nuevo, 0), taw)
+        agotamiento[i] = actual
+    return {'agotamiento': agotamiento, 'ks': ks, 'eta': ks * etc[:, None], 'excedente': excedente}
+
+
+def calcular_agroclima(df_power, cultivo, latitud, textura=None, materia_organica=None, elevacion_m=0.0):
+    """
+    Indicadores agroclimáticos del período de df_power (una o varias campañas):
+    grados día, ET0 (Hargreaves y Penman-Monteith), ETc del cultivo, balance
+    hídrico diario por zona con el agua útil de su textura y días de estrés por
+    calor y helada. `textura` es la capa de zonas con arena y arcilla (%);
+    sin ella el balance se hace para una zona con la textura óptima del cultivo.
+    Devuelve {'diario', 'anual', 'zonas', 'resumen'}, o None si faltan variables.
+    """
+    if df_power is None or len(df_power) == 0 or not set(COLUMNAS_AGROCLIMA) <= set(df_power.columns):
+        return None
+    clima = CLIMA_CULTIVOS[cultivo]
+    df = df_power.sort_values('fecha')
+    fechas = pd.DatetimeIndex(df['fecha'])
+    tmax = df['temperatura_max'].to_numpy(dtype=float)
+    tmin = df['temperatura_min'].to_numpy(dtype=float)
+    tmedia = df['temperatura'].to_numpy(dtype=float)
+    precipitacion = df['precipitacion'].to_numpy(dtype=float)
+    ra = radiacion_extraterrestre(latitud, fechas.dayofyear.to_numpy())
+    rs = df['radiacion_solar'].to_numpy(dtype=float) * KWH_A_MJ
+    grupos = campanias(fechas, latitud)
+
+    gdd = grados_dia(tmax, tmin, clima['temperatura_base'])
+    et0_h = et0_hargreaves(tmax, tmin, tmedia, ra)
+    et0_pm = et0_penman_monteith(tmax, tmin, tmedia, df['humedad_relativa'].to_numpy(dtype=float),
+                                 df['viento_2m'].to_numpy(dtype=float), rs, ra, elevacion_m)
+    etc = clima['kc'] * et0_pm
+    calor = tmax > clima['temperatura_calor']
+    helada = tmin < clima['temperatura_helada']
+
+    if textura is not None and len(textura) > 0:
+        arena, arcilla = textura['arena'].to_numpy(), textura['arcilla'].to_numpy()
+    else:
+        arena = np.array([TEXTURA_SUELO_OPTIMA[cultivo]['arena_optima']])
+        arcilla = np.array([TEXTURA_SUELO_OPTIMA[cultivo]['arcilla_optima']])
+        materia_organica = None
+    agua_util_mm = 1000 * agua_util(arena, arcilla, materia_organica) * clima['profundidad_raices_m']
+    balance = balance_hidrico(precipitacion, etc, agua_util_mm, clima['fraccion_agotamiento'])
+    estres = balance['ks'] < 1
+    etc_total = etc.sum()
+
+    diario = pd.DataFrame({
+        'fecha': fechas,
+        'campania': grupos,
+        'gdd': gdd,
+        'gdd_acumulado': acumulado_por_grupo(gdd, grupos),
+        'et0_hargreaves': et0_h,
+        'et0_penman_monteith': et0_pm,
+        'etc': etc,
+        'precipitacion': precipitacion,
+        'balance_acumulado': acumulado_por_grupo(precipitacion - etc, grupos),
+        'agotamiento_medio': balance['agotamiento'].mean(axis=1),
+        'ks_medio': balance['ks'].mean(axis=1),
+        'estres_calor': calor,
+        'helada': helada,
+    })
+
+    inicios = _inicios_grupo(grupos)
+    sumas = lambda valores: np.add.reduceat(np.asarray(valores, dtype=float), inicios, axis=0)
+    anual = pd.DataFrame({
+        'campania': grupos[inicios],
+        'dias': np.diff(np.r_[inicios, len(grupos)]),
+        'gdd': sumas(gdd),
+        'et0_hargreaves_mm': sumas(et0_h),
+        'et0_penman_monteith_mm': sumas(et0_pm),
+        'etc_mm': sumas(etc),
+        'precipitacion_mm': sumas(precipitacion),
+        'dias_calor': sumas(calor).astype(int),
+        'dias_helada': sumas(helada).astype(int),
+        'dias_estres_hidrico_medio': sumas(estres).mean(axis=1),
+    }).round(1)
+
+    eta_total = balance['eta'].sum(axis=0)
+    zonas = pd.DataFrame({
+        'agua_util_mm': agua_util_mm,
+        'dias_estres_hidrico': estres.sum(axis=0),
+        'deficit_hidrico_mm': etc_total - eta_total,
+        'exceso_hidrico_mm': balance['excedente'].sum(axis=0),
+        'dias_exceso': (balance['excedente'] > 0).sum(axis=0),
+        'agotamiento_final_mm': balance['agotamiento'][-1],
+        'factor_hidrico': eta_total / etc_total if etc_total > 0 else np.ones(len(agua_util_mm)),
+    }).round({'agua_util_mm': 1, 'deficit_hidrico_mm': 1, 'exceso_hidrico_mm': 1,
+              'agotamiento_final_mm': 1, 'factor_hidrico': 3})
+
+    resumen = {
+        'dias': int(len(df)),
+        'campanias': int(len(inicios)),
+        'temperatura_base': float(clima['temperatura_base']),
+        'gdd': round(float(gdd.sum()), 1),
+        'et0_hargreaves_mm': round(float(et0_h.sum()), 1),
+        'et0_penman_monteith_mm': round(float(et0_pm.sum()), 1),
+        'etc_mm': round(float(etc_total), 1),
+        'precipitacion_mm': round(float(precipitacion.sum()), 1),
+        'balance_mm': round(float(precipitacion.sum() - etc_total), 1),
+        'dias_calor': int(calor.sum()),
+        'dias_helada': int(helada.sum()),
+        'agua_util_mm': round(float(agua_util_mm.mean()), 1),
+        'dias_estres_hidrico': round(float(zonas['dias_estres_hidrico'].mean()), 1),
+        'deficit_hidrico_mm': round(float(zonas['deficit_hidrico_mm'].mean()), 1),
+        'exceso_hidrico_mm': round(float(zonas['exceso_hidrico_mm'].mean()), 1),
+        'factor_hidrico': round(float(zonas['factor_hidrico'].mean()), 3),
+        'dias_ciclo': int(clima['dias_ciclo']),
+        'ciclo_completo': bool(len(df) >= clima['dias_ciclo']),
+    }
+    return {'diario': diario, 'anual': anual, 'zonas': zonas, 'resumen': resumen}
+
+
+def ajustar_proyecciones_clima(proyecciones, agroclima, cultivo):
+    """
+    Agrega a las proyecciones por zona el factor hídrico (ETc real / ETc) y el
+    rendimiento con fertilización limitado por agua según FAO-33:
+    1 - Yr/Ym = ky (1 - ETr/ETc). El ky de FAO-33 vale para la campaña entera:
+    si la ventana es más corta que el ciclo del cultivo (dias_ciclo) sólo se
+    agrega la relación como indicador de la ventana (factor_hidrico_ventana).
+    """
+    if agroclima is None:
+        return proyecciones
+    tabla = proyecciones.copy()
+    factor = agroclima['zonas']['factor_hidrico'].to_numpy(dtype=float)
+    if len(factor) != len(tabla):
+        factor = np.full(len(tabla), factor.mean())
+    if not agroclima['resumen'].get('ciclo_completo', True):
+        tabla['factor_hidrico_ventana'] = factor
+        return tabla
+    reduccion = np.clip(1 - CLIMA_CULTIVOS[cultivo]['ky'] * (1 - factor), 0, 1)
+    tabla['factor_hidrico'] = factor
+    tabla['rendimiento_limitado_agua'] = np.round(tabla['rendimiento_con_fert'].to_numpy(dtype=float) * reduccion, 0)
+    return tabla
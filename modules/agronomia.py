@@ -0,0 +1,116 @@
+# modules/agronomia.py - Pipeline agronómico vectorizado: NPK, costos y rendimiento (zonas × cultivos)
+import numpy as np
+import pandas as pd
+
+from .cultivos import CULTIVOS, parametros_cultivos
+
+# Precios de referencia de fertilizante (USD/kg de nutriente); se pueden reemplazar por escenario
+PRECIOS_FERTILIZANTE = {'N': 1.2, 'P': 2.5, 'K': 1.8}
+
+# Criterios disponibles para ordenar cultivos en cada zona (clave -> etiqueta)
+CRITERIOS_RANKING = {
+    'margen': 'Margen (USD/ha)',
+    'ingreso': 'Ingreso bruto (USD/ha)',
+    'rendimiento_con_fert': 'Rendimiento con fert. (kg/ha)',
+    'incremento_esperado': 'Incremento esperado (%)',
+}
+
+# Columnas de TABLA_CULTIVOS que usan las etapas NPK, costos y rendimiento
+COLUMNAS_AGRONOMICAS = ['n_min', 'n_max', 'p_min', 'p_max', 'k_min', 'k_max',
+                        'rendimiento_optimo', 'costo_fertilizacion', 'precio_venta']
+
+
+def parametros_vectorizados(cultivos):
+    """
+    Parámetros de los cultivos como columnas (C, 1), listas para broadcasting
+    contra arrays de zonas (1, Z). Se toman de TABLA_CULTIVOS por índice entero.
+    """
+    columnas = parametros_cultivos(cultivos, COLUMNAS_AGRONOMICAS)
+    return {columna: valores[:, None] for columna, valores in columnas.items()}
+
+
+def _dosis(factor, minimo, maximo):
+    return np.round(np.clip(factor * (maximo - minimo) + minimo, minimo * 0.8, maximo * 1.2), 1)
+
+
+def recomendaciones_npk(ndvi, ndre, materia_organica, humedad_suelo, p):
+    """Dosis N, P, K (kg/ha) para cada cultivo × zona."""
+    mo_rel = materia_organica / 8
+    factor_n = (1 - ndre) * 0.6 + (1 - ndvi) * 0.4
+    factor_p = (1 - mo_rel) * 0.7 + (1 - humedad_suelo) * 0.3
+    factor_k = (1 - ndre) * 0.4 + (1 - humedad_suelo) * 0.4 + (1 - mo_rel) * 0.2
+    return (_dosis(factor_n, p['n_min'], p['n_max']),
+            _dosis(factor_p, p['p_min'], p['p_max']),
+            _dosis(factor_k, p['k_min'], p['k_max']))
+
+
+def costos_fertilizacion(rec_n, rec_p, rec_k, costo_fijo, precios=None):
+    """
+    Costo por nutriente y total (USD/ha); costo_fijo es el COSTO_FERTILIZACION
+    del cultivo y `precios` un dict N/P/K en USD/kg (por defecto PRECIOS_FERTILIZANTE).
+    """
+    precios = {**PRECIOS_FERTILIZANTE, **(precios or {})}
+    costo_n = rec_n * precios['N']
+    costo_p = rec_p * precios['P']
+    costo_k = rec_k * precios['K']
+    costo_total = costo_n + costo_p + costo_k + costo_fijo
+    return np.round(costo_n, 2), np.round(costo_p, 2), np.round(costo_k, 2), np.round(costo_total, 2)
+
+
+def proyecciones_rendimiento(npk_actual, ndvi, rendimiento_optimo):
+    """Rendimiento sin y con fertilización (kg/ha) e incremento esperado (%)."""
+    rendimiento_base = rendimiento_optimo * npk_actual * 0.7
+    incremento = (1 - npk_actual) * 0.4 + (1 - ndvi) * 0.2
+    return (np.round(rendimiento_base, 0),
+            np.round(rendimiento_base * (1 + incremento), 0),
+            np.round(incremento * 100, 1))
+
+
+def evaluar_cultivos(fertilidad, cultivos=None, precios=None):
+    """
+    Evalúa en una sola pasada todas las zonas de la tabla de fertilidad
+    (columnas ndvi, ndre, materia_organica, humedad_suelo, npk_actual) para
+    uno o varios cultivos (por defecto los 14). Cada salida es un array (C, Z).
+    El ingreso usa el PRECIO_VENTA de cada cultivo.
+    """
+    cultivos = list(CULTIVOS) if cultivos is None else list(cultivos)
+    p = parametros_vectorizados(cultivos)
+
+    def fila(columna):
+        return np.asarray(fertilidad[columna], dtype=float)[None, :]
+
+    ndvi, ndre = fila('ndvi'), fila('ndre')
+    materia_organica, humedad_suelo, npk_actual = fila('materia_organica'), fila('humedad_suelo'), fila('npk_actual')
+
+    rec_n, rec_p, rec_k = recomendaciones_npk(ndvi, ndre, materia_organica, humedad_suelo, p)
+    costo_n, costo_p, costo_k, costo_total = costos_fertilizacion(rec_n, rec_p, rec_k, p['costo_fertilizacion'], precios)
+    rend_sin, rend_con, incremento = proyecciones_rendimiento(npk_actual, ndvi, p['rendimiento_optimo'])
+    ingreso = rend_con * p['precio_venta']
+
+    return {
+        'cultivos': cultivos,
+        'rec_N': rec_n, 'rec_P': rec_p, 'rec_K': rec_k,
+        'costo_nitrogeno': costo_n, 'costo_fosforo': costo_p,
+        'costo_potasio': costo_k, 'costo_total': costo_total,
+        'rendimiento_sin_fert': rend_sin, 'rendimiento_con_fert': rend_con,
+        'incremento_esperado': incremento,
+        'ingreso': ingreso,
+        'margen': ingreso - costo_total,
+    }
+
+
+def ranking_cultivos(fertilidad, cultivos=None, criterio='margen', top=3):
+    """
+    Ordena los cultivos en cada zona según `criterio` (ver CRITERIOS_RANKING).
+    Retorna un DataFrame con una fila por zona: cultivo_1..top y su valor.
+    """
+    evaluacion = evaluar_cultivos(fertilidad, cultivos)
+    valores = evaluacion[criterio]
+    nombres = np.asarray(evaluacion['cultivos'])
+    top = max(1, min(top, len(nombres)))
+    orden = np.argsort(-valores, axis=0, kind='stable')[:top]
+    columnas = {}
+    for puesto in range(top):
+        columnas[f'cultivo_{puesto + 1}'] = nombres[orden[puesto]]
+        columnas[f'{criterio}_{puesto + 1}'] = np.take_along_axis(valores, orden[puesto][None, :], axis=0)[0]
+    return pd.DataFrame(columnas)
@@ -0,0 +1,21 @@
+# modules/almacenamiento.py - Directorio local para datos persistentes entre sesiones
+import os
+
+# Se puede redirigir con la variable de entorno CULTIVOS_DATA_DIR (p. ej. un volumen montado)
+DIRECTORIO_DATOS = os.environ.get(
+    'CULTIVOS_DATA_DIR',
+    os.path.join(os.path.expanduser('~'), '.cultivos_tropicales')
+)
+
+
+def directorio_datos(*partes):
+    """Subdirectorio dentro del directorio de datos (se crea si no existe)."""
+    ruta = os.path.join(DIRECTORIO_DATOS, *partes)
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+
+def ruta_datos(*partes):
+    """Ruta de archivo dentro del directorio de datos, creando su carpeta."""
+    directorio = directorio_datos(*partes[:-1])
+    return os.path.join(directorio, partes[-1])
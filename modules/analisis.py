@@ -0,0 +1,361 @@
+# modules/analisis.py - Etapas de análisis agronómico por zona (importables desde workers)
+import math
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.geometry import Polygon
+
+from . import eventos
+from .cultivos import PARAMETROS_CULTIVOS, TEXTURA_SUELO_OPTIMA
+from .agronomia import evaluar_cultivos, costos_fertilizacion
+from .texturas import clasificar_textura_usda
+from .incertidumbre import simular_rendimientos
+
+# ===== FUNCIONES AUXILIARES - CORREGIDAS PARA EPSG:4326 =====
+def validar_y_corregir_crs(gdf):
+    if gdf is None or len(gdf) == 0:
+        return gdf
+    try:
+        if gdf.crs is None:
+            gdf = gdf.set_crs('EPSG:4326', inplace=False)
+            eventos.info("ℹ️ Se asignó EPSG:4326 al archivo (no tenía CRS)")
+        elif str(gdf.crs).upper() != 'EPSG:4326':
+            original_crs = str(gdf.crs)
+            gdf = gdf.to_crs('EPSG:4326')
+            eventos.info(f"ℹ️ Transformado de {original_crs} a EPSG:4326")
+        return gdf
+    except Exception as e:
+        eventos.advertencia(f"⚠️ Error al corregir CRS: {str(e)}")
+        return gdf
+
+def calcular_superficie(gdf):
+    """Superficie total (ha); usa el mismo servicio de área que las zonas."""
+    try:
+        if gdf is None or len(gdf) == 0:
+            return 0.0
+        return float(calcular_area_zonas(gdf).sum())
+    except Exception as e:
+        return 0.0
+
+def dividir_parcela_en_zonas(gdf, n_zonas):
+    if len(gdf) == 0:
+        return gdf
+    gdf = validar_y_corregir_crs(gdf)
+    parcela_principal = gdf.iloc[0].geometry
+    bounds = parcela_principal.bounds
+    minx, miny, maxx, maxy = bounds
+    sub_poligonos = []
+    n_cols = math.ceil(math.sqrt(n_zonas))
+    n_rows = math.ceil(n_zonas / n_cols)
+    width = (maxx - minx) / n_cols
+    height = (maxy - miny) / n_rows
+    for i in range(n_rows):
+        for j in range(n_cols):
+            if len(sub_poligonos) >= n_zonas:
+                break
+            cell_minx = minx + (j * width)
+            cell_maxx = minx + ((j + 1) * width)
+            cell_miny = miny + (i * height)
+            cell_maxy = miny + ((i + 1) * height)
+            cell_poly = Polygon([(cell_minx, cell_miny), (cell_maxx, cell_miny), (cell_maxx, cell_maxy), (cell_minx, cell_maxy)])
+            intersection = parcela_principal.intersection(cell_poly)
+            if not intersection.is_empty and intersection.area > 0:
+                sub_poligonos.append(intersection)
+    if sub_poligonos:
+        nuevo_gdf = gpd.GeoDataFrame({'id_zona': range(1, len(sub_poligonos) + 1), 'geometry': sub_poligonos}, crs='EPSG:4326')
+        return nuevo_gdf
+    else:
+        return gdf
+
+# ===== FUNCIONES DE ANÁLISIS COMPLETOS =====
+# Columnas de la tabla de fertilidad (una fila por zona, mismo orden que gdf_dividido)
+COLUMNAS_FERTILIDAD = ['materia_organica', 'humedad_suelo', 'ndvi', 'ndre', 'ndwi', 'npk_actual']
+# Desvío del ruido gaussiano por variable (MO, humedad, NDVI, NDRE, NDWI)
+RUIDO_FERTILIDAD = np.array([0.2, 0.05, 0.06, 0.04, 0.08])
+
+def semilla_determinista(*partes):
+    """
+    Semilla de 64 bits estable entre procesos y sesiones (hash() de Python no lo es),
+    derivada de los datos de entrada: mismos datos = mismos resultados = caché válida.
+    """
+    texto = '|'.join(str(p) for p in partes)
+    return int.from_bytes(hashlib.sha256(texto.encode('utf-8')).digest()[:8], 'little')
+
+def centros_zonas(gdf_dividido):
+    """
+    Centros x, y del rectángulo envolvente de cada zona, como arrays.
+    Para las celdas de la grilla coincide con el centroide y es ~20x más
+    rápido que calcularlo (sólo se usa para el gradiente espacial).
+    """
+    limites = shapely.bounds(np.asarray(gdf_dividido.geometry, dtype=object))
+    return (limites[:, 0] + limites[:, 2]) / 2, (limites[:, 1] + limites[:, 3]) / 2
+
+def _normalizar(valores):
+    minimo, maximo = valores.min(), valores.max()
+    if maximo == minimo:
+        return np.full(len(valores), 0.5)
+    return (valores - minimo) / (maximo - minimo)
+
+def analizar_fertilidad_actual(gdf_dividido, cultivo, datos_satelitales, semilla=None):
+    """
+    Motor de fertilidad vectorizado: calcula MO, humedad, NDVI, NDRE, NDWI e
+    índice NPK de todas las zonas a la vez con arrays de NumPy.
+    El ruido sale de un np.random.Generator sembrado; si no se indica `semilla`
+    se deriva del cultivo, el valor satelital y la posición de las zonas, así el mismo
+    análisis produce siempre la misma tabla. Retorna un DataFrame columnar.
+    """
+    n = len(gdf_dividido)
+    if n == 0:
+        return pd.DataFrame({c: np.empty(0) for c in COLUMNAS_FERTILIDAD})
+    params = PARAMETROS_CULTIVOS[cultivo]
+    valor_base_satelital = datos_satelitales.get('valor_promedio', 0.6) if datos_satelitales else 0.6
+
+    x, y = centros_zonas(gdf_dividido)
+    if semilla is None:
+        semilla = semilla_determinista(cultivo, round(float(valor_base_satelital), 6), n,
+                                       hashlib.sha256(np.round(np.concatenate([x, y]), 7).tobytes()).hexdigest())
+    rng = np.random.default_rng(semilla)
+    ruido = rng.normal(0.0, RUIDO_FERTILIDAD, size=(n, len(RUIDO_FERTILIDAD)))
+
+    patron_espacial = _normalizar(x) * 0.6 + _normalizar(y) * 0.4
+
+    mo_opt = params['MATERIA_ORGANICA_OPTIMA']
+    materia_organica = np.clip(mo_opt * 0.7 + patron_espacial * (mo_opt * 0.6) + ruido[:, 0], 0.5, 8.0)
+
+    hum_opt = params['HUMEDAD_OPTIMA']
+    humedad_suelo = np.clip(hum_opt * 0.8 + patron_espacial * (hum_opt * 0.4) + ruido[:, 1], 0.1, 0.8)
+
+    ndvi = np.clip(valor_base_satelital * 0.8 + patron_espacial * (valor_base_satelital * 0.4) + ruido[:, 2], 0.1, 0.9)
+
+    ndre_opt = params['NDRE_OPTIMO']
+    ndre = np.clip(ndre_opt * 0.7 + patron_espacial * (ndre_opt * 0.4) + ruido[:, 3], 0.05, 0.7)
+
+    ndwi = np.clip(0.2 + ruido[:, 4], 0, 1)
+
+    npk_actual = np.clip(ndvi * 0.4 + ndre * 0.3 + (materia_organica / 8) * 0.2 + humedad_suelo * 0.1, 0, 1)
+
+    return pd.DataFrame({
+        'materia_organica': np.round(materia_organica, 2),
+        'humedad_suelo': np.round(humedad_suelo, 3),
+        'ndvi': np.round(ndvi, 3),
+        'ndre': np.round(ndre, 3),
+        'ndwi': np.round(ndwi, 3),
+        'npk_actual': np.round(npk_actual, 3)
+    })
+
+def analizar_recomendaciones_npk(indices, cultivo):
+    """Dosis N, P, K (kg/ha) por zona como arrays, a partir de la tabla de fertilidad."""
+    evaluacion = evaluar_cultivos(indices, [cultivo])
+    return evaluacion['rec_N'][0], evaluacion['rec_P'][0], evaluacion['rec_K'][0]
+
+def analizar_costos(gdf_dividido, cultivo, recomendaciones_n, recomendaciones_p, recomendaciones_k, precios=None):
+    """Costos de fertilización por zona (USD/ha) como tabla columnar; `precios` = dict N/P/K en USD/kg."""
+    params = PARAMETROS_CULTIVOS[cultivo]
+    costo_n, costo_p, costo_k, costo_total = costos_fertilizacion(
+        np.asarray(recomendaciones_n, dtype=float), np.asarray(recomendaciones_p, dtype=float),
+        np.asarray(recomendaciones_k, dtype=float), params['COSTO_FERTILIZACION'], precios
+    )
+    return pd.DataFrame({
+        'costo_nitrogeno': costo_n,
+        'costo_fosforo': costo_p,
+        'costo_potasio': costo_k,
+        'costo_total': costo_total
+    })
+
+def analizar_proyecciones_cosecha(gdf_dividido, cultivo, indices, n_muestras=0, semilla=0):
+    """
+    Rendimiento sin/con fertilización e incremento esperado por zona, como tabla columnar.
+    Con n_muestras > 0 agrega las bandas Monte Carlo P10/P50/P90 de ambos rendimientos.
+    """
+    evaluacion = evaluar_cultivos(indices, [cultivo])
+    tabla = pd.DataFrame({
+        'rendimiento_sin_fert': evaluacion['rendimiento_sin_fert'][0],
+        'rendimiento_con_fert': evaluacion['rendimiento_con_fert'][0],
+        'incremento_esperado': evaluacion['incremento_esperado'][0]
+    })
+    if n_muestras > 0:
+        area = gdf_dividido['area_ha'] if 'area_ha' in gdf_dividido.columns else calcular_area_zonas(gdf_dividido)
+        simulacion = simular_rendimientos(indices, area, cultivo, n_muestras=n_muestras, semilla=semilla)
+        tabla = pd.concat([tabla, simulacion['zonas']], axis=1)
+    return tabla
+
+def clasificar_textura_suelo_vectorizado(arena, limo, arcilla):
+    """Clase textural USDA (12 clases) de muchas zonas a la vez, vía tabla precalculada."""
+    return clasificar_textura_usda(arena, limo, arcilla)
+
+def clasificar_textura_suelo(arena, limo, arcilla):
+    try:
+        return str(clasificar_textura_suelo_vectorizado([arena], [limo], [arcilla])[0])
+    except Exception as e:
+        return "NO_DETERMINADA"
+
+def _mezclar_splitmix64(x):
+    """Función de mezcla SplitMix64 sobre uint64 (hash contador -> bits pseudoaleatorios)."""
+    x = (x + np.uint64(0x9E3779B97F4A7C15))
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def normales_por_zona(semilla, ids_zona, n_variables):
+    """
+    Matriz (zonas, n_variables) de normales estándar donde cada zona tiene su propio
+    flujo determinista derivado de (semilla, id de zona): el valor de una zona no
+    depende de cuántas zonas haya ni de su orden. Todo en operaciones de arrays.
+    """
+    ids = np.asarray(ids_zona, dtype=np.uint64)[:, None]
+    contador = np.arange(2 * n_variables, dtype=np.uint64)[None, :]
+    with np.errstate(over='ignore'):
+        base = _mezclar_splitmix64(np.uint64(semilla % 2**64) ^ _mezclar_splitmix64(ids))
+        bits = _mezclar_splitmix64(base + contador * np.uint64(0xD1B54A32D192ED03))
+    # 53 bits -> uniforme en (0, 1); Box-Muller para pasar a normal
+    uniformes = ((bits >> np.uint64(11)).astype(np.float64) + 0.5) / 2.0 ** 53
+    u1, u2 = uniformes[:, :n_variables], uniformes[:, n_variables:]
+    return np.sqrt(-2.0 * np.log(u1)) * np.cos(2.0 * np.pi * u2)
+
+def analizar_textura_suelo(gdf_dividido, cultivo):
+    """
+    Etapa de textura vectorizada: arena/limo/arcilla de todas las zonas en una
+    pasada y clasificación por arrays. La semilla de cada zona sale de su
+    id_zona y de la parcela, así que se reproduce en cualquier proceso.
+    Agrega (en el mismo GeoDataFrame) area_ha, arena, limo, arcilla y textura_suelo.
+    """
+    gdf_dividido = validar_y_corregir_crs(gdf_dividido)
+    params_textura = TEXTURA_SUELO_OPTIMA[cultivo]
+    n = len(gdf_dividido)
+    if n == 0:
+        for columna in ('area_ha', 'arena', 'limo', 'arcilla'):
+            gdf_dividido[columna] = np.empty(0)
+        gdf_dividido['textura_suelo'] = np.empty(0, dtype=object)
+        return gdf_dividido
+
+    if 'area_ha' not in gdf_dividido.columns:
+        gdf_dividido['area_ha'] = calcular_area_zonas(gdf_dividido)
+
+    ids_zona = gdf_dividido['id_zona'].to_numpy() if 'id_zona' in gdf_dividido.columns else np.arange(1, n + 1)
+    semilla = semilla_determinista(cultivo, 'textura', *np.round(gdf_dividido.total_bounds, 6))
+    ruido = normales_por_zona(semilla, ids_zona, 3)
+
+    x, y = centros_zonas(gdf_dividido)
+    variabilidad_local = 0.15 + 0.7 * (((y + 90) / 180) * ((x + 180) / 360))
+
+    arena_optima = params_textura['arena_optima']
+    limo_optima = params_textura['limo_optima']
+    arcilla_optima = params_textura['arcilla_optima']
+    arena_val = np.clip(arena_optima * (0.8 + 0.4 * variabilidad_local) + arena_optima * 0.15 * ruido[:, 0], 5, 95)
+    limo_val = np.clip(limo_optima * (0.7 + 0.6 * variabilidad_local) + limo_optima * 0.2 * ruido[:, 1], 5, 95)
+    arcilla_val = np.clip(arcilla_optima * (0.75 + 0.5 * variabilidad_local) + arcilla_optima * 0.15 * ruido[:, 2], 5, 95)
+
+    total = arena_val + limo_val + arcilla_val
+    gdf_dividido['arena'] = arena_val / total * 100
+    gdf_dividido['limo'] = limo_val / total * 100
+    gdf_dividido['arcilla'] = arcilla_val / total * 100
+    gdf_dividido['textura_suelo'] = clasificar_textura_suelo_vectorizado(
+        gdf_dividido['arena'], gdf_dividido['limo'], gdf_dividido['arcilla']
+    )
+    return gdf_dividido
+
+def calcular_area_zonas(gdf_dividido):
+    """
+    Servicio de área compartido: área (ha) de cada zona como array, en el mismo
+    orden que gdf_dividido y con el mismo criterio que calcular_superficie.
+    """
+    if gdf_dividido is None or len(gdf_dividido) == 0:
+        return np.empty(0)
+    try:
+        gdf = validar_y_corregir_crs(gdf_dividido)
+        minx, miny, maxx, maxy = gdf.total_bounds
+        if minx < -180 or maxx > 180 or miny < -90 or maxy > 90:
+            return gdf.geometry.area.to_numpy() * 111000 * 111000 / 10000
+        return gdf.to_crs('EPSG:3857').geometry.area.to_numpy() / 10000
+    except Exception:
+        return gdf_dividido.geometry.area.to_numpy() / 10000
+
+# ===== COMBINAR TODOS LOS RESULTADOS EN UN SOLO GeoDataFrame =====
+# Esquema explícito de la capa de resultados: (columna, etapa de origen, campo, dtype).
+# Índices, dosis y rendimientos entran cómodos en float32; los montos en USD
+# quedan en float64 porque se suman sobre miles de zonas.
+ESQUEMA_RESULTADOS = [
+    ('fert_npk_actual', 'fertilidad', 'npk_actual', 'float32'),
+    ('fert_ndvi', 'fertilidad', 'ndvi', 'float32'),
+    ('fert_ndre', 'fertilidad', 'ndre', 'float32'),
+    ('fert_ndwi', 'fertilidad', 'ndwi', 'float32'),
+    ('fert_materia_organica', 'fertilidad', 'materia_organica', 'float32'),
+    ('fert_humedad_suelo', 'fertilidad', 'humedad_suelo', 'float32'),
+    ('rec_N', 'recomendaciones', 'N', 'float32'),
+    ('rec_P', 'recomendaciones', 'P', 'float32'),
+    ('rec_K', 'recomendaciones', 'K', 'float32'),
+    ('costo_costo_nitrogeno', 'costos', 'costo_nitrogeno', 'float64'),
+    ('costo_costo_fosforo', 'costos', 'costo_fosforo', 'float64'),
+    ('costo_costo_potasio', 'costos', 'costo_potasio', 'float64'),
+    ('costo_costo_total', 'costos', 'costo_total', 'float64'),
+    ('proy_rendimiento_sin_fert', 'proyecciones', 'rendimiento_sin_fert', 'float32'),
+    ('proy_rendimiento_con_fert', 'proyecciones', 'rendimiento_con_fert', 'float32'),
+    ('proy_incremento_esperado', 'proyecciones', 'incremento_esperado', 'float32'),
+]
+
+# Columnas que sólo existen si la etapa las produjo (p. ej. bandas Monte Carlo)
+ESQUEMA_RESULTADOS_OPCIONAL = [
+    (f'proy_{rend}_{q}', 'proyecciones', f'{rend}_{q}', 'float32')
+    for rend in ('rendimiento_sin_fert', 'rendimiento_con_fert') for q in ('p10', 'p50', 'p90')
+] + [
+    # Ajuste por balance hídrico (etapa agroclima)
+    ('proy_factor_hidrico', 'proyecciones', 'factor_hidrico', 'float32'),
+    ('proy_rendimiento_limitado_agua', 'proyecciones', 'rendimiento_limitado_agua', 'float32'),
+    ('proy_factor_hidrico_ventana', 'proyecciones', 'factor_hidrico_ventana', 'float32'),
+]
+
+def _a_tabla(salida_etapa):
+    """Salida de una etapa (DataFrame, dict de columnas o lista de dicts) como DataFrame columnar."""
+    if isinstance(salida_etapa, pd.DataFrame):
+        return salida_etapa.reset_index(drop=True)
+    if isinstance(salida_etapa, dict):
+        return pd.DataFrame(salida_etapa)
+    return pd.DataFrame.from_records(list(salida_etapa))
+
+def combinar_resultados(gdf_dividido, fertilidad_actual, rec_n, rec_p, rec_k, costos, proyecciones):
+    """
+    Une las salidas de todas las etapas a la capa de zonas en una sola
+    concatenación de columnas tipadas según ESQUEMA_RESULTADOS.
+    La textura ya está en gdf_dividido y se conserva tal cual.
+    """
+    n = len(gdf_dividido)
+    etapas = {
+        'fertilidad': _a_tabla(fertilidad_actual),
+        'recomendaciones': pd.DataFrame({'N': np.asarray(rec_n), 'P': np.asarray(rec_p), 'K': np.asarray(rec_k)}),
+        'costos': _a_tabla(costos),
+        'proyecciones': _a_tabla(proyecciones),
+    }
+    for nombre, tabla in etapas.items():
+        if len(tabla) != n:
+            raise ValueError(f"La etapa '{nombre}' tiene {len(tabla)} filas para {n} zonas")
+
+    columnas = {
+        columna: etapas[etapa][campo].to_numpy(dtype=dtype)
+        for columna, etapa, campo, dtype in ESQUEMA_RESULTADOS
+    }
+    columnas.update({
+        columna: etapas[etapa][campo].to_numpy(dtype=dtype)
+        for columna, etapa, campo, dtype in ESQUEMA_RESULTADOS_OPCIONAL
+        if campo in etapas[etapa].columns
+    })
+    tabla_resultados = pd.DataFrame(columnas, index=gdf_dividido.index)
+    base = gdf_dividido.drop(columns=[c for c in columnas if c in gdf_dividido.columns])
+    return gpd.GeoDataFrame(
+        pd.concat([base, tabla_resultados], axis=1),
+        geometry=gdf_dividido.geometry.name, crs=gdf_dividido.crs
+    )
+
+def columnas_float64(df):
+    """
+    Copia con las columnas float32 pasadas a float64 por su representación
+    decimal más corta (0.538 y no 0.5379999876), para exportar a GeoJSON/JSON.
+    """
+    float32 = df.select_dtypes(include='float32').columns
+    if len(float32) == 0:
+        return df
+    df = df.copy()
+    for columna in float32:
+        df[columna] = df[columna].astype(str).astype('float64')
+    return df
@@ -0,0 +1,426 @@
+# modules/batch.py - Reanálisis sin interfaz: muchos lotes en un pool de procesos, con checkpoints en disco
+#
+#   python -m modules.batch limites/ --cultivo MAIZ --salida resultados/ --procesos 4
+#   python -m modules.batch manifiesto.csv --salida resultados/
+#
+# Cada lote escribe sus resultados en <salida>/<id_lote>/; resumen.json se escribe al
+# final y marca el lote como completado, así una corrida interrumpida se retoma
+# sin repetir los lotes ya terminados. Un lote cuyo resumen lista etapas con
+# respaldo (datos simulados, DEM sintético) se vuelve a procesar al retomar.
+import os
+import re
+import sys
+import json
+import shutil
+import time
+import logging
+import argparse
+import traceback
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely import wkb
+
+from .eventos import Reportador, destino_lista, destino_logging, usar_reportador
+from .cultivos import CULTIVOS
+from .ingesta import FORMATOS_VECTORIALES, es_formato_vectorial, leer_vectorial
+from .analisis import columnas_float64
+from .lotes import MAX_PROCESOS_LOTES, nombrar_lotes, ejecutar_lotes_en_paralelo
+from .datos_externos import SATELITES_GEE, gee_autenticado, inicializar_gee
+from .clima_power import obtener_clima_lotes
+from .pipeline import ejecutar_analisis_completo
+
+EXTENSIONES_LIMITES = tuple(FORMATOS_VECTORIALES) + ('.shp', '.zip', '.kml')
+ARCHIVO_RESUMEN = 'resumen.json'
+ARCHIVO_ERROR = 'error.json'
+ARCHIVO_RESUMEN_BATCH = 'resumen_batch.csv'
+# Columnas del manifiesto que pueden variar por lote (las demás se ignoran)
+PARAMETROS_LOTE = ['cultivo', 'n_divisiones', 'satelite', 'fecha_inicio', 'fecha_fin',
+                   'indice', 'intervalo_curvas', 'resolucion_dem', 'resolucion_prescripcion']
+
+
+def parametros_defecto():
+    """Mismos valores por defecto que la barra lateral de la app."""
+    hoy = date.today()
+    return {
+        'cultivo': None,
+        'n_divisiones': 32,
+        'satelite': 'DATOS_SIMULADOS',
+        'fecha_inicio': hoy - timedelta(days=30),
+        'fecha_fin': hoy,
+        'indice': 'NDVI',
+        'intervalo_curvas': 5.0,
+        'resolucion_dem': 10.0,
+        'resolucion_prescripcion': None,
+    }
+
+
+def _id_seguro(texto):
+    """Identificador usable como nombre de carpeta."""
+    return re.sub(r'[^\w.-]+', '_', str(texto)).strip('_') or 'lote'
+
+
+def _a_fecha(valor):
+    return valor if isinstance(valor, date) and not isinstance(valor, datetime) else pd.Timestamp(valor).date()
+
+
+def leer_limites(ruta):
+    """Límites de un archivo (formatos vectoriales, .shp, shapefile en .zip o .kml) en EPSG:4326."""
+    extension = os.path.splitext(ruta)[1].lower()
+    if es_formato_vectorial(ruta):
+        gdf, _ = leer_vectorial(ruta)
+    elif extension == '.zip':
+        gdf = gpd.read_file(f"zip://{os.path.abspath(ruta)}")
+    else:
+        gdf = gpd.read_file(ruta)
+    if gdf.crs is None:
+        gdf = gdf.set_crs('EPSG:4326')
+    gdf = gdf.to_crs('EPSG:4326')
+    return gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+
+
+def _tareas_de_archivo(ruta, id_base, parametros):
+    gdf = nombrar_lotes(leer_limites(ruta))
+    tareas = []
+    for row in gdf.itertuples():
+        id_lote = id_base if len(gdf) == 1 else f"{id_base}__{row.id_lote}"
+        tareas.append({
+            'id_lote': _id_seguro(id_lote),
+            'nombre_lote': row.nombre_lote if len(gdf) > 1 else id_base,
+            'archivo': ruta,
+            'geometria_wkb': wkb.dumps(row.geometry),
+            **parametros,
+        })
+    return tareas
+
+
+def cargar_tareas(origen, **parametros):
+    """
+    Arma las tareas del batch desde:
+      - un directorio: cada archivo de límites es un lote (o varios, si tiene varias entidades);
+      - un manifiesto .csv: columna `archivo` (relativa al CSV) y opcionales `id_lote` y
+        cualquiera de PARAMETROS_LOTE para sobrescribir los valores generales por lote;
+      - un archivo vectorial: cada entidad es un lote.
+    `parametros` sobrescribe parametros_defecto() para todos los lotes.
+    """
+    generales = {**parametros_defecto(), **{k: v for k, v in parametros.items() if v is not None}}
+    tareas = []
+    if os.path.isdir(origen):
+        for nombre in sorted(os.listdir(origen)):
+            ruta = os.path.join(origen, nombre)
+            if os.path.isfile(ruta) and os.path.splitext(nombre)[1].lower() in EXTENSIONES_LIMITES:
+                tareas.extend(_tareas_de_archivo(ruta, os.path.splitext(nombre)[0], generales))
+    elif origen.lower().endswith('.csv'):
+        manifiesto = pd.read_csv(origen)
+        if 'archivo' not in manifiesto.columns:
+            raise ValueError("El manifiesto necesita una columna 'archivo'")
+        base = os.path.dirname(os.path.abspath(origen))
+        for fila in manifiesto.to_dict('records'):
+            propios = {k: fila[k] for k in PARAMETROS_LOTE if k in fila and not pd.isna(fila[k])}
+            ruta = fila['archivo'] if os.path.isabs(fila['archivo']) else os.path.join(base, fila['archivo'])
+            id_base = fila.get('id_lote')
+            id_base = os.path.splitext(os.path.basename(ruta))[0] if id_base is None or pd.isna(id_base) else str(id_base)
+            tareas.extend(_tareas_de_archivo(ruta, id_base, {**generales, **propios}))
+    else:
+        tareas = _tareas_de_archivo(origen, os.path.splitext(os.path.basename(origen))[0], generales)
+
+    ids = [t['id_lote'] for t in tareas]
+    repetidos = sorted({i for i in ids if ids.count(i) > 1})
+    if repetidos:
+        raise ValueError(f"Identificadores de lote repetidos: {', '.join(repetidos[:10])}")
+    for tarea in tareas:
+        if tarea['cultivo'] not in CULTIVOS:
+            raise ValueError(f"Lote {tarea['id_lote']}: cultivo desconocido '{tarea['cultivo']}' "
+                             f"(opciones: {', '.join(CULTIVOS)})")
+        tarea['n_divisiones'] = int(tarea['n_divisiones'])
+        tarea['intervalo_curvas'] = float(tarea['intervalo_curvas'])
+        tarea['resolucion_dem'] = float(tarea['resolucion_dem'])
+        if tarea['resolucion_prescripcion'] is not None:
+            tarea['resolucion_prescripcion'] = float(tarea['resolucion_prescripcion'])
+        tarea['fecha_inicio'] = _a_fecha(tarea['fecha_inicio'])
+        tarea['fecha_fin'] = _a_fecha(tarea['fecha_fin'])
+    return tareas
+
+
+# ===== WORKER =====
+_estado_worker = {'gee_intentado': False}
+
+
+def _inicializar_worker():
+    """Una vez por proceso: los eventos del análisis van a stderr (avisos y errores)."""
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+
+
+def _escribir_json(ruta, datos):
+    tmp = ruta + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, ruta)
+
+
+def _promedio(gdf, columna, pesos, decimales):
+    return round(float(np.average(gdf[columna].astype(float), weights=pesos)), decimales)
+
+
+def resumen_lote(tarea, resultados):
+    """Indicadores del lote (ponderados por área) para resumen.json y resumen_batch.csv."""
+    gdf = resultados['gdf_completo']
+    area = gdf['area_ha'].astype(float)
+    pesos = area if area.sum() > 0 else None
+    df_power = resultados.get('df_power')
+    dem = resultados.get('dem_data') or {}
+    satelital = resultados.get('datos_satelitales') or {}
+    agroclima = (resultados.get('agroclima') or {}).get('resumen', {})
+    etapas_respaldo = [e['etapa'] for e in resultados.get('etapas', []) if e.get('respaldo')]
+    return {
+        'id_lote': tarea['id_lote'],
+        'nombre_lote': tarea['nombre_lote'],
+        'archivo': tarea['archivo'],
+        'cultivo': tarea['cultivo'],
+        'area_ha': round(float(resultados['area_total']), 2),
+        'zonas': len(gdf),
+        'indice_npk': _promedio(gdf, 'fert_npk_actual', pesos, 3),
+        'ndvi': _promedio(gdf, 'fert_ndvi', pesos, 3),
+        'rec_n_kg_ha': _promedio(gdf, 'rec_N', pesos, 1),
+        'rec_p_kg_ha': _promedio(gdf, 'rec_P', pesos, 1),
+        'rec_k_kg_ha': _promedio(gdf, 'rec_K', pesos, 1),
+        'costo_total_usd': round(float((gdf['costo_costo_total'].astype(float) * area).sum()), 2),
+        'rend_sin_fert_kg_ha': _promedio(gdf, 'proy_rendimiento_sin_fert', pesos, 0),
+        'rend_con_fert_kg_ha': _promedio(gdf, 'proy_rendimiento_con_fert', pesos, 0),
+        'textura_predominante': gdf['textura_suelo'].mode()[0] if len(gdf) else 'N/D',
+        'fuente_satelital': satelital.get('fuente', 'N/D'),
+        'fuente_dem': dem.get('fuente', 'N/D'),
+        'curvas_nivel': len(dem.get('curvas_nivel') or []),
+        'precipitacion_mm': round(float(df_power['precipitacion'].sum()), 1) if df_power is not None else None,
+        'gdd': agroclima.get('gdd'),
+        'et0_mm': agroclima.get('et0_penman_monteith_mm'),
+        'deficit_hidrico_mm': agroclima.get('deficit_hidrico_mm'),
+        'dias_estres_hidrico': agroclima.get('dias_estres_hidrico'),
+        'dias_calor': agroclima.get('dias_calor'),
+        'dias_helada': agroclima.get('dias_helada'),
+        'rend_limitado_agua_kg_ha': (_promedio(gdf, 'proy_rendimiento_limitado_agua', pesos, 0)
+                                     if 'proy_rendimiento_limitado_agua' in gdf else None),
+        'etapas_respaldo': etapas_respaldo,
+    }
+
+
+def _reporte_markdown(tarea, resumen, gdf):
+    lineas = [
+        f"# Reporte del lote {resumen['nombre_lote']}",
+        "",
+        f"- Cultivo: {resumen['cultivo']}",
+        f"- Área: {resumen['area_ha']} ha en {resumen['zonas']} zonas",
+        f"- Período: {tarea['fecha_inicio']} a {tarea['fecha_fin']} ({tarea['satelite']}, {tarea['indice']})",
+        f"- Fuente satelital: {resumen['fuente_satelital']} · DEM: {resumen['fuente_dem']} "
+        f"({resumen['curvas_nivel']} curvas cada {tarea['intervalo_curvas']} m)",
+        f"- Precipitación del período: {resumen['precipitacion_mm'] if resumen['precipitacion_mm'] is not None else 'N/D'} mm",
+        f"- Grados día: {resumen['gdd'] if resumen['gdd'] is not None else 'N/D'} · "
+        f"ET0: {resumen['et0_mm'] if resumen['et0_mm'] is not None else 'N/D'} mm · "
+        f"déficit hídrico: {resumen['deficit_hidrico_mm'] if resumen['deficit_hidrico_mm'] is not None else 'N/D'} mm · "
+        f"días con calor / helada: {resumen['dias_calor']} / {resumen['dias_helada']}",
+        f"- Dosis media N/P/K: {resumen['rec_n_kg_ha']} / {resumen['rec_p_kg_ha']} / {resumen['rec_k_kg_ha']} kg/ha",
+        f"- Costo total de fertilización: {resumen['costo_total_usd']} USD",
+        f"- Rendimiento sin / con fertilización: {resumen['rend_sin_fert_kg_ha']:.0f} / {resumen['rend_con_fert_kg_ha']:.0f} kg/ha",
+        "",
+        "| Zona | Área (ha) | NPK | N | P | K | Rend. con fert. (kg/ha) | Textura |",
+        "|---:|---:|---:|---:|---:|---:|---:|---|",
+    ]
+    for fila in gdf.itertuples():
+        lineas.append(f"| {fila.id_zona} | {fila.area_ha:.2f} | {fila.fert_npk_actual:.3f} | {fila.rec_N:.1f} | "
+                      f"{fila.rec_P:.1f} | {fila.rec_K:.1f} | {fila.proy_rendimiento_con_fert:.0f} | {fila.textura_suelo} |")
+    return "\n".join(lineas) + "\n"
+
+
+def guardar_resultados_lote(tarea, resultados, directorio):
+    """Escribe las capas y el reporte del lote; resumen.json va al final (checkpoint)."""
+    gdf = resultados['gdf_completo']
+    columnas_float64(gdf).to_file(os.path.join(directorio, 'zonas.geojson'), driver='GeoJSON')
+    pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).to_csv(os.path.join(directorio, 'zonas.csv'), index=False)
+    if resultados.get('df_power') is not None:
+        resultados['df_power'].to_csv(os.path.join(directorio, 'clima.csv'), index=False)
+    if resultados.get('agroclima') is not None:
+        resultados['agroclima']['anual'].to_csv(os.path.join(directorio, 'agroclima.csv'), index=False)
+    dem = resultados.get('dem_data') or {}
+    if dem.get('curvas_nivel'):
+        gpd.GeoDataFrame({'elevacion': dem['elevaciones']}, geometry=dem['curvas_nivel'], crs='EPSG:4326') \
+            .to_file(os.path.join(directorio, 'curvas_nivel.geojson'), driver='GeoJSON')
+    prescripcion = resultados.get('prescripcion') or {}
+    if prescripcion.get('archivo'):
+        shutil.copyfile(prescripcion['archivo'], os.path.join(directorio, 'prescripcion.tif'))
+
+    resumen = resumen_lote(tarea, resultados)
+    with open(os.path.join(directorio, 'reporte.md'), 'w', encoding='utf-8') as f:
+        f.write(_reporte_markdown(tarea, resumen, gdf))
+    return resumen
+
+
+def procesar_lote(tarea):
+    """Worker del batch: análisis completo de un lote y escritura de sus resultados."""
+    directorio = os.path.join(tarea['salida'], tarea['id_lote'])
+    os.makedirs(directorio, exist_ok=True)
+    inicio = time.perf_counter()
+    resultado = {'id_lote': tarea['id_lote'], 'exitoso': False, 'error': None, 'segundos': 0.0}
+    avisos = []
+    try:
+        if tarea['satelite'] in SATELITES_GEE and not _estado_worker['gee_intentado']:
+            _estado_worker['gee_intentado'] = True
+            if not gee_autenticado():
+                inicializar_gee()
+        gdf = gpd.GeoDataFrame({'id_zona': [1]}, geometry=[wkb.loads(tarea['geometria_wkb'])], crs='EPSG:4326')
+        reportador = Reportador(destino_logging(prefijo=f"{tarea['id_lote']}: "),
+                                destino_lista(avisos, ('advertencia', 'error')))
+        with usar_reportador(reportador):
+            resultados = ejecutar_analisis_completo(
+                gdf, tarea['cultivo'], tarea['n_divisiones'], tarea['satelite'],
+                tarea['fecha_inicio'], tarea['fecha_fin'], tarea['intervalo_curvas'],
+                tarea['resolucion_dem'], tarea['indice'],
+                resolucion_prescripcion=tarea['resolucion_prescripcion']
+            )
+        if not resultados['exitoso']:
+            raise RuntimeError(resultados.get('error') or "El análisis completo no terminó")
+        resumen = guardar_resultados_lote(tarea, resultados, directorio)
+        resultado['segundos'] = time.perf_counter() - inicio
+        resumen.update({
+            'segundos': round(resultado['segundos'], 2),
+            'procesado': datetime.now().isoformat(timespec='seconds'),
+            'etapas': resultados.get('etapas', []),
+            'avisos': [f"[{a['etapa'] or '-'}] {a['mensaje']}" for a in avisos],
+        })
+        if os.path.exists(os.path.join(directorio, ARCHIVO_ERROR)):
+            os.remove(os.path.join(directorio, ARCHIVO_ERROR))
+        _escribir_json(os.path.join(directorio, ARCHIVO_RESUMEN), resumen)
+        resultado['exitoso'] = True
+    except Exception as e:
+        resultado['error'] = str(e)
+        resultado['segundos'] = time.perf_counter() - inicio
+        _escribir_json(os.path.join(directorio, ARCHIVO_ERROR),
+                       {'id_lote': tarea['id_lote'], 'error': str(e), 'traceback': traceback.format_exc()})
+    return resultado
+
+
+# ===== CORRIDA =====
+def lote_completado(salida, id_lote):
+    """
+    True si el lote tiene resumen.json sin etapas de respaldo; los lotes que
+    usaron datos simulados o un DEM sintético se reprocesan al retomar.
+    """
+    ruta = os.path.join(salida, id_lote, ARCHIVO_RESUMEN)
+    if not os.path.exists(ruta):
+        return False
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return not json.load(f).get('etapas_respaldo')
+    except (OSError, ValueError):
+        return False
+
+
+def resumen_batch(salida, tareas):
+    """Una fila por lote completado (de esta corrida o de corridas anteriores)."""
+    filas = []
+    for tarea in tareas:
+        ruta = os.path.join(salida, tarea['id_lote'], ARCHIVO_RESUMEN)
+        if os.path.exists(ruta):
+            with open(ruta, encoding='utf-8') as f:
+                fila = json.load(f)
+            fila.pop('etapas', None)
+            fila.pop('avisos', None)
+            fila['etapas_respaldo'] = ', '.join(fila.get('etapas_respaldo') or [])
+            filas.append(fila)
+    return pd.DataFrame(filas)
+
+
+def precargar_clima(tareas):
+    """
+    Descarga el clima de NASA POWER de todos los lotes antes de repartirlos:
+    una vez por celda de 0,5° y ventana de fechas, así cada worker lo lee de la
+    caché en disco en lugar de pedirlo a la API.
+    """
+    ventanas = defaultdict(dict)
+    for tarea in tareas:
+        centroide = wkb.loads(tarea['geometria_wkb']).centroid
+        ventanas[(tarea['fecha_inicio'], tarea['fecha_fin'])][tarea['id_lote']] = (centroide.y, centroide.x)
+    for (fecha_inicio, fecha_fin), ubicaciones in ventanas.items():
+        obtener_clima_lotes(ubicaciones, fecha_inicio, fecha_fin)
+
+
+def ejecutar_batch(tareas, salida, max_procesos=MAX_PROCESOS_LOTES, reanudar=True, al_avanzar=None):
+    """
+    Procesa las tareas pendientes en un pool de procesos (los lotes con
+    resumen.json y sin etapas de respaldo se saltean si `reanudar`), escribe
+    resumen_batch.csv y devuelve las métricas de la corrida, incluido el
+    rendimiento en lotes/min.
+    """
+    os.makedirs(salida, exist_ok=True)
+    pendientes = [{**t, 'salida': salida} for t in tareas
+                  if not (reanudar and lote_completado(salida, t['id_lote']))]
+    inicio = time.perf_counter()
+    precargar_clima(pendientes)
+    resultados = ejecutar_lotes_en_paralelo(pendientes, max_procesos, al_avanzar,
+                                            funcion=procesar_lote, inicializador=_inicializar_worker)
+    segundos = time.perf_counter() - inicio
+
+    resumen = resumen_batch(salida, tareas)
+    if len(resumen):
+        resumen.to_csv(os.path.join(salida, ARCHIVO_RESUMEN_BATCH), index=False)
+    fallidos = [r for r in resultados if not r['exitoso']]
+    return {
+        'total': len(tareas),
+        'omitidos': len(tareas) - len(pendientes),
+        'procesados': len(resultados),
+        'exitosos': len(resultados) - len(fallidos),
+        'fallidos': fallidos,
+        'segundos': segundos,
+        'lotes_por_minuto': len(resultados) / (segundos / 60) if segundos > 0 and resultados else 0.0,
+        'resumen': resumen,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m modules.batch',
+        description="Análisis completo de muchos lotes sin interfaz, con checkpoints para retomar."
+    )
+    parser.add_argument('origen', help="Directorio de límites, manifiesto .csv o archivo vectorial con varios lotes")
+    parser.add_argument('--salida', default='resultados_batch', help="Directorio de resultados (default: %(default)s)")
+    parser.add_argument('--cultivo', choices=CULTIVOS, help="Cultivo (obligatorio si el manifiesto no lo trae)")
+    parser.add_argument('--zonas', dest='n_divisiones', type=int, help="Zonas de manejo por lote (default: 32)")
+    parser.add_argument('--satelite', help="Fuente satelital (default: DATOS_SIMULADOS)")
+    parser.add_argument('--indice', help="Índice de vegetación (default: NDVI)")
+    parser.add_argument('--desde', dest='fecha_inicio', help="Fecha inicio AAAA-MM-DD (default: hace 30 días)")
+    parser.add_argument('--hasta', dest='fecha_fin', help="Fecha fin AAAA-MM-DD (default: hoy)")
+    parser.add_argument('--intervalo-curvas', dest='intervalo_curvas', type=float, help="Metros entre curvas (default: 5)")
+    parser.add_argument('--resolucion-dem', dest='resolucion_dem', type=float, help="Resolución del DEM sintético en m (default: 10)")
+    parser.add_argument('--prescripcion-pixel', dest='resolucion_prescripcion', type=float, metavar='METROS',
+                        help="Prescripción por píxel a esta resolución, con prescripcion.tif por lote (default: por zona)")
+    parser.add_argument('--procesos', type=int, default=MAX_PROCESOS_LOTES, help="Procesos en paralelo (default: %(default)s)")
+    parser.add_argument('--sin-reanudar', action='store_true', help="Reprocesar también los lotes ya completados")
+    args = parser.parse_args(argv)
+    _inicializar_worker()
+
+    parametros = {k: getattr(args, k) for k in PARAMETROS_LOTE}
+    try:
+        tareas = cargar_tareas(args.origen, **parametros)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not tareas:
+        parser.error(f"No se encontraron límites en {args.origen}")
+
+    def al_avanzar(completados, total):
+        print(f"\r  {completados}/{total} lotes", end='', file=sys.stderr, flush=True)
+
+    print(f"📦 {len(tareas)} lote(s) → {os.path.abspath(args.salida)}", file=sys.stderr)
+    corrida = ejecutar_batch(tareas, args.salida, args.procesos, not args.sin_reanudar, al_avanzar)
+    if corrida['procesados']:
+        print(file=sys.stderr)
+    for fallido in corrida['fallidos']:
+        print(f"⚠️ Lote {fallido['id_lote']}: {fallido['error']}", file=sys.stderr)
+    print(f"✅ {corrida['exitosos']}/{corrida['procesados']} lote(s) procesados en {corrida['segundos']:.1f} s "
+          f"({corrida['lotes_por_minuto']:.1f} lotes/min); {corrida['omitidos']} ya estaban completos")
+    return 1 if corrida['fallidos'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
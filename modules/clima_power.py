@@ -0,0 +1,305 @@
+# modules/clima_power.py - Series diarias de NASA POWER: caché Parquet por celda de 0,5° y descarga agrupada de muchos lotes
+import os
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import eventos
+from .almacenamiento import directorio_datos
+
+URL_POWER_PUNTO = "https://power.larc.nasa.gov/api/temporal/daily/point"
+URL_POWER_REGIONAL = "https://power.larc.nasa.gov/api/temporal/daily/regional"
+# Parámetro de POWER -> columna de df_power
+PARAMETROS_POWER = {
+    'ALLSKY_SFC_SW_DWN': 'radiacion_solar',
+    'WS2M': 'viento_2m',
+    'T2M': 'temperatura',
+    'PRECTOTCORR': 'precipitacion',
+    'T2M_MAX': 'temperatura_max',
+    'T2M_MIN': 'temperatura_min',
+    'RH2M': 'humedad_relativa',
+}
+COLUMNAS_POWER = ['fecha'] + list(PARAMETROS_POWER.values())
+# Grilla nativa de POWER: todos los puntos de una celda devuelven la misma serie
+PASO_GRILLA_POWER = 0.5
+# Días recientes que POWER todavía puede completar: si vienen vacíos no se guardan
+DIAS_LATENCIA_POWER = 7
+VALOR_FALTANTE_POWER = -999
+TIMEOUT_POWER = (10, 60)
+REINTENTOS_POWER = 3
+DIRECTORIO_POWER = 'clima_power'
+# El endpoint regional pide una variable por solicitud sobre una caja de 2° a 10° de lado:
+# conviene cuando una caja de hasta 10° reúne más celdas que variables a descargar
+LADO_MIN_REGIONAL = 2.0
+LADO_MAX_REGIONAL = 10.0
+MIN_CELDAS_REGIONAL = 2 * len(PARAMETROS_POWER)
+
+
+def celda_power(lat, lon):
+    """Centro de la celda de 0,5° de POWER que contiene el punto (lat, lon)."""
+    return (round(round(lat / PASO_GRILLA_POWER) * PASO_GRILLA_POWER, 2),
+            round(round(lon / PASO_GRILLA_POWER) * PASO_GRILLA_POWER, 2))
+
+
+def sesion_power():
+    """Sesión HTTP con reintentos y espera exponencial ante errores de red, 429 y 5xx."""
+    reintentos = Retry(total=REINTENTOS_POWER, backoff_factor=1.0,
+                       status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',))
+    sesion = requests.Session()
+    sesion.mount('https://', HTTPAdapter(max_retries=reintentos))
+    return sesion
+
+
+def _tramos_faltantes(faltantes):
+    """Agrupa fechas faltantes (ordenadas) en tramos consecutivos [(inicio, fin), ...]."""
+    if len(faltantes) == 0:
+        return []
+    cortes = np.flatnonzero(np.diff(faltantes.values.astype('datetime64[D]').astype(np.int64)) > 1)
+    inicios = np.r_[0, cortes + 1]
+    fines = np.r_[cortes, len(faltantes) - 1]
+    return [(faltantes[i].date(), faltantes[j].date()) for i, j in zip(inicios, fines)]
+
+
+def serie_desde_parametros(series):
+    """DataFrame de df_power (con NaN en los faltantes) a partir de properties.parameter de POWER."""
+    fechas = pd.to_datetime(list(series[next(iter(PARAMETROS_POWER))].keys()), format='%Y%m%d')
+    df = pd.DataFrame({'fecha': fechas})
+    for parametro, columna in PARAMETROS_POWER.items():
+        df[columna] = np.asarray(list(series[parametro].values()), dtype=float)
+    return df.replace(VALOR_FALTANTE_POWER, np.nan)
+
+
+def descargar_power_punto(lat, lon, fecha_inicio, fecha_fin, sesion=None):
+    """Serie diaria de POWER para un punto; lanza excepción si la API no responde o no trae datos."""
+    params = {
+        'parameters': ','.join(PARAMETROS_POWER),
+        'community': 'RE',
+        'longitude': lon,
+        'latitude': lat,
+        'start': fecha_inicio.strftime("%Y%m%d"),
+        'end': fecha_fin.strftime("%Y%m%d"),
+        'format': 'JSON'
+    }
+    response = (sesion or sesion_power()).get(URL_POWER_PUNTO, params=params, timeout=TIMEOUT_POWER)
+    response.raise_for_status()
+    data = response.json()
+    if 'properties' not in data or 'parameter' not in data['properties']:
+        raise ValueError(f"Respuesta de NASA POWER sin datos: {data.get('messages') or data.get('message')}")
+    return serie_desde_parametros(data['properties']['parameter'])
+
+
+class CachePower:
+    """
+    Series diarias de NASA POWER guardadas en Parquet, un archivo por celda
+    de 0,5°. Una consulta sólo descarga los días que faltan en disco (en
+    tramos consecutivos), así ventanas superpuestas salen casi enteras del
+    disco y los lotes de una misma celda comparten la serie.
+    """
+
+    def __init__(self, directorio=None):
+        self.directorio = directorio or directorio_datos(DIRECTORIO_POWER)
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def ruta(self, celda):
+        lat, lon = celda
+        return os.path.join(self.directorio, f"power_{lat:+07.2f}_{lon:+08.2f}.parquet")
+
+    def leer(self, celda):
+        ruta = self.ruta(celda)
+        if os.path.exists(ruta):
+            serie = pd.read_parquet(ruta)
+            # Una serie guardada con menos variables que PARAMETROS_POWER se vuelve a descargar
+            if set(COLUMNAS_POWER) <= set(serie.columns):
+                return serie[COLUMNAS_POWER]
+        return pd.DataFrame({c: pd.Series(dtype='datetime64[ns]' if c == 'fecha' else float)
+                             for c in COLUMNAS_POWER})
+
+    def guardar(self, celda, nuevos):
+        """Incorpora días descargados a la serie de la celda; devuelve la serie completa."""
+        limite = pd.Timestamp(date.today() - timedelta(days=DIAS_LATENCIA_POWER))
+        completos = nuevos[COLUMNAS_POWER[1:]].notna().all(axis=1)
+        nuevos = nuevos[completos | (nuevos['fecha'] < limite)]
+        serie = pd.concat([self.leer(celda), nuevos], ignore_index=True)
+        serie = serie.drop_duplicates('fecha', keep='last').sort_values('fecha', ignore_index=True)
+        ruta = self.ruta(celda)
+        # Nombre único: dos hilos o procesos pueden completar la misma celda a la vez
+        tmp = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        serie.to_parquet(tmp, index=False)
+        os.replace(tmp, ruta)
+        return serie
+
+    def faltantes(self, celda, fecha_inicio, fecha_fin, serie=None):
+        """Tramos [(inicio, fin)] de la ventana que todavía no están en disco."""
+        serie = self.leer(celda) if serie is None else serie
+        fechas = pd.date_range(pd.Timestamp(fecha_inicio).normalize(), pd.Timestamp(fecha_fin).normalize(), freq='D')
+        return _tramos_faltantes(fechas[~fechas.isin(serie['fecha'])])
+
+    def completar(self, celda, fecha_inicio, fecha_fin, descargar, sesion=None):
+        """
+        Descarga con `descargar(celda, inicio, fin, sesion)` los tramos que faltan
+        de la celda y devuelve la serie en disco. Si la red falla, la serie queda
+        incompleta: se avisa cuántos días faltan y recortar_serie lo marca en el df_power.
+        """
+        serie = self.leer(celda)
+        tramos = self.faltantes(celda, fecha_inicio, fecha_fin, serie)
+        for inicio, fin in tramos:
+            try:
+                serie = self.guardar(celda, descargar(celda, inicio, fin, sesion))
+            except Exception as e:
+                dias = sum((f - i).days + 1 for i, f in self.faltantes(celda, fecha_inicio, fecha_fin, serie))
+                eventos.advertencia(f"NASA POWER no respondió para la celda {celda} ({inicio} a {fin}): {e}. "
+                                    f"La serie queda incompleta (faltan {dias} días).")
+                break
+        return serie
+
+    def serie(self, lat, lon, fecha_inicio, fecha_fin, sesion=None):
+        """df_power de la celda del punto para la ventana pedida, o None si no hay datos."""
+        celda = celda_power(lat, lon)
+        fecha_fin = min(pd.Timestamp(fecha_fin).date(), date.today())
+        serie = self.completar(celda, fecha_inicio, fecha_fin,
+                               lambda c, inicio, fin, s: descargar_power_punto(*c, inicio, fin, s), sesion)
+        return recortar_serie(serie, fecha_inicio, fecha_fin)
+
+
+def recortar_serie(serie, fecha_inicio, fecha_fin):
+    """
+    Días de la ventana con todas las variables presentes, como df_power, o None si no
+    queda ninguno. Los días que faltan (descarga fallida o todavía no publicados) se
+    informan en df_power.attrs['dias_faltantes'] (ver serie_completa).
+    """
+    inicio, fin = pd.Timestamp(fecha_inicio).normalize(), pd.Timestamp(fecha_fin).normalize()
+    df_power = serie[(serie['fecha'] >= inicio) & (serie['fecha'] <= fin)].dropna().reset_index(drop=True)
+    if df_power.empty:
+        return None
+    df_power.attrs['dias_faltantes'] = max((fin - inicio).days + 1 - len(df_power), 0)
+    return df_power
+
+
+def serie_completa(df_power, fecha_inicio, fecha_fin):
+    """True si df_power trae todos los días de la ventana (hasta hoy) con todas las variables."""
+    if df_power is None:
+        return False
+    if 'dias_faltantes' in df_power.attrs:
+        return df_power.attrs['dias_faltantes'] == 0
+    fecha_fin = min(pd.Timestamp(fecha_fin).date(), date.today())
+    dias = (pd.Timestamp(fecha_fin) - pd.Timestamp(fecha_inicio).normalize()).days + 1
+    return len(df_power) >= dias
+
+
+# ===== SERVICIO DE CLIMA PARA MUCHOS LOTES =====
+def _caja_regional(celdas):
+    """(lat_min, lat_max, lon_min, lon_max) que cubre las celdas, con el lado mínimo que acepta POWER."""
+    lats, lons = np.array(celdas, dtype=float).T
+    caja = []
+    for minimo, maximo in ((lats.min(), lats.max()), (lons.min(), lons.max())):
+        minimo, maximo = minimo - PASO_GRILLA_POWER / 2, maximo + PASO_GRILLA_POWER / 2
+        falta = max(LADO_MIN_REGIONAL - (maximo - minimo), 0) / 2
+        caja += [float(minimo - falta), float(maximo + falta)]
+    return tuple(caja)
+
+
+def descargar_power_regional(celdas, fecha_inicio, fecha_fin, sesion=None):
+    """
+    Series diarias de todas las celdas de POWER dentro de la caja que cubre
+    `celdas` (una solicitud por variable). Devuelve {celda: DataFrame}.
+    """
+    sesion = sesion or sesion_power()
+    lat_min, lat_max, lon_min, lon_max = _caja_regional(celdas)
+    por_celda = defaultdict(dict)
+    for parametro in PARAMETROS_POWER:
+        params = {
+            'parameters': parametro,
+            'community': 'RE',
+            'latitude-min': lat_min,
+            'latitude-max': lat_max,
+            'longitude-min': lon_min,
+            'longitude-max': lon_max,
+            'start': fecha_inicio.strftime("%Y%m%d"),
+            'end': fecha_fin.strftime("%Y%m%d"),
+            'format': 'JSON'
+        }
+        response = sesion.get(URL_POWER_REGIONAL, params=params, timeout=TIMEOUT_POWER)
+        response.raise_for_status()
+        for feature in response.json().get('features', []):
+            lon, lat = feature['geometry']['coordinates'][:2]
+            serie = feature.get('properties', {}).get('parameter', {}).get(parametro)
+            if serie:
+                por_celda[celda_power(lat, lon)][parametro] = serie
+    return {celda: serie_desde_parametros(series) for celda, series in por_celda.items()
+            if len(series) == len(PARAMETROS_POWER)}
+
+
+def _bloques_regionales(celdas):
+    """
+    Celdas empaquetadas en bloques de a lo sumo LADO_MAX_REGIONAL de lado (lo máximo
+    que cubre una solicitud regional). Se agrupan por extensión, no por una grilla
+    fija, así un conjunto de lotes que cruza un múltiplo de 10° queda en un solo bloque.
+    Primer ajuste sobre las celdas ordenadas: cada celda va al primer bloque que la
+    admite sin pasarse del lado máximo.
+    """
+    lado_centros = LADO_MAX_REGIONAL - PASO_GRILLA_POWER
+    bloques = []   # [lat_min, lat_max, lon_min, lon_max, celdas]
+    for celda in sorted(celdas):
+        lat, lon = celda
+        for bloque in bloques:
+            if max(bloque[1], lat) - min(bloque[0], lat) <= lado_centros and \
+                    max(bloque[3], lon) - min(bloque[2], lon) <= lado_centros:
+                bloque[:4] = min(bloque[0], lat), max(bloque[1], lat), min(bloque[2], lon), max(bloque[3], lon)
+                bloque[4].append(celda)
+                break
+        else:
+            bloques.append([lat, lat, lon, lon, [celda]])
+    return [bloque[4] for bloque in bloques]
+
+
+def obtener_clima_lotes(ubicaciones, fecha_inicio, fecha_fin, cache=None, regional=True):
+    """
+    df_power de muchos lotes a la vez: {id: (lat, lon)} -> {id: df_power o None}.
+    Los lotes se agrupan por celda de 0,5° y cada celda se descarga una sola vez
+    (sólo los días que le faltan en disco); los bloques densos de celdas se piden
+    al endpoint regional y el resto punto por punto. Las solicitudes pasan de
+    O(lotes) a O(celdas).
+    """
+    cache = cache or CachePower()
+    fecha_fin = min(pd.Timestamp(fecha_fin).date(), date.today())
+    lotes_por_celda = defaultdict(list)
+    for id_lote, (lat, lon) in ubicaciones.items():
+        lotes_por_celda[celda_power(lat, lon)].append(id_lote)
+
+    sesion = sesion_power()
+    solicitudes = 0
+    faltantes = {celda: cache.faltantes(celda, fecha_inicio, fecha_fin) for celda in lotes_por_celda}
+    if regional:
+        for bloque in _bloques_regionales([celda for celda, tramos in faltantes.items() if tramos]):
+            if len(bloque) < MIN_CELDAS_REGIONAL:
+                continue
+            inicio = min(faltantes[celda][0][0] for celda in bloque)
+            fin = max(faltantes[celda][-1][1] for celda in bloque)
+            try:
+                solicitudes += len(PARAMETROS_POWER)
+                series = descargar_power_regional(bloque, inicio, fin, sesion)
+            except Exception as e:
+                eventos.advertencia(f"Falló la descarga regional de NASA POWER ({len(bloque)} celdas): {e}")
+                continue
+            for celda in bloque:
+                if celda in series:
+                    cache.guardar(celda, series[celda])
+                    faltantes[celda] = cache.faltantes(celda, fecha_inicio, fecha_fin)
+
+    clima = {}
+    for n, (celda, lotes) in enumerate(lotes_por_celda.items()):
+        solicitudes += len(faltantes[celda])
+        serie = cache.completar(celda, fecha_inicio, fecha_fin,
+                                lambda c, inicio, fin, s: descargar_power_punto(*c, inicio, fin, s), sesion)
+        df_power = recortar_serie(serie, fecha_inicio, fecha_fin)
+        clima.update({id_lote: df_power for id_lote in lotes})
+        eventos.progreso((n + 1) / len(lotes_por_celda), f"Clima NASA POWER: celda {n + 1}/{len(lotes_por_celda)}")
+    eventos.info(f"Clima NASA POWER: {len(ubicaciones)} lote(s) en {len(lotes_por_celda)} celda(s), "
+                 f"{solicitudes} solicitud(es) a la API")
+    return clima
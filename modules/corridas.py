@@ -0,0 +1,298 @@
+# modules/corridas.py - Almacén de corridas del análisis completo: GeoParquet + NPZ + JSON por corrida
+import os
+import json
+import uuid
+import shutil
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from . import eventos
+from .almacenamiento import directorio_datos
+
+DIRECTORIO_CORRIDAS = 'corridas'
+ARCHIVO_METADATOS = 'metadatos.json'
+ARCHIVO_DEM = 'dem.npz'
+ARCHIVO_CURVAS = 'curvas.parquet'
+ARCHIVO_PRESCRIPCION = 'prescripcion.tif'
+ARCHIVO_PRESCRIPCION_ZONAS = 'prescripcion_zonas.parquet'
+ARCHIVO_VISTA_PREVIA = 'prescripcion.npz'
+# Tablas de la etapa agroclima -> archivo Parquet (el resumen va en metadatos.json)
+TABLAS_AGROCLIMA = {
+    'diario': 'agroclima_diario.parquet',
+    'anual': 'agroclima_anual.parquet',
+    'zonas': 'agroclima_zonas.parquet',
+}
+VERSION_CORRIDA = 1
+# Tablas de resultados -> archivo Parquet (GeoParquet para las que tienen geometría)
+TABLAS_CORRIDA = {
+    'gdf_completo': 'zonas.parquet',
+    'gdf_dividido': 'textura.parquet',
+    'fertilidad_actual': 'fertilidad.parquet',
+    'costos': 'costos.parquet',
+    'proyecciones': 'proyecciones.parquet',
+    'recomendaciones_npk': 'npk.parquet',
+    'df_power': 'clima.parquet',
+}
+PARAMETROS_FECHA = ('fecha_inicio', 'fecha_fin')
+
+
+def _a_json(valor):
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, np.ndarray):
+        return valor.tolist()
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return str(valor)
+
+
+def _promedio(gdf, columna, pesos):
+    if columna not in gdf.columns or pesos.sum() <= 0:
+        return None
+    return float(np.average(gdf[columna].astype(float), weights=pesos))
+
+
+def resumen_corrida(resultados):
+    """Indicadores del establecimiento para listar y comparar corridas (promedios ponderados por área)."""
+    gdf = resultados.get('gdf_completo')
+    if gdf is None or len(gdf) == 0:
+        return {'area_ha': float(resultados.get('area_total') or 0), 'zonas': 0}
+    area = gdf['area_ha'].astype(float).to_numpy()
+    rendimiento_con = _promedio(gdf, 'proy_rendimiento_con_fert', area)
+    agroclima = (resultados.get('agroclima') or {}).get('resumen', {})
+    return {
+        'area_ha': round(float(resultados.get('area_total') or area.sum()), 2),
+        'zonas': int(len(gdf)),
+        'npk_promedio': _promedio(gdf, 'fert_npk_actual', area),
+        'ndvi_promedio': _promedio(gdf, 'fert_ndvi', area),
+        'materia_organica_promedio': _promedio(gdf, 'fert_materia_organica', area),
+        'costo_total_usd': float((gdf['costo_costo_total'] * area).sum()) if 'costo_costo_total' in gdf else None,
+        'rendimiento_sin_fert_kg_ha': _promedio(gdf, 'proy_rendimiento_sin_fert', area),
+        'rendimiento_con_fert_kg_ha': rendimiento_con,
+        'produccion_con_fert_t': rendimiento_con * area.sum() / 1000 if rendimiento_con is not None else None,
+        'rendimiento_limitado_agua_kg_ha': _promedio(gdf, 'proy_rendimiento_limitado_agua', area),
+        'gdd': agroclima.get('gdd'),
+        'deficit_hidrico_mm': agroclima.get('deficit_hidrico_mm'),
+    }
+
+
+class AlmacenCorridas:
+    """
+    Corridas del análisis completo persistidas en disco, una carpeta por id:
+    zonas y tablas en (Geo)Parquet, grillas del DEM en NPZ comprimido, curvas
+    de nivel en GeoParquet, el GeoTIFF de prescripción por píxel si lo hay y
+    parámetros, resumen y registro de etapas en JSON.
+    Cargar una corrida reconstruye el dict `resultados` sin recalcular nada.
+    Cada corrida lleva la clave de su propietario (el espacio de trabajo que la
+    guardó) y listar() muestra sólo las de ese espacio.
+    """
+
+    def __init__(self, directorio=None):
+        self.directorio = directorio or directorio_datos(DIRECTORIO_CORRIDAS)
+        os.makedirs(self.directorio, exist_ok=True)
+        # id -> (mtime de metadatos.json, fila del listado o None si no se pudo leer)
+        self._filas = {}
+        self._lock = threading.Lock()
+
+    def _ruta(self, id_corrida, *partes):
+        return os.path.join(self.directorio, id_corrida, *partes)
+
+    def guardar(self, resultados, nombre='', propietario=''):
+        """Guarda una corrida exitosa de `propietario` y devuelve su id (fecha-hora + sufijo aleatorio)."""
+        id_corrida = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        tmp = self._ruta(f".{id_corrida}.tmp")
+        os.makedirs(tmp)
+        try:
+            tablas = []
+            for clave, archivo in TABLAS_CORRIDA.items():
+                tabla = resultados.get(clave)
+                if isinstance(tabla, dict):
+                    tabla = pd.DataFrame(tabla)
+                if tabla is None:
+                    continue
+                tabla.to_parquet(os.path.join(tmp, archivo))
+                tablas.append(clave)
+
+            dem_data = resultados.get('dem_data')
+            dem_meta = None
+            if dem_data is not None:
+                arrays = {k: v for k, v in dem_data.items() if isinstance(v, np.ndarray)}
+                np.savez_compressed(os.path.join(tmp, ARCHIVO_DEM), **arrays)
+                curvas = dem_data.get('curvas_con_elevacion') or []
+                gpd.GeoDataFrame({'elevacion': [float(e) for _, e in curvas]},
+                                 geometry=[linea for linea, _ in curvas]).to_parquet(os.path.join(tmp, ARCHIVO_CURVAS))
+                dem_meta = {k: v for k, v in dem_data.items()
+                            if k not in arrays and k not in ('curvas_con_elevacion', 'curvas_nivel', 'elevaciones')}
+
+            prescripcion = resultados.get('prescripcion')
+            prescripcion_meta = None
+            if prescripcion is not None:
+                prescripcion['zonas'].to_parquet(os.path.join(tmp, ARCHIVO_PRESCRIPCION_ZONAS))
+                np.savez_compressed(os.path.join(tmp, ARCHIVO_VISTA_PREVIA), vista_previa=prescripcion['vista_previa'])
+                if prescripcion.get('archivo') and os.path.exists(prescripcion['archivo']):
+                    shutil.copyfile(prescripcion['archivo'], os.path.join(tmp, ARCHIVO_PRESCRIPCION))
+                prescripcion_meta = {k: v for k, v in prescripcion.items()
+                                     if k not in ('zonas', 'vista_previa', 'archivo')}
+
+            agroclima = resultados.get('agroclima')
+            if agroclima is not None:
+                for clave, archivo in TABLAS_AGROCLIMA.items():
+                    agroclima[clave].to_parquet(os.path.join(tmp, archivo))
+
+            parametros = resultados.get('parametros', {})
+            metadatos = {
+                'version': VERSION_CORRIDA,
+                'id': id_corrida,
+                'nombre': nombre,
+                'propietario': propietario,
+                'creada': datetime.now().isoformat(timespec='seconds'),
+                'cultivo': parametros.get('cultivo'),
+                'parametros': parametros,
+                'area_total': resultados.get('area_total'),
+                'datos_satelitales': resultados.get('datos_satelitales'),
+                'dem': dem_meta,
+                'prescripcion': prescripcion_meta,
+                'agroclima': agroclima['resumen'] if agroclima is not None else None,
+                'etapas': resultados.get('etapas', []),
+                'tablas': tablas,
+                'resumen': resumen_corrida(resultados),
+            }
+            with open(os.path.join(tmp, ARCHIVO_METADATOS), 'w', encoding='utf-8') as f:
+                json.dump(metadatos, f, ensure_ascii=False, indent=2, default=_a_json)
+            os.replace(tmp, self._ruta(id_corrida))
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return id_corrida
+
+    def metadatos(self, id_corrida):
+        with open(self._ruta(id_corrida, ARCHIVO_METADATOS), encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _fila(meta):
+        parametros = meta.get('parametros', {})
+        return {
+            'id': meta['id'], 'nombre': meta.get('nombre', ''), 'propietario': meta.get('propietario', ''),
+            'creada': meta['creada'], 'cultivo': meta.get('cultivo'), 'n_divisiones': parametros.get('n_divisiones'),
+            'satelite': parametros.get('satelite'), 'fecha_inicio': parametros.get('fecha_inicio'),
+            'fecha_fin': parametros.get('fecha_fin'), **meta.get('resumen', {}),
+        }
+
+    def listar(self, propietario=None):
+        """
+        Una fila por corrida (más recientes primero) con sus parámetros y resumen;
+        con `propietario`, sólo las de ese espacio. Cada metadatos.json se lee una
+        sola vez (de nuevo sólo si cambió) y los ilegibles se omiten con una advertencia.
+        """
+        filas = []
+        with self._lock:
+            presentes = set()
+            for id_corrida in os.listdir(self.directorio):
+                if id_corrida.startswith('.'):
+                    continue
+                try:
+                    modificado = os.path.getmtime(self._ruta(id_corrida, ARCHIVO_METADATOS))
+                except OSError:
+                    continue
+                presentes.add(id_corrida)
+                entrada = self._filas.get(id_corrida)
+                if entrada is None or entrada[0] != modificado:
+                    try:
+                        fila = self._fila(self.metadatos(id_corrida))
+                    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                        eventos.advertencia(f"⚠️ Se omite la corrida {id_corrida}: metadatos ilegibles ({e})")
+                        fila = None
+                    entrada = self._filas[id_corrida] = (modificado, fila)
+                if entrada[1] is not None and propietario in (None, entrada[1]['propietario']):
+                    filas.append(entrada[1])
+            for id_corrida in set(self._filas) - presentes:
+                del self._filas[id_corrida]
+        if not filas:
+            return pd.DataFrame(columns=['id', 'nombre', 'creada', 'cultivo'])
+        return pd.DataFrame(filas).sort_values('creada', ascending=False, ignore_index=True)
+
+    def cargar(self, id_corrida):
+        """dict `resultados` con la misma forma que devuelve ejecutar_analisis_completo."""
+        meta = self.metadatos(id_corrida)
+        parametros = dict(meta.get('parametros', {}))
+        for clave in PARAMETROS_FECHA:
+            if parametros.get(clave):
+                parametros[clave] = date.fromisoformat(parametros[clave][:10])
+        resultados = {
+            'exitoso': True, 'id_corrida': id_corrida, 'nombre_corrida': meta.get('nombre', ''),
+            'parametros': parametros, 'area_total': meta.get('area_total', 0),
+            'datos_satelitales': meta.get('datos_satelitales'), 'etapas': meta.get('etapas', []),
+            'mapas': {}, 'curvas_nivel': None, 'pendientes': None, 'dem_data': None, 'prescripcion': None, 'agroclima': None,
+            **{clave: None for clave in TABLAS_CORRIDA},
+        }
+        for clave in meta.get('tablas', []):
+            ruta = self._ruta(id_corrida, TABLAS_CORRIDA[clave])
+            try:
+                tabla = gpd.read_parquet(ruta)
+            except ValueError:
+                tabla = pd.read_parquet(ruta)
+            resultados[clave] = tabla
+        if resultados['recomendaciones_npk'] is not None:
+            npk = resultados['recomendaciones_npk']
+            resultados['recomendaciones_npk'] = {c: npk[c].to_numpy() for c in npk.columns}
+        resultados['textura'] = resultados['gdf_dividido']
+
+        if meta.get('dem') is not None:
+            with np.load(self._ruta(id_corrida, ARCHIVO_DEM)) as arrays:
+                dem_data = {**meta['dem'], **{k: arrays[k] for k in arrays.files}}
+            curvas = gpd.read_parquet(self._ruta(id_corrida, ARCHIVO_CURVAS))
+            dem_data['curvas_nivel'] = list(curvas.geometry)
+            dem_data['elevaciones'] = curvas['elevacion'].tolist()
+            dem_data['curvas_con_elevacion'] = list(zip(dem_data['curvas_nivel'], dem_data['elevaciones']))
+            resultados['dem_data'] = dem_data
+
+        if meta.get('prescripcion') is not None:
+            ruta_tiff = self._ruta(id_corrida, ARCHIVO_PRESCRIPCION)
+            with np.load(self._ruta(id_corrida, ARCHIVO_VISTA_PREVIA)) as arrays:
+                vista_previa = arrays['vista_previa']
+            resultados['prescripcion'] = {
+                **meta['prescripcion'],
+                'transform': tuple(meta['prescripcion']['transform']),
+                'archivo': ruta_tiff if os.path.exists(ruta_tiff) else None,
+                'vista_previa': vista_previa,
+                'zonas': pd.read_parquet(self._ruta(id_corrida, ARCHIVO_PRESCRIPCION_ZONAS)),
+            }
+
+        if meta.get('agroclima') is not None:
+            resultados['agroclima'] = {
+                'resumen': meta['agroclima'],
+                **{clave: pd.read_parquet(self._ruta(id_corrida, archivo)) for clave, archivo in TABLAS_AGROCLIMA.items()},
+            }
+        return resultados
+
+    def eliminar(self, id_corrida):
+        shutil.rmtree(self._ruta(id_corrida), ignore_errors=True)
+
+
+def comparar_corridas(almacen, id_a, id_b):
+    """Tabla indicador x corrida (con la diferencia b - a) para ver dos corridas lado a lado."""
+    metas = [almacen.metadatos(id_corrida) for id_corrida in (id_a, id_b)]
+    etiquetas = [meta.get('nombre') or meta['id'] for meta in metas]
+    if etiquetas[0] == etiquetas[1]:
+        etiquetas = [meta['id'] for meta in metas]
+    columnas = {}
+    for etiqueta, meta in zip(etiquetas, metas):
+        parametros = meta.get('parametros', {})
+        columnas[etiqueta] = {
+            'cultivo': meta.get('cultivo'),
+            'satelite': parametros.get('satelite'),
+            'periodo': f"{parametros.get('fecha_inicio')} a {parametros.get('fecha_fin')}",
+            **meta.get('resumen', {}),
+        }
+    tabla = pd.DataFrame(columnas)
+    a, b = tabla.columns[0], tabla.columns[-1]
+    numericas = pd.to_numeric(tabla[a], errors='coerce').notna() & pd.to_numeric(tabla[b], errors='coerce').notna()
+    tabla['diferencia'] = None
+    tabla.loc[numericas, 'diferencia'] = (pd.to_numeric(tabla.loc[numericas, b])
+                                          - pd.to_numeric(tabla.loc[numericas, a])).round(3)
+    return tabla
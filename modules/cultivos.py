@@ -0,0 +1,123 @@
+# modules/cultivos.py - Registro de cultivos: archivo de datos compilado a una tabla columnar tipada
+import json
+import os
+
+import numpy as np
+
+# Se puede apuntar a otro registro (p. ej. con cultivos propios) con la variable CULTIVOS_ARCHIVO
+ARCHIVO_CULTIVOS = os.environ.get(
+    'CULTIVOS_ARCHIVO',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos', 'cultivos.json')
+)
+
+# (columna de la tabla, ruta dentro de cada cultivo del registro, dtype)
+COLUMNAS_TABLA = [
+    ('n_min', ('parametros', 'NITROGENO', 'min'), np.float64),
+    ('n_max', ('parametros', 'NITROGENO', 'max'), np.float64),
+    ('p_min', ('parametros', 'FOSFORO', 'min'), np.float64),
+    ('p_max', ('parametros', 'FOSFORO', 'max'), np.float64),
+    ('k_min', ('parametros', 'POTASIO', 'min'), np.float64),
+    ('k_max', ('parametros', 'POTASIO', 'max'), np.float64),
+    ('materia_organica_optima', ('parametros', 'MATERIA_ORGANICA_OPTIMA'), np.float64),
+    ('humedad_optima', ('parametros', 'HUMEDAD_OPTIMA'), np.float64),
+    ('ndvi_optimo', ('parametros', 'NDVI_OPTIMO'), np.float64),
+    ('ndre_optimo', ('parametros', 'NDRE_OPTIMO'), np.float64),
+    ('rendimiento_optimo', ('parametros', 'RENDIMIENTO_OPTIMO'), np.float64),
+    ('costo_fertilizacion', ('parametros', 'COSTO_FERTILIZACION'), np.float64),
+    ('precio_venta', ('parametros', 'PRECIO_VENTA'), np.float64),
+    ('arena_optima', ('textura', 'arena_optima'), np.float64),
+    ('limo_optima', ('textura', 'limo_optima'), np.float64),
+    ('arcilla_optima', ('textura', 'arcilla_optima'), np.float64),
+    ('densidad_aparente_optima', ('textura', 'densidad_aparente_optima'), np.float64),
+    ('porosidad_optima', ('textura', 'porosidad_optima'), np.float64),
+    ('textura_optima', ('textura', 'textura_optima'), object),
+    ('temperatura_base', ('clima', 'temperatura_base'), np.float64),
+    ('temperatura_calor', ('clima', 'temperatura_calor'), np.float64),
+    ('temperatura_helada', ('clima', 'temperatura_helada'), np.float64),
+    ('kc', ('clima', 'kc'), np.float64),
+    ('profundidad_raices_m', ('clima', 'profundidad_raices_m'), np.float64),
+    ('fraccion_agotamiento', ('clima', 'fraccion_agotamiento'), np.float64),
+    ('ky', ('clima', 'ky'), np.float64),
+    ('dias_ciclo', ('clima', 'dias_ciclo'), np.float64),
+]
+
+
+def _valor(cultivo, ruta):
+    valor = cultivo
+    for clave in ruta:
+        if not isinstance(valor, dict) or clave not in valor:
+            raise ValueError(f"Cultivo '{cultivo.get('nombre', '?')}': falta '{'.'.join(ruta)}' en el registro")
+        valor = valor[clave]
+    return valor
+
+
+def cargar_registro(ruta=ARCHIVO_CULTIVOS):
+    """Lee y valida el archivo de cultivos; devuelve la lista de cultivos en su orden."""
+    with open(ruta, encoding='utf-8') as f:
+        datos = json.load(f)
+    cultivos = datos['cultivos'] if isinstance(datos, dict) else datos
+    nombres = [c.get('nombre') for c in cultivos]
+    if not nombres or any(not n for n in nombres):
+        raise ValueError(f"El registro {ruta} no tiene cultivos o hay cultivos sin 'nombre'")
+    repetidos = sorted({n for n in nombres if nombres.count(n) > 1})
+    if repetidos:
+        raise ValueError(f"Cultivos repetidos en {ruta}: {', '.join(repetidos)}")
+    for cultivo in cultivos:
+        for _, ruta_valor, _ in COLUMNAS_TABLA:
+            _valor(cultivo, ruta_valor)
+    return cultivos
+
+
+def compilar_tabla(cultivos):
+    """
+    Tabla columnar: una fila por cultivo (en el orden del registro) y un array
+    tipado por columna, para tomar parámetros por índice entero en las etapas
+    vectorizadas en lugar de buscar dicts anidados por nombre.
+    """
+    tabla = {'cultivo': np.array([c['nombre'] for c in cultivos], dtype=object)}
+    for columna, ruta, dtype in COLUMNAS_TABLA:
+        tabla[columna] = np.array([_valor(c, ruta) for c in cultivos], dtype=dtype)
+    return tabla
+
+
+# Se carga y compila una sola vez por proceso, al importar el módulo
+REGISTRO_CULTIVOS = cargar_registro()
+TABLA_CULTIVOS = compilar_tabla(REGISTRO_CULTIVOS)
+CULTIVOS = list(TABLA_CULTIVOS['cultivo'])
+INDICE_CULTIVOS = {nombre: i for i, nombre in enumerate(CULTIVOS)}
+
+
+def indices_cultivos(cultivos):
+    """Índices enteros (fila de TABLA_CULTIVOS) de una lista de cultivos."""
+    try:
+        return np.array([INDICE_CULTIVOS[c] for c in cultivos], dtype=np.intp)
+    except KeyError as e:
+        raise ValueError(f"Cultivo desconocido: {e.args[0]}") from None
+
+
+def parametros_cultivos(cultivos, columnas=None):
+    """Columnas de la tabla para los cultivos dados: dict columna -> array (C,)."""
+    idx = indices_cultivos(cultivos)
+    columnas = [c for c, _, _ in COLUMNAS_TABLA] if columnas is None else columnas
+    return {columna: TABLA_CULTIVOS[columna][idx] for columna in columnas}
+
+
+# ===== VISTAS POR NOMBRE (las usa el código que consulta un cultivo a la vez) =====
+VARIEDADES_CULTIVOS = {c['nombre']: list(c.get('variedades', [])) for c in REGISTRO_CULTIVOS}
+
+PARAMETROS_CULTIVOS = {
+    c['nombre']: {
+        **c['parametros'],
+        'VARIEDADES': VARIEDADES_CULTIVOS[c['nombre']],
+        'ZONAS_ARGENTINA': list(c.get('zonas_argentina', [])),
+    }
+    for c in REGISTRO_CULTIVOS
+}
+
+TEXTURA_SUELO_OPTIMA = {c['nombre']: dict(c['textura']) for c in REGISTRO_CULTIVOS}
+
+CLIMA_CULTIVOS = {c['nombre']: dict(c['clima']) for c in REGISTRO_CULTIVOS}
+
+ICONOS_CULTIVOS = {c['nombre']: c.get('icono', '🌱') for c in REGISTRO_CULTIVOS}
+
+COLORES_CULTIVOS = {c['nombre']: c.get('color', '#808080') for c in REGISTRO_CULTIVOS}
@@ -0,0 +1,516 @@
+# modules/datos_externos.py - Fuentes externas: satélite (GEE / simulado) y clima diario NASA POWER
+import os
+import json
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from . import eventos
+from .cultivos import PARAMETROS_CULTIVOS
+from .clima_power import CachePower
+
+try:
+    import ee
+    GEE_AVAILABLE = True
+except ImportError:
+    GEE_AVAILABLE = False
+
+PROYECTO_GEE = 'ee-mawucano25'
+# ee.Initialize es global al proceso, así que el estado de autenticación también
+_estado_gee = {'autenticado': False}
+
+
+def gee_autenticado():
+    return GEE_AVAILABLE and _estado_gee['autenticado']
+
+
+# === INICIALIZACIÓN SEGURA DE GOOGLE EARTH ENGINE (NO MODIFICAR) ===
+def inicializar_gee():
+    """Inicializa GEE con Service Account (variable GEE_SERVICE_ACCOUNT) o credenciales locales."""
+    if not GEE_AVAILABLE:
+        return False
+
+    try:
+        # Intentar con Service Account desde secrets (Streamlit Cloud)
+        gee_secret = os.environ.get('GEE_SERVICE_ACCOUNT')
+        if gee_secret:
+            try:
+                credentials_info = json.loads(gee_secret.strip())
+                credentials = ee.ServiceAccountCredentials(
+                    credentials_info['client_email'],
+                    key_data=json.dumps(credentials_info)
+                )
+                ee.Initialize(credentials, project=PROYECTO_GEE)
+                _estado_gee['autenticado'] = True
+                print("✅ GEE inicializado con Service Account")
+                return True
+            except Exception as e:
+                print(f"⚠️ Error con Service Account: {str(e)}")
+
+        # Fallback: autenticación local (desarrollo en tu Linux)
+        try:
+            ee.Initialize(project=PROYECTO_GEE)
+            _estado_gee['autenticado'] = True
+            print("✅ GEE inicializado localmente")
+            return True
+        except Exception as e:
+            print(f"⚠️ Error inicialización local: {str(e)}")
+
+        _estado_gee['autenticado'] = False
+        return False
+
+    except Exception as e:
+        _estado_gee['autenticado'] = False
+        print(f"❌ Error crítico GEE: {str(e)}")
+        return False
+
+
+# ===== FUNCIONES PARA DATOS SATELITALES =====
+def descargar_datos_landsat8(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
+    try:
+        datos_simulados = {
+            'indice': indice,
+            'valor_promedio': 0.65 + np.random.normal(0, 0.1),
+            'fuente': 'Landsat-8',
+            'fecha': datetime.now().strftime('%Y-%m-%d'),
+            'id_escena': f"LC08_{np.random.randint(1000000, 9999999)}",
+            'cobertura_nubes': f"{np.random.randint(0, 15)}%",
+            'resolucion': '30m'
+        }
+        return datos_simulados
+    except Exception as e:
+        eventos.error(f"❌ Error procesando Landsat 8: {str(e)}")
+        return None
+
+def descargar_datos_sentinel2(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
+    try:
+        datos_simulados = {
+            'indice': indice,
+            'valor_promedio': 0.72 + np.random.normal(0, 0.08),
+            'fuente': 'Sentinel-2',
+            'fecha': datetime.now().strftime('%Y-%m-%d'),
+            'id_escena': f"S2A_{np.random.randint(1000000, 9999999)}",
+            'cobertura_nubes': f"{np.random.randint(0, 10)}%",
+            'resolucion': '10m'
+        }
+        return datos_simulados
+    except Exception as e:
+        eventos.error(f"❌ Error procesando Sentinel-2: {str(e)}")
+        return None
+
+def generar_datos_simulados(gdf, cultivo, indice='NDVI'):
+    datos_simulados = {
+        'indice': indice,
+        'valor_promedio': PARAMETROS_CULTIVOS[cultivo]['NDVI_OPTIMO'] * 0.8 + np.random.normal(0, 0.1),
+        'fuente': 'Simulación',
+        'fecha': datetime.now().strftime('%Y-%m-%d'),
+        'resolucion': '10m'
+    }
+    return datos_simulados
+
+# ===== GRILLA DEL ÍNDICE (ANÁLISIS MULTI-LOTE) =====
+# Un grupo de lotes cercanos comparte una sola consulta satelital; la grilla del índice
+# sobre la envolvente del grupo permite que cada lote tome sus propias estadísticas
+# (lotes.recortar_datos_satelitales), igual que con la grilla del DEM.
+CELDAS_GRILLA_INDICE = 64
+
+def _ejes_grilla(bounds, n_filas, n_cols):
+    """Centros de celda de una grilla regular sobre la caja (fila 0 = norte)."""
+    minx, miny, maxx, maxy = bounds
+    xs = minx + (np.arange(n_cols) + 0.5) * (maxx - minx) / n_cols
+    ys = maxy - (np.arange(n_filas) + 0.5) * (maxy - miny) / n_filas
+    return np.meshgrid(xs, ys)
+
+def _grilla_indice_gee(index_image, geometry, bounds, indice, escala_m):
+    """Muestrea el índice en una grilla de a lo sumo CELDAS_GRILLA_INDICE celdas por lado."""
+    minx, miny, maxx, maxy = bounds
+    lado_m = max(maxx - minx, maxy - miny) * 111000
+    escala = max(escala_m, lado_m / CELDAS_GRILLA_INDICE)
+    muestra = (index_image.reproject(crs='EPSG:4326', scale=escala)
+               .sampleRectangle(region=geometry, defaultValue=-9999)
+               .getInfo())
+    valores = np.array(muestra['properties'][indice], dtype=float)
+    valores[valores == -9999] = np.nan
+    X, Y = _ejes_grilla(bounds, *valores.shape)
+    return {'X': X, 'Y': Y, 'valores': valores}
+
+def grilla_indice_simulada(bounds, valor_promedio, valor_std=0.08):
+    """
+    Campo suave del índice alrededor de valor_promedio sobre la caja, determinista
+    para una misma caja (la misma envolvente produce la misma grilla).
+    """
+    minx, miny, maxx, maxy = bounds
+    n = CELDAS_GRILLA_INDICE
+    X, Y = _ejes_grilla(bounds, n, n)
+    u = (X - minx) / max(maxx - minx, 1e-9)
+    v = (Y - miny) / max(maxy - miny, 1e-9)
+    semilla = zlib.crc32(','.join(f'{b:.5f}' for b in bounds).encode())
+    rng = np.random.default_rng(semilla)
+    campo = np.zeros_like(u)
+    for _ in range(4):
+        a, b = rng.uniform(0.3, 2.0, size=2)
+        campo += np.sin(2 * np.pi * (a * u + b * v) + rng.uniform(0, 2 * np.pi))
+    campo = (campo - campo.mean()) / (campo.std() or 1.0)
+    valores = np.clip(valor_promedio + valor_std * campo, -1.0, 1.0)
+    return {'X': X, 'Y': Y, 'valores': valores}
+
+# ===== FUNCIONES GOOGLE EARTH ENGINE =====
+def obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice='NDVI', con_grilla=False):
+    """Obtener datos reales de Sentinel-2 usando Google Earth Engine con manejo robusto"""
+    if not GEE_AVAILABLE or not gee_autenticado():
+        eventos.advertencia("⚠️ GEE no disponible o no autenticado")
+        return None
+    
+    try:
+        if gdf is None or len(gdf) == 0:
+            eventos.error("❌ El área de estudio no es válida")
+            return None
+        
+        bounds = gdf.total_bounds
+        min_lon, min_lat, max_lon, max_lat = bounds
+        
+        if (abs(max_lon - min_lon) < 0.0001 or abs(max_lat - min_lat) < 0.0001):
+            eventos.advertencia("⚠️ El área de estudio es muy pequeña. Ampliando bounding box.")
+            min_lon -= 0.001
+            max_lon += 0.001
+            min_lat -= 0.001
+            max_lat += 0.001
+        
+        geometry = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
+        start_date = fecha_inicio.strftime('%Y-%m-%d')
+        end_date = fecha_fin.strftime('%Y-%m-%d')
+        
+        if fecha_inicio > fecha_fin:
+            eventos.error("❌ La fecha de inicio debe ser anterior a la fecha de fin")
+            start_date, end_date = end_date, start_date
+            eventos.info("ℹ️ Se intercambiaron las fechas automáticamente")
+        
+        collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+                     .filterBounds(geometry)
+                     .filterDate(start_date, end_date)
+                     .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 60)))
+        
+        collection_size = collection.size().getInfo()
+        
+        if collection_size == 0:
+            eventos.advertencia(f"⚠️ No se encontraron imágenes Sentinel-2 para:")
+            eventos.advertencia(f"   - Área: [{min_lon:.4f}, {min_lat:.4f}, {max_lon:.4f}, {max_lat:.4f}]")
+            eventos.advertencia(f"   - Período: {start_date} a {end_date}")
+            eventos.info("🔄 Intentando con filtro de nubes más permisivo (<80%)...")
+            collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+                         .filterBounds(geometry)
+                         .filterDate(start_date, end_date)
+                         .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 80)))
+            collection_size = collection.size().getInfo()
+            if collection_size == 0:
+                eventos.error("❌ No hay imágenes disponibles incluso con filtro permisivo")
+                return None
+            else:
+                eventos.exito(f"✅ Encontradas {collection_size} imágenes con filtro permisivo")
+        
+        image = collection.sort('CLOUDY_PIXEL_PERCENTAGE').first()
+        if image is None:
+            eventos.error("❌ Error crítico: La imagen seleccionada es nula")
+            return None
+        
+        image_id = image.get('system:index').getInfo()
+        cloud_percent = image.get('CLOUDY_PIXEL_PERCENTAGE').getInfo()
+        image_date = image.get('system:time_start').getInfo()
+        
+        if image_date:
+            image_date_str = datetime.fromtimestamp(image_date / 1000).strftime('%Y-%m-%d')
+            eventos.info(f"📅 Imagen seleccionada: {image_id} ({image_date_str}) - Nubes: {cloud_percent}%")
+        
+        try:
+            if indice == 'NDVI':
+                ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
+                index_image = ndvi
+            elif indice == 'NDWI':
+                ndwi = image.normalizedDifference(['B3', 'B8']).rename('NDWI')
+                index_image = ndwi
+            elif indice == 'EVI':
+                evi = image.expression(
+                    '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))',
+                    {'NIR': image.select('B8'), 'RED': image.select('B4'), 'BLUE': image.select('B2')}
+                ).rename('EVI')
+                index_image = evi
+            elif indice == 'NDRE':
+                ndre = image.normalizedDifference(['B8', 'B5']).rename('NDRE')
+                index_image = ndre
+            elif indice == 'SAVI':
+                savi = image.expression(
+                    '((NIR - RED) / (NIR + RED + 0.5)) * (1.5)',
+                    {'NIR': image.select('B8'), 'RED': image.select('B4')}
+                ).rename('SAVI')
+                index_image = savi
+            elif indice == 'MSAVI':
+                msavi = image.expression(
+                    '(2 * NIR + 1 - sqrt(pow((2 * NIR + 1), 2) - 8 * (NIR - RED))) / 2',
+                    {'NIR': image.select('B8'), 'RED': image.select('B4')}
+                ).rename('MSAVI')
+                index_image = msavi
+            else:
+                ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
+                index_image = ndvi
+                indice = 'NDVI'
+        except Exception as e:
+            eventos.error(f"❌ Error calculando índice {indice}: {str(e)}")
+            try:
+                ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
+                index_image = ndvi
+                indice = 'NDVI'
+                eventos.info("ℹ️ Usando NDVI como índice por defecto")
+            except:
+                eventos.error("❌ Error crítico: No se pudo calcular ningún índice")
+                return None
+        
+        try:
+            stats = index_image.reduceRegion(
+                reducer=ee.Reducer.mean().combine(
+                    reducer2=ee.Reducer.minMax(),
+                    sharedInputs=True
+                ).combine(
+                    reducer2=ee.Reducer.stdDev(),
+                    sharedInputs=True
+                ),
+                geometry=geometry,
+                scale=10,
+                bestEffort=True,
+                maxPixels=1e9
+            )
+            
+            stats_dict = stats.getInfo()
+            
+            if not stats_dict:
+                eventos.advertencia("⚠️ No se pudieron obtener estadísticas de la imagen")
+                valor_promedio = 0.6
+                valor_min = 0.3
+                valor_max = 0.9
+                valor_std = 0.1
+            else:
+                valor_promedio = stats_dict.get(f'{indice}_mean', 0.6)
+                valor_min = stats_dict.get(f'{indice}_min', 0.3)
+                valor_max = stats_dict.get(f'{indice}_max', 0.9)
+                valor_std = stats_dict.get(f'{indice}_stdDev', 0.1)
+                
+        except Exception as e:
+            eventos.advertencia(f"⚠️ Error obteniendo estadísticas: {str(e)}")
+            valor_promedio = 0.6 + np.random.normal(0, 0.1)
+            valor_min = max(0.1, valor_promedio - 0.3)
+            valor_max = min(0.95, valor_promedio + 0.3)
+            valor_std = 0.1
+        
+        grilla = None
+        if con_grilla:
+            try:
+                grilla = _grilla_indice_gee(index_image, geometry, (min_lon, min_lat, max_lon, max_lat), indice, 10)
+            except Exception as e:
+                eventos.advertencia(f"⚠️ No se pudo muestrear la grilla del índice: {str(e)}")
+        
+        return {
+            'indice': indice,
+            'valor_promedio': valor_promedio,
+            'valor_min': valor_min,
+            'valor_max': valor_max,
+            'valor_std': valor_std,
+            'fuente': f'Sentinel-2 (Google Earth Engine) - {image_id}' if image_id else 'Sentinel-2 (GEE)',
+            'fecha_descarga': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'fecha_imagen': image_date_str if 'image_date_str' in locals() else 'N/A',
+            'resolucion': '10m',
+            'estado': 'exitosa',
+            'cobertura_nubes': f"{cloud_percent}%" if cloud_percent else 'N/A',
+            'nota': f"Imágenes encontradas: {collection_size}" if collection_size else 'Sin imágenes',
+            'grilla': grilla
+        }
+        
+    except Exception as e:
+        eventos.error(f"❌ Error obteniendo datos de Google Earth Engine: {str(e)}")
+        eventos.info("💡 Usando datos simulados como alternativa")
+        return None
+
+def obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, dataset='LANDSAT/LC08/C02/T1_L2', indice='NDVI', con_grilla=False):
+    if not GEE_AVAILABLE or not gee_autenticado():
+        return None
+    try:
+        bounds = gdf.total_bounds
+        min_lon, min_lat, max_lon, max_lat = bounds
+        geometry = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
+        start_date = fecha_inicio.strftime('%Y-%m-%d')
+        end_date = fecha_fin.strftime('%Y-%m-%d')
+        
+        if 'LC08' in dataset or 'LANDSAT/LC08' in dataset:
+            red_band = 'SR_B4'
+            nir_band = 'SR_B5'
+            red_edge_band = 'SR_B6'
+            blue_band = 'SR_B2'
+        elif 'LC09' in dataset:
+            red_band = 'SR_B4'
+            nir_band = 'SR_B5'
+            red_edge_band = 'SR_B6'
+            blue_band = 'SR_B2'
+        else:
+            red_band = 'SR_B4'
+            nir_band = 'SR_B5'
+            red_edge_band = 'SR_B6'
+            blue_band = 'SR_B2'
+        
+        collection = (ee.ImageCollection(dataset)
+                     .filterBounds(geometry)
+                     .filterDate(start_date, end_date)
+                     .filter(ee.Filter.lt('CLOUD_COVER', 20)))
+        
+        image = collection.sort('CLOUD_COVER').first()
+        if image is None:
+            eventos.advertencia("⚠️ No se encontraron imágenes Landsat para el período y área seleccionados")
+            return None
+        
+        if indice == 'NDVI':
+            ndvi = image.normalizedDifference([nir_band, red_band]).rename('NDVI')
+            index_image = ndvi
+        elif indice == 'NDRE':
+            ndre = image.normalizedDifference([nir_band, red_edge_band]).rename('NDRE')
+            index_image = ndre
+        elif indice == 'NDWI':
+            ndwi = image.normalizedDifference(['SR_B3', nir_band]).rename('NDWI')
+            index_image = ndwi
+        elif indice == 'EVI':
+            evi = image.expression(
+                '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))',
+                {'NIR': image.select(nir_band), 'RED': image.select(red_band), 'BLUE': image.select(blue_band)}
+            ).rename('EVI')
+            index_image = evi
+        elif indice == 'SAVI':
+            savi = image.expression(
+                '((NIR - RED) / (NIR + RED + 0.5)) * (1.5)',
+                {'NIR': image.select(nir_band), 'RED': image.select(red_band)}
+            ).rename('SAVI')
+            index_image = savi
+        elif indice == 'MSAVI':
+            msavi = image.expression(
+                '(2 * NIR + 1 - sqrt(pow((2 * NIR + 1), 2) - 8 * (NIR - RED))) / 2',
+                {'NIR': image.select(nir_band), 'RED': image.select(red_band)}
+            ).rename('MSAVI')
+            index_image = msavi
+        else:
+            ndvi = image.normalizedDifference([nir_band, red_band]).rename('NDVI')
+            index_image = ndvi
+            indice = 'NDVI'
+        
+        stats = index_image.reduceRegion(
+            reducer=ee.Reducer.mean().combine(
+                reducer2=ee.Reducer.minMax(),
+                sharedInputs=True
+            ).combine(
+                reducer2=ee.Reducer.stdDev(),
+                sharedInputs=True
+            ),
+            geometry=geometry,
+            scale=30,
+            bestEffort=True
+        )
+        
+        stats_dict = stats.getInfo()
+        if not stats_dict:
+            eventos.advertencia("⚠️ No se pudieron obtener estadísticas de la imagen")
+            return None
+        
+        valor_promedio = stats_dict.get(f'{indice}_mean', 0)
+        valor_min = stats_dict.get(f'{indice}_min', 0)
+        valor_max = stats_dict.get(f'{indice}_max', 0)
+        valor_std = stats_dict.get(f'{indice}_stdDev', 0)
+        
+        fecha_imagen_ee = image.get('system:time_start')
+        fecha_imagen = fecha_imagen_ee.getInfo() if fecha_imagen_ee else None
+        if fecha_imagen:
+            fecha_imagen = datetime.fromtimestamp(fecha_imagen / 1000).strftime('%Y-%m-%d')
+        
+        if 'LC08' in dataset:
+            nombre_satelite = 'Landsat 8'
+        elif 'LC09' in dataset:
+            nombre_satelite = 'Landsat 9'
+        else:
+            nombre_satelite = 'Landsat'
+        
+        cloud_cover_ee = image.get('CLOUD_COVER')
+        cloud_cover = cloud_cover_ee.getInfo() if cloud_cover_ee else 'N/A'
+        
+        grilla = None
+        if con_grilla:
+            try:
+                grilla = _grilla_indice_gee(index_image, geometry, tuple(bounds), indice, 30)
+            except Exception as e:
+                eventos.advertencia(f"⚠️ No se pudo muestrear la grilla del índice: {str(e)}")
+        
+        return {
+            'indice': indice,
+            'valor_promedio': valor_promedio,
+            'valor_min': valor_min,
+            'valor_max': valor_max,
+            'valor_std': valor_std,
+            'fuente': f'{nombre_satelite} (Google Earth Engine)',
+            'fecha_descarga': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'fecha_imagen': fecha_imagen,
+            'resolucion': '30m',
+            'estado': 'exitosa',
+            'cobertura_nubes': f"{cloud_cover}%" if cloud_cover != 'N/A' else 'N/A',
+            'grilla': grilla
+        }
+        
+    except Exception as e:
+        eventos.error(f"❌ Error obteniendo datos de Landsat desde GEE: {str(e)}")
+        return None
+
+def descargar_datos_satelitales_gee(gdf, fecha_inicio, fecha_fin, satelite, indice='NDVI', con_grilla=False):
+    if satelite == 'SENTINEL-2_GEE':
+        return obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice, con_grilla)
+    elif satelite == 'LANDSAT-8_GEE':
+        return obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, 'LANDSAT/LC08/C02/T1_L2', indice, con_grilla)
+    elif satelite == 'LANDSAT-9_GEE':
+        return obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, 'LANDSAT/LC09/C02/T1_L2', indice, con_grilla)
+    else:
+        return None
+
+SATELITES_GEE = ['SENTINEL-2_GEE', 'LANDSAT-8_GEE', 'LANDSAT-9_GEE']
+
+def descargar_datos_satelitales(gdf, satelite, fecha_inicio, fecha_fin, indice='NDVI', con_grilla=False):
+    """Descarga de la fuente satelital elegida; None si no hay datos (o la fuente es simulada)."""
+    if satelite in SATELITES_GEE:
+        return descargar_datos_satelitales_gee(gdf, fecha_inicio, fecha_fin, satelite, indice, con_grilla)
+    elif satelite == "SENTINEL-2":
+        return descargar_datos_sentinel2(gdf, fecha_inicio, fecha_fin, indice)
+    elif satelite == "LANDSAT-8":
+        return descargar_datos_landsat8(gdf, fecha_inicio, fecha_fin, indice)
+    return None
+
+def completar_datos_satelitales(datos_satelitales, gdf, cultivo, satelite, indice='NDVI', con_grilla=False):
+    """Respaldo a datos simulados del cultivo cuando la descarga no trajo datos."""
+    if datos_satelitales is not None:
+        return datos_satelitales
+    if satelite in SATELITES_GEE:
+        eventos.advertencia("⚠️ No se pudieron obtener datos de GEE. Usando datos simulados.")
+    elif satelite in ("SENTINEL-2", "LANDSAT-8"):
+        return None
+    datos_simulados = generar_datos_simulados(gdf, cultivo, indice)
+    if con_grilla:
+        datos_simulados['grilla'] = grilla_indice_simulada(
+            tuple(gdf.total_bounds), datos_simulados['valor_promedio'])
+    return datos_simulados
+
+def obtener_datos_satelitales(gdf, cultivo, satelite, fecha_inicio, fecha_fin, indice='NDVI', con_grilla=False):
+    """
+    Selecciona la fuente satelital (GEE, simulada) con respaldo a datos simulados.
+    Con con_grilla=True agrega la grilla del índice sobre la caja de gdf (análisis multi-lote).
+    """
+    datos_satelitales = descargar_datos_satelitales(gdf, satelite, fecha_inicio, fecha_fin, indice, con_grilla)
+    return completar_datos_satelitales(datos_satelitales, gdf, cultivo, satelite, indice, con_grilla)
+
+# ===== FUNCIÓN PARA OBTENER DATOS DE NASA POWER =====
+def obtener_datos_nasa_power(gdf, fecha_inicio, fecha_fin):
+    """Clima diario del centroide desde la caché local de POWER (sólo se descargan los días que faltan)."""
+    try:
+        centroid = gdf.geometry.unary_union.centroid
+        return CachePower().serie(centroid.y, centroid.x, fecha_inicio, fecha_fin)
+    except Exception as e:
+        eventos.advertencia(f"No se pudo obtener el clima de NASA POWER: {e}")
+        return None
@@ -0,0 +1,119 @@
+# modules/dosis_optima.py - Dosis económica óptima de nitrógeno (EONR) por zona
+import numpy as np
+import pandas as pd
+
+from .cultivos import PARAMETROS_CULTIVOS
+from .agronomia import PRECIOS_FERTILIZANTE
+
+MODELOS_RESPUESTA = {
+    'mitscherlich': 'Mitscherlich (exponencial)',
+    'cuadratico_plateau': 'Cuadrático-plateau',
+}
+# Fracción de la respuesta máxima que se asume alcanzada con la dosis agronómica recomendada
+FRACCION_RESPUESTA_DOSIS_AGRONOMICA = 0.95
+
+
+def calibrar_curvas(rendimiento_sin_fert, rendimiento_con_fert, dosis_n, modelo='mitscherlich',
+                    fraccion=FRACCION_RESPUESTA_DOSIS_AGRONOMICA):
+    """
+    Parámetros de la curva de respuesta a N de cada zona, a partir de dos puntos
+    ya estimados por el análisis: Y(0) = rendimiento sin fertilizar e
+    Y(dosis_n) = rendimiento con fertilizar, donde la dosis recomendada logra
+    `fraccion` de la respuesta máxima. Todo vectorizado sobre zonas.
+
+    mitscherlich:        Y(N) = A - (A - Y0)·exp(-c·N)
+    cuadratico_plateau:  Y(N) = Y0 + a·N - q·N²  para N < Nj = a / (2q); luego Y = Y0 + q·Nj²
+    """
+    y0 = np.asarray(rendimiento_sin_fert, dtype=float)
+    y1 = np.asarray(rendimiento_con_fert, dtype=float)
+    dosis = np.maximum(np.asarray(dosis_n, dtype=float), 1e-6)
+    respuesta = np.maximum(y1 - y0, 0.0)
+    respuesta_max = respuesta / fraccion
+    if modelo == 'mitscherlich':
+        return {
+            'modelo': modelo,
+            'y0': y0,
+            'asintota': y0 + respuesta_max,
+            'c': -np.log(1 - fraccion) / dosis,
+        }
+    if modelo == 'cuadratico_plateau':
+        # Y(Nj) - Y(dosis) = q·(Nj - dosis)² = (1 - fraccion)·respuesta_max y q·Nj² = respuesta_max
+        n_quiebre = dosis / (1 - np.sqrt(1 - fraccion))
+        q = respuesta_max / n_quiebre ** 2
+        return {
+            'modelo': modelo,
+            'y0': y0,
+            'a': 2 * q * n_quiebre,
+            'q': q,
+            'n_quiebre': n_quiebre,
+        }
+    raise ValueError(f"Modelo de respuesta desconocido: {modelo}")
+
+
+def rendimiento_curva(curvas, dosis_n):
+    """Rendimiento (kg/ha) de cada zona con la dosis dada (escalar o array por zona)."""
+    n = np.maximum(np.asarray(dosis_n, dtype=float), 0.0)
+    if curvas['modelo'] == 'mitscherlich':
+        return curvas['asintota'] - (curvas['asintota'] - curvas['y0']) * np.exp(-curvas['c'] * n)
+    n_efectiva = np.minimum(n, curvas['n_quiebre'])
+    return curvas['y0'] + curvas['a'] * n_efectiva - curvas['q'] * n_efectiva ** 2
+
+
+def dosis_economica_optima(curvas, precio_n, precio_grano, dosis_maxima=None):
+    """
+    Resuelve la condición de retorno marginal dY/dN = precio_n / precio_grano
+    en forma cerrada para todas las zonas a la vez. Retorna la dosis (kg N/ha).
+    """
+    relacion = precio_n / precio_grano if precio_grano > 0 else np.inf
+    if curvas['modelo'] == 'mitscherlich':
+        pendiente_inicial = (curvas['asintota'] - curvas['y0']) * curvas['c']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dosis = np.where(pendiente_inicial > relacion,
+                             np.log(pendiente_inicial / relacion) / curvas['c'], 0.0)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dosis = np.where(curvas['q'] > 0, (curvas['a'] - relacion) / (2 * curvas['q']), 0.0)
+        dosis = np.clip(dosis, 0.0, curvas['n_quiebre'])
+    dosis = np.maximum(np.nan_to_num(dosis, nan=0.0, posinf=0.0), 0.0)
+    if dosis_maxima is not None:
+        dosis = np.minimum(dosis, dosis_maxima)
+    return dosis
+
+
+def optimizar_dosis_n(gdf_completo, cultivo, modelo='mitscherlich', precio_n=None, precio_grano=None,
+                      precios=None):
+    """
+    EONR por zona sobre la capa de resultados (columnas rec_N, rec_P, rec_K,
+    proy_rendimiento_sin_fert, proy_rendimiento_con_fert). Devuelve un DataFrame
+    con la dosis óptima, el rendimiento esperado y el beneficio (USD/ha) contra
+    la dosis agronómica actual. P, K y el costo fijo se mantienen.
+    """
+    params = PARAMETROS_CULTIVOS[cultivo]
+    precios = {**PRECIOS_FERTILIZANTE, **(precios or {})}
+    precio_n = precios['N'] if precio_n is None else precio_n
+    precio_grano = params['PRECIO_VENTA'] if precio_grano is None else precio_grano
+
+    dosis_actual = gdf_completo['rec_N'].to_numpy(dtype=float)
+    curvas = calibrar_curvas(gdf_completo['proy_rendimiento_sin_fert'], gdf_completo['proy_rendimiento_con_fert'],
+                             dosis_actual, modelo)
+    dosis_opt = dosis_economica_optima(curvas, precio_n, precio_grano,
+                                       dosis_maxima=params['NITROGENO']['max'] * 1.5)
+    otros_costos = (gdf_completo['rec_P'].to_numpy(dtype=float) * precios['P']
+                    + gdf_completo['rec_K'].to_numpy(dtype=float) * precios['K']
+                    + params['COSTO_FERTILIZACION'])
+
+    def beneficio(dosis):
+        return precio_grano * rendimiento_curva(curvas, dosis) - precio_n * dosis - otros_costos
+
+    rend_opt = rendimiento_curva(curvas, dosis_opt)
+    beneficio_opt = beneficio(dosis_opt)
+    beneficio_actual = beneficio(dosis_actual)
+    return pd.DataFrame({
+        'id_zona': gdf_completo['id_zona'].to_numpy() if 'id_zona' in gdf_completo.columns else np.arange(1, len(dosis_actual) + 1),
+        'dosis_n_actual': np.round(dosis_actual, 1),
+        'dosis_n_optima': np.round(dosis_opt, 1),
+        'rendimiento_optimo': np.round(rend_opt, 0),
+        'beneficio_optimo': np.round(beneficio_opt, 2),
+        'beneficio_actual': np.round(beneficio_actual, 2),
+        'ganancia': np.round(beneficio_opt - beneficio_actual, 2),
+    })
@@ -0,0 +1,99 @@
+# modules/escenarios.py - Motor de escenarios económicos: precios de fertilizante × precio del grano
+import numpy as np
+
+from .agronomia import PRECIOS_FERTILIZANTE
+
+# Tope de celdas (zonas × escenarios) para materializar márgenes por zona (~200 MB en float32)
+MAX_CELDAS_POR_ZONA = 50_000_000
+
+
+def grilla_precios_fertilizante(precios_n, precios_p, precios_k):
+    """Producto cartesiano de precios N, P, K (USD/kg) -> matriz (Sf, 3)."""
+    n, p, k = np.meshgrid(np.atleast_1d(precios_n), np.atleast_1d(precios_p), np.atleast_1d(precios_k), indexing='ij')
+    return np.column_stack([n.ravel(), p.ravel(), k.ravel()]).astype(float)
+
+
+def precios_por_multiplicador(multiplicadores, precios_base=None):
+    """Escenarios (Sf, 3) que escalan juntos los tres precios de referencia."""
+    base = precios_base or PRECIOS_FERTILIZANTE
+    vector = np.array([base['N'], base['P'], base['K']], dtype=float)
+    return np.atleast_1d(np.asarray(multiplicadores, dtype=float))[:, None] * vector[None, :]
+
+
+def evaluar_escenarios(rec_n, rec_p, rec_k, rendimiento_con_fert, area_ha, costo_fijo,
+                       precios_fertilizante, precios_grano, rendimiento_sin_fert=None, por_zona=False):
+    """
+    Evalúa costo, ingreso y margen para todas las combinaciones de
+    Sf escenarios de fertilizante (matriz (Sf, 3) de USD/kg N, P, K) y
+    Sg precios del grano (USD/kg), por broadcasting.
+
+    A nivel establecimiento (ponderado por área) se trabaja con totales, así el
+    costo es O(Z + Sf·Sg) sin importar la cantidad de zonas. Con por_zona=True
+    además se devuelve el margen (Z, Sf, Sg) en float32.
+
+    Retorna un dict con:
+      costo_ha (Sf,), ingreso_ha (Sg,), margen_ha (Sf, Sg)  [USD/ha del establecimiento]
+      equilibrio_grano_ha (Sf,)       precio del grano con margen 0
+      equilibrio_grano_zona (Z, Sf)   ídem por zona
+      margen_incremental_ha (Sf, Sg) y equilibrio_fertilizacion_zona (Z, Sf)
+          si se da rendimiento_sin_fert (fertilizar vs. no fertilizar)
+      margen_zona (Z, Sf, Sg)         sólo con por_zona=True
+    """
+    dosis = np.column_stack([np.asarray(rec_n, dtype=float), np.asarray(rec_p, dtype=float),
+                             np.asarray(rec_k, dtype=float)])
+    rend_con = np.asarray(rendimiento_con_fert, dtype=float)
+    area = np.asarray(area_ha, dtype=float)
+    fijo = np.broadcast_to(np.asarray(costo_fijo, dtype=float), rend_con.shape)
+    precios_fert = np.atleast_2d(np.asarray(precios_fertilizante, dtype=float))
+    precios_grano = np.atleast_1d(np.asarray(precios_grano, dtype=float))
+
+    area_total = area.sum()
+    pesos = area / area_total if area_total > 0 else np.full(len(area), 1.0 / max(len(area), 1))
+
+    # Costo por zona y escenario de fertilizante: (Z, 3) @ (3, Sf)
+    costo_zona = dosis @ precios_fert.T + fijo[:, None]
+    costo_ha = pesos @ costo_zona
+    rendimiento_ha = pesos @ rend_con
+    ingreso_ha = rendimiento_ha * precios_grano
+
+    resultado = {
+        'costo_ha': costo_ha,
+        'ingreso_ha': ingreso_ha,
+        'margen_ha': ingreso_ha[None, :] - costo_ha[:, None],
+        'equilibrio_grano_ha': costo_ha / rendimiento_ha if rendimiento_ha > 0 else np.full(len(costo_ha), np.inf),
+    }
+    with np.errstate(divide='ignore', invalid='ignore'):
+        resultado['equilibrio_grano_zona'] = np.where(rend_con[:, None] > 0, costo_zona / rend_con[:, None], np.inf)
+
+    if rendimiento_sin_fert is not None:
+        rend_sin = np.asarray(rendimiento_sin_fert, dtype=float)
+        respuesta = rend_con - rend_sin
+        respuesta_ha = pesos @ respuesta
+        resultado['margen_incremental_ha'] = respuesta_ha * precios_grano[None, :] - costo_ha[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            resultado['equilibrio_fertilizacion_zona'] = np.where(
+                respuesta[:, None] > 0, costo_zona / respuesta[:, None], np.inf
+            )
+
+    if por_zona:
+        celdas = len(rend_con) * len(precios_fert) * len(precios_grano)
+        if celdas > MAX_CELDAS_POR_ZONA:
+            raise ValueError(f"{celdas:,} celdas zona×escenario superan el máximo ({MAX_CELDAS_POR_ZONA:,}); "
+                             "reducí la grilla o usá los resultados por establecimiento")
+        resultado['margen_zona'] = (rend_con[:, None, None].astype(np.float32) * precios_grano[None, None, :].astype(np.float32)
+                                    - costo_zona[:, :, None].astype(np.float32))
+    return resultado
+
+
+def multiplicador_equilibrio_fertilizante(rec_n, rec_p, rec_k, rendimiento_con_fert, costo_fijo,
+                                          precio_grano, precios_base=None):
+    """
+    Por zona: factor sobre los precios de referencia de N, P y K con el que el
+    margen se anula al precio de grano dado (>1 = hay margen para subas).
+    """
+    base = precios_base or PRECIOS_FERTILIZANTE
+    costo_variable = (np.asarray(rec_n, dtype=float) * base['N'] + np.asarray(rec_p, dtype=float) * base['P']
+                      + np.asarray(rec_k, dtype=float) * base['K'])
+    margen_bruto = np.asarray(rendimiento_con_fert, dtype=float) * precio_grano - np.asarray(costo_fijo, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(costo_variable > 0, margen_bruto / costo_variable, np.inf)
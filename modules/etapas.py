@@ -0,0 +1,190 @@
+# modules/etapas.py - Grafo de etapas con memoización por huella de entradas
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from . import eventos
+
+# Entradas en memoria por defecto: un análisis completo ocupa ~15 (una por etapa)
+MAX_ENTRADAS_CACHE = 128
+
+
+def _actualizar_huella(h, valor):
+    """Agrega `valor` al hash con su tipo, así 1, 1.0 y '1' dan huellas distintas."""
+    h.update(type(valor).__name__.encode())
+    if valor is None or isinstance(valor, (bool, int, float, str, np.generic, date, datetime)):
+        h.update(repr(valor).encode())
+    elif isinstance(valor, bytes):
+        h.update(valor)
+    elif isinstance(valor, gpd.GeoDataFrame):
+        h.update(str(valor.crs).encode())
+        h.update(b''.join(shapely.to_wkb(np.asarray(valor.geometry, dtype=object))))
+        _actualizar_huella(h, pd.DataFrame(valor.drop(columns=valor.geometry.name)))
+    elif isinstance(valor, (pd.DataFrame, pd.Series)):
+        if isinstance(valor, pd.DataFrame):
+            h.update(repr(list(valor.columns)).encode())
+        h.update(pd.util.hash_pandas_object(valor, index=True).to_numpy().tobytes())
+    elif isinstance(valor, np.ndarray):
+        h.update(f"{valor.dtype}{valor.shape}".encode())
+        h.update(np.ascontiguousarray(valor).tobytes() if valor.dtype != object else repr(valor.tolist()).encode())
+    elif isinstance(valor, dict):
+        for clave in sorted(valor, key=repr):
+            _actualizar_huella(h, clave)
+            _actualizar_huella(h, valor[clave])
+    elif isinstance(valor, (list, tuple)):
+        h.update(str(len(valor)).encode())
+        for elemento in valor:
+            _actualizar_huella(h, elemento)
+    elif isinstance(valor, shapely.Geometry):
+        h.update(shapely.to_wkb(valor))
+    else:
+        h.update(repr(valor).encode())
+
+
+def huella(valor):
+    """SHA-256 del contenido de un parámetro (escalares, fechas, arrays, DataFrames, GeoDataFrames)."""
+    h = hashlib.sha256()
+    _actualizar_huella(h, valor)
+    return h.hexdigest()
+
+
+class CacheEtapas:
+    """
+    Salidas de etapas memoizadas por clave, con descarte LRU. Es compartida
+    entre sesiones (las claves sólo dependen del contenido de las entradas),
+    por eso las etapas no deben modificar en el lugar lo que reciben ni lo que
+    devuelven.
+    """
+
+    def __init__(self, max_entradas=MAX_ENTRADAS_CACHE):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def obtener(self, clave):
+        """(encontrado, valor, segundos que llevó calcularlo)."""
+        with self._lock:
+            if clave not in self._entradas:
+                return False, None, 0.0
+            self._entradas.move_to_end(clave)
+            valor, segundos = self._entradas[clave]
+            return True, valor, segundos
+
+    def guardar(self, clave, valor, segundos):
+        with self._lock:
+            self._entradas[clave] = (valor, segundos)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+
+class SinCache:
+    """
+    Salida de una etapa que no debe memoizarse: una descarga falló, vino
+    incompleta o se usó un respaldo (datos simulados, DEM sintético). El grafo
+    usa `valor` como salida de la etapa, pero no la guarda en la caché ni a las
+    etapas que dependen de ella, así la próxima ejecución vuelve a intentar la
+    fuente real en vez de servir el respaldo desde la caché.
+    """
+
+    __slots__ = ('valor', 'motivo')
+
+    def __init__(self, valor, motivo=''):
+        self.valor = valor
+        self.motivo = motivo
+
+
+def validar_grafo(etapas, parametros):
+    """Verifica que cada entrada sea un parámetro o una etapa anterior (orden topológico)."""
+    definidas = set(parametros)
+    for nombre, entradas, _ in etapas:
+        if nombre in definidas:
+            raise ValueError(f"La etapa '{nombre}' está duplicada o pisa un parámetro")
+        faltantes = [e for e in entradas if e not in definidas]
+        if faltantes:
+            raise ValueError(f"La etapa '{nombre}' usa entradas no definidas antes: {', '.join(faltantes)}")
+        definidas.add(nombre)
+
+
+def ejecutar_grafo(etapas, parametros, cache=None, al_completar=None):
+    """
+    Ejecuta las etapas `(nombre, entradas, funcion)` en orden; cada función
+    recibe los valores de sus entradas (parámetros o salidas de etapas previas)
+    en el orden declarado.
+
+    La clave de una etapa es el hash de su nombre y de las claves de sus
+    entradas: la huella del valor para los parámetros y la clave de la etapa
+    para las salidas intermedias. Así un cambio de parámetro invalida sólo las
+    etapas que dependen de él, sin tener que hashear salidas grandes.
+
+    Una función puede devolver `SinCache(valor)` para que su salida (y la de
+    todas las etapas que dependen de ella) no se guarde en la caché.
+
+    Retorna (salidas, registro): dict nombre -> valor y lista con, por etapa,
+    si vino de caché, si quedó fuera de la caché por un respaldo, los segundos de esta ejecución y los del
+    cálculo original.
+    Los eventos que emite cada función llevan el nombre de su etapa y, al
+    terminar cada una, se emite el avance del grafo. `al_completar(nombre,
+    valor, registro_etapa)` se llama tras cada etapa (resultados parciales);
+    si lanza una excepción, el grafo se detiene.
+    """
+    validar_grafo(etapas, parametros)
+    claves = {nombre: huella(valor) for nombre, valor in parametros.items()}
+    valores = dict(parametros)
+    no_memoizables = set()
+    registro = []
+    for i, (nombre, entradas, funcion) in enumerate(etapas):
+        h = hashlib.sha256(nombre.encode())
+        for entrada in entradas:
+            h.update(f"|{entrada}={claves[entrada]}".encode())
+        clave = h.hexdigest()
+        claves[nombre] = clave
+
+        inicio = time.perf_counter()
+        respaldo = bool(no_memoizables.intersection(entradas))
+        memoizable = cache is not None and not respaldo
+        encontrado, valor, segundos_calculo = cache.obtener(clave) if memoizable else (False, None, 0.0)
+        if not encontrado:
+            try:
+                with eventos.etapa(nombre), eventos.tramo(i / len(etapas), (i + 1) / len(etapas)):
+                    valor = funcion(*[valores[e] for e in entradas])
+            except Exception as e:
+                raise RuntimeError(f"Etapa '{nombre}': {e}") from e
+            segundos_calculo = time.perf_counter() - inicio
+            if isinstance(valor, SinCache):
+                if valor.motivo:
+                    with eventos.etapa(nombre):
+                        eventos.info(f"ℹ️ No se guarda en caché: {valor.motivo}")
+                valor, respaldo = valor.valor, True
+            if respaldo:
+                no_memoizables.add(nombre)
+            elif cache is not None:
+                cache.guardar(clave, valor, segundos_calculo)
+        valores[nombre] = valor
+        registro.append({
+            'etapa': nombre,
+            'cache': encontrado,
+            'respaldo': respaldo,
+            'segundos': time.perf_counter() - inicio,
+            'segundos_calculo': segundos_calculo,
+        })
+        if al_completar is not None:
+            al_completar(nombre, valor, registro[-1])
+        with eventos.etapa(nombre):
+            eventos.progreso((i + 1) / len(etapas), "desde caché" if encontrado else "calculada")
+    salidas = {nombre: valores[nombre] for nombre, _, _ in etapas}
+    return salidas, registro
@@ -0,0 +1,145 @@
+# modules/eventos.py - Eventos de progreso del cómputo (etapa, nivel, mensaje, fracción, tiempo), sin depender de la interfaz
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+NIVELES = ('debug', 'info', 'exito', 'advertencia', 'error')
+_NIVEL_LOGGING = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'exito': logging.INFO,
+    'advertencia': logging.WARNING,
+    'error': logging.ERROR,
+}
+LOGGER = logging.getLogger('cultivos')
+
+
+class Reportador:
+    """
+    Recibe los eventos que emite el cómputo y los reenvía a sus destinos:
+    funciones destino(evento) con evento = dict(etapa, nivel, mensaje,
+    fraccion, transcurrido). La app los dibuja con Streamlit; el batch y los
+    workers los mandan al log.
+    """
+
+    def __init__(self, *destinos):
+        self.destinos = list(destinos)
+        self.inicio = time.perf_counter()
+
+    def emitir(self, nivel, mensaje, fraccion=None, etapa=None):
+        if nivel not in _NIVEL_LOGGING:
+            raise ValueError(f"Nivel de evento desconocido: {nivel}")
+        evento = {
+            'etapa': etapa if etapa is not None else _etapa.get(),
+            'nivel': nivel,
+            'mensaje': mensaje,
+            'fraccion': None if fraccion is None else _en_tramo(fraccion),
+            'transcurrido': time.perf_counter() - self.inicio,
+        }
+        for destino in self.destinos:
+            destino(evento)
+        return evento
+
+
+def destino_logging(logger=LOGGER, prefijo=''):
+    """Destino que escribe cada evento en `logger` con el nivel equivalente."""
+    def destino(evento):
+        etapa = f"[{evento['etapa']}] " if evento['etapa'] else ''
+        avance = f" ({evento['fraccion']:.0%})" if evento['fraccion'] is not None else ''
+        logger.log(_NIVEL_LOGGING[evento['nivel']],
+                   f"{prefijo}{etapa}{evento['mensaje']}{avance} +{evento['transcurrido']:.1f}s")
+    return destino
+
+
+def destino_lista(lista, niveles=None):
+    """Destino que acumula en `lista` los eventos (sólo los de `niveles`, si se indican)."""
+    def destino(evento):
+        if niveles is None or evento['nivel'] in niveles:
+            lista.append(evento)
+    return destino
+
+
+# Reportador, etapa y tramo de avance activos en el contexto actual (cada hilo de Streamlit tiene los suyos)
+_reportador = ContextVar('reportador', default=None)
+_etapa = ContextVar('etapa', default=None)
+_tramo = ContextVar('tramo', default=(0.0, 1.0))
+
+
+def _en_tramo(fraccion):
+    inicio, fin = _tramo.get()
+    return inicio + (fin - inicio) * min(max(float(fraccion), 0.0), 1.0)
+_REPORTADOR_LOG = Reportador(destino_logging())
+
+
+def reportador_actual():
+    reportador = _reportador.get()
+    return reportador if reportador is not None else _REPORTADOR_LOG
+
+
+def fijar_reportador(reportador):
+    """Reportador por defecto del resto del contexto actual (p. ej. una ejecución del script de Streamlit)."""
+    _reportador.set(reportador)
+
+
+@contextmanager
+def usar_reportador(reportador):
+    """Dirige los eventos emitidos dentro del bloque a `reportador`."""
+    token = _reportador.set(reportador)
+    try:
+        yield reportador
+    finally:
+        _reportador.reset(token)
+
+
+@contextmanager
+def etapa(nombre):
+    """Los eventos emitidos dentro del bloque llevan esta etapa."""
+    token = _etapa.set(nombre)
+    try:
+        yield
+    finally:
+        _etapa.reset(token)
+
+
+@contextmanager
+def tramo(inicio, fin):
+    """
+    Dentro del bloque, la fracción 0-1 que emita una subtarea se lleva a
+    [inicio, fin] del avance actual; así el avance de una etapa anidada no
+    hace retroceder la barra del proceso que la contiene.
+    """
+    token = _tramo.set((_en_tramo(inicio), _en_tramo(fin)))
+    try:
+        yield
+    finally:
+        _tramo.reset(token)
+
+
+def emitir(nivel, mensaje, fraccion=None):
+    return reportador_actual().emitir(nivel, mensaje, fraccion)
+
+
+def debug(mensaje):
+    return emitir('debug', mensaje)
+
+
+def info(mensaje):
+    return emitir('info', mensaje)
+
+
+def exito(mensaje):
+    return emitir('exito', mensaje)
+
+
+def advertencia(mensaje):
+    return emitir('advertencia', mensaje)
+
+
+def error(mensaje):
+    return emitir('error', mensaje)
+
+
+def progreso(fraccion, mensaje=''):
+    """Avance (0-1) de la tarea en curso; la interfaz lo muestra como barra."""
+    return emitir('info', mensaje, fraccion)
@@ -48,7 +48,7 @@ def crear_docx_con_ia(output_path, resultados, cultivo, satelite, fecha_inicio,
     doc.add_heading('3. RIESGO DE ENCHARCAMIENTO', level=1)
     # Si hay datos topográficos, mostrarlos...
     # ...
-    analisis_agua = generar_analisis_riesgo_hidrico(df_resumen, stats, cultivo)
+    analisis_agua = generar_analisis_riesgo_hidrico(df_resumen, stats, cultivo, resultados.get('agroclima'))
     doc.add_heading('3.1 Análisis de humedad y textura', level=2)
     doc.add_paragraph(analisis_agua)
     
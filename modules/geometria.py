@@ -0,0 +1,157 @@
+# modules/geometria.py - Reparación y simplificación de geometrías al momento de la carga
+import numpy as np
+import geopandas as gpd
+import shapely
+from shapely.geometry import Polygon, MultiPolygon
+
+# Tolerancia por defecto (metros): del orden de la resolución de análisis (Sentinel-2 = 10 m)
+TOLERANCIA_SIMPLIFICACION_M = 1.0
+# Partes de polígono más chicas que esto se consideran astillas (slivers)
+AREA_MINIMA_SLIVER_M2 = 25.0
+# Relación de compacidad 4·pi·A/P² por debajo de la cual una parte es una astilla
+COMPACIDAD_MINIMA_SLIVER = 0.02
+
+
+def contar_vertices(geometrias):
+    """Cuenta vértices totales de una GeoSeries/lista de geometrías."""
+    if geometrias is None or len(geometrias) == 0:
+        return 0
+    return int(shapely.get_num_coordinates(np.asarray(geometrias, dtype=object)).sum())
+
+
+def _solo_poligonos(geom):
+    """Extrae la parte poligonal de una geometría (make_valid puede devolver colecciones)."""
+    if geom is None or geom.is_empty:
+        return None
+    if isinstance(geom, (Polygon, MultiPolygon)):
+        return geom
+    partes = [g for g in getattr(geom, 'geoms', []) if isinstance(g, (Polygon, MultiPolygon))]
+    if not partes:
+        return None
+    return shapely.union_all(partes)
+
+
+def _quitar_astillas(geom, area_minima_m2, compacidad_minima):
+    """
+    Elimina partes secundarias de un (Multi)Polygon en CRS métrico que sean
+    astillas. La parte más grande se conserva siempre: un lote angosto y
+    largo (p. ej. 10 m × 2 km) es poco compacto pero no es una astilla.
+    """
+    if geom is None:
+        return None
+    partes = list(geom.geoms) if isinstance(geom, MultiPolygon) else [geom]
+    principal = max(range(len(partes)), key=lambda i: partes[i].area)
+    conservadas = []
+    for i, parte in enumerate(partes):
+        if i == principal:
+            conservadas.append(parte)
+            continue
+        area = parte.area
+        perimetro = parte.length
+        compacidad = (4 * np.pi * area / perimetro ** 2) if perimetro > 0 else 0.0
+        if area >= area_minima_m2 and compacidad >= compacidad_minima:
+            conservadas.append(parte)
+    if not conservadas:
+        return None
+    return conservadas[0] if len(conservadas) == 1 else MultiPolygon(conservadas)
+
+
+def _es_cobertura_valida(geoms):
+    """True si los polígonos forman una cobertura (sin solapes) apta para coverage_simplify."""
+    if not hasattr(shapely, 'coverage_simplify') or not hasattr(shapely, 'coverage_is_valid'):
+        return False
+    try:
+        return bool(shapely.coverage_is_valid(geoms))
+    except Exception:
+        return False
+
+
+def preparar_geometria(gdf, tolerancia_m=TOLERANCIA_SIMPLIFICACION_M,
+                       area_minima_m2=AREA_MINIMA_SLIVER_M2,
+                       compacidad_minima=COMPACIDAD_MINIMA_SLIVER, unir=False):
+    """
+    Etapa de ingesta: make_valid, eliminación de astillas y simplificación
+    que preserva la topología, en un CRS UTM estimado para trabajar en metros.
+    Retorna (gdf_en_EPSG4326, estadisticas) con los vértices antes/después.
+    Si hay varios polígonos que comparten bordes, se simplifican como cobertura
+    para no abrir huecos ni solapes entre ellos. Con unir=True los polígonos
+    reparados se unen en una sola geometría antes de buscar astillas, así solo
+    la parte más grande de toda la carga queda protegida.
+    """
+    estadisticas = {
+        'vertices_antes': contar_vertices(gdf.geometry) if gdf is not None else 0,
+        'vertices_despues': 0,
+        'geometrias_reparadas': 0,
+        'astillas_eliminadas': 0,
+        'tolerancia_m': tolerancia_m
+    }
+    if gdf is None or len(gdf) == 0:
+        return gdf, estadisticas
+
+    crs_original = gdf.crs if gdf.crs is not None else 'EPSG:4326'
+    gdf = gdf.set_crs(crs_original, allow_override=True)
+
+    invalidas = ~gdf.geometry.is_valid
+    estadisticas['geometrias_reparadas'] = int(invalidas.sum())
+    geometrias = gdf.geometry.copy()
+    if invalidas.any():
+        geometrias[invalidas] = shapely.make_valid(np.asarray(geometrias[invalidas], dtype=object))
+    geometrias = geometrias.apply(_solo_poligonos)
+
+    gdf = gdf.set_geometry(geometrias)
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    if len(gdf) == 0:
+        return gdf.to_crs('EPSG:4326'), estadisticas
+    if unir:
+        union = _solo_poligonos(shapely.union_all(np.asarray(gdf.geometry, dtype=object)))
+        gdf = gpd.GeoDataFrame(geometry=[union], crs=gdf.crs)
+
+    crs_metrico = gdf.estimate_utm_crs()
+    gdf_m = gdf.to_crs(crs_metrico)
+
+    partes_antes = int(shapely.get_num_geometries(np.asarray(gdf_m.geometry, dtype=object)).sum())
+    gdf_m = gdf_m.set_geometry(gdf_m.geometry.apply(
+        lambda g: _quitar_astillas(g, area_minima_m2, compacidad_minima)
+    ))
+    gdf_m = gdf_m[gdf_m.geometry.notna()]
+    partes_despues = int(shapely.get_num_geometries(np.asarray(gdf_m.geometry, dtype=object)).sum()) if len(gdf_m) else 0
+    estadisticas['astillas_eliminadas'] = partes_antes - partes_despues
+
+    if tolerancia_m and tolerancia_m > 0 and len(gdf_m) > 0:
+        geoms = np.asarray(gdf_m.geometry, dtype=object)
+        if len(geoms) > 1 and _es_cobertura_valida(geoms):
+            simplificadas = shapely.coverage_simplify(geoms, tolerancia_m)
+        else:
+            simplificadas = shapely.simplify(geoms, tolerancia_m, preserve_topology=True)
+        # Si la simplificación deja una geometría inválida o vacía se repara, y si no
+        # queda polígono se conserva la geometría sin simplificar
+        originales = np.asarray(gdf_m.geometry, dtype=object)
+        invalidas = ~shapely.is_valid(simplificadas) | shapely.is_empty(simplificadas)
+        for i in np.flatnonzero(invalidas):
+            reparada = _solo_poligonos(shapely.make_valid(simplificadas[i]))
+            simplificadas[i] = reparada if reparada is not None and not reparada.is_empty else originales[i]
+        gdf_m = gdf_m.set_geometry(gpd.GeoSeries(simplificadas, index=gdf_m.index, crs=crs_metrico))
+
+    gdf_final = gdf_m.to_crs('EPSG:4326').reset_index(drop=True)
+    estadisticas['vertices_despues'] = contar_vertices(gdf_final.geometry)
+    return gdf_final, estadisticas
+
+
+def verificar_astillas():
+    """
+    Chequeo rápido (``python modules/geometria.py``): un lote de ~90 ha con una
+    astilla de 3 m² cargado en modo unión debe quedar en una sola parte.
+    """
+    from shapely.geometry import box
+    grado = 1 / 111320
+    lote = box(-60, -34, -60 + 1000 * grado, -34 + 900 * grado)
+    astilla = box(-60 + 1100 * grado, -34, -60 + 1101.5 * grado, -34 + 2 * grado)
+    gdf = gpd.GeoDataFrame(geometry=[lote, astilla], crs='EPSG:4326').explode(ignore_index=True)
+    resultado, estadisticas = preparar_geometria(gdf, unir=True)
+    assert estadisticas['astillas_eliminadas'] == 1, estadisticas
+    assert len(resultado) == 1 and isinstance(resultado.geometry.iloc[0], Polygon)
+    print(f"OK: {estadisticas['astillas_eliminadas']} astilla eliminada en modo unión")
+
+
+if __name__ == '__main__':
+    verificar_astillas()
@@ -165,7 +165,25 @@ Analiza los índices espectrales NDVI y NDRE de forma técnica, relacionándolos
         return "⚠️ Análisis NDVI/NDRE no disponible por error de API."
     return resultado
 
-def generar_analisis_riesgo_hidrico(df_resumen: pd.DataFrame, stats: Dict, cultivo: str) -> str:
+def resumen_agroclima_texto(agroclima: Optional[Dict]) -> str:
+    """Bloque de texto con los indicadores agroclimáticos del período (vacío si no hay clima)."""
+    if not agroclima:
+        return ""
+    r = agroclima['resumen']
+    zonas = agroclima['zonas']
+    ventana = '' if r.get('ciclo_completo', True) else f" (sólo de la ventana: {r['dias']} de {r['dias_ciclo']} días del ciclo)"
+    return f"""
+**Balance agroclimático del período ({r['dias']} días, NASA POWER):**
+- Precipitación: {r['precipitacion_mm']:.0f} mm · ET0 Penman-Monteith: {r['et0_penman_monteith_mm']:.0f} mm (Hargreaves: {r['et0_hargreaves_mm']:.0f} mm) · ETc del cultivo: {r['etc_mm']:.0f} mm
+- Balance P - ETc: {r['balance_mm']:.0f} mm
+- Agua útil en la zona de raíces: {zonas['agua_util_mm'].min():.0f} - {zonas['agua_util_mm'].max():.0f} mm según la textura de la zona
+- Déficit hídrico medio: {r['deficit_hidrico_mm']:.0f} mm con {r['dias_estres_hidrico']:.0f} días de estrés; excedente (drenaje/escurrimiento): {r['exceso_hidrico_mm']:.0f} mm
+- Relación ETc real / ETc: {r['factor_hidrico']:.2f}{ventana}
+- Grados día (base {r['temperatura_base']:.0f} °C): {r['gdd']:.0f} · días con estrés por calor: {r['dias_calor']} · días con helada: {r['dias_helada']}
+"""
+
+def generar_analisis_riesgo_hidrico(df_resumen: pd.DataFrame, stats: Dict, cultivo: str,
+                                    agroclima: Optional[Dict] = None) -> str:
     system = f"""Eres un hidrólogo de suelos y especialista en manejo del agua en agroecosistemas.
 Evalúa el riesgo hídrico y propone estrategias de adaptación basadas en principios agroecológicos:
 - Captación y almacenamiento de agua de lluvia.
@@ -180,9 +198,9 @@ Evalúa el riesgo hídrico y propone estrategias de adaptación basadas en princ
 
 **Zonas representativas:**
 {df_resumen[['Zona', 'Humedad', 'Textura']].to_string(index=False)}
-
+{resumen_agroclima_texto(agroclima)}
 **Análisis requerido:**
-1. Evaluar el riesgo de estrés hídrico (déficit o exceso) según la textura y la variabilidad espacial.
+1. Evaluar el riesgo de estrés hídrico (déficit o exceso) según la textura, la variabilidad espacial y el balance agroclimático.
 2. Estimar la capacidad de retención de agua disponible para el cultivo.
 3. Proponer un plan de manejo agroecológico del agua que incluya al menos:
    - Prácticas para aumentar la infiltración (coberturas muertas/vivas, hoyos de siembra, etc.).
@@ -0,0 +1,133 @@
+# modules/incertidumbre.py - Monte Carlo vectorizado de rendimientos (P10/P50/P90 por zona y establecimiento)
+import numpy as np
+import pandas as pd
+
+from .cultivos import PARAMETROS_CULTIVOS
+
+# Desvíos por fuente de incertidumbre. Las componentes "comun" son compartidas por todas
+# las zonas en cada muestra (calibración del sensor, clima de la campaña), las demás son
+# independientes por zona.
+INCERTIDUMBRE_DEFECTO = {
+    'ndvi': 0.04,             # satélite, por zona (NDVI y NDRE comparten el error de escena)
+    'ndre': 0.03,
+    'satelite_comun': 0.5,    # sesgo de la escena, en desvíos del error satelital, igual para todo el lote
+    'materia_organica': 0.3,  # suelo, por zona (%)
+    'humedad_suelo': 0.04,
+    'clima_comun': 0.12,      # factor log-normal de la campaña sobre el rendimiento
+    'clima_zona': 0.04,       # heterogeneidad climática/de manejo entre zonas
+}
+CUANTILES = (0.10, 0.50, 0.90)
+# Elementos (muestras × zonas) por bloque: acota la memoria a ~8 MB por array float32
+MAX_ELEMENTOS_BLOQUE = 2_000_000
+
+
+def _generador(semilla):
+    """SFC64: el generador de bits más rápido de NumPy, suficiente para Monte Carlo."""
+    return np.random.Generator(np.random.SFC64(semilla))
+
+
+def _rendimientos_bloque(rngs, comunes, ndvi, ndre, mo, humedad, rendimiento_optimo, inc):
+    """
+    Muestras de rendimiento sin y con fertilización para un bloque de zonas,
+    con forma (zonas, muestras) para que los cuantiles recorran memoria contigua.
+    Cada fila sale del generador de su zona (`rngs`), así las muestras de una
+    zona no dependen de cómo se partió el lote en bloques.
+    """
+    n_zonas, n_muestras = len(ndvi), len(comunes['satelite'])
+    forma = (n_zonas, n_muestras)
+
+    def normales():
+        salida = np.empty(forma, dtype=np.float32)
+        for fila, rng in zip(salida, rngs):
+            rng.standard_normal(dtype=np.float32, out=fila)
+        return salida
+
+    def ruido(sigma):
+        return normales() * np.float32(sigma)
+
+    # NDVI y NDRE salen de la misma escena: un solo error de reflectancia escalado para cada índice
+    error_satelital = normales()
+    error_satelital += comunes['satelite'][None, :]
+    ndvi_s = np.clip(ndvi[:, None] + error_satelital * np.float32(inc['ndvi']), 0.1, 0.9)
+    ndre_s = np.clip(ndre[:, None] + error_satelital * np.float32(inc['ndre']), 0.05, 0.7)
+    mo_s = np.clip(mo[:, None] + ruido(inc['materia_organica']), 0.5, 8.0)
+    hum_s = np.clip(humedad[:, None] + ruido(inc['humedad_suelo']), 0.1, 0.8)
+
+    npk = np.clip(ndvi_s * 0.4 + ndre_s * 0.3 + (mo_s / 8) * 0.2 + hum_s * 0.1, 0, 1)
+    clima = np.exp(ruido(inc['clima_zona']))
+    clima *= comunes['clima'][None, :]
+    rend_sin = np.float32(rendimiento_optimo * 0.7) * npk * clima
+    rend_con = rend_sin * (1 + (1 - npk) * 0.4 + (1 - ndvi_s) * 0.2)
+    return rend_sin, rend_con
+
+
+def simular_rendimientos(fertilidad, area_ha, cultivo, n_muestras=10_000, incertidumbre=None,
+                         semilla=0, max_elementos=MAX_ELEMENTOS_BLOQUE, cuantiles=CUANTILES):
+    """
+    Monte Carlo de rendimientos: muestrea la incertidumbre satelital, de suelo
+    y climática como arrays (zonas × muestras) y los procesa por bloques de
+    zonas para acotar memoria. Las componentes comunes se sortean una sola vez,
+    así la producción total conserva la correlación entre zonas, y cada zona
+    tiene su propio generador, así el resultado no depende de `max_elementos`.
+
+    `fertilidad` tiene columnas ndvi, ndre, materia_organica y humedad_suelo.
+    Retorna un dict con:
+      zonas: DataFrame con rendimiento_sin_fert_pXX y rendimiento_con_fert_pXX (kg/ha)
+      produccion_sin_fert, produccion_con_fert: muestras (N,) de producción total (kg)
+      establecimiento: DataFrame de cuantiles de producción total (t)
+    """
+    inc = {**INCERTIDUMBRE_DEFECTO, **(incertidumbre or {})}
+    rendimiento_optimo = PARAMETROS_CULTIVOS[cultivo]['RENDIMIENTO_OPTIMO']
+    ndvi = np.asarray(fertilidad['ndvi'], dtype=np.float32)
+    ndre = np.asarray(fertilidad['ndre'], dtype=np.float32)
+    mo = np.asarray(fertilidad['materia_organica'], dtype=np.float32)
+    humedad = np.asarray(fertilidad['humedad_suelo'], dtype=np.float32)
+    area = np.asarray(area_ha, dtype=np.float64)
+    n_zonas = len(ndvi)
+
+    secuencia = np.random.SeedSequence(semilla)
+    semilla_comun, semilla_zonas = secuencia.spawn(2)
+    rng_comun = _generador(semilla_comun)
+    comunes = {
+        'satelite': (rng_comun.standard_normal(n_muestras) * inc['satelite_comun']).astype(np.float32),
+        # Log-normal con media 1
+        'clima': np.exp(rng_comun.standard_normal(n_muestras) * inc['clima_comun']
+                        - inc['clima_comun'] ** 2 / 2).astype(np.float32),
+    }
+
+    zonas_por_bloque = max(1, int(max_elementos // max(n_muestras, 1)))
+    inicios = range(0, n_zonas, zonas_por_bloque)
+    semillas_zona = semilla_zonas.spawn(n_zonas)
+    niveles = np.asarray(cuantiles)
+    q_sin = np.empty((len(niveles), n_zonas), dtype=np.float32)
+    q_con = np.empty((len(niveles), n_zonas), dtype=np.float32)
+    produccion_sin = np.zeros(n_muestras)
+    produccion_con = np.zeros(n_muestras)
+
+    for inicio in inicios:
+        bloque = slice(inicio, min(inicio + zonas_por_bloque, n_zonas))
+        rngs = [_generador(s) for s in semillas_zona[bloque]]
+        rend_sin, rend_con = _rendimientos_bloque(
+            rngs, comunes, ndvi[bloque], ndre[bloque], mo[bloque], humedad[bloque], rendimiento_optimo, inc
+        )
+        q_sin[:, bloque] = np.quantile(rend_sin, niveles, axis=1)
+        q_con[:, bloque] = np.quantile(rend_con, niveles, axis=1)
+        produccion_sin += area[bloque] @ rend_sin
+        produccion_con += area[bloque] @ rend_con
+
+    columnas = {}
+    for i, nivel in enumerate(niveles):
+        etiqueta = f"p{int(round(nivel * 100)):02d}"
+        columnas[f'rendimiento_sin_fert_{etiqueta}'] = np.round(q_sin[i], 0)
+        columnas[f'rendimiento_con_fert_{etiqueta}'] = np.round(q_con[i], 0)
+    establecimiento = pd.DataFrame({
+        'cuantil': [f"P{int(round(n * 100))}" for n in niveles],
+        'produccion_sin_fert_t': np.quantile(produccion_sin, niveles) / 1000,
+        'produccion_con_fert_t': np.quantile(produccion_con, niveles) / 1000,
+    })
+    return {
+        'zonas': pd.DataFrame(columnas),
+        'produccion_sin_fert': produccion_sin,
+        'produccion_con_fert': produccion_con,
+        'establecimiento': establecimiento,
+    }
@@ -0,0 +1,79 @@
+# modules/ingesta.py - Lectura columnar (Arrow) de formatos vectoriales de un solo archivo
+import os
+import warnings
+import importlib.util
+from io import BytesIO
+
+import geopandas as gpd
+
+try:
+    import pyogrio
+    PYOGRIO_DISPONIBLE = True
+except ImportError:
+    PYOGRIO_DISPONIBLE = False
+
+# pyarrow es requerido por use_arrow y por GeoParquet; sólo se verifica que esté instalado
+ARROW_DISPONIBLE = importlib.util.find_spec('pyarrow') is not None
+
+# Extensión -> nombre legible. Todos se leen vía pyogrio, salvo GeoParquet (pyarrow directo)
+FORMATOS_VECTORIALES = {
+    '.gpkg': 'GeoPackage',
+    '.geojson': 'GeoJSON',
+    '.json': 'GeoJSON',
+    '.fgb': 'FlatGeobuf',
+    '.parquet': 'GeoParquet',
+    '.geoparquet': 'GeoParquet',
+}
+
+
+def extension_archivo(nombre):
+    return os.path.splitext(nombre or '')[1].lower()
+
+
+def es_formato_vectorial(nombre):
+    return extension_archivo(nombre) in FORMATOS_VECTORIALES
+
+
+def _como_bytes(archivo):
+    """Acepta ruta, bytes o archivo abierto (p. ej. UploadedFile de Streamlit)."""
+    if isinstance(archivo, (bytes, bytearray)):
+        return bytes(archivo)
+    if isinstance(archivo, (str, os.PathLike)):
+        with open(archivo, 'rb') as f:
+            return f.read()
+    archivo.seek(0)
+    return archivo.read()
+
+
+def leer_vectorial(archivo, nombre=None, capa=None, use_arrow=True):
+    """
+    Lee GeoPackage, GeoJSON, FlatGeobuf o GeoParquet a un GeoDataFrame
+    conservando todas las columnas de atributos. Con pyogrio + pyarrow las
+    entidades se transfieren en bloque como columnas Arrow (use_arrow), sin
+    construir un objeto Python por entidad y por campo. GeoParquet se lee
+    directamente con pyarrow. Retorna (gdf, capas_disponibles).
+    """
+    if nombre is None:
+        nombre = archivo if isinstance(archivo, (str, os.PathLike)) else getattr(archivo, 'name', '')
+    extension = extension_archivo(str(nombre))
+    if extension not in FORMATOS_VECTORIALES:
+        raise ValueError(f"Formato no soportado: {extension or nombre}")
+
+    contenido = BytesIO(_como_bytes(archivo))
+    if FORMATOS_VECTORIALES[extension] == 'GeoParquet':
+        if not ARROW_DISPONIBLE:
+            raise ImportError("Leer GeoParquet requiere pyarrow")
+        return gpd.read_parquet(contenido), []
+
+    if not PYOGRIO_DISPONIBLE:
+        return gpd.read_file(contenido, layer=capa), []
+
+    with warnings.catch_warnings():
+        # El buffer en /vsimem/ no tiene extensión; GDAL lo advierte para GeoPackage
+        warnings.filterwarnings('ignore', message='.*non conformant file extension')
+        capas = [str(c) for c in pyogrio.list_layers(contenido)[:, 0]]
+        contenido.seek(0)
+        if capa is None and capas:
+            capa = capas[0]
+        gdf = pyogrio.read_dataframe(contenido, layer=capa, use_arrow=use_arrow and ARROW_DISPONIBLE)
+    return gdf, capas
@@ -0,0 +1,256 @@
+# modules/lotes.py - Análisis por lotes: un análisis por polígono en un pool de procesos
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely import wkb
+from shapely.geometry import box
+
+from .analisis import (
+    dividir_parcela_en_zonas,
+    calcular_area_zonas,
+    analizar_fertilidad_actual,
+    analizar_recomendaciones_npk,
+    analizar_costos,
+    analizar_proyecciones_cosecha,
+    analizar_textura_suelo,
+    combinar_resultados
+)
+
+# Límite de procesos simultáneos por defecto (cada worker importa geopandas completo)
+MAX_PROCESOS_LOTES = max(1, min(4, (os.cpu_count() or 2) - 1))
+# Margen (grados) para considerar que dos lotes comparten descargas de GEE/DEM/NASA
+MARGEN_AGRUPACION_GRADOS = 0.01
+# Columnas candidatas para el nombre del lote en el archivo original
+COLUMNAS_NOMBRE_LOTE = ['nombre', 'NOMBRE', 'Nombre', 'name', 'Name', 'NAME', 'lote', 'LOTE', 'Lote', 'id', 'ID']
+
+
+def nombrar_lotes(gdf):
+    """Agrega 'id_lote' y 'nombre_lote' conservando los atributos originales."""
+    gdf = gdf.reset_index(drop=True).copy()
+    gdf['id_lote'] = range(1, len(gdf) + 1)
+    columna = next((c for c in COLUMNAS_NOMBRE_LOTE if c in gdf.columns), None)
+    if columna is not None:
+        gdf['nombre_lote'] = gdf[columna].astype(str)
+    else:
+        gdf['nombre_lote'] = [f"Lote {i}" for i in gdf['id_lote']]
+    return gdf
+
+
+def agrupar_lotes_por_cercania(gdf_lotes, margen=MARGEN_AGRUPACION_GRADOS):
+    """
+    Asigna a cada lote un 'grupo' de lotes cuyas envolventes (ampliadas por
+    `margen`) se solapan. Cada grupo comparte una sola descarga de datos externos.
+    """
+    envolventes = shapely.buffer(shapely.envelope(np.asarray(gdf_lotes.geometry, dtype=object)), margen)
+    grupos = shapely.get_parts(shapely.union_all(envolventes))
+    arbol = shapely.STRtree(grupos)
+    idx_lote, idx_grupo = arbol.query(envolventes, predicate='intersects')
+    asignacion = np.zeros(len(gdf_lotes), dtype=int)
+    asignacion[idx_lote] = idx_grupo
+    gdf_lotes = gdf_lotes.copy()
+    gdf_lotes['grupo'] = asignacion + 1
+    return gdf_lotes
+
+
+def recortar_grilla_dem(dem, bounds):
+    """Subconjunto de la grilla X/Y/Z/pendientes del grupo que cubre el bbox del lote."""
+    if dem is None or dem.get('Z') is None:
+        return None
+    minx, miny, maxx, maxy = bounds
+    X, Y = dem['X'], dem['Y']
+    filas = np.where((Y.max(axis=1) >= miny) & (Y.min(axis=1) <= maxy))[0]
+    cols = np.where((X.max(axis=0) >= minx) & (X.min(axis=0) <= maxx))[0]
+    if len(filas) == 0 or len(cols) == 0:
+        return None
+    sl = (slice(filas.min(), filas.max() + 1), slice(cols.min(), cols.max() + 1))
+    recorte = {k: dem[k][sl] for k in ('X', 'Y', 'Z') if dem.get(k) is not None}
+    recorte['pendientes'] = dem['pendientes'][sl] if dem.get('pendientes') is not None else None
+    recorte['fuente'] = dem.get('fuente', 'N/A')
+    return recorte
+
+
+def _resumen_topografia(geometria, dem):
+    if dem is None:
+        return np.nan, np.nan
+    dentro = shapely.contains_xy(geometria, dem['X'], dem['Y'])
+    if not np.any(dentro):
+        return np.nan, np.nan
+    elevacion = np.nanmean(dem['Z'][dentro]) if np.any(~np.isnan(dem['Z'][dentro])) else np.nan
+    pendiente = np.nan
+    if dem.get('pendientes') is not None and np.any(~np.isnan(dem['pendientes'][dentro])):
+        pendiente = np.nanmean(dem['pendientes'][dentro])
+    return elevacion, pendiente
+
+
+def analizar_lote(tarea):
+    """
+    Worker: ejecuta las etapas agronómicas para un lote usando los datos externos
+    ya descargados para su grupo. Debe ser importable (se ejecuta en otro proceso).
+    """
+    resultado = {'id_lote': tarea['id_lote'], 'nombre_lote': tarea['nombre_lote'],
+                 'grupo': tarea['grupo'], 'exitoso': False, 'error': None,
+                 'gdf_completo': None, 'resumen': None}
+    try:
+        geometria = wkb.loads(tarea['geometria_wkb'])
+        cultivo = tarea['cultivo']
+        gdf_lote = gpd.GeoDataFrame({'id_zona': [1], 'geometry': [geometria]}, crs='EPSG:4326')
+        gdf_dividido = dividir_parcela_en_zonas(gdf_lote, tarea['n_zonas'])
+        gdf_dividido['area_ha'] = calcular_area_zonas(gdf_dividido)
+
+        fertilidad = analizar_fertilidad_actual(gdf_dividido, cultivo, tarea['datos_satelitales'])
+        rec_n, rec_p, rec_k = analizar_recomendaciones_npk(fertilidad, cultivo)
+        costos = analizar_costos(gdf_dividido, cultivo, rec_n, rec_p, rec_k)
+        proyecciones = analizar_proyecciones_cosecha(gdf_dividido, cultivo, fertilidad)
+        gdf_dividido = analizar_textura_suelo(gdf_dividido, cultivo)
+        gdf_completo = combinar_resultados(gdf_dividido, fertilidad, rec_n, rec_p, rec_k, costos, proyecciones)
+
+        area = gdf_completo['area_ha'].astype(float)
+        area_total = float(area.sum())
+        pesos = area if area_total > 0 else None
+        elevacion, pendiente = _resumen_topografia(geometria, tarea.get('dem'))
+
+        resultado['gdf_completo'] = gdf_completo
+        resultado['resumen'] = {
+            'Lote': tarea['id_lote'],
+            'Nombre': tarea['nombre_lote'],
+            'Grupo descarga': tarea['grupo'],
+            'Área (ha)': round(area_total, 2),
+            'Zonas': len(gdf_completo),
+            'Índice NPK': round(float(np.average(gdf_completo['fert_npk_actual'], weights=pesos)), 3),
+            'NDVI': round(float(np.average(gdf_completo['fert_ndvi'], weights=pesos)), 3),
+            'N rec. (kg/ha)': round(float(np.average(gdf_completo['rec_N'], weights=pesos)), 1),
+            'P rec. (kg/ha)': round(float(np.average(gdf_completo['rec_P'], weights=pesos)), 1),
+            'K rec. (kg/ha)': round(float(np.average(gdf_completo['rec_K'], weights=pesos)), 1),
+            'Costo total (USD)': round(float((gdf_completo['costo_costo_total'].astype(float) * area).sum()), 2),
+            'Rend. sin fert. (kg/ha)': round(float(np.average(gdf_completo['proy_rendimiento_sin_fert'], weights=pesos)), 0),
+            'Rend. con fert. (kg/ha)': round(float(np.average(gdf_completo['proy_rendimiento_con_fert'], weights=pesos)), 0),
+            'Textura predominante': gdf_completo['textura_suelo'].mode()[0] if len(gdf_completo) else 'N/D',
+            'Elevación media (m)': round(float(elevacion), 1) if not np.isnan(elevacion) else np.nan,
+            'Pendiente media (%)': round(float(pendiente), 2) if not np.isnan(pendiente) else np.nan,
+            'Precipitación período (mm)': tarea.get('precipitacion_total', np.nan)
+        }
+        resultado['exitoso'] = True
+    except Exception as e:
+        resultado['error'] = str(e)
+    return resultado
+
+
+def recortar_datos_satelitales(datos, geometria):
+    """
+    Estadísticas del índice propias del lote a partir de la grilla compartida del grupo:
+    celdas cuyo centro cae dentro del lote (o la más cercana al centroide si el lote es
+    más chico que una celda). Sin grilla devuelve los valores del grupo. El resultado
+    no incluye la grilla, para no serializarla en cada tarea.
+    """
+    if datos is None:
+        return None
+    grilla = datos.get('grilla')
+    recortados = {k: v for k, v in datos.items() if k != 'grilla'}
+    if grilla is None:
+        return recortados
+    X, Y, valores = grilla['X'], grilla['Y'], grilla['valores']
+    validos = ~np.isnan(valores)
+    dentro = shapely.contains_xy(geometria, X, Y) & validos
+    if not dentro.any():
+        if not validos.any():
+            return recortados
+        centro = geometria.centroid
+        distancia = np.where(validos, (X - centro.x) ** 2 + (Y - centro.y) ** 2, np.inf)
+        dentro = distancia == distancia.min()
+    muestra = valores[dentro]
+    recortados.update({
+        'valor_promedio': float(muestra.mean()),
+        'valor_min': float(muestra.min()),
+        'valor_max': float(muestra.max()),
+        'valor_std': float(muestra.std()),
+        'celdas_indice': int(dentro.sum())
+    })
+    return recortados
+
+
+def preparar_tareas(gdf_lotes, cultivo, n_zonas, datos_por_grupo):
+    """Arma las tareas serializables (geometría en WKB, datos del grupo recortados al lote)."""
+    tareas = []
+    for row in gdf_lotes.itertuples():
+        compartido = datos_por_grupo.get(row.grupo, {})
+        df_power = compartido.get('df_power')
+        precipitacion = float(df_power['precipitacion'].sum()) if df_power is not None else np.nan
+        tareas.append({
+            'id_lote': int(row.id_lote),
+            'nombre_lote': row.nombre_lote,
+            'grupo': int(row.grupo),
+            'geometria_wkb': wkb.dumps(row.geometry),
+            'cultivo': cultivo,
+            'n_zonas': n_zonas,
+            'datos_satelitales': recortar_datos_satelitales(compartido.get('datos_satelitales'), row.geometry),
+            'dem': recortar_grilla_dem(compartido.get('dem'), row.geometry.bounds),
+            'precipitacion_total': round(precipitacion, 1) if not np.isnan(precipitacion) else np.nan
+        })
+    return tareas
+
+
+def ejecutar_lotes_en_paralelo(tareas, max_procesos=MAX_PROCESOS_LOTES, al_avanzar=None,
+                               funcion=analizar_lote, inicializador=None):
+    """
+    Ejecuta `funcion` (por defecto `analizar_lote`) sobre todas las tareas con un
+    pool de procesos acotado. `al_avanzar(completados, total)` se llama desde el
+    proceso principal e `inicializador()` una vez en cada worker.
+    Usa 'spawn' para no heredar los hilos del servidor de Streamlit.
+    """
+    total = len(tareas)
+    resultados = []
+    if total == 0:
+        return resultados
+    max_procesos = max(1, min(int(max_procesos), total))
+    if max_procesos == 1:
+        if inicializador:
+            inicializador()
+        for i, tarea in enumerate(tareas, start=1):
+            resultados.append(funcion(tarea))
+            if al_avanzar:
+                al_avanzar(i, total)
+    else:
+        contexto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max_procesos, mp_context=contexto,
+                                 initializer=inicializador) as pool:
+            futuros = [pool.submit(funcion, tarea) for tarea in tareas]
+            for i, futuro in enumerate(as_completed(futuros), start=1):
+                resultados.append(futuro.result())
+                if al_avanzar:
+                    al_avanzar(i, total)
+    resultados.sort(key=lambda r: r['id_lote'])
+    return resultados
+
+
+def resumen_establecimiento(resultados_lotes):
+    """Tabla resumen a nivel establecimiento: una fila por lote más una fila de totales."""
+    filas = [r['resumen'] for r in resultados_lotes if r['exitoso']]
+    if not filas:
+        return pd.DataFrame()
+    df = pd.DataFrame(filas)
+    area = df['Área (ha)']
+    pesos = area if area.sum() > 0 else None
+    total = {col: np.nan for col in df.columns}
+    total.update({
+        'Lote': 'TOTAL',
+        'Nombre': f"{len(df)} lotes",
+        'Grupo descarga': df['Grupo descarga'].nunique(),
+        'Área (ha)': round(float(area.sum()), 2),
+        'Zonas': int(df['Zonas'].sum()),
+        'Costo total (USD)': round(float(df['Costo total (USD)'].sum()), 2),
+        'Textura predominante': df['Textura predominante'].mode()[0]
+    })
+    for col in ['Índice NPK', 'NDVI', 'N rec. (kg/ha)', 'P rec. (kg/ha)', 'K rec. (kg/ha)',
+                'Rend. sin fert. (kg/ha)', 'Rend. con fert. (kg/ha)']:
+        total[col] = round(float(np.average(df[col], weights=pesos)), 3)
+    return pd.concat([df, pd.DataFrame([total])], ignore_index=True)
+
+
+def envolvente_grupo(gdf_grupo):
+    """GeoDataFrame con el rectángulo que cubre un grupo de lotes (para las descargas compartidas)."""
+    return gpd.GeoDataFrame({'geometry': [box(*gdf_grupo.total_bounds)]}, crs='EPSG:4326')
@@ -0,0 +1,206 @@
+# modules/pipeline.py - Análisis completo de una parcela como grafo de etapas memoizadas
+import traceback
+
+import numpy as np
+
+from . import eventos
+from .analisis import (
+    COLUMNAS_FERTILIDAD,
+    validar_y_corregir_crs,
+    calcular_superficie,
+    dividir_parcela_en_zonas,
+    calcular_area_zonas,
+    analizar_fertilidad_actual,
+    analizar_recomendaciones_npk,
+    analizar_costos,
+    analizar_proyecciones_cosecha,
+    analizar_textura_suelo,
+    combinar_resultados
+)
+from .datos_externos import (
+    SATELITES_GEE,
+    descargar_datos_satelitales,
+    completar_datos_satelitales,
+    obtener_datos_nasa_power,
+    gee_autenticado
+)
+from .topografia import obtener_dem_analisis, generar_curvas_dem
+from .prescripcion import calcular_prescripcion_pixeles
+from .agroclima import calcular_agroclima, ajustar_proyecciones_clima
+from .clima_power import serie_completa
+from .etapas import ejecutar_grafo, SinCache
+
+
+def dividir_zonas_con_area(gdf, n_divisiones):
+    gdf_dividido = dividir_parcela_en_zonas(gdf, n_divisiones).copy()
+    gdf_dividido['area_ha'] = calcular_area_zonas(gdf_dividido)
+    return gdf_dividido
+
+
+def descarga_satelital(parcela, satelite, fecha_inicio, fecha_fin, indice):
+    """Descarga de la fuente elegida; si una fuente real (GEE) no trae datos, la etapa no se memoiza."""
+    datos = descargar_datos_satelitales(parcela, satelite, fecha_inicio, fecha_fin, indice)
+    if datos is None and satelite in SATELITES_GEE:
+        return SinCache(None, "GEE no trajo datos, se usan datos simulados")
+    return datos
+
+
+def clima_de_parcela(parcela, fecha_inicio, fecha_fin):
+    """Clima de NASA POWER; una serie ausente o incompleta no se memoiza."""
+    df_power = obtener_datos_nasa_power(parcela, fecha_inicio, fecha_fin)
+    if not serie_completa(df_power, fecha_inicio, fecha_fin):
+        return SinCache(df_power, "la serie de NASA POWER está incompleta")
+    return df_power
+
+
+def dem_de_parcela(parcela, resolucion_dem):
+    """DEM de la parcela; el DEM sintético de respaldo no se memoiza."""
+    dem = obtener_dem_analisis(parcela, resolucion_dem)
+    if dem is None or dem['fuente'] == 'Sintético':
+        return SinCache(dem, "no hubo DEM real, se usa el sintético")
+    return dem
+
+
+def agroclima_de_parcela(df_power, parcela, textura, fertilidad, cultivo, dem):
+    """Indicadores agroclimáticos del período con la latitud de la parcela, la elevación media del DEM y las zonas."""
+    latitud = parcela.geometry.unary_union.centroid.y
+    elevacion = float(np.nanmean(dem['Z'])) if dem is not None and np.isfinite(dem['Z']).any() else 0.0
+    return calcular_agroclima(df_power, cultivo, latitud, textura, fertilidad['materia_organica'].to_numpy(), elevacion)
+
+
+# (nombre, entradas, función). Las entradas son parámetros de ejecutar_analisis_completo
+# o etapas anteriores; ninguna etapa modifica lo que recibe, porque sus salidas se comparten
+# desde la caché. Sólo descarga_satelital, nasa_power y dem hacen E/S, y ninguna depende del cultivo;
+# si una descarga falla o cae en un respaldo, esa etapa y sus dependientes no se memoizan.
+ETAPAS_ANALISIS = [
+    ('parcela', ('gdf',), lambda gdf: validar_y_corregir_crs(gdf.copy())),
+    ('superficie', ('parcela',), calcular_superficie),
+    ('descarga_satelital', ('parcela', 'satelite', 'fecha_inicio', 'fecha_fin', 'indice', 'gee_autenticado'),
+     lambda parcela, satelite, inicio, fin, indice, _: descarga_satelital(parcela, satelite, inicio, fin, indice)),
+    ('datos_satelitales', ('descarga_satelital', 'parcela', 'cultivo', 'satelite', 'indice'), completar_datos_satelitales),
+    ('nasa_power', ('parcela', 'fecha_inicio', 'fecha_fin'), clima_de_parcela),
+    ('zonas', ('parcela', 'n_divisiones'), dividir_zonas_con_area),
+    ('fertilidad', ('zonas', 'cultivo', 'datos_satelitales'), analizar_fertilidad_actual),
+    ('npk', ('fertilidad', 'cultivo'), analizar_recomendaciones_npk),
+    ('costos', ('zonas', 'cultivo', 'npk'), lambda zonas, cultivo, npk: analizar_costos(zonas, cultivo, *npk)),
+    ('proyecciones', ('zonas', 'cultivo', 'fertilidad'), analizar_proyecciones_cosecha),
+    ('textura', ('zonas', 'cultivo'), lambda zonas, cultivo: analizar_textura_suelo(zonas.copy(), cultivo)),
+    ('dem', ('parcela', 'resolucion_dem'), dem_de_parcela),
+    ('curvas', ('dem', 'parcela', 'intervalo_curvas'), generar_curvas_dem),
+    ('agroclima', ('nasa_power', 'parcela', 'textura', 'fertilidad', 'cultivo', 'dem'), agroclima_de_parcela),
+    ('proyecciones_clima', ('proyecciones', 'agroclima', 'cultivo'), ajustar_proyecciones_clima),
+    ('combinar', ('textura', 'fertilidad', 'npk', 'costos', 'proyecciones_clima'),
+     lambda textura, fertilidad, npk, costos, proyecciones: combinar_resultados(textura, fertilidad, *npk, costos, proyecciones)),
+]
+
+# Modo prescripción por píxel: la fertilidad por zona es la base de cada píxel y las
+# tablas por zona (fertilidad, NPK, proyecciones) pasan a ser promedios de los píxeles.
+_ETAPAS = {etapa[0]: etapa for etapa in ETAPAS_ANALISIS}
+ETAPAS_PRESCRIPCION = [
+    _ETAPAS[nombre] for nombre in ('parcela', 'superficie', 'descarga_satelital', 'datos_satelitales',
+                                   'nasa_power', 'zonas', 'fertilidad', 'dem', 'curvas')
+] + [
+    ('prescripcion', ('zonas', 'fertilidad', 'cultivo', 'datos_satelitales', 'dem', 'resolucion_prescripcion'),
+     calcular_prescripcion_pixeles),
+    ('fertilidad_pixeles', ('prescripcion',), lambda prescripcion: prescripcion['zonas'][COLUMNAS_FERTILIDAD].copy()),
+    ('npk', ('prescripcion',),
+     lambda prescripcion: tuple(prescripcion['zonas'][c].to_numpy() for c in ('rec_N', 'rec_P', 'rec_K'))),
+    _ETAPAS['costos'],
+    ('proyecciones', ('prescripcion',),
+     lambda prescripcion: prescripcion['zonas'][['rendimiento_sin_fert', 'rendimiento_con_fert',
+                                                 'incremento_esperado']].copy()),
+    _ETAPAS['textura'],
+    _ETAPAS['agroclima'],
+    _ETAPAS['proyecciones_clima'],
+    ('combinar', ('textura', 'fertilidad_pixeles', 'npk', 'costos', 'proyecciones_clima'), _ETAPAS['combinar'][2]),
+]
+
+
+def etapas_del_analisis(resolucion_prescripcion=None):
+    """Grafo que corre ejecutar_analisis_completo: por píxel si hay resolución de prescripción."""
+    return ETAPAS_PRESCRIPCION if resolucion_prescripcion else ETAPAS_ANALISIS
+
+
+# ===== FUNCIÓN PARA EJECUTAR TODOS LOS ANÁLISIS =====
+def ejecutar_analisis_completo(gdf, cultivo, n_divisiones, satelite, fecha_inicio, fecha_fin,
+                               intervalo_curvas=5.0, resolucion_dem=10.0, indice='NDVI', cache=None,
+                               al_completar=None, resolucion_prescripcion=None):
+    """
+    Ejecuta el grafo ETAPAS_ANALISIS con memoización: un cambio de parámetro
+    sólo recalcula las etapas que dependen de él (p. ej. el intervalo de curvas
+    sólo vuelve a contornear y el cultivo no repite descargas).
+    resultados['etapas'] registra por etapa si vino de caché y cuánto tardó, y
+    resultados['parametros'] los parámetros del análisis (sin la geometría).
+    `cache` es una CacheEtapas (sin caché se calculan todas las etapas) y
+    `al_completar(nombre, valor, registro_etapa)` recibe cada etapa al terminar.
+    Con `resolucion_prescripcion` (m) corre ETAPAS_PRESCRIPCION: evaluación por
+    píxel, GeoTIFF de dosis variable en resultados['prescripcion'] y tablas
+    por zona agregadas desde los píxeles.
+    resultados['agroclima'] trae grados día, ET0, balance hídrico por zona y
+    días de estrés térmico del período (None si no hay clima de NASA POWER).
+    """
+    resultados = {
+        'exitoso': False,
+        'gdf_dividido': None,
+        'fertilidad_actual': None,
+        'recomendaciones_npk': None,
+        'costos': None,
+        'proyecciones': None,
+        'textura': None,
+        'df_power': None,
+        'agroclima': None,
+        'area_total': 0,
+        'mapas': {},
+        'dem_data': None,
+        'curvas_nivel': None,
+        'pendientes': None,
+        'datos_satelitales': None,
+        'prescripcion': None,
+        'etapas': []
+    }
+
+    try:
+        parametros = {
+            'gdf': gdf,
+            'cultivo': cultivo,
+            'n_divisiones': int(n_divisiones),
+            'satelite': satelite,
+            'fecha_inicio': fecha_inicio,
+            'fecha_fin': fecha_fin,
+            'indice': indice,
+            'gee_autenticado': gee_autenticado(),
+            'intervalo_curvas': float(intervalo_curvas),
+            'resolucion_dem': float(resolucion_dem),
+        }
+        etapas = etapas_del_analisis(resolucion_prescripcion)
+        if resolucion_prescripcion:
+            parametros['resolucion_prescripcion'] = float(resolucion_prescripcion)
+        salidas, registro = ejecutar_grafo(etapas, parametros, cache, al_completar)
+        rec_n, rec_p, rec_k = salidas['npk']
+
+        resultados.update({
+            'parametros': {k: v for k, v in parametros.items() if k not in ('gdf', 'gee_autenticado')},
+            'area_total': salidas['superficie'],
+            'datos_satelitales': salidas['datos_satelitales'],
+            'df_power': salidas['nasa_power'],
+            'gdf_dividido': salidas['textura'],
+            'fertilidad_actual': salidas.get('fertilidad_pixeles', salidas['fertilidad']),
+            'recomendaciones_npk': {'N': rec_n, 'P': rec_p, 'K': rec_k},
+            'costos': salidas['costos'],
+            'proyecciones': salidas['proyecciones_clima'],
+            'textura': salidas['textura'],
+            'agroclima': salidas['agroclima'],
+            'dem_data': salidas['curvas'],
+            'gdf_completo': salidas['combinar'],
+            'prescripcion': salidas.get('prescripcion'),
+            'etapas': registro,
+        })
+        resultados['exitoso'] = True
+        return resultados
+
+    except Exception as e:
+        eventos.error(f"❌ Error en el análisis completo: {str(e)}")
+        traceback.print_exc()
+        resultados['exitoso'] = False
+        resultados['error'] = str(e)
+        return resultados
@@ -0,0 +1,262 @@
+# modules/prescripcion.py - Prescripción por píxel: fertilidad, NPK y rendimiento por bloques y GeoTIFF de dosis variable
+import os
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+from . import eventos
+from .almacenamiento import directorio_datos
+from .cultivos import PARAMETROS_CULTIVOS
+from .agronomia import evaluar_cultivos
+from .analisis import COLUMNAS_FERTILIDAD, RUIDO_FERTILIDAD, centros_zonas, semilla_determinista, normales_por_zona
+
+# ===== DEPENDENCIAS OPCIONALES =====
+try:
+    import rasterio
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+    RASTERIO_OK = True
+except ImportError:
+    RASTERIO_OK = False
+
+DIRECTORIO_PRESCRIPCIONES = 'prescripciones'
+RESOLUCION_PRESCRIPCION_DEFECTO = 10.0   # m; la maquinaria aplica a 10-30 m
+# Lado del bloque procesado a la vez: ~260 mil píxeles × ~25 arrays float64 ≈ 50 MB, sea cual sea el lote
+BLOQUE_PIXELES = 512
+TESELA_TIFF = 256
+MAX_LADO_VISTA_PREVIA = 400
+NODATA = -9999.0
+RETENCION_DIAS = 7
+# Dentro de la zona el ruido es más chico que entre zonas (la zona ya trae el suyo)
+ESCALA_RUIDO_PIXEL = 0.3
+# Bandas del GeoTIFF: (columna, descripción)
+BANDAS_PRESCRIPCION = [
+    ('rec_N', 'Dosis N (kg/ha)'),
+    ('rec_P', 'Dosis P (kg/ha)'),
+    ('rec_K', 'Dosis K (kg/ha)'),
+    ('rendimiento_sin_fert', 'Rendimiento sin fertilizar (kg/ha)'),
+    ('rendimiento_con_fert', 'Rendimiento con fertilización (kg/ha)'),
+    ('npk_actual', 'Índice NPK actual'),
+]
+# Columnas de la evaluación agronómica que se promedian por zona
+COLUMNAS_EVALUACION = ['rec_N', 'rec_P', 'rec_K', 'rendimiento_sin_fert', 'rendimiento_con_fert', 'incremento_esperado']
+
+
+def _purgar_prescripciones(directorio, dias=RETENCION_DIAS):
+    limite = time.time() - dias * 86400
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        if nombre.endswith('.tif') and os.path.getmtime(ruta) < limite:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+
+def _muestreador_dem(dem):
+    """
+    Función (lon, lat) -> (relieve, pendiente relativa) por vecino más cercano
+    sobre la grilla regular del DEM. relieve > 0 en bajos (más húmedos).
+    """
+    if dem is None or dem.get('Z') is None:
+        return None
+    X, Y, Z = np.asarray(dem['X'], dtype=float), np.asarray(dem['Y'], dtype=float), np.asarray(dem['Z'], dtype=float)
+    if not np.isfinite(Z).any() or Z.ndim != 2 or min(Z.shape) < 2:
+        return None
+    x0, dx = X[0, 0], X[0, 1] - X[0, 0]
+    y0, dy = Y[0, 0], Y[1, 0] - Y[0, 0]
+    z_media, z_desvio = np.nanmean(Z), np.nanstd(Z)
+    relieve = np.clip((z_media - Z) / z_desvio, -2, 2) if z_desvio > 0 else np.zeros_like(Z)
+    pendientes = dem.get('pendientes')
+    if pendientes is not None and np.isfinite(pendientes).any():
+        pendiente_ref = np.nanpercentile(pendientes, 95)
+        pendiente_rel = np.clip(pendientes / pendiente_ref, 0, 1) if pendiente_ref > 0 else np.zeros_like(Z)
+    else:
+        pendiente_rel = np.zeros_like(Z)
+    relieve = np.nan_to_num(relieve)
+    pendiente_rel = np.nan_to_num(pendiente_rel)
+
+    def muestrear(lon, lat):
+        j = np.clip(np.rint((lon - x0) / dx), 0, Z.shape[1] - 1).astype(np.intp) if dx else np.zeros(len(lon), np.intp)
+        i = np.clip(np.rint((lat - y0) / dy), 0, Z.shape[0] - 1).astype(np.intp) if dy else np.zeros(len(lat), np.intp)
+        return relieve[i, j], pendiente_rel[i, j]
+    return muestrear
+
+
+def calcular_prescripcion_pixeles(gdf_zonas, fertilidad, cultivo, datos_satelitales, dem,
+                                  resolucion_m=RESOLUCION_PRESCRIPCION_DEFECTO, bloque=BLOQUE_PIXELES,
+                                  directorio=None):
+    """
+    Evalúa fertilidad, dosis NPK y rendimiento en cada píxel de `resolucion_m`
+    metros (en la UTM del lote). Cada píxel parte de los valores de su zona y
+    agrega el gradiente espacial continuo del modelo de fertilidad, el relieve
+    del DEM sobre la humedad y un ruido menor derivado del índice global del
+    píxel (no depende del tamaño de bloque); la grilla se recorre en bloques
+    de `bloque`² píxeles, así la memoria no depende del tamaño del lote. Con
+    rasterio las bandas (BANDAS_PRESCRIPCION) se escriben bloque a bloque en
+    un GeoTIFF teselado y comprimido.
+
+    Retorna un dict con la grilla (crs, transform, ancho, alto, resolucion_m),
+    los píxeles válidos, la ruta del GeoTIFF (o None), una vista previa
+    reducida de la dosis de N y `zonas`: promedios por zona de las columnas de
+    fertilidad y de la evaluación, el desvío de la dosis de N y los píxeles.
+    """
+    inicio = time.perf_counter()
+    n_zonas = len(gdf_zonas)
+    params = PARAMETROS_CULTIVOS[cultivo]
+    valor_base_satelital = datos_satelitales.get('valor_promedio', 0.6) if datos_satelitales else 0.6
+
+    crs = gdf_zonas.estimate_utm_crs()
+    zonas_utm = gdf_zonas.to_crs(crs)
+    geometrias = np.asarray(zonas_utm.geometry, dtype=object)
+    arbol = shapely.STRtree(geometrias)
+    minx, miny, maxx, maxy = zonas_utm.total_bounds
+    ancho = max(1, int(np.ceil((maxx - minx) / resolucion_m)))
+    alto = max(1, int(np.ceil((maxy - miny) / resolucion_m)))
+    a_geograficas = Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
+    muestrear_dem = _muestreador_dem(dem)
+
+    # Gradiente espacial con la misma normalización que usa la fertilidad por zona
+    cx, cy = centros_zonas(zonas_utm)
+    rango_x = (cx.max() - cx.min()) or 1.0
+    rango_y = (cy.max() - cy.min()) or 1.0
+    patron_zona = (cx - cx.min()) / rango_x * 0.6 + (cy - cy.min()) / rango_y * 0.4
+    amplitud = {
+        'materia_organica': params['MATERIA_ORGANICA_OPTIMA'] * 0.6,
+        'humedad_suelo': params['HUMEDAD_OPTIMA'] * 0.4,
+        'ndvi': valor_base_satelital * 0.4,
+        'ndre': params['NDRE_OPTIMO'] * 0.4,
+        'ndwi': 0.0,
+    }
+    limites = {'materia_organica': (0.5, 8.0), 'humedad_suelo': (0.1, 0.8), 'ndvi': (0.1, 0.9),
+               'ndre': (0.05, 0.7), 'ndwi': (0.0, 1.0)}
+    base_zona = {c: np.asarray(fertilidad[c], dtype=float) for c in COLUMNAS_FERTILIDAD}
+    semilla = semilla_determinista('prescripcion', cultivo, resolucion_m, n_zonas,
+                                   round(float(valor_base_satelital), 6), round(float(minx), 2), round(float(maxy), 2))
+
+    columnas_suma = COLUMNAS_FERTILIDAD + COLUMNAS_EVALUACION
+    sumas = {c: np.zeros(n_zonas) for c in columnas_suma}
+    suma_n2 = np.zeros(n_zonas)
+    pixeles = np.zeros(n_zonas, dtype=np.int64)
+
+    paso = max(1, int(np.ceil(max(alto, ancho) / MAX_LADO_VISTA_PREVIA)))
+    vista_previa = np.full((-(-alto // paso), -(-ancho // paso)), np.nan, dtype=np.float32)
+
+    archivo = None
+    destino = None
+    if RASTERIO_OK:
+        directorio = directorio or directorio_datos(DIRECTORIO_PRESCRIPCIONES)
+        _purgar_prescripciones(directorio)
+        archivo = os.path.join(directorio, f"prescripcion_{cultivo}_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}.tif")
+        teselado = ancho >= TESELA_TIFF and alto >= TESELA_TIFF
+        destino = rasterio.open(
+            archivo, 'w', driver='GTiff', width=ancho, height=alto, count=len(BANDAS_PRESCRIPCION),
+            dtype='float32', crs=crs.to_wkt(), transform=from_origin(minx, maxy, resolucion_m, resolucion_m),
+            nodata=NODATA, compress='deflate', predictor=3, tiled=teselado,
+            **({'blockxsize': TESELA_TIFF, 'blockysize': TESELA_TIFF} if teselado else {}), BIGTIFF='IF_SAFER'
+        )
+        for b, (_, descripcion) in enumerate(BANDAS_PRESCRIPCION, start=1):
+            destino.set_band_description(b, descripcion)
+    else:
+        eventos.advertencia("⚠️ Rasterio no instalado: se calcula la prescripción por píxel pero no se escribe el GeoTIFF.")
+
+    bloques = [(f, c) for f in range(0, alto, bloque) for c in range(0, ancho, bloque)]
+    try:
+        for k, (fila0, col0) in enumerate(bloques):
+            h, w = min(bloque, alto - fila0), min(bloque, ancho - col0)
+            xs = minx + (col0 + np.arange(w) + 0.5) * resolucion_m
+            ys = maxy - (fila0 + np.arange(h) + 0.5) * resolucion_m
+            XX, YY = np.meshgrid(xs, ys)
+            x, y = XX.ravel(), YY.ravel()
+            indice_global = ((fila0 + np.arange(h))[:, None] * ancho + (col0 + np.arange(w))[None, :]).ravel()
+
+            # Zona de cada píxel (centro dentro del polígono); los de afuera quedan en NODATA
+            idx_pixel, idx_zona = arbol.query(shapely.points(x, y), predicate='intersects')
+            zona = np.full(x.size, -1, dtype=np.intp)
+            zona[idx_pixel[::-1]] = idx_zona[::-1]
+            validos = np.flatnonzero(zona >= 0)
+            bandas = np.full((len(BANDAS_PRESCRIPCION), h * w), NODATA, dtype=np.float32)
+
+            if len(validos):
+                z = zona[validos]
+                xv, yv = x[validos], y[validos]
+                delta = ((xv - cx.min()) / rango_x * 0.6 + (yv - cy.min()) / rango_y * 0.4) - patron_zona[z]
+                # Cada píxel usa su índice global como id del flujo de normales, igual que una zona
+                ruido = normales_por_zona(semilla, indice_global[validos], len(RUIDO_FERTILIDAD)) \
+                    * (RUIDO_FERTILIDAD * ESCALA_RUIDO_PIXEL)
+
+                valores = {}
+                for j, columna in enumerate(['materia_organica', 'humedad_suelo', 'ndvi', 'ndre', 'ndwi']):
+                    valores[columna] = base_zona[columna][z] + delta * amplitud[columna] + ruido[:, j]
+                if muestrear_dem is not None:
+                    relieve, pendiente_rel = muestrear_dem(*a_geograficas.transform(xv, yv))
+                    valores['humedad_suelo'] += 0.02 * relieve - 0.03 * pendiente_rel
+                for columna, (minimo, maximo) in limites.items():
+                    np.clip(valores[columna], minimo, maximo, out=valores[columna])
+                valores['npk_actual'] = np.clip(valores['ndvi'] * 0.4 + valores['ndre'] * 0.3
+                                                + (valores['materia_organica'] / 8) * 0.2
+                                                + valores['humedad_suelo'] * 0.1, 0, 1)
+
+                evaluacion = evaluar_cultivos(valores, [cultivo])
+                for columna in COLUMNAS_EVALUACION:
+                    valores[columna] = evaluacion[columna][0]
+
+                for columna in columnas_suma:
+                    sumas[columna] += np.bincount(z, weights=valores[columna], minlength=n_zonas)
+                suma_n2 += np.bincount(z, weights=valores['rec_N'] ** 2, minlength=n_zonas)
+                pixeles += np.bincount(z, minlength=n_zonas)
+                for b, (columna, _) in enumerate(BANDAS_PRESCRIPCION):
+                    bandas[b, validos] = valores[columna]
+
+            bandas = bandas.reshape(len(BANDAS_PRESCRIPCION), h, w)
+            if destino is not None:
+                destino.write(bandas, window=Window(col0, fila0, w, h))
+            # Vista previa: un píxel de cada `paso` en filas y columnas globales
+            f_ini, c_ini = (-fila0) % paso, (-col0) % paso
+            submuestra = bandas[0, f_ini::paso, c_ini::paso]
+            f_vp, c_vp = (fila0 + f_ini) // paso, (col0 + c_ini) // paso
+            vista_previa[f_vp:f_vp + submuestra.shape[0], c_vp:c_vp + submuestra.shape[1]] = \
+                np.where(submuestra == NODATA, np.nan, submuestra)
+            eventos.progreso((k + 1) / len(bloques), f"Prescripción por píxel: bloque {k + 1} de {len(bloques)}")
+    except Exception:
+        if destino is not None:
+            destino.close()
+            os.remove(archivo)
+        raise
+    if destino is not None:
+        destino.close()
+
+    # Resumen por zona; las zonas sin píxeles (más chicas que uno) conservan su evaluación por zona
+    evaluacion_zonas = evaluar_cultivos(fertilidad, [cultivo])
+    con_pixeles = pixeles > 0
+    resumen = {}
+    for columna in columnas_suma:
+        por_zona = base_zona[columna] if columna in base_zona else np.asarray(evaluacion_zonas[columna][0], dtype=float)
+        resumen[columna] = np.where(con_pixeles, sumas[columna] / np.maximum(pixeles, 1), por_zona)
+    media_n = resumen['rec_N']
+    resumen['rec_N_desvio'] = np.where(con_pixeles, np.sqrt(np.maximum(suma_n2 / np.maximum(pixeles, 1) - media_n ** 2, 0)), 0.0)
+    resumen['pixeles'] = pixeles
+    zonas = pd.DataFrame(resumen)
+    redondeo = {'materia_organica': 2, 'humedad_suelo': 3, 'ndvi': 3, 'ndre': 3, 'ndwi': 3, 'npk_actual': 3,
+                'rec_N': 1, 'rec_P': 1, 'rec_K': 1, 'rec_N_desvio': 1, 'rendimiento_sin_fert': 0,
+                'rendimiento_con_fert': 0, 'incremento_esperado': 1}
+    zonas = zonas.round(redondeo)
+
+    return {
+        'resolucion_m': float(resolucion_m),
+        'crs': crs.to_string(),
+        'transform': (float(minx), float(resolucion_m), 0.0, float(maxy), 0.0, -float(resolucion_m)),
+        'ancho': ancho,
+        'alto': alto,
+        'pixeles': int(pixeles.sum()),
+        'archivo': archivo,
+        'bandas': [columna for columna, _ in BANDAS_PRESCRIPCION],
+        'vista_previa': vista_previa,
+        'zonas': zonas,
+        'segundos': time.perf_counter() - inicio,
+    }
@@ -0,0 +1,153 @@
+# modules/registro_lotes.py - Registro persistente de lotes con índice espacial STRtree
+import os
+import hashlib
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.geometry import box, Point
+
+from .almacenamiento import ruta_datos
+
+ARCHIVO_REGISTRO = 'registro_lotes.geojson'
+COLUMNAS_REGISTRO = ['id_registro', 'establecimiento', 'nombre_lote', 'area_ha', 'fecha_registro']
+
+
+def _id_geometria(geom):
+    """Identificador estable del lote: hash de su geometría normalizada (mismo polígono = mismo id)."""
+    return hashlib.sha1(shapely.to_wkb(shapely.normalize(geom))).hexdigest()[:16]
+
+
+class RegistroLotes:
+    """
+    Registro multi-establecimiento de lotes, persistido en disco entre sesiones.
+    Las consultas espaciales (bbox, punto, intersección) usan un STRtree que se
+    reconstruye sólo cuando cambia el registro, así cada consulta es O(log n).
+    La instancia se comparte entre sesiones: las mutaciones, la escritura en disco
+    y la construcción perezosa del árbol van bajo un mismo candado.
+    """
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta or ruta_datos(ARCHIVO_REGISTRO)
+        self._candado = threading.RLock()
+        self._arbol = None
+        self.gdf = self._cargar()
+
+    def _cargar(self):
+        if os.path.exists(self.ruta):
+            try:
+                gdf = gpd.read_file(self.ruta)
+                return gdf.set_crs('EPSG:4326', allow_override=True).reset_index(drop=True)
+            except Exception:
+                pass
+        return gpd.GeoDataFrame({c: [] for c in COLUMNAS_REGISTRO}, geometry=[], crs='EPSG:4326')
+
+    def guardar(self):
+        with self._candado:
+            if len(self.gdf) == 0:
+                if os.path.exists(self.ruta):
+                    os.remove(self.ruta)
+                return
+            tmp = self.ruta + '.tmp'
+            self.gdf.to_file(tmp, driver='GeoJSON')
+            os.replace(tmp, self.ruta)
+
+    def __len__(self):
+        return len(self.gdf)
+
+    @property
+    def arbol(self):
+        return self._instantanea()[1]
+
+    def _instantanea(self):
+        """(gdf, árbol) consistentes entre sí, aunque otra sesión mute el registro después."""
+        with self._candado:
+            if self._arbol is None:
+                self._arbol = shapely.STRtree(np.asarray(self.gdf.geometry, dtype=object))
+            return self.gdf, self._arbol
+
+    def registrar(self, gdf_lotes, establecimiento='', columna_nombre='nombre_lote'):
+        """
+        Agrega (o actualiza) lotes. Un lote ya registrado con la misma geometría
+        conserva su id y sólo actualiza nombre/establecimiento. Retorna los ids.
+        """
+        gdf_lotes = gdf_lotes.to_crs('EPSG:4326') if gdf_lotes.crs is not None else gdf_lotes.set_crs('EPSG:4326')
+        areas = gdf_lotes.to_crs(gdf_lotes.estimate_utm_crs()).geometry.area / 10000
+        nombres = gdf_lotes[columna_nombre].astype(str) if columna_nombre in gdf_lotes.columns \
+            else pd.Series([f"Lote {i + 1}" for i in range(len(gdf_lotes))], index=gdf_lotes.index)
+        nuevos = gpd.GeoDataFrame({
+            'id_registro': [_id_geometria(g) for g in gdf_lotes.geometry],
+            'establecimiento': establecimiento,
+            'nombre_lote': nombres.values,
+            'area_ha': areas.round(2).values,
+            'fecha_registro': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }, geometry=gdf_lotes.geometry.values, crs='EPSG:4326')
+        nuevos = nuevos.drop_duplicates('id_registro', keep='last')
+        with self._candado:
+            existentes = self.gdf.set_index('id_registro')
+            sin_cambios = nuevos['id_registro'].isin(existentes.index).all() and all(
+                existentes.at[i, 'nombre_lote'] == n and existentes.at[i, 'establecimiento'] == establecimiento
+                for i, n in zip(nuevos['id_registro'], nuevos['nombre_lote'])
+            )
+            if sin_cambios:
+                return nuevos['id_registro'].tolist()
+            conservados = self.gdf[~self.gdf['id_registro'].isin(nuevos['id_registro'])]
+            self.gdf = pd.concat([conservados, nuevos], ignore_index=True)
+            self._arbol = None
+            self.guardar()
+        return nuevos['id_registro'].tolist()
+
+    def eliminar(self, ids):
+        with self._candado:
+            quitar = self.gdf['id_registro'].isin(list(ids))
+            if not quitar.any():
+                return
+            self.gdf = self.gdf[~quitar].reset_index(drop=True)
+            self._arbol = None
+            self.guardar()
+
+    def consultar_bbox(self, minx, miny, maxx, maxy):
+        """Lotes cuyo polígono intersecta el rectángulo (p. ej. una tesela DEM o escena)."""
+        return self.consultar_interseccion(box(minx, miny, maxx, maxy))
+
+    def consultar_interseccion(self, geometria):
+        """Lotes que intersectan una geometría arbitraria (huella de escena, buffer, etc.)."""
+        gdf, arbol = self._instantanea()
+        if len(gdf) == 0:
+            return gdf.copy()
+        idx = arbol.query(geometria, predicate='intersects')
+        return gdf.iloc[np.sort(idx)]
+
+    def consultar_punto(self, lon, lat):
+        """Lote(s) que contienen un punto (clic en el mapa, muestra GPS)."""
+        gdf, arbol = self._instantanea()
+        if len(gdf) == 0:
+            return gdf.copy()
+        idx = arbol.query(Point(lon, lat), predicate='within')
+        if len(idx) == 0:
+            idx = arbol.query(Point(lon, lat), predicate='intersects')
+        return gdf.iloc[np.sort(idx)]
+
+    def asignar_puntos(self, gdf_puntos):
+        """
+        Une en bloque puntos (detecciones, muestras) con el lote que los contiene.
+        Agrega 'id_registro' y 'nombre_lote' (None si el punto cae fuera de todo lote).
+        """
+        gdf_puntos = gdf_puntos.copy()
+        ids = np.full(len(gdf_puntos), None, dtype=object)
+        nombres = np.full(len(gdf_puntos), None, dtype=object)
+        gdf, arbol = self._instantanea()
+        if len(gdf) > 0 and len(gdf_puntos) > 0:
+            puntos = np.asarray(gdf_puntos.to_crs('EPSG:4326').geometry, dtype=object)
+            idx_punto, idx_lote = arbol.query(puntos, predicate='intersects')
+            # Si un punto cae en varios lotes solapados, se conserva el primero
+            _, primeros = np.unique(idx_punto, return_index=True)
+            idx_punto, idx_lote = idx_punto[primeros], idx_lote[primeros]
+            ids[idx_punto] = gdf['id_registro'].values[idx_lote]
+            nombres[idx_punto] = gdf['nombre_lote'].values[idx_lote]
+        gdf_puntos['id_registro'] = ids
+        gdf_puntos['nombre_lote'] = nombres
+        return gdf_puntos
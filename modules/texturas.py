@@ -0,0 +1,84 @@
+# modules/texturas.py - Triángulo textural USDA (12 clases) por tabla de búsqueda precalculada
+import numpy as np
+
+# (nombre, color para mapas), en el orden de los códigos enteros de la tabla
+CLASES_TEXTURA_USDA = [
+    ('Arena', '#fff7bc'),
+    ('Arena franca', '#fee391'),
+    ('Franco arenoso', '#f6e8c3'),
+    ('Franco', '#c7eae5'),
+    ('Franco limoso', '#d9f0a3'),
+    ('Limo', '#addd8e'),
+    ('Franco arcillo arenoso', '#dfc27d'),
+    ('Franco arcilloso', '#5ab4ac'),
+    ('Franco arcillo limoso', '#80cdc1'),
+    ('Arcilla arenosa', '#bf812d'),
+    ('Arcilla limosa', '#35978f'),
+    ('Arcilla', '#01665e'),
+]
+TEXTURA_NO_DETERMINADA = 'NO_DETERMINADA'
+NOMBRES_TEXTURA = np.array([n for n, _ in CLASES_TEXTURA_USDA] + [TEXTURA_NO_DETERMINADA], dtype=object)
+COLORES_TEXTURA = {**{n: c for n, c in CLASES_TEXTURA_USDA}, TEXTURA_NO_DETERMINADA: '#999999'}
+CODIGO_NO_DETERMINADA = len(CLASES_TEXTURA_USDA)
+
+# Resolución de la tabla: 0.1 % de arena y de arcilla
+PASOS_POR_PORCIENTO = 10
+
+
+def _clase_usda(arena, limo, arcilla):
+    """Reglas del triángulo USDA evaluadas sobre arrays (% que suman 100)."""
+    condiciones = [
+        limo + 1.5 * arcilla < 15,
+        limo + 2 * arcilla < 30,
+        ((arcilla >= 7) & (arcilla < 20) & (arena > 52)) | ((arcilla < 7) & (limo < 50)),
+        (arcilla >= 7) & (arcilla < 27) & (limo >= 28) & (limo < 50) & (arena <= 52),
+        (limo >= 50) & (((arcilla >= 12) & (arcilla < 27)) | ((limo < 80) & (arcilla < 12))),
+        (limo >= 80) & (arcilla < 12),
+        (arcilla >= 20) & (arcilla < 35) & (limo < 28) & (arena > 45),
+        (arcilla >= 27) & (arcilla < 40) & (arena > 20) & (arena <= 45),
+        (arcilla >= 27) & (arcilla < 40),
+        (arcilla >= 35) & (arena > 45),
+        (arcilla >= 40) & (limo >= 40),
+        arcilla >= 40,
+    ]
+    return np.select(condiciones, np.arange(len(condiciones)), default=CODIGO_NO_DETERMINADA).astype(np.uint8)
+
+
+def _construir_tabla():
+    """Tabla [arena, arcilla] -> código de clase, a 0.1 % sobre todo el simplex."""
+    valores = np.arange(100 * PASOS_POR_PORCIENTO + 1) / PASOS_POR_PORCIENTO
+    arena, arcilla = np.meshgrid(valores, valores, indexing='ij')
+    limo = 100 - arena - arcilla
+    tabla = _clase_usda(arena, limo, arcilla)
+    tabla[limo < -1e-9] = CODIGO_NO_DETERMINADA
+    return tabla
+
+
+# Se calcula una sola vez al importar (~1 M celdas, uint8)
+TABLA_TEXTURA_USDA = _construir_tabla()
+
+
+def codigos_textura_usda(arena, limo, arcilla):
+    """
+    Código de clase USDA para arrays de cualquier forma (zonas o rásters de suelo).
+    Los porcentajes se normalizan a 100 y se indexan en la tabla precalculada;
+    valores faltantes o negativos dan CODIGO_NO_DETERMINADA.
+    """
+    arena = np.asarray(arena, dtype=float)
+    limo = np.asarray(limo, dtype=float)
+    arcilla = np.asarray(arcilla, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        escala = (100.0 * PASOS_POR_PORCIENTO) / (arena + limo + arcilla)
+        i_arena = arena * escala
+        i_arcilla = arcilla * escala
+        validos = (np.isfinite(i_arena) & np.isfinite(i_arcilla) & (escala > 0)
+                   & (arena >= 0) & (limo >= 0) & (arcilla >= 0))
+    limite = 100 * PASOS_POR_PORCIENTO
+    i_arena = np.clip(np.rint(np.where(validos, i_arena, 0)), 0, limite).astype(np.intp)
+    i_arcilla = np.clip(np.rint(np.where(validos, i_arcilla, 0)), 0, limite - i_arena).astype(np.intp)
+    return np.where(validos, TABLA_TEXTURA_USDA[i_arena, i_arcilla], CODIGO_NO_DETERMINADA).astype(np.uint8)
+
+
+def clasificar_textura_usda(arena, limo, arcilla):
+    """Nombre de la clase USDA (array de str con la forma de la entrada)."""
+    return NOMBRES_TEXTURA[codigos_textura_usda(arena, limo, arcilla)]
@@ -0,0 +1,589 @@
+# modules/topografia.py - DEM (OpenTopography, Open Topo Data, sintético), pendientes y curvas de nivel
+import os
+from io import BytesIO
+
+import numpy as np
+import requests
+from shapely.geometry import LineString, Point, mapping
+
+from . import eventos
+
+# ===== DEPENDENCIAS OPCIONALES =====
+try:
+    import rasterio
+    from rasterio.mask import mask
+    from rasterio.crs import CRS
+    RASTERIO_OK = True
+except ImportError:
+    RASTERIO_OK = False
+
+try:
+    from skimage import measure
+    SKIMAGE_OK = True
+except ImportError:
+    SKIMAGE_OK = False
+
+# Las curvas de nivel necesitan scikit-image
+CURVAS_OK = SKIMAGE_OK
+
+
+# ===== DESCARGA DE DEM =====
+def obtener_dem_opentopography(gdf, api_key=None):
+    """
+    Descarga DEM SRTM 1 arc-seg (30m) desde OpenTopography.
+    Retorna (dem_array, meta, transform) o (None, None, None) si falla.
+    Requiere rasterio.
+    """
+    if not RASTERIO_OK:
+        eventos.advertencia("⚠️ Rasterio no instalado. No se puede descargar DEM real.")
+        return None, None, None
+
+    # 1. Obtener API Key (prioridad: argumento > variable entorno > secret)
+    if api_key is None:
+        api_key = os.environ.get("OPENTOPOGRAPHY_API_KEY", None)
+    if not api_key:
+        eventos.advertencia("⚠️ No se encontró API Key de OpenTopography. Se usará DEM sintético.")
+        eventos.info("📌 Obtén una API Key gratuita en: https://opentopography.org/")
+        return None, None, None
+
+    try:
+        # 2. Obtener bounding box y validar que esté dentro de la cobertura SRTM (latitudes entre -60 y 60)
+        bounds = gdf.total_bounds
+        west, south, east, north = bounds
+
+        # Verificar límites
+        if south < -60 or north > 60:
+            eventos.advertencia("⚠️ El área está fuera de la cobertura de SRTM (latitudes > 60° o < -60°). Usando DEM sintético.")
+            return None, None, None
+
+        lon_span = east - west
+        lat_span = north - south
+        west = max(west - 0.05 * lon_span, -180)
+        east = min(east + 0.05 * lon_span, 180)
+        south = max(south - 0.05 * lat_span, -60)
+        north = min(north + 0.05 * lat_span, 60)
+
+        params = {
+            "demtype": "SRTMGL1",
+            "south": south,
+            "north": north,
+            "west": west,
+            "east": east,
+            "outputFormat": "GTiff",
+            "API_Key": api_key
+        }
+
+        url = "https://portal.opentopography.org/API/globaldem"
+        
+        eventos.info("🛰️ Descargando DEM desde OpenTopography...")
+        response = requests.get(url, params=params, timeout=60)
+            
+        if response.status_code == 403:
+            eventos.error("❌ API Key inválida o no autorizada.")
+            return None, None, None
+        elif response.status_code == 404:
+            eventos.error("❌ No se encontraron datos SRTM para esta área.")
+            return None, None, None
+        elif response.status_code != 200:
+            eventos.error(f"❌ Error en OpenTopography: HTTP {response.status_code}")
+            return None, None, None
+
+        dem_bytes = BytesIO(response.content)
+        with rasterio.open(dem_bytes) as src:
+            geom = [mapping(gdf.unary_union)]
+            out_image, out_transform = mask(src, geom, crop=True, nodata=-32768, all_touched=True)
+            out_meta = src.meta.copy()
+            out_meta.update({
+                "driver": "GTiff",
+                "height": out_image.shape[1],
+                "width": out_image.shape[2],
+                "transform": out_transform,
+                "nodata": -32768
+            })
+
+        dem_array = out_image.squeeze()
+        dem_array = np.ma.masked_where(dem_array <= -32768, dem_array)
+        
+        if dem_array.mask.all() if isinstance(dem_array, np.ma.MaskedArray) else np.all(dem_array <= -32768):
+            eventos.advertencia("⚠️ El DEM descargado no contiene datos válidos dentro del polígono.")
+            return None, None, None
+
+        eventos.exito("✅ DEM SRTM 30m descargado y recortado exitosamente.")
+        return dem_array, out_meta, out_transform
+
+    except requests.exceptions.Timeout:
+        eventos.error("❌ Tiempo de espera agotado al conectar con OpenTopography.")
+        return None, None, None
+    except Exception as e:
+        eventos.error(f"❌ Error inesperado al obtener DEM: {str(e)[:200]}")
+        return None, None, None
+
+def obtener_dem_opentopodata_api(gdf, dataset="srtm30m"):
+    """
+    Obtiene DEM desde la API pública Open Topo Data.
+    Datasets disponibles: srtm30m, srtm90m, aster30m, eudem25m, etc.
+    Límite gratuito: 1000 consultas/día, 100 puntos/consulta.
+    Retorna (dem_array, meta, transform) compatible con el resto del código.
+    """
+    if not RASTERIO_OK:
+        eventos.advertencia("⚠️ Rasterio no instalado. No se puede procesar DEM desde Open Topo Data.")
+        return None, None, None
+
+    try:
+        bounds = gdf.total_bounds
+        minx, miny, maxx, maxy = bounds
+
+        # Definir resolución aproximada para grilla (máximo 50x50 para cumplir límite de 100 puntos)
+        nx = 50
+        ny = 50
+        x_vals = np.linspace(minx, maxx, nx)
+        y_vals = np.linspace(miny, maxy, ny)
+
+        # Construir lista de ubicaciones (lat,lon) para la API
+        locations = []
+        for y in y_vals:
+            for x in x_vals:
+                locations.append(f"{y:.6f},{x:.6f}")
+
+        # Dividir en lotes de 100 (límite de la API)
+        batch_size = 100
+        all_elevations = []
+        n_lotes = (len(locations) + batch_size - 1) // batch_size
+        for i in range(0, len(locations), batch_size):
+            batch = locations[i:i+batch_size]
+            loc_str = "|".join(batch)
+            url = f"https://api.opentopodata.org/v1/{dataset}"
+            params = {"locations": loc_str, "interpolation": "cubic"}
+
+            eventos.progreso(i // batch_size / n_lotes,
+                             f"📡 Consultando lote {i//batch_size + 1} de {n_lotes} de Open Topo Data...")
+            resp = requests.get(url, params=params, timeout=30)
+
+            if resp.status_code != 200:
+                eventos.error(f"Error en API Open Topo Data: HTTP {resp.status_code}")
+                return None, None, None
+
+            data = resp.json()
+            if data.get('status') != 'OK':
+                eventos.error(f"Error en respuesta: {data.get('error', 'desconocido')}")
+                return None, None, None
+
+            elevations = [r['elevation'] for r in data['results']]
+            all_elevations.extend(elevations)
+
+        # Reconstruir grilla
+        Z = np.array(all_elevations).reshape(ny, nx)
+        X, Y = np.meshgrid(x_vals, y_vals)
+
+        # Crear una transformación aproximada (para compatibilidad con código que espera transform)
+        # La transform de rasterio: (res_x, 0, minx, 0, -res_y, maxy) si se usa from_origin
+        # Pero aquí podemos usar None y luego tratar como DEM sintético
+        # Para simplificar, devolvemos None en transform y construiremos X,Y,Z en dem_data
+        # Creamos un array enmascarado con NaN fuera del polígono
+        points = np.vstack([X.ravel(), Y.ravel()]).T
+        mask = gdf.geometry.unary_union.contains([Point(p) for p in points])
+        mask = mask.reshape(X.shape)
+        Z_masked = Z.copy().astype(float)
+        Z_masked[~mask] = np.nan
+        dem_array = np.ma.masked_invalid(Z_masked)
+
+        # Meta información básica
+        meta = {
+            'driver': 'GTiff',
+            'height': ny,
+            'width': nx,
+            'count': 1,
+            'crs': CRS.from_epsg(4326),
+            'transform': None  # No tenemos transform real, lo manejaremos aparte
+        }
+
+        eventos.exito(f"✅ DEM obtenido de Open Topo Data ({dataset}) - {nx}x{ny} puntos")
+        return dem_array, meta, None  # transform = None
+
+    except Exception as e:
+        eventos.error(f"❌ Error obteniendo DEM de Open Topo Data: {str(e)}")
+        return None, None, None
+
+def generar_curvas_nivel_reales(dem_array, transform, intervalo=10, polygon=None):
+    """
+    Genera curvas de nivel a partir de un DEM real (array) y su transform.
+    Opcionalmente filtra curvas que intersecten el polígono de la parcela.
+    Requiere scikit-image.
+    """
+    if dem_array is None or not SKIMAGE_OK:
+        return []
+
+    # Enmascarar nodata
+    if isinstance(dem_array, np.ma.MaskedArray):
+        valid_mask = ~dem_array.mask
+        data = dem_array.data.astype(float)
+        data[~valid_mask] = np.nan
+    else:
+        data = dem_array.astype(float)
+        valid_mask = data > -32768
+        data[~valid_mask] = np.nan
+
+    if not np.any(valid_mask):
+        eventos.advertencia("⚠️ El DEM no contiene datos válidos para generar curvas.")
+        return []
+
+    vmin = np.nanmin(data)
+    vmax = np.nanmax(data)
+    if np.isnan(vmin) or np.isnan(vmax):
+        return []
+
+    niveles = np.arange(np.floor(vmin / intervalo) * intervalo,
+                        np.ceil(vmax / intervalo) * intervalo + intervalo,
+                        intervalo)
+
+    # Si el rango es muy pequeño, usar un intervalo más fino
+    if vmax - vmin < intervalo * 2 and len(niveles) < 3:
+        intervalo_ajustado = (vmax - vmin) / 5
+        niveles = np.arange(vmin, vmax + intervalo_ajustado, intervalo_ajustado)
+        eventos.info(f"ℹ️ Terreno muy plano: se usó intervalo de {intervalo_ajustado:.1f} m en lugar de {intervalo} m")
+
+    # Rellenar con un valor muy negativo para que find_contours no se salga
+    data_filled = np.where(valid_mask, data, -9999)
+
+    contours = []
+    for nivel in niveles:
+        try:
+            for contour in measure.find_contours(data_filled, nivel):
+                coords = []
+                valid_contour = True
+                for row, col in contour:
+                    r, c = int(round(row)), int(round(col))
+                    # Verificar que el punto esté dentro del array y sea válido
+                    if not (0 <= r < data.shape[0] and 0 <= c < data.shape[1]) or not valid_mask[r, c]:
+                        valid_contour = False
+                        break
+                    x, y = transform * (col, row)
+                    coords.append((x, y))
+                if valid_contour and len(coords) >= 3:
+                    line = LineString(coords)
+                    # Filtrar líneas muy cortas y opcionalmente por polígono
+                    if line.length > 0.01:
+                        if polygon is None or line.intersects(polygon):
+                            contours.append((line, nivel))
+        except Exception:
+            continue
+    if contours:
+        eventos.info(f"✅ Generadas {len(contours)} curvas de nivel (intervalo {intervalo} m)")
+    else:
+        eventos.advertencia("⚠️ No se generaron curvas de nivel. El terreno puede ser muy plano o el DEM no tiene variación.")
+    return contours
+
+def generar_curvas_nivel_simuladas(gdf, intervalo=10):
+    """
+    Genera curvas de nivel sintéticas cuando no hay DEM real.
+    También puede usarse para datos provenientes de Open Topo Data (X,Y,Z ya definidos).
+    Requiere scikit-image.
+    """
+    if not SKIMAGE_OK:
+        return []
+    from scipy.ndimage import gaussian_filter
+    bounds = gdf.total_bounds
+    minx, miny, maxx, maxy = bounds
+    n = 200  # Mayor resolución para más detalle
+    x = np.linspace(minx, maxx, n)
+    y = np.linspace(miny, maxy, n)
+    X, Y = np.meshgrid(x, y)
+
+    # Semilla reproducible basada en la ubicación
+    seed = int((minx + miny) * 1e6) % (2**32)
+    rng = np.random.RandomState(seed)
+
+    # Generar relieve con varias ondas
+    Z = rng.randn(n, n) * 30
+    Z = gaussian_filter(Z, sigma=8)
+    # Añadir gradiente y colinas
+    Z = 50 + Z + 0.01 * (X - minx) * 111000 + 0.005 * (Y - miny) * 111000
+    for _ in range(5):
+        cx = rng.uniform(minx, maxx)
+        cy = rng.uniform(miny, maxy)
+        r = rng.uniform(0.001, 0.008)
+        h = rng.uniform(30, 100)
+        Z += h * np.exp(-((X-cx)**2 + (Y-cy)**2) / (2*r**2))
+
+    # Enmascarar fuera del polígono
+    points = np.vstack([X.ravel(), Y.ravel()]).T
+    mask = gdf.geometry.unary_union.contains([Point(p) for p in points])
+    mask = mask.reshape(X.shape)
+    Z[~mask] = np.nan
+
+    # Rellenar NaN con valor muy bajo para find_contours
+    Z_filled = np.where(np.isnan(Z), -9999, Z)
+
+    vmin = np.nanmin(Z)
+    vmax = np.nanmax(Z)
+    if np.isnan(vmin) or np.isnan(vmax):
+        return []
+
+    niveles = np.arange(vmin, vmax + intervalo, intervalo)
+    if len(niveles) < 2:
+        return []
+
+    contours = []
+    polygon = gdf.geometry.unary_union
+    for nivel in niveles:
+        try:
+            for contour in measure.find_contours(Z_filled, nivel):
+                coords = []
+                for row, col in contour:
+                    r, c = int(round(row)), int(round(col))
+                    if r < 0 or r >= n or c < 0 or c >= n or np.isnan(Z[r, c]):
+                        continue
+                    lon = minx + (c / n) * (maxx - minx)
+                    lat = miny + (r / n) * (maxy - miny)
+                    coords.append((lon, lat))
+                if len(coords) >= 3:
+                    line = LineString(coords)
+                    if line.length > 0.01 and line.intersects(polygon):
+                        contours.append((line, nivel))
+        except Exception:
+            continue
+    if contours:
+        eventos.info(f"✅ Generadas {len(contours)} curvas de nivel sintéticas (intervalo {intervalo} m)")
+    else:
+        eventos.advertencia("⚠️ No se generaron curvas de nivel sintéticas.")
+    return contours
+
+def generar_dem_sintetico_fallback(gdf, resolucion=10.0):
+    """
+    Función de respaldo para obtener X, Y, Z cuando no hay DEM real.
+    No requiere rasterio ni skimage.
+    """
+    bounds = gdf.total_bounds
+    minx, miny, maxx, maxy = bounds
+
+    num_cells_x = int((maxx - minx) * 111000 / resolucion)
+    num_cells_y = int((maxy - miny) * 111000 / resolucion)
+    num_cells_x = max(50, min(num_cells_x, 200))
+    num_cells_y = max(50, min(num_cells_y, 200))
+
+    x = np.linspace(minx, maxx, num_cells_x)
+    y = np.linspace(miny, maxy, num_cells_y)
+    X, Y = np.meshgrid(x, y)
+
+    centroid = gdf.geometry.unary_union.centroid
+    seed_value = int(centroid.x * 10000 + centroid.y * 10000) % (2**32)
+    rng = np.random.RandomState(seed_value)
+
+    elevacion_base = rng.uniform(100, 300)
+    slope_x = rng.uniform(-0.001, 0.001)
+    slope_y = rng.uniform(-0.001, 0.001)
+
+    Z = elevacion_base + slope_x * (X - minx) + slope_y * (Y - miny)
+    n_hills = rng.randint(3, 7)
+    for _ in range(n_hills):
+        cx = rng.uniform(minx, maxx)
+        cy = rng.uniform(miny, maxy)
+        r = rng.uniform(0.001, 0.005)
+        h = rng.uniform(20, 80)
+        Z += h * np.exp(-((X-cx)**2 + (Y-cy)**2) / (2*r**2))
+
+    # enmascarar fuera de la parcela
+    points = np.vstack([X.flatten(), Y.flatten()]).T
+    mask = gdf.geometry.unary_union.contains([Point(p) for p in points])
+    mask = mask.reshape(X.shape)
+    Z[~mask] = np.nan
+
+    return X, Y, Z, bounds
+
+
+# ===== CURVAS DESDE UNA GRILLA REGULAR (X,Y,Z) =====
+def extraer_curvas_de_grid(X, Y, Z, intervalo, polygon=None):
+    """
+    Extrae curvas de nivel de una grilla regular definida por X, Y, Z.
+    X, Y son matrices de coordenadas, Z es matriz de elevaciones (con NaN).
+    """
+    if not SKIMAGE_OK:
+        return []
+    from skimage import measure
+
+    Z_filled = np.where(np.isnan(Z), -9999, Z)
+    niveles = np.arange(np.nanmin(Z), np.nanmax(Z) + intervalo, intervalo)
+    if len(niveles) < 2:
+        return []
+
+    ny, nx = Z.shape
+    contours = []
+    for nivel in niveles:
+        try:
+            for contour in measure.find_contours(Z_filled, nivel):
+                coords = []
+                for row, col in contour:
+                    r, c = int(round(row)), int(round(col))
+                    if r < 0 or r >= ny or c < 0 or c >= nx or np.isnan(Z[r, c]):
+                        continue
+                    # Interpolar coordenadas (podría ser más preciso, pero aproximado)
+                    lon = X[r, c]
+                    lat = Y[r, c]
+                    coords.append((lon, lat))
+                if len(coords) >= 3:
+                    line = LineString(coords)
+                    if line.length > 0.01 and (polygon is None or line.intersects(polygon)):
+                        contours.append((line, nivel))
+        except Exception:
+            continue
+    if contours:
+        eventos.info(f"✅ Generadas {len(contours)} curvas de nivel desde grilla")
+    else:
+        eventos.advertencia("⚠️ No se generaron curvas de nivel desde la grilla.")
+    return contours
+
+# ===== DEM Y CURVAS PARA EL ANÁLISIS COMPLETO =====
+def obtener_dem_analisis(gdf, resolucion_dem=10.0):
+    """
+    Etapa DEM (PRIORIDAD: REAL > OPENTOPODATA > SINTÉTICO): grilla X/Y/Z,
+    pendientes y fuente. Las curvas de nivel se generan aparte en
+    generar_curvas_dem, así cambiar el intervalo no vuelve a descargar el DEM.
+    """
+    try:
+        api_key = os.environ.get("OPENTOPOGRAPHY_API_KEY", None)
+        dem_array, dem_meta, dem_transform = obtener_dem_opentopography(gdf, api_key)
+
+        # Si falla OpenTopography, intentar con Open Topo Data API
+        if dem_array is None:
+            eventos.info("ℹ️ Intentando con fuente alternativa: Open Topo Data API (srtm30m)")
+            dem_array, dem_meta, dem_transform = obtener_dem_opentopodata_api(gdf, dataset="srtm30m")
+
+        dem_data = {
+            'X': None, 'Y': None, 'Z': None,
+            'bounds': None,
+            'pendientes': None,
+            'fuente': 'No disponible',
+            'dem_array': None, 'transform': None
+        }
+
+        if dem_array is not None and not (isinstance(dem_array, np.ma.MaskedArray) and dem_array.mask.all()):
+            if dem_transform is not None:
+                # Caso OpenTopography (con transform)
+                eventos.info("✅ Usando DEM real SRTM 30m (OpenTopography)")
+                dem_data['fuente'] = 'SRTM 30m'
+
+                height, width = dem_array.shape
+                cols = np.arange(width)
+                rows = np.arange(height)
+                X_grid, Y_grid = np.meshgrid(cols, rows)
+                X_geo = dem_transform[2] + dem_transform[0] * X_grid + dem_transform[1] * Y_grid
+                Y_geo = dem_transform[5] + dem_transform[3] * X_grid + dem_transform[4] * Y_grid
+
+                # Convertir a float antes de rellenar con NaN
+                if isinstance(dem_array, np.ma.MaskedArray):
+                    Z = dem_array.astype(float).filled(np.nan)
+                else:
+                    Z = dem_array.astype(float)
+                    Z[Z <= -32768] = np.nan
+
+                dem_data.update({
+                    'X': X_geo, 'Y': Y_geo, 'Z': Z,
+                    'bounds': gdf.total_bounds,
+                    'dem_array': dem_array, 'transform': dem_transform
+                })
+            else:
+                # Caso Open Topo Data (sin transform): la malla se reconstruye desde los bounds
+                eventos.info("✅ Usando DEM de Open Topo Data")
+                dem_data['fuente'] = 'Open Topo Data'
+
+                height, width = dem_array.shape
+                bounds = gdf.total_bounds
+                minx, miny, maxx, maxy = bounds
+                x_vals = np.linspace(minx, maxx, width)
+                y_vals = np.linspace(miny, maxy, height)
+                X_geo, Y_geo = np.meshgrid(x_vals, y_vals)
+
+                if isinstance(dem_array, np.ma.MaskedArray):
+                    Z = dem_array.astype(float).filled(np.nan)
+                else:
+                    Z = dem_array.astype(float)
+
+                dem_data.update({
+                    'X': X_geo, 'Y': Y_geo, 'Z': Z,
+                    'bounds': bounds
+                })
+        else:
+            eventos.info("ℹ️ Usando DEM sintético (fuentes externas no disponibles)")
+            dem_data['fuente'] = 'Sintético'
+            X, Y, Z, bounds = generar_dem_sintetico_fallback(gdf, resolucion_dem)
+            dem_data.update({'X': X, 'Y': Y, 'Z': Z, 'bounds': bounds})
+
+        # Calcular pendientes (si hay datos válidos)
+        if dem_data['Z'] is not None and not np.all(np.isnan(dem_data['Z'])):
+            Z_grid = dem_data['Z'].astype(float)
+            mask_valid = ~np.isnan(Z_grid)
+
+            if np.any(mask_valid):
+                # Obtener resolución espacial en grados
+                if dem_data['fuente'] == 'SRTM 30m' and dem_transform is not None:
+                    res_x_deg = abs(dem_transform[0])
+                    res_y_deg = abs(dem_transform[4])
+                    lat_media = np.nanmean(dem_data['Y'][mask_valid])
+                    res_x_m = res_x_deg * 111320 * np.cos(np.radians(lat_media))
+                    res_y_m = res_y_deg * 111320
+                else:
+                    # Para Open Topo Data o sintético, calcular desde la malla
+                    X = dem_data['X']
+                    Y = dem_data['Y']
+                    dx_deg = X[0,1] - X[0,0]
+                    dy_deg = Y[1,0] - Y[0,0]
+                    lat_media = np.nanmean(Y[mask_valid])
+                    res_x_m = abs(dx_deg) * 111320 * np.cos(np.radians(lat_media))
+                    res_y_m = abs(dy_deg) * 111320
+
+                dy = np.gradient(Z_grid, axis=0) / res_y_m
+                dx = np.gradient(Z_grid, axis=1) / res_x_m
+                pendientes = np.sqrt(dx**2 + dy**2) * 100
+                pendientes[~mask_valid] = np.nan
+                dem_data['pendientes'] = pendientes
+
+        return dem_data
+
+    except Exception as e:
+        eventos.error(f"❌ Error crítico en análisis DEM: {str(e)[:100]}")
+        return None
+
+def obtener_grilla_dem(gdf, resolucion_dem=10.0):
+    """
+    DEM como grilla X/Y/Z (+ pendientes y fuente) para un área, con la misma
+    prioridad que el análisis completo (es su etapa DEM sin el raster original).
+    """
+    dem = obtener_dem_analisis(gdf, resolucion_dem)
+    if dem is None:
+        return None
+    return {k: dem[k] for k in ('X', 'Y', 'Z', 'pendientes', 'fuente')}
+
+def generar_curvas_dem(dem, gdf, intervalo_curvas=5.0):
+    """
+    Etapa de curvas de nivel sobre el DEM ya obtenido. Devuelve un dict nuevo
+    (dem_data completo, como lo usan las pestañas) sin modificar el de la etapa DEM.
+    """
+    if dem is None:
+        return None
+    dem_data = {k: v for k, v in dem.items() if k not in ('dem_array', 'transform')}
+    dem_data.update({'curvas_nivel': [], 'elevaciones': [], 'curvas_con_elevacion': []})
+    if not CURVAS_OK:
+        return dem_data
+
+    try:
+        polygon_union = gdf.geometry.unary_union
+        if dem['fuente'] == 'SRTM 30m':
+            curvas_con_elev = generar_curvas_nivel_reales(dem['dem_array'], dem['transform'], intervalo_curvas,
+                                                          polygon=polygon_union)
+        elif dem['fuente'] == 'Open Topo Data':
+            curvas_con_elev = extraer_curvas_de_grid(dem['X'], dem['Y'], dem['Z'], intervalo_curvas, polygon_union)
+        elif dem['fuente'] == 'Sintético':
+            curvas_con_elev = generar_curvas_nivel_simuladas(gdf, intervalo_curvas)
+        else:
+            curvas_con_elev = []
+    except Exception as e:
+        eventos.error(f"❌ Error generando curvas de nivel: {str(e)[:100]}")
+        curvas_con_elev = []
+
+    if curvas_con_elev:
+        dem_data['curvas_con_elevacion'] = curvas_con_elev
+        dem_data['curvas_nivel'] = [line for line, _ in curvas_con_elev]
+        dem_data['elevaciones'] = [e for _, e in curvas_con_elev]
+        if dem['fuente'] != 'Sintético':
+            eventos.exito(f"✅ Generadas {len(curvas_con_elev)} curvas de nivel ({dem['fuente']}).")
+    return dem_data
@@ -0,0 +1,336 @@
+# modules/trabajos.py - Cola de trabajos en SQLite con workers en procesos aparte
+#
+#   python -m modules.trabajos --procesos 2
+#
+# La app encola cada análisis completo y sigue respondiendo; los workers (procesos
+# lanzados por la app o por el comando de arriba) toman trabajos de la cola, escriben
+# su avance, sus eventos y la salida de cada etapa en la base, y la interfaz los
+# consulta. El tope de trabajos simultáneos vale para todo el host porque se
+# controla al reclamar el trabajo dentro de una transacción de la base compartida.
+import os
+import sys
+import time
+import uuid
+import pickle
+import sqlite3
+import logging
+import threading
+import argparse
+import multiprocessing
+from contextlib import closing
+
+import pandas as pd
+
+from .almacenamiento import ruta_datos
+from .eventos import Reportador, destino_logging, usar_reportador
+from .etapas import CacheEtapas
+from .datos_externos import SATELITES_GEE, gee_autenticado, inicializar_gee
+from .pipeline import ejecutar_analisis_completo, etapas_del_analisis
+
+ARCHIVO_COLA = 'trabajos.sqlite'
+# Trabajos ejecutándose a la vez en el host (0 = sin cola: la app analiza en su propio hilo)
+MAX_TRABAJOS_HOST = int(os.environ.get('CULTIVOS_MAX_TRABAJOS', max(1, min(2, (os.cpu_count() or 2) - 1))))
+INTERVALO_SONDEO = 0.5   # segundos entre consultas de un worker ocioso
+RETENCION_DIAS = 7       # los trabajos terminados se borran pasado este tiempo
+
+PENDIENTE, EJECUTANDO, TERMINADO, FALLIDO, CANCELADO = 'pendiente', 'ejecutando', 'terminado', 'fallido', 'cancelado'
+ESTADOS_FINALES = (TERMINADO, FALLIDO, CANCELADO)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    estado TEXT NOT NULL,
+    creado REAL NOT NULL,
+    iniciado REAL,
+    terminado REAL,
+    pid INTEGER,
+    fraccion REAL NOT NULL DEFAULT 0,
+    total_etapas INTEGER,
+    etapa TEXT,
+    mensaje TEXT,
+    error TEXT,
+    parametros BLOB NOT NULL,
+    resultado BLOB
+);
+CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, creado);
+CREATE TABLE IF NOT EXISTS eventos_trabajo (
+    id_trabajo TEXT NOT NULL,
+    etapa TEXT,
+    nivel TEXT NOT NULL,
+    mensaje TEXT,
+    transcurrido REAL
+);
+CREATE INDEX IF NOT EXISTS eventos_trabajo_id ON eventos_trabajo (id_trabajo);
+CREATE TABLE IF NOT EXISTS etapas_trabajo (
+    id_trabajo TEXT NOT NULL,
+    etapa TEXT NOT NULL,
+    orden INTEGER NOT NULL,
+    cache INTEGER NOT NULL,
+    segundos REAL NOT NULL,
+    valor BLOB,
+    PRIMARY KEY (id_trabajo, etapa)
+);
+"""
+
+
+class TrabajoCancelado(Exception):
+    pass
+
+
+def _proceso_vivo(pid):
+    if not pid or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _serializar(valor):
+    try:
+        return pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+
+class ColaTrabajos:
+    """
+    Cola de análisis persistida en SQLite (un archivo por host). Cada operación
+    abre su propia conexión, así la misma cola se usa desde los hilos de
+    Streamlit y desde los procesos worker.
+    """
+
+    def __init__(self, ruta=None, max_trabajos=MAX_TRABAJOS_HOST):
+        self.ruta = ruta or ruta_datos(ARCHIVO_COLA)
+        self.max_trabajos = max(1, int(max_trabajos))
+        self._workers = []
+        self._lock = threading.Lock()
+        with closing(self._conectar()) as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.executescript(_ESQUEMA)
+            columnas = {fila[1] for fila in con.execute("PRAGMA table_info(trabajos)")}
+            if 'total_etapas' not in columnas:
+                con.execute("ALTER TABLE trabajos ADD COLUMN total_etapas INTEGER")
+        self.purgar()
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+
+    # ----- lado de la interfaz -----
+    def encolar(self, **parametros):
+        """Agrega un análisis completo (argumentos de ejecutar_analisis_completo) y devuelve su id."""
+        id_trabajo = uuid.uuid4().hex
+        total_etapas = len(etapas_del_analisis(parametros.get('resolucion_prescripcion')))
+        with closing(self._conectar()) as con:
+            con.execute("INSERT INTO trabajos (id, estado, creado, total_etapas, parametros) VALUES (?, ?, ?, ?, ?)",
+                        (id_trabajo, PENDIENTE, time.time(), total_etapas,
+                         pickle.dumps(parametros, protocol=pickle.HIGHEST_PROTOCOL)))
+        return id_trabajo
+
+    def estado(self, id_trabajo):
+        """
+        dict con estado, fraccion, total de etapas, etapa, mensaje, error, tiempos
+        y posición en la cola (None si no existe).
+        """
+        with closing(self._conectar()) as con:
+            con.row_factory = sqlite3.Row
+            fila = con.execute(
+                "SELECT id, estado, creado, iniciado, terminado, fraccion, total_etapas, etapa, mensaje, error "
+                "FROM trabajos WHERE id = ?", (id_trabajo,)
+            ).fetchone()
+            if fila is None:
+                return None
+            estado = dict(fila)
+            estado['posicion'] = con.execute(
+                "SELECT COUNT(*) FROM trabajos WHERE estado = ? AND creado <= ?", (PENDIENTE, estado['creado'])
+            ).fetchone()[0] if estado['estado'] == PENDIENTE else 0
+        return estado
+
+    def eventos(self, id_trabajo, niveles=('exito', 'advertencia', 'error')):
+        with closing(self._conectar()) as con:
+            marcas = ','.join('?' * len(niveles))
+            return pd.read_sql_query(
+                f"SELECT etapa, nivel, mensaje, transcurrido FROM eventos_trabajo "
+                f"WHERE id_trabajo = ? AND nivel IN ({marcas}) ORDER BY rowid",
+                con, params=(id_trabajo, *niveles)
+            )
+
+    def etapas_completadas(self, id_trabajo):
+        """Etapas ya terminadas del trabajo, en orden (sin sus valores)."""
+        with closing(self._conectar()) as con:
+            return pd.read_sql_query(
+                "SELECT etapa, cache, segundos FROM etapas_trabajo WHERE id_trabajo = ? ORDER BY orden",
+                con, params=(id_trabajo,)
+            ).astype({'cache': bool})
+
+    def resultado_parcial(self, id_trabajo, etapa):
+        """Salida de una etapa terminada (None si todavía no está)."""
+        with closing(self._conectar()) as con:
+            fila = con.execute("SELECT valor FROM etapas_trabajo WHERE id_trabajo = ? AND etapa = ?",
+                               (id_trabajo, etapa)).fetchone()
+        return pickle.loads(fila[0]) if fila and fila[0] is not None else None
+
+    def resultado(self, id_trabajo):
+        """dict de resultados de ejecutar_analisis_completo, o None si el trabajo no terminó bien."""
+        with closing(self._conectar()) as con:
+            fila = con.execute("SELECT resultado FROM trabajos WHERE id = ? AND estado = ?",
+                               (id_trabajo, TERMINADO)).fetchone()
+        return pickle.loads(fila[0]) if fila and fila[0] is not None else None
+
+    def cancelar(self, id_trabajo):
+        """
+        Un trabajo pendiente no se ejecuta; uno en curso se detiene al terminar su
+        etapa actual y hasta entonces (pid no nulo) sigue ocupando un lugar del tope.
+        """
+        with closing(self._conectar()) as con:
+            con.execute("UPDATE trabajos SET estado = ?, terminado = ? WHERE id = ? AND estado IN (?, ?)",
+                        (CANCELADO, time.time(), id_trabajo, PENDIENTE, EJECUTANDO))
+
+    def purgar(self, dias=RETENCION_DIAS):
+        """Borra los trabajos terminados hace más de `dias` días, con sus eventos y etapas."""
+        limite = time.time() - dias * 86400
+        with closing(self._conectar()) as con:
+            viejos = [f[0] for f in con.execute(
+                f"SELECT id FROM trabajos WHERE estado IN ({','.join('?' * len(ESTADOS_FINALES))}) AND terminado < ?",
+                (*ESTADOS_FINALES, limite)
+            )]
+            for tabla, columna in (('eventos_trabajo', 'id_trabajo'), ('etapas_trabajo', 'id_trabajo'), ('trabajos', 'id')):
+                con.executemany(f"DELETE FROM {tabla} WHERE {columna} = ?", [(i,) for i in viejos])
+
+    # ----- lado del worker -----
+    def reclamar(self):
+        """
+        Toma el trabajo pendiente más antiguo si hay menos de max_trabajos en
+        ejecución en el host (contando los cancelados cuyo worker todavía no
+        terminó la etapa en curso). Los trabajos de workers que murieron se
+        marcan como fallidos. Retorna (id, parametros) o None.
+        """
+        with closing(self._conectar()) as con:
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                en_curso = con.execute("SELECT id, pid FROM trabajos WHERE estado = ?", (EJECUTANDO,)).fetchall()
+                huerfanos = [(i,) for i, pid in en_curso if not _proceso_vivo(pid)]
+                con.executemany("UPDATE trabajos SET estado = ?, terminado = ?, error = ? WHERE id = ?",
+                                [(FALLIDO, time.time(), "El worker terminó sin completar el trabajo", i)
+                                 for (i,) in huerfanos])
+                cancelando = con.execute("SELECT id, pid FROM trabajos WHERE estado = ? AND pid IS NOT NULL",
+                                         (CANCELADO,)).fetchall()
+                cancelados_muertos = [(i,) for i, pid in cancelando if not _proceso_vivo(pid)]
+                con.executemany("UPDATE trabajos SET pid = NULL WHERE id = ?", cancelados_muertos)
+                ocupados = len(en_curso) - len(huerfanos) + len(cancelando) - len(cancelados_muertos)
+                fila = None
+                if ocupados < self.max_trabajos:
+                    fila = con.execute("SELECT id, parametros FROM trabajos WHERE estado = ? ORDER BY creado LIMIT 1",
+                                       (PENDIENTE,)).fetchone()
+                if fila is not None:
+                    con.execute("UPDATE trabajos SET estado = ?, iniciado = ?, pid = ? WHERE id = ?",
+                                (EJECUTANDO, time.time(), os.getpid(), fila[0]))
+                con.execute('COMMIT')
+            except Exception:
+                con.execute('ROLLBACK')
+                raise
+        return (fila[0], pickle.loads(fila[1])) if fila is not None else None
+
+    def _destino(self, id_trabajo):
+        """Destino de eventos que guarda el avance en la fila del trabajo y los mensajes en eventos_trabajo."""
+        def destino(evento):
+            with closing(self._conectar()) as con:
+                if evento['fraccion'] is not None:
+                    con.execute("UPDATE trabajos SET fraccion = ?, etapa = ?, mensaje = ? WHERE id = ?",
+                                (evento['fraccion'], evento['etapa'], evento['mensaje'], id_trabajo))
+                else:
+                    con.execute("INSERT INTO eventos_trabajo VALUES (?, ?, ?, ?, ?)",
+                                (id_trabajo, evento['etapa'], evento['nivel'], evento['mensaje'], evento['transcurrido']))
+        return destino
+
+    def ejecutar(self, id_trabajo, parametros, cache=None):
+        """Corre un trabajo reclamado y guarda su resultado (lo llama el worker)."""
+        def al_completar(nombre, valor, registro_etapa):
+            with closing(self._conectar()) as con:
+                con.execute("INSERT OR REPLACE INTO etapas_trabajo VALUES (?, ?, ?, ?, ?, ?)",
+                            (id_trabajo, nombre, orden.setdefault(nombre, len(orden)), int(registro_etapa['cache']),
+                             registro_etapa['segundos'], _serializar(valor)))
+                estado = con.execute("SELECT estado FROM trabajos WHERE id = ?", (id_trabajo,)).fetchone()
+            if estado is None or estado[0] == CANCELADO:
+                raise TrabajoCancelado("Trabajo cancelado")
+
+        orden = {}
+        reportador = Reportador(self._destino(id_trabajo), destino_logging(prefijo=f"{id_trabajo[:8]}: "))
+        try:
+            if parametros.get('satelite') in SATELITES_GEE and not gee_autenticado():
+                inicializar_gee()
+            with usar_reportador(reportador):
+                resultados = ejecutar_analisis_completo(**parametros, cache=cache, al_completar=al_completar)
+        except Exception as e:
+            resultados = {'exitoso': False, 'error': str(e)}
+        with closing(self._conectar()) as con:
+            if resultados['exitoso']:
+                con.execute("UPDATE trabajos SET estado = ?, terminado = ?, fraccion = 1, resultado = ? "
+                            "WHERE id = ? AND estado = ?",
+                            (TERMINADO, time.time(), _serializar(resultados), id_trabajo, EJECUTANDO))
+            else:
+                con.execute("UPDATE trabajos SET estado = ?, terminado = ?, error = ? WHERE id = ? AND estado = ?",
+                            (FALLIDO, time.time(), resultados.get('error'), id_trabajo, EJECUTANDO))
+            # Si se canceló, el worker confirma que lo soltó y el lugar vuelve a quedar libre
+            con.execute("UPDATE trabajos SET pid = NULL WHERE id = ? AND estado = ?", (id_trabajo, CANCELADO))
+
+    # ----- workers -----
+    def iniciar_workers(self, n=None):
+        """
+        Lanza (o relanza, si alguno murió) `n` procesos worker hijos de este
+        proceso; terminan solos cuando el proceso que los lanzó desaparece.
+        """
+        n = self.max_trabajos if n is None else n
+        contexto = multiprocessing.get_context('spawn')
+        # Varias sesiones de Streamlit comparten la cola y pueden llamar a la vez
+        with self._lock:
+            self._workers = [p for p in self._workers if p.is_alive()]
+            while len(self._workers) < n:
+                proceso = contexto.Process(target=bucle_worker, args=(self.ruta, self.max_trabajos, os.getpid()),
+                                           daemon=True, name=f"worker-trabajos-{len(self._workers) + 1}")
+                proceso.start()
+                self._workers.append(proceso)
+            return len(self._workers)
+
+
+def bucle_worker(ruta, max_trabajos, pid_padre=None):
+    """
+    Proceso worker: reclama y ejecuta trabajos hasta que muere su proceso
+    padre. Cada worker tiene su CacheEtapas, así un reanálisis con otro cultivo
+    que cae en el mismo worker no repite descargas.
+    """
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+    cola = ColaTrabajos(ruta, max_trabajos)
+    cache = CacheEtapas()
+    while pid_padre is None or os.getppid() == pid_padre:
+        trabajo = cola.reclamar()
+        if trabajo is None:
+            time.sleep(INTERVALO_SONDEO)
+            continue
+        cola.ejecutar(*trabajo, cache=cache)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m modules.trabajos',
+        description="Workers de la cola de análisis (para correrlos aparte de la app de Streamlit)."
+    )
+    parser.add_argument('--procesos', type=int, default=MAX_TRABAJOS_HOST,
+                        help="Workers y tope de trabajos simultáneos en el host (default: %(default)s)")
+    parser.add_argument('--cola', help=f"Base SQLite de la cola (default: {ARCHIVO_COLA} en el directorio de datos)")
+    args = parser.parse_args(argv)
+    cola = ColaTrabajos(args.cola, args.procesos)
+    print(f"⚙️ {cola.iniciar_workers()} worker(s) atendiendo {cola.ruta}", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(5)
+            cola.iniciar_workers()
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())